@@ -9,6 +9,7 @@ import logging
 from uuid import uuid4
 from initial_file_validation import initial_file_validation
 from send_sqs_message import make_and_send_sqs_message
+from plan_file_shards import plan_file_shards, get_shard_size_bytes, upload_shard_plan, delete_shard_plan
 from make_and_upload_ack_file import make_and_upload_the_ack_file
 from s3_clients import s3_client
 from elasticcache import upload_to_elasticache
@@ -43,11 +44,24 @@ def lambda_handler(event, context):  # pylint: disable=unused-argument
             if "data-sources" in bucket_name:
                 # Process file from batch_data_source_bucket with validation
                 validation_passed, permission = initial_file_validation(file_key)
+                # Split a large file into shards of rows, so that it is processed by several tasks
+                shard_size_bytes = get_shard_size_bytes()
+                shards = (
+                    plan_file_shards(response["Body"], shard_size_bytes, file_size=response["ContentLength"])
+                    if validation_passed and shard_size_bytes and response["ContentLength"] > shard_size_bytes
+                    else None
+                )
+                if shards:
+                    shards = upload_shard_plan(message_id, shards)
                 message_delivered = (
-                    make_and_send_sqs_message(file_key, message_id, permission, created_at_formatted_string)
+                    make_and_send_sqs_message(file_key, message_id, permission, created_at_formatted_string, shards)
                     if validation_passed else False
                 )
-                if not validation_passed:
+                # If the messages for the shards could not all be sent, the plan is deleted so that no shard is
+                # processed, and the file is acked as not delivered
+                if shards and not message_delivered:
+                    delete_shard_plan(message_id)
+                if not validation_passed or not message_delivered:
                     make_and_upload_the_ack_file(
                         message_id, file_key, message_delivered, created_at_formatted_string
                     )
@@ -0,0 +1,179 @@
+"""Functions for splitting a large file into shards of whole rows, each of which is processed by its own task"""
+
+import os
+import json
+import logging
+from csv import reader
+from hashlib import blake2b
+from typing import Dict, Iterator, List, Union
+from s3_clients import s3_client
+from utils_for_filenameprocessor import get_environment
+
+logger = logging.getLogger()
+
+# Number of bytes requested from the S3 StreamingBody per read when planning the shards of a file
+STREAM_CHUNK_SIZE = 64 * 1024
+# Maximum number of shards of a file, so that the messages for every shard can be sent in one SQS SendMessageBatch
+MAX_SHARDS = 10
+
+
+def get_shard_size_bytes() -> int:
+    """
+    Returns the approximate number of bytes of the file to be processed by each task, given by FILE_SHARD_SIZE_BYTES.
+    Defaults to 0, which processes every file in a single task.
+    """
+    return max(0, int(os.getenv("FILE_SHARD_SIZE_BYTES", "0")))
+
+
+def stream_byte_lines(streaming_body) -> Iterator[bytes]:
+    """Reads the streaming body in chunks and yields each raw line (including its line ending)"""
+    remainder = b""
+    for chunk in iter(lambda: streaming_body.read(STREAM_CHUNK_SIZE), b""):
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if remainder:
+        yield remainder
+
+
+def get_max_moved_rows() -> int:
+    """
+    Returns the maximum number of rows of a file which may be moved to an earlier shard (see plan_file_shards), given
+    by FILE_SHARD_MAX_MOVED_ROWS. Defaults to 1000. A file with more such rows is processed in a single task.
+    """
+    return max(0, int(os.getenv("FILE_SHARD_MAX_MOVED_ROWS", "1000")))
+
+
+def get_field(row: list, index: Union[int, None]) -> Union[str, None]:
+    """Returns the value of the row at the index, or None if the row has no such column"""
+    return row[index] if index is not None and index < len(row) else None
+
+
+def plan_file_shards(
+    streaming_body, shard_size_bytes: int, max_moved_rows: Union[int, None] = None, file_size: Union[int, None] = None
+) -> Union[List[dict], None]:
+    """
+    Reads the streaming body once and splits the data rows of the file into shards of at least shard_size_bytes
+    bytes (the last shard may be smaller). If the file_size is given, the shards are made large enough that there are
+    no more than MAX_SHARDS of them. Shards always start at the start of a row, which is found using the csv
+    reader so that a quoted newline is never taken to be the end of a row, and blank lines are not counted as rows.
+    Returns a list of shards, each with its index, the number of shards, the byte range [start_byte, end_byte), the
+    number of its first row within the file (counting from 1, excluding the header row) and the ACTION_FLAGs of the
+    whole file.
+    The shards may be processed at the same time, so every row of a local_id is processed by the shard of its first
+    row, which keeps the operations for the local_id in file order. Each shard lists the moved_rows of later shards
+    which it processes after its own rows, as [row number, start byte, end byte], and the skipped_row_numbers of its
+    own rows which an earlier shard processes. Returns None if more than max_moved_rows rows would be moved.
+    """
+    max_moved_rows = get_max_moved_rows() if max_moved_rows is None else max_moved_rows
+    if file_size:
+        shard_size_bytes = max(shard_size_bytes, -(-file_size // MAX_SHARDS))
+    bytes_read = 0
+
+    def decoded_lines() -> Iterator[str]:
+        nonlocal bytes_read
+        for line in stream_byte_lines(streaming_body):
+            bytes_read += len(line)
+            yield line.decode("utf-8")
+
+    # The csv reader only pulls as many lines as are needed to complete each row, so the number of bytes read
+    # before each call to next gives the offset of the start of that row
+    csv_reader = reader(decoded_lines(), delimiter="|")
+    headers = next(csv_reader, [])
+    unique_id_index, unique_id_uri_index, action_flag_index = (
+        headers.index(column) if column in headers else None
+        for column in ("UNIQUE_ID", "UNIQUE_ID_URI", "ACTION_FLAG")
+    )
+
+    shards = []
+    action_flags = set()
+    # The index of the shard of the first row of each local_id, keyed by a short digest of the local_id to bound the
+    # memory used. Local_ids which share a digest are simply processed by the same shard.
+    first_shard_indexes: Dict[bytes, int] = {}
+    moved_row_count = 0
+    row_count = 0
+    while True:
+        row_offset = bytes_read
+        if (row := next(csv_reader, None)) is None:
+            break
+        if not row:
+            continue
+        row_count += 1
+        if not shards or row_offset - shards[-1]["start_byte"] >= shard_size_bytes:
+            shards.append(
+                {"start_byte": row_offset, "first_row_number": row_count, "moved_rows": [], "skipped_row_numbers": []}
+            )
+        if (action_flag := get_field(row, action_flag_index)) is not None:
+            action_flags.add(action_flag.upper())
+
+        local_id = f"{get_field(row, unique_id_index)}^{get_field(row, unique_id_uri_index)}"
+        local_id_digest = blake2b(local_id.encode("utf-8"), digest_size=8).digest()
+        shard_index = first_shard_indexes.setdefault(local_id_digest, len(shards) - 1)
+        if shard_index != len(shards) - 1:
+            moved_row_count += 1
+            if moved_row_count > max_moved_rows:
+                logger.warning(
+                    "File not split into shards, as more than %s rows share a local_id with a row of an earlier shard",
+                    max_moved_rows,
+                )
+                return None
+            shards[shard_index]["moved_rows"].append([row_count, row_offset, bytes_read])
+            shards[-1]["skipped_row_numbers"].append(row_count)
+
+    for shard_index, shard in enumerate(shards):
+        shard["shard_index"] = shard_index
+        shard["shard_count"] = len(shards)
+        shard["end_byte"] = shards[shard_index + 1]["start_byte"] if shard_index + 1 < len(shards) else bytes_read
+        shard["action_flags"] = sorted(action_flags)
+
+    logger.info(
+        "File of %s bytes and %s rows split into %s shards, with %s rows moved to the shard of their local_id",
+        bytes_read,
+        row_count,
+        len(shards),
+        moved_row_count,
+    )
+    return shards
+
+
+def get_shard_plan_key(message_id: str) -> str:
+    """Returns the key, in the ack bucket, of the plan of the shards of the file with the message_id"""
+    return f"shard_plans/{message_id}.json"
+
+
+def get_ack_bucket_name() -> str:
+    """Returns the name of the ack bucket, in which the plans of the shards of files are stored"""
+    return os.getenv("ACK_BUCKET_NAME", f"immunisation-batch-{get_environment()}-data-destinations")
+
+
+def upload_shard_plan(message_id: str, shards: List[dict]) -> List[dict]:
+    """
+    Uploads the moved_rows and skipped_row_numbers of each shard, which grow with the number of rows moved between
+    shards, to the ack bucket as the plan of the file's shards. Returns the shards without them, and with the plan_key
+    instead, for the message for each shard. The message is passed to the task in an environment variable, so must stay
+    small.
+    """
+    plan_key = get_shard_plan_key(message_id)
+    plan = {
+        "shards": [
+            {"moved_rows": shard["moved_rows"], "skipped_row_numbers": shard["skipped_row_numbers"]}
+            for shard in shards
+        ]
+    }
+    s3_client.put_object(Bucket=get_ack_bucket_name(), Key=plan_key, Body=json.dumps(plan).encode("utf-8"))
+    return [
+        {
+            **{key: value for key, value in shard.items() if key not in ("moved_rows", "skipped_row_numbers")},
+            "plan_key": plan_key,
+        }
+        for shard in shards
+    ]
+
+
+def delete_shard_plan(message_id: str) -> None:
+    """
+    Deletes the plan of the shards of the file with the message_id, when the messages for its shards could not all be
+    sent. A shard task which starts after this finds no plan, so does not process its rows.
+    """
+    s3_client.delete_object(Bucket=get_ack_bucket_name(), Key=get_shard_plan_key(message_id))
@@ -9,6 +9,16 @@ from s3_clients import sqs_client
 
 logger = logging.getLogger()
 
+# Number of times the SendMessageBatch of the messages for the shards of a file is attempted
+SHARD_MESSAGE_ATTEMPTS = 3
+
+
+def get_supplier_queue_url() -> str:
+    """Returns the URL of the supplier queue"""
+    imms_env = os.getenv("SHORT_QUEUE_PREFIX", "imms-batch-internal-dev")
+    account_id = os.getenv("LOCAL_ACCOUNT_ID")
+    return f"https://sqs.eu-west-2.amazonaws.com/{account_id}/{imms_env}-metadata-queue.fifo"
+
 
 def send_to_supplier_queue(message_body: dict) -> bool:
     """Sends a message to the supplier queue and returns a bool indicating if the message has been successfully sent"""
@@ -18,9 +28,7 @@ def send_to_supplier_queue(message_body: dict) -> bool:
         return False
 
     # Find the URL of the relevant queue
-    imms_env = os.getenv("SHORT_QUEUE_PREFIX", "imms-batch-internal-dev")
-    account_id = os.getenv("LOCAL_ACCOUNT_ID")
-    queue_url = f"https://sqs.eu-west-2.amazonaws.com/{account_id}/{imms_env}-metadata-queue.fifo"
+    queue_url = get_supplier_queue_url()
 
     # Send to queue
     try:
@@ -32,6 +40,45 @@ def send_to_supplier_queue(message_body: dict) -> bool:
     return True
 
 
+def send_shards_to_supplier_queue(message_body: dict, shards: list) -> bool:
+    """
+    Sends a message for each shard of the file to the supplier queue, in order in the supplier's message group, in a
+    single SendMessageBatch (there are at most MAX_SHARDS shards). Each message has a deduplication id made from the
+    message_id and the shard index, so entries which fail can be retried without any shard being sent twice.
+    Returns a bool indicating if the message for every shard has been successfully sent.
+    """
+    if not (supplier := message_body["supplier"]):
+        logger.error("Messages not sent to supplier queue as unable to identify supplier")
+        return False
+
+    pending = {
+        str(shard["shard_index"]): {
+            "Id": str(shard["shard_index"]),
+            "MessageBody": json_dumps({**message_body, "shard": shard}),
+            "MessageGroupId": supplier,
+            "MessageDeduplicationId": f"{message_body['message_id']}_{shard['shard_index']}",
+        }
+        for shard in shards
+    }
+    for _ in range(SHARD_MESSAGE_ATTEMPTS):
+        try:
+            response = sqs_client.send_message_batch(QueueUrl=get_supplier_queue_url(), Entries=list(pending.values()))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("An unexpected error occurred: %s", e)
+            return False
+        for result in response.get("Successful", []):
+            pending.pop(result["Id"], None)
+        if not pending:
+            logger.info("Messages for %s shards sent to SQS queue for supplier:%s", len(shards), supplier)
+            return True
+        # Entries which failed through the fault of the sender would fail again, so are not retried
+        if any(result.get("SenderFault") for result in response.get("Failed", [])):
+            break
+
+    logger.error("Messages for shards %s not sent to SQS queue for supplier:%s", sorted(pending), supplier)
+    return False
+
+
 def make_message_body_for_sqs(file_key: str, message_id: str, permission: str,
                               created_at_formatted_string: str) -> dict:
     """Returns the message body for the message which will be sent to SQS"""
@@ -48,11 +95,14 @@ def make_message_body_for_sqs(file_key: str, message_id: str, permission: str,
 
 
 def make_and_send_sqs_message(file_key: str, message_id: str, permission: str,
-                              created_at_formatted_string: str) -> bool:
+                              created_at_formatted_string: str, shards: list = None) -> bool:
     """
-    Attempts to send a message to the SQS queue.
-    Returns a bool to indication if the message has been sent successfully.
+    Attempts to send a message to the SQS queue, or one message for each shard of the file if shards are given. The
+    shards are sent in order in the supplier's message group, in the same way as the supplier's other files.
+    Returns a bool to indication if the message (or every message) has been sent successfully.
     """
     message_body = make_message_body_for_sqs(file_key=file_key, message_id=message_id, permission=permission,
                                              created_at_formatted_string=created_at_formatted_string)
-    return send_to_supplier_queue(message_body)
+    if not shards:
+        return send_to_supplier_queue(message_body)
+    return send_shards_to_supplier_queue(message_body, shards)
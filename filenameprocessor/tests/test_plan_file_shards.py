@@ -0,0 +1,173 @@
+"""Tests for plan_file_shards"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from csv import DictReader, reader
+from io import BytesIO, StringIO
+from json import dumps as json_dumps, loads as json_loads
+from moto import mock_s3
+from boto3 import client as boto3_client
+import os
+import sys
+maindir = os.path.dirname(__file__)
+srcdir = '../src'
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from plan_file_shards import (  # noqa: E402
+    plan_file_shards, get_shard_size_bytes, get_max_moved_rows, upload_shard_plan, delete_shard_plan, MAX_SHARDS
+)
+from tests.utils_for_tests.values_for_tests import (  # noqa: E402
+    DESTINATION_BUCKET_NAME, MOCK_ENVIRONMENT_DICT, VALID_FILE_CONTENT
+)
+
+HEADER_ROW, FIRST_ROW, SECOND_ROW = VALID_FILE_CONTENT.split("\n")
+FIRST_ROW_UNIQUE_ID = "0001_RSV_v5_RUN_2_CDFDPS-742_valid_dose_1"
+
+
+def make_file_bytes(unique_ids: list) -> bytes:
+    """Returns a file with a row for each unique_id"""
+    rows = [FIRST_ROW.replace(FIRST_ROW_UNIQUE_ID, unique_id) for unique_id in unique_ids]
+    return "\n".join([HEADER_ROW] + rows).encode("utf-8")
+
+
+class TestPlanFileShards(TestCase):
+    """Tests for plan_file_shards"""
+
+    def test_shards_cover_every_row_once(self):
+        """
+        Tests that the shards start at the start of a row, cover the rows of the file in order without gaps, and give
+        the number of the first row of each shard
+        """
+        # Includes a quoted newline, and a blank line which is not counted as a row
+        rows = [FIRST_ROW, SECOND_ROW.replace('"JOHN"', '"JO\nHN"'), "", FIRST_ROW] * 25
+        file_bytes = "\n".join([HEADER_ROW] + rows).encode("utf-8")
+        all_rows = list(DictReader(StringIO(file_bytes.decode("utf-8")), delimiter="|"))
+
+        for shard_size_bytes in (1, 1000, 10000, len(file_bytes)):
+            with self.subTest(shard_size_bytes=shard_size_bytes):
+                shards = plan_file_shards(BytesIO(file_bytes), shard_size_bytes)
+
+                self.assertEqual(shards[0]["start_byte"], len(HEADER_ROW) + 1)
+                self.assertEqual(shards[-1]["end_byte"], len(file_bytes))
+                rows_so_far = []
+                for shard_index, shard in enumerate(shards):
+                    self.assertEqual((shard["shard_index"], shard["shard_count"]), (shard_index, len(shards)))
+                    self.assertEqual(shard["first_row_number"], len(rows_so_far) + 1)
+                    if shard_index:
+                        self.assertEqual(shard["start_byte"], shards[shard_index - 1]["end_byte"])
+                    shard_content = file_bytes[shard["start_byte"]:shard["end_byte"]].decode("utf-8")
+                    shard_rows = list(DictReader(StringIO(shard_content), fieldnames=all_rows[0].keys(), delimiter="|"))
+                    self.assertTrue(shard_rows)
+                    rows_so_far.extend(shard_rows)
+                self.assertEqual(rows_so_far, all_rows)
+
+        self.assertEqual(len(plan_file_shards(BytesIO(file_bytes), 1)), 75)
+        self.assertEqual(len(plan_file_shards(BytesIO(file_bytes), len(file_bytes))), 1)
+
+    def test_rows_of_a_local_id_are_processed_by_the_shard_of_its_first_row(self):
+        """
+        Tests that each row which shares a local_id with a row of an earlier shard is moved to that shard, so that
+        every row is processed once, and all of the rows of each local_id are processed by one shard in file order
+        """
+        unique_ids = [f"id_{index}" for index in range(40)] + ["id_3", "id_39", "id_3", "id_41", "id_41"]
+        file_bytes = make_file_bytes(unique_ids)
+        shards = plan_file_shards(BytesIO(file_bytes), 2000)
+        self.assertGreater(len(shards), 2)
+
+        processed_row_numbers = []
+        for shard in shards:
+            first_row_number = shard["first_row_number"]
+            end_row_number = first_row_number + len(
+                list(reader(StringIO(file_bytes[shard["start_byte"]:shard["end_byte"]].decode("utf-8")), delimiter="|"))
+            )
+            own_row_numbers = [
+                row_number for row_number in range(first_row_number, end_row_number)
+                if row_number not in shard["skipped_row_numbers"]
+            ]
+            for row_number, start_byte, end_byte in shard["moved_rows"]:
+                moved_row = file_bytes[start_byte:end_byte].decode("utf-8").rstrip("\n")
+                self.assertEqual(moved_row, FIRST_ROW.replace(FIRST_ROW_UNIQUE_ID, unique_ids[row_number - 1]))
+            shard_row_numbers = own_row_numbers + [row_number for row_number, _, _ in shard["moved_rows"]]
+            self.assertEqual(shard_row_numbers, sorted(shard_row_numbers))
+            processed_row_numbers.append(shard_row_numbers)
+
+        self.assertEqual(sorted(sum(processed_row_numbers, [])), list(range(1, len(unique_ids) + 1)))
+        for unique_id in set(unique_ids):
+            row_numbers = {row_number for row_number, row_id in enumerate(unique_ids, 1) if row_id == unique_id}
+            self.assertEqual(sum(bool(row_numbers & set(numbers)) for numbers in processed_row_numbers), 1)
+        # id_3 is the only local_id with rows in more than one shard (the rows of id_39, and of id_41, share a shard)
+        self.assertEqual([row_number for shard in shards for row_number, _, _ in shard["moved_rows"]], [41, 43])
+        self.assertEqual([row_number for shard in shards for row_number in shard["skipped_row_numbers"]], [41, 43])
+        self.assertEqual({action_flag for shard in shards for action_flag in shard["action_flags"]}, {"NEW"})
+
+    def test_file_with_too_many_moved_rows_is_not_split(self):
+        """Tests that a file is not split if more than max_moved_rows rows would be moved to an earlier shard"""
+        file_bytes = make_file_bytes([f"id_{index % 20}" for index in range(60)])
+        self.assertEqual(sum(len(shard["moved_rows"]) for shard in plan_file_shards(BytesIO(file_bytes), 2000, 40)), 40)
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(plan_file_shards(BytesIO(file_bytes), 2000, 39))
+
+    @mock_s3
+    @patch.dict("os.environ", MOCK_ENVIRONMENT_DICT)
+    def test_upload_shard_plan(self):
+        """
+        Tests that the moved rows and skipped row numbers of the shards are uploaded to the ack bucket, leaving
+        messages which stay small however many rows are moved (the task is given its message in an environment
+        variable, which is limited to 8KiB)
+        """
+        s3_client = boto3_client("s3", region_name="eu-west-2")
+        s3_client.create_bucket(
+            Bucket=DESTINATION_BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+        )
+        file_bytes = make_file_bytes([f"id_{index % 200}" for index in range(1200)])
+        shards = plan_file_shards(BytesIO(file_bytes), 100000)
+        self.assertEqual(sum(len(shard["moved_rows"]) for shard in shards), 1000)
+
+        messages = upload_shard_plan("test_message_id", shards)
+
+        self.assertGreater(len(messages), 1)
+        for message, shard in zip(messages, shards):
+            self.assertEqual(message.pop("plan_key"), "shard_plans/test_message_id.json")
+            self.assertEqual(message, {
+                key: value for key, value in shard.items() if key not in ("moved_rows", "skipped_row_numbers")
+            })
+            self.assertLess(len(json_dumps(message)), 1024)
+        plan = json_loads(
+            s3_client.get_object(Bucket=DESTINATION_BUCKET_NAME, Key="shard_plans/test_message_id.json")["Body"].read()
+        )
+        self.assertEqual(plan["shards"], [
+            {"moved_rows": shard["moved_rows"], "skipped_row_numbers": shard["skipped_row_numbers"]} for shard in shards
+        ])
+
+    def test_number_of_shards_is_limited(self):
+        """Tests that, given the size of the file, the shards are made large enough that there are at most MAX_SHARDS"""
+        file_bytes = make_file_bytes([f"id_{index}" for index in range(100)])
+        self.assertEqual(len(plan_file_shards(BytesIO(file_bytes), 1)), 100)
+        self.assertLessEqual(len(plan_file_shards(BytesIO(file_bytes), 1, file_size=len(file_bytes))), MAX_SHARDS)
+
+    @mock_s3
+    @patch.dict("os.environ", MOCK_ENVIRONMENT_DICT)
+    def test_delete_shard_plan(self):
+        """Tests that the plan of the shards is deleted from the ack bucket"""
+        s3_client = boto3_client("s3", region_name="eu-west-2")
+        s3_client.create_bucket(
+            Bucket=DESTINATION_BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+        )
+        upload_shard_plan("test_message_id", plan_file_shards(BytesIO(make_file_bytes(["id_0", "id_1"])), 1))
+
+        delete_shard_plan("test_message_id")
+
+        self.assertNotIn("Contents", s3_client.list_objects_v2(Bucket=DESTINATION_BUCKET_NAME))
+
+    def test_get_shard_size_bytes(self):
+        """Tests that the shard size is read from the environment, defaulting to 0 (no sharding)"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_shard_size_bytes(), 0)
+        with patch.dict("os.environ", {"FILE_SHARD_SIZE_BYTES": "1000"}):
+            self.assertEqual(get_shard_size_bytes(), 1000)
+
+    def test_get_max_moved_rows(self):
+        """Tests that the maximum number of moved rows is read from the environment, defaulting to 1000"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_max_moved_rows(), 1000)
+        with patch.dict("os.environ", {"FILE_SHARD_MAX_MOVED_ROWS": "10"}):
+            self.assertEqual(get_max_moved_rows(), 10)
@@ -11,7 +11,9 @@ import sys
 maindir = os.path.dirname(__file__)
 srcdir = '../src'
 sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
-from send_sqs_message import send_to_supplier_queue, make_message_body_for_sqs, make_and_send_sqs_message  # noqa: E402
+from send_sqs_message import (  # noqa: E402
+    send_to_supplier_queue, make_message_body_for_sqs, make_and_send_sqs_message, SHARD_MESSAGE_ATTEMPTS
+)
 from tests.utils_for_tests.values_for_tests import MOCK_ENVIRONMENT_DICT, SQS_ATTRIBUTES  # noqa: E402
 
 
@@ -114,6 +116,76 @@ class TestSendSQSMessage(TestCase):
         messages = mock_sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=1)
         self.assertEqual(json_loads(messages["Messages"][0]["Body"]), expected_message_body)
 
+    @mock_sqs
+    def test_make_and_send_sqs_message_with_shards(self):
+        """Test that make_and_send_sqs_message sends one message per shard, in order in the supplier's message group"""
+        mock_sqs_client = boto3_client("sqs", region_name="eu-west-2")
+        queue_name = "imms-batch-internal-dev-metadata-queue.fifo"
+        queue_url = mock_sqs_client.create_queue(QueueName=queue_name, Attributes=SQS_ATTRIBUTES)["QueueUrl"]
+        file_key = "Covid19_Vaccinations_v5_YGMYH_20200101T12345600.csv"
+        message_id = str(uuid4())
+        shards = [
+            {"shard_index": 0, "shard_count": 2, "start_byte": 10, "end_byte": 20, "first_row_number": 1},
+            {"shard_index": 1, "shard_count": 2, "start_byte": 20, "end_byte": 30, "first_row_number": 5},
+        ]
+
+        self.assertTrue(make_and_send_sqs_message(file_key=file_key, message_id=message_id, permission="FLU_FULL",
+                                                  created_at_formatted_string="test", shards=shards))
+
+        messages = mock_sqs_client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10, AttributeNames=["MessageGroupId"]
+        )["Messages"]
+        self.assertEqual([json_loads(message["Body"])["shard"] for message in messages], shards)
+        self.assertEqual({json_loads(message["Body"])["message_id"] for message in messages}, {message_id})
+        self.assertEqual(
+            [message["Attributes"]["MessageGroupId"] for message in messages],
+            ["MEDICAL_DIRECTOR", "MEDICAL_DIRECTOR"],
+        )
+
+    def test_make_and_send_sqs_message_with_shards_retries_failed_shards(self):
+        """
+        Test that the shards are sent in one SendMessageBatch, that only the shards which failed are sent again, and
+        that each shard keeps the same deduplication id so it is never delivered twice
+        """
+        message_id = str(uuid4())
+        shards = [{"shard_index": index, "shard_count": 3} for index in range(3)]
+        mock_sqs_client = MagicMock()
+        mock_sqs_client.send_message_batch.side_effect = [
+            {"Successful": [{"Id": "0"}, {"Id": "2"}], "Failed": [{"Id": "1", "SenderFault": False}]},
+            {"Successful": [{"Id": "1"}]},
+        ]
+
+        with patch("send_sqs_message.sqs_client", mock_sqs_client):
+            self.assertTrue(make_and_send_sqs_message(
+                file_key="Covid19_Vaccinations_v5_YGMYH_20200101T12345600.csv", message_id=message_id,
+                permission="FLU_FULL", created_at_formatted_string="test", shards=shards
+            ))
+
+        first_entries, retried_entries = [
+            call.kwargs["Entries"] for call in mock_sqs_client.send_message_batch.call_args_list
+        ]
+        self.assertEqual([entry["Id"] for entry in first_entries], ["0", "1", "2"])
+        self.assertEqual(retried_entries, [first_entries[1]])
+        self.assertEqual(
+            [entry["MessageDeduplicationId"] for entry in first_entries],
+            [f"{message_id}_0", f"{message_id}_1", f"{message_id}_2"],
+        )
+
+    def test_make_and_send_sqs_message_with_shards_partial_failure(self):
+        """Test that make_and_send_sqs_message fails if a shard still cannot be sent after retrying"""
+        shards = [{"shard_index": index, "shard_count": 2} for index in range(2)]
+        mock_sqs_client = MagicMock()
+        mock_sqs_client.send_message_batch.return_value = {
+            "Successful": [{"Id": "0"}], "Failed": [{"Id": "1", "SenderFault": False}]
+        }
+
+        with patch("send_sqs_message.sqs_client", mock_sqs_client), self.assertLogs(level="ERROR"):
+            self.assertFalse(make_and_send_sqs_message(
+                file_key="Covid19_Vaccinations_v5_YGMYH_20200101T12345600.csv", message_id=str(uuid4()),
+                permission="FLU_FULL", created_at_formatted_string="test", shards=shards
+            ))
+        self.assertEqual(mock_sqs_client.send_message_batch.call_count, SHARD_MESSAGE_ATTEMPTS)
+
     @mock_sqs
     def test_make_and_send_sqs_message_failure(self):
         """Test make_and_send_sqs_message function for a failure due to queue not existing"""
@@ -0,0 +1,108 @@
+"""
+Benchmark of the throughput of forward_lambda_handler against stubbed Imms API lambdas, for batches of 1 to 1000
+single row Kinesis records, forwarding the rows one at a time compared with forwarding them concurrently (see
+concurrent_forwarding). The stubbed lambdas sleep for a fixed latency: the RequestResponse search invoke made for each
+UPDATE and DELETE row takes longer than the Event invoke made for every row.
+
+Usage (from the recordforwarder directory): python benchmarks/benchmark_concurrent_forwarding.py [max_batch_size]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import logging
+import contextlib
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+os.environ.update(
+    {
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "CREATE_LAMBDA_NAME": "stub_create_imms",
+        "UPDATE_LAMBDA_NAME": "stub_update_imms",
+        "DELETE_LAMBDA_NAME": "stub_delete_imms",
+        "SEARCH_LAMBDA_NAME": "stub_search_imms",
+    }
+)
+from forwarding_lambda import forward_lambda_handler  # noqa: E402
+from tests.utils_for_recordfowarder_tests.utils_for_recordforwarder_tests import generate_kinesis_message  # noqa: E402
+from tests.utils_for_recordfowarder_tests.values_for_recordforwarder_tests import (  # noqa: E402
+    Message,
+    MOCK_IDENTIFIER_SYSTEM,
+    MOCK_IDENTIFIER_VALUE,
+)
+
+# The per-row logs would otherwise dominate the output
+logging.getLogger().setLevel(logging.WARNING)
+
+SEARCH_LATENCY_SECONDS = 0.02
+EVENT_INVOKE_LATENCY_SECONDS = 0.01
+BATCH_SIZES = [1, 10, 100, 1000]
+WORKER_COUNTS = [1, 10, 32]
+
+SEARCH_RESPONSE = json.dumps(
+    {
+        "statusCode": 200,
+        "body": json.dumps({"total": 1, "entry": [{"resource": {"id": Message.IMMS_ID, "meta": {"versionId": 1}}}]}),
+    }
+)
+
+
+class StubLambdaClient:
+    """Stands in for the lambda client, sleeping for the latency of each invoke"""
+
+    def invoke(self, FunctionName, InvocationType, Payload):  # pylint: disable=invalid-name,unused-argument
+        """Returns a successful search response, or the response to an Event invoke, after sleeping"""
+        if InvocationType == "RequestResponse":
+            time.sleep(SEARCH_LATENCY_SECONDS)
+            return {"Payload": io.StringIO(SEARCH_RESPONSE)}
+        time.sleep(EVENT_INVOKE_LATENCY_SECONDS)
+        return {"StatusCode": 202}
+
+
+def make_event(batch_size: int) -> dict:
+    """Returns an event of the given number of single row records, with a mix of operations and a few repeated rows"""
+    rng = random.Random(20241025)
+    fhir_json = {
+        "resourceType": "Immunization",
+        "identifier": [{"system": MOCK_IDENTIFIER_SYSTEM, "value": MOCK_IDENTIFIER_VALUE}],
+    }
+    records = []
+    for index in range(batch_size):
+        message = rng.choice(
+            [Message.create_message, Message.create_message, Message.update_message, Message.delete_message]
+        )
+        local_id = f"{rng.randrange(max(1, batch_size * 9 // 10))}^system"
+        message_body = {**message, "row_id": f"file^{index + 1}", "local_id": local_id, "fhir_json": fhir_json}
+        records.extend(generate_kinesis_message(message_body)["Records"])
+    return {"Records": records}
+
+
+def time_batch(event: dict, workers: int) -> float:
+    """Returns the time taken to forward the batch using the given number of workers"""
+    with patch.dict("os.environ", {"FORWARDING_WORKERS": str(workers)}):
+        # invoke_lambda prints the response of each Event invoke
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            forward_lambda_handler(event, None)
+            return time.perf_counter() - start
+
+
+def main(max_batch_size: int) -> None:
+    """Measures the throughput for each batch size up to max_batch_size, for each number of workers"""
+    print(f"Stubbed latency: search {SEARCH_LATENCY_SECONDS}s, invoke {EVENT_INVOKE_LATENCY_SECONDS}s")
+    print(f"{'Batch size':>10} " + " ".join(f"{f'{workers} workers':>16}" for workers in WORKER_COUNTS))
+    with patch("utils_for_record_forwarder.lambda_client", StubLambdaClient()):
+        for batch_size in [batch_size for batch_size in BATCH_SIZES if batch_size <= max_batch_size]:
+            event = make_event(batch_size)
+            throughputs = [batch_size / time_batch(event, workers) for workers in WORKER_COUNTS]
+            print(f"{batch_size:>10} " + " ".join(f"{f'{throughput:.0f} rows/s':>16}" for throughput in throughputs))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -1,11 +1,17 @@
 """Initialise s3, kinesis and lambda clients"""
 
+import os
 from boto3 import client as boto3_client
+from botocore.config import Config
 
 REGION_NAME = "eu-west-2"
 
+# Rows are forwarded by up to FORWARDING_WORKERS threads (see concurrent_forwarding), each of which may hold a
+# connection of the lambda and sqs clients
+CONCURRENT_CLIENT_CONFIG = Config(max_pool_connections=max(10, int(os.getenv("FORWARDING_WORKERS", "10"))))
+
 s3_client = boto3_client("s3", region_name=REGION_NAME)
 kinesis_client = boto3_client("kinesis", region_name=REGION_NAME)
-lambda_client = boto3_client("lambda", region_name=REGION_NAME)
+lambda_client = boto3_client("lambda", region_name=REGION_NAME, config=CONCURRENT_CLIENT_CONFIG)
 firehose_client = boto3_client("firehose", region_name=REGION_NAME)
-sqs_client = boto3_client("sqs", region_name=REGION_NAME)
+sqs_client = boto3_client("sqs", region_name=REGION_NAME, config=CONCURRENT_CLIENT_CONFIG)
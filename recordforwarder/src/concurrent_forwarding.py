@@ -0,0 +1,201 @@
+"""Forwards the rows of a batch of Kinesis records concurrently, keeping the rows of each local_id in order"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Set, Union
+
+logger = logging.getLogger()
+
+
+def get_forwarding_workers() -> int:
+    """
+    Returns the number of threads used to forward the rows of a batch, given by FORWARDING_WORKERS. Defaults to 10.
+    1 forwards the rows one at a time.
+    """
+    return max(1, int(os.getenv("FORWARDING_WORKERS", "10")))
+
+
+def get_retried_rows_size() -> int:
+    """
+    Returns the maximum number of row_ids held by the record of the rows which have already been forwarded from a
+    batch which will be retried (see RetriedRows), given by RETRIED_ROWS_SIZE. Defaults to 100000.
+    """
+    return max(1, int(os.getenv("RETRIED_ROWS_SIZE", "100000")))
+
+
+class RetriedRows:
+    """
+    Thread-safe record, kept across warm invocations of the forwarder, of the row_ids of the rows which were forwarded
+    from the first record of a batch with a row which failed, or from a later record. The batch is retried from that
+    record, so these rows are delivered again, and are skipped rather than forwarded a second time (which would, for
+    example, create a duplicate immunization). Holds up to max_size row_ids, forgetting the least recently added.
+    The record is only held by this execution environment, so a retry handled by another one forwards the rows again.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._row_ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, row_id: str) -> bool:
+        with self._lock:
+            return row_id in self._row_ids
+
+    def add(self, row_ids: Iterable[str]) -> None:
+        """Records that the rows have been forwarded, forgetting the least recently added rows once full"""
+        with self._lock:
+            for row_id in row_ids:
+                self._row_ids[row_id] = None
+                self._row_ids.move_to_end(row_id)
+            while len(self._row_ids) > self.max_size:
+                self._row_ids.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forgets every row"""
+        with self._lock:
+            self._row_ids.clear()
+
+
+retried_rows = RetriedRows(get_retried_rows_size())
+
+
+def group_by_local_id(message_bodies: List[dict]) -> List[List[int]]:
+    """
+    Returns the positions of the message bodies grouped by local_id, with the groups in the order in which their
+    local_id first appears, and the positions of each group in their original order
+    """
+    groups: Dict[str, List[int]] = {}
+    for position, message_body in enumerate(message_bodies):
+        groups.setdefault(message_body.get("local_id"), []).append(position)
+    return list(groups.values())
+
+
+def get_synchronous_positions(groups: List[List[int]]) -> Set[int]:
+    """
+    Returns the positions of the rows which must be forwarded synchronously, which are the rows followed by another
+    row of their local_id in the batch
+    """
+    return {position for positions in groups for position in positions[:-1]}
+
+
+class BatchProgress:
+    """
+    Tracks the first record of the batch with a row which failed to be forwarded, and the positions of the rows which
+    were forwarded. Once a row has failed, the rows of that record and of every later record are not forwarded, as
+    they will be retried from that record.
+    """
+
+    def __init__(self):
+        self.first_failed_record_index: Union[int, None] = None
+        self.forwarded_positions: List[int] = []
+        self._lock = threading.Lock()
+
+    def should_forward(self, record_index: int) -> bool:
+        """Returns whether the rows of the record should still be forwarded"""
+        return self.first_failed_record_index is None or record_index < self.first_failed_record_index
+
+    def record_forwarded(self, position: int) -> None:
+        """Records that the row at the position was forwarded"""
+        with self._lock:
+            self.forwarded_positions.append(position)
+
+    def record_failure(self, record_index: int) -> None:
+        """Records that a row of the record failed to be forwarded"""
+        with self._lock:
+            if self.first_failed_record_index is None or record_index < self.first_failed_record_index:
+                self.first_failed_record_index = record_index
+
+
+def forward_in_order(
+    message_bodies: List[dict],
+    positions: List[int],
+    record_indexes: List[int],
+    forward: Callable[[dict, bool], bool],
+    progress: BatchProgress,
+    synchronous_positions: Set[int],
+    already_forwarded: Union[RetriedRows, None] = None,
+) -> None:
+    """
+    Forwards each of the message bodies at the positions in turn (synchronously if its position is one of the
+    synchronous_positions), stopping once a row has failed. Rows whose row_ids are in already_forwarded have already
+    been forwarded, so are not forwarded again.
+    """
+    for position in positions:
+        record_index = record_indexes[position]
+        if not progress.should_forward(record_index):
+            return
+        row_id = message_bodies[position].get("row_id")
+        if already_forwarded is not None and row_id in already_forwarded:
+            logger.info("Row %s has already been forwarded, so is not forwarded again", row_id)
+        elif not forward(message_bodies[position], position in synchronous_positions):
+            progress.record_failure(record_index)
+            return
+        progress.record_forwarded(position)
+
+
+def forward_rows(
+    message_bodies: List[dict],
+    forward: Callable[[dict, bool], bool],
+    workers: int,
+    record_indexes: Union[List[int], None] = None,
+    already_forwarded: Union[RetriedRows, None] = None,
+) -> Union[int, None]:
+    """
+    Forwards the rows using a pool of up to the given number of threads. The rows which share a local_id are forwarded
+    in order by a single thread, and the rows of different local_ids are forwarded concurrently.
+    The Imms API lambdas are invoked asynchronously, so the order in which they are invoked does not set the order in
+    which they run. Each row followed by another row of its local_id in the batch is therefore forwarded
+    synchronously (forward is called with True), so that (for example) the UPDATE of a vaccination record never runs
+    before its CREATE has completed. Rows of a local_id in different batches are not ordered in this way.
+    record_indexes gives the index, within the batch, of the record which carried each row (by default, each row is
+    taken to have its own record). forward returns False if the row failed to be forwarded and should be retried, and
+    must handle any other errors itself.
+    If already_forwarded is given, the rows it holds are not forwarded again and, if a row fails, the rows forwarded
+    from the first record with a row which failed, or from a later record, are added to it (see RetriedRows).
+    Returns the index of the first record with a row which failed, or None if every row was forwarded.
+    """
+    if record_indexes is None:
+        record_indexes = list(range(len(message_bodies)))
+    groups = group_by_local_id(message_bodies)
+    synchronous_positions = get_synchronous_positions(groups)
+    progress = BatchProgress()
+    if workers <= 1 or len(groups) <= 1:
+        forward_in_order(
+            message_bodies,
+            range(len(message_bodies)),
+            record_indexes,
+            forward,
+            progress,
+            synchronous_positions,
+            already_forwarded,
+        )
+    else:
+        logger.info("Forwarding %s rows for %s local_ids using %s threads", len(message_bodies), len(groups), workers)
+        with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as executor:
+            # Consuming the results re-raises any error which escaped forward
+            list(
+                executor.map(
+                    lambda positions: forward_in_order(
+                        message_bodies,
+                        positions,
+                        record_indexes,
+                        forward,
+                        progress,
+                        synchronous_positions,
+                        already_forwarded,
+                    ),
+                    groups,
+                )
+            )
+
+    first_failed_record_index = progress.first_failed_record_index
+    if already_forwarded is not None and first_failed_record_index is not None:
+        already_forwarded.add(
+            message_bodies[position].get("row_id")
+            for position in progress.forwarded_positions
+            if record_indexes[position] >= first_failed_record_index and message_bodies[position].get("row_id")
+        )
+    return first_failed_record_index
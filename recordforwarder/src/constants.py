@@ -2,6 +2,9 @@
 
 IMMS_BATCH_APP_NAME = "Imms-Batch-App"
 
+# Version of the Kinesis records which carry several rows (records without a version carry a single row)
+AGGREGATED_RECORD_VERSION = 2
+
 
 class Operations:
     """Class containing the CRUD operation lambdas which can be invoked by the batch process"""
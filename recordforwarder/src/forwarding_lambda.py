@@ -4,9 +4,13 @@ import os
 import json
 import base64
 import logging
+from botocore.exceptions import BotoCoreError, ClientError
 from send_request_to_lambda import send_request_to_lambda
 from errors import MessageNotSuccessfulError
+from utils_for_record_forwarder import get_message_bodies
 from clients import sqs_client
+from concurrent_forwarding import forward_rows, get_forwarding_workers, retried_rows
+from imms_id_cache import imms_id_cache
 
 logging.basicConfig(level="INFO")
 logger = logging.getLogger()
@@ -14,12 +18,15 @@ logger = logging.getLogger()
 queue_url = os.getenv("SQS_QUEUE_URL", "Queue_url")
 
 
-def forward_request_to_lambda(message_body):
-    """Forwards the request to the Imms API (where possible) and updates the ack file with the outcome"""
+def forward_request_to_lambda(message_body, synchronous: bool = False):
+    """
+    Forwards the request to the Imms API (where possible) and updates the ack file with the outcome. If synchronous,
+    waits for the Imms API to complete the request.
+    """
     row_id = message_body.get("row_id")
     logger.info("BEGINNING FORWARDING MESSAGE: ID %s", row_id)
     try:
-        send_request_to_lambda(message_body)
+        send_request_to_lambda(message_body, synchronous)
     except MessageNotSuccessfulError as error:
         error_message_body = {
             "diagnostics": str(error.message),
@@ -38,19 +45,57 @@ def forward_request_to_lambda(message_body):
     logger.info("FINISHED FORWARDING MESSAGE: ID %s", row_id)
 
 
+def forward_row(message_body: dict, synchronous: bool = False) -> bool:
+    """
+    Forwards the row, waiting for the Imms API to complete the request if synchronous. Returns False if forwarding
+    failed because of an error from an AWS service (such as a failure to invoke the Imms API lambda or to send the
+    failure ack), in which case the row is retried. Any other error is logged rather than raised, so that an error for
+    one row does not prevent the remaining rows of the batch from being forwarded.
+    """
+    try:
+        forward_request_to_lambda(message_body, synchronous)
+    except (ClientError, BotoCoreError) as error:
+        logger.error("Error forwarding row %s, which will be retried: %s", message_body.get("row_id"), error)
+        return False
+    except Exception as error:  # pylint:disable=broad-exception-caught
+        logger.error("Error processing message: %s", error)
+    return True
+
+
 def forward_lambda_handler(event, _):
-    """Forward each row to the Imms API"""
+    """
+    Forward each row to the Imms API. Returns the batchItemFailures holding the sequence number of the first record
+    with a row which failed to be forwarded (if there is one), so that the batch is retried from that record.
+    """
     logger.info("Processing started")
-    for record in event["Records"]:
+    message_bodies = []
+    record_indexes = []
+    for record_index, record in enumerate(event["Records"]):
         try:
             kinesis_payload = record["kinesis"]["data"]
             decoded_payload = base64.b64decode(kinesis_payload).decode("utf-8")
-            message_body = json.loads(decoded_payload)
-            forward_request_to_lambda(message_body)
+            record_message_bodies = get_message_bodies(json.loads(decoded_payload))
         except Exception as error:  # pylint:disable=broad-exception-caught
             logger.error("Error processing message: %s", error)
+            continue
+        message_bodies.extend(record_message_bodies)
+        record_indexes.extend([record_index] * len(record_message_bodies))
+
+    # The rows of the batch are forwarded concurrently, except that the rows which share a local_id are forwarded in
+    # the order in which they appear in the batch, each waiting for the Imms API to complete the one before it. Rows
+    # which were forwarded before an earlier attempt at the batch failed are not forwarded again.
+    first_failed_record_index = forward_rows(
+        message_bodies, forward_row, get_forwarding_workers(), record_indexes, retried_rows
+    )
+    logger.info("Imms id cache statistics: %s", json.dumps(imms_id_cache.statistics()))
     logger.info("Processing ended")
 
+    if first_failed_record_index is None:
+        return {"batchItemFailures": []}
+    sequence_number = event["Records"][first_failed_record_index]["kinesis"]["sequenceNumber"]
+    logger.warning("Batch will be retried from the record with sequence number %s", sequence_number)
+    return {"batchItemFailures": [{"itemIdentifier": sequence_number}]}
+
 
 if __name__ == "__main__":
     forward_lambda_handler({"Records": []}, {})
@@ -5,16 +5,21 @@ import logging
 from errors import IdNotFoundError
 from utils_for_record_forwarder import invoke_lambda
 from constants import IMMS_BATCH_APP_NAME
+from imms_id_cache import imms_id_cache, get_imms_id_cache_enabled
 
 logger = logging.getLogger()
 
 
-def get_imms_id_and_version(fhir_json: dict) -> tuple[str, int]:
-    """Send a GET request to Imms API requesting the id and version"""
+def get_immunization_identifier(fhir_json: dict) -> str:
+    """Returns the immunization identifier of the fhir_json, in the format system|value"""
+    identifier = fhir_json.get("identifier", [{}])[0]
+    return f"{identifier.get('system')}|{identifier.get('value')}"
+
+
+def search_imms_id_and_version(immunization_identifier: str) -> tuple[str, int]:
+    """Send a GET request to Imms API requesting the id and version of the immunization identifier"""
     # Create payload
     headers = {"SupplierSystem": IMMS_BATCH_APP_NAME}
-    identifier = fhir_json.get("identifier", [{}])[0]
-    immunization_identifier = f"{identifier.get('system')}|{identifier.get('value')}"
     query_string_parameters = {"_element": "id,meta", "immunization.identifier": immunization_identifier}
     request_payload = {"headers": headers, "body": None, "queryStringParameters": query_string_parameters}
 
@@ -29,3 +34,16 @@ def get_imms_id_and_version(fhir_json: dict) -> tuple[str, int]:
     # Return imms_id and version
     resource = body.get("entry", [])[0].get("resource", {})
     return resource.get("id"), resource.get("meta", {}).get("versionId")
+
+
+def get_imms_id_and_version(fhir_json: dict) -> tuple[str, int]:
+    """
+    Returns the id and version of the immunization identified by the fhir_json, from the imms id cache where possible,
+    and otherwise from the Imms API
+    """
+    immunization_identifier = get_immunization_identifier(fhir_json)
+    if not get_imms_id_cache_enabled():
+        return search_imms_id_and_version(immunization_identifier)
+    return imms_id_cache.get_or_search(
+        immunization_identifier, lambda: search_imms_id_and_version(immunization_identifier)
+    )
@@ -0,0 +1,151 @@
+"""
+Cache of the imms_id and version of each immunization identifier (system|value), which is kept across warm
+invocations of the forwarder so that the search lambda is not invoked for every row of the same vaccination. An
+identifier is evicted once an update or delete of it has been sent, unless the new version is known to be correct.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, Union
+
+
+def get_imms_id_cache_enabled() -> bool:
+    """Returns whether the imms id cache is used, given by IMMS_ID_CACHE_ENABLED. Defaults to true."""
+    return os.getenv("IMMS_ID_CACHE_ENABLED", "true").lower() not in ("false", "0", "no", "off")
+
+
+def get_imms_id_cache_size() -> int:
+    """Returns the maximum number of identifiers held in the imms id cache, given by IMMS_ID_CACHE_SIZE"""
+    return max(1, int(os.getenv("IMMS_ID_CACHE_SIZE", "10000")))
+
+
+def get_imms_id_cache_ttl_seconds() -> float:
+    """
+    Returns the number of seconds for which an entry of the imms id cache is used, given by IMMS_ID_CACHE_TTL_SECONDS.
+    The TTL bounds how long the cache can hold a stale version after a change made outside this forwarder.
+    """
+    return float(os.getenv("IMMS_ID_CACHE_TTL_SECONDS", "300"))
+
+
+class _InFlightSearch:
+    """A search for an identifier, whose outcome is shared by every lookup of the identifier made while it runs"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Union[Tuple[str, int], None] = None
+        self.error: Union[Exception, None] = None
+        # Set if the identifier is updated or evicted while the search runs, as the result may then be out of date
+        self.superseded = False
+
+
+class ImmsIdCache:
+    """
+    Thread-safe LRU cache, with a time to live, of the (imms_id, version) of each immunization identifier. Holds up
+    to max_size identifiers, evicting the least recently used. Concurrent lookups of an identifier which is not
+    cached share a single search. Searches which fail are not cached.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        # Entries, in least to most recently used order, as identifier: (imms_id, version, expiry time)
+        self._entries: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+        self._in_flight: Dict[str, _InFlightSearch] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_searches = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get_or_search(self, identifier: str, search: Callable[[], Tuple[str, int]]) -> Tuple[str, int]:
+        """
+        Returns the cached (imms_id, version) of the identifier or, if it is not cached, the result of the search
+        (which is then cached). If a search for the identifier is already running, waits for and shares its result.
+        """
+        with self._lock:
+            entry = self._entries.get(identifier)
+            if entry is not None:
+                if entry[2] > self.clock():
+                    self._entries.move_to_end(identifier)
+                    self.hits += 1
+                    return entry[0], entry[1]
+                del self._entries[identifier]
+                self.expirations += 1
+
+            in_flight = self._in_flight.get(identifier)
+            is_searching = in_flight is None
+            if is_searching:
+                self.misses += 1
+                in_flight = self._in_flight[identifier] = _InFlightSearch()
+            else:
+                self.shared_searches += 1
+
+        if not is_searching:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            in_flight.value = search()
+        except Exception as error:
+            in_flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[identifier]
+                if in_flight.value is not None and not in_flight.superseded:
+                    self._set(identifier, *in_flight.value)
+            in_flight.done.set()
+        return in_flight.value
+
+    def update(self, identifier: str, imms_id: str, version: int) -> None:
+        """Caches the (imms_id, version) of the identifier, such as the new version following an update"""
+        with self._lock:
+            self._supersede_search(identifier)
+            self._set(identifier, imms_id, version)
+
+    def evict(self, identifier: str) -> None:
+        """Removes the identifier from the cache, such as following a delete"""
+        with self._lock:
+            self._supersede_search(identifier)
+            self._entries.pop(identifier, None)
+
+    def clear(self) -> None:
+        """Removes every identifier from the cache, and resets the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.shared_searches = self.expirations = self.evictions = 0
+
+    def statistics(self) -> dict:
+        """Returns the hit, miss and eviction counts and the hit rate (cached or shared lookups over all lookups)"""
+        lookups = self.hits + self.shared_searches + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "shared_searches": self.shared_searches,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.shared_searches) / lookups, 4) if lookups else None,
+        }
+
+    def _supersede_search(self, identifier: str) -> None:
+        """Prevents the result of any search for the identifier which is running from being cached"""
+        if identifier in self._in_flight:
+            self._in_flight[identifier].superseded = True
+
+    def _set(self, identifier: str, imms_id: str, version: int) -> None:
+        """Caches the entry as the most recently used, evicting the least recently used if the cache is full"""
+        self._entries[identifier] = (imms_id, version, self.clock() + self.ttl_seconds)
+        self._entries.move_to_end(identifier)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+imms_id_cache = ImmsIdCache(get_imms_id_cache_size(), get_imms_id_cache_ttl_seconds())
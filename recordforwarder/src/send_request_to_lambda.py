@@ -2,7 +2,8 @@
 
 import os
 from errors import MessageNotSuccessfulError, IdNotFoundError
-from get_imms_id_and_version import get_imms_id_and_version
+from get_imms_id_and_version import get_imms_id_and_version, get_immunization_identifier
+from imms_id_cache import imms_id_cache, get_imms_id_cache_enabled
 from utils_for_record_forwarder import invoke_lambda
 from constants import IMMS_BATCH_APP_NAME
 
@@ -12,8 +13,29 @@ UPDATE_LAMBDA_NAME = os.getenv("UPDATE_LAMBDA_NAME")
 DELETE_LAMBDA_NAME = os.getenv("DELETE_LAMBDA_NAME")
 
 
+def send_write_request(lambda_name: str, payload: dict, synchronous: bool) -> bool:
+    """
+    Invokes the Imms API lambda which creates, updates or deletes the immunization. The lambda records the outcome of
+    the request itself, so only a failure to invoke it raises an error. If synchronous, waits for the lambda to
+    complete, and returns whether the request succeeded. Otherwise returns False, as the outcome is not known.
+    """
+    if not synchronous:
+        invoke_lambda(lambda_name, payload)
+        return False
+    status_code, _, _ = invoke_lambda(lambda_name, payload, synchronous=True)
+    if status_code is None:
+        raise MessageNotSuccessfulError("Failed to send request to API")
+    return 200 <= status_code < 300
+
+
 def send_create_request(
-    fhir_json: dict, supplier: str, file_key: str, row_id: str, created_at_formatted_string: str, local_id: str
+    fhir_json: dict,
+    supplier: str,
+    file_key: str,
+    row_id: str,
+    created_at_formatted_string: str,
+    local_id: str,
+    synchronous: bool = False,
 ):
     """Sends the create request."""
     # Send create request
@@ -26,11 +48,17 @@ def send_create_request(
         "local_id": local_id,
     }
     payload = {"headers": headers, "body": fhir_json}
-    invoke_lambda(CREATE_LAMBDA_NAME, payload)
+    send_write_request(CREATE_LAMBDA_NAME, payload, synchronous)
 
 
 def send_update_request(
-    fhir_json: dict, supplier: str, file_key: str, row_id: str, created_at_formatted_string: str, local_id: str
+    fhir_json: dict,
+    supplier: str,
+    file_key: str,
+    row_id: str,
+    created_at_formatted_string: str,
+    local_id: str,
+    synchronous: bool = False,
 ):
     """Obtains the imms_id, sends the update request."""
     # Obtain imms_id and version
@@ -55,13 +83,32 @@ def send_update_request(
         "local_id": local_id,
     }
     payload = {"headers": headers, "body": fhir_json, "pathParameters": {"id": imms_id}}
-    invoke_lambda(UPDATE_LAMBDA_NAME, payload)
+    succeeded = send_write_request(UPDATE_LAMBDA_NAME, payload, synchronous)
+
+    # Once the update is known to have succeeded, the next update of the immunization must be sent with the next
+    # version. Otherwise (including when the update lambda is invoked asynchronously, so it is not known whether or
+    # when the update will succeed) the version cached for the immunization can no longer be relied on.
+    if get_imms_id_cache_enabled():
+        immunization_identifier = get_immunization_identifier(fhir_json)
+        if succeeded and str(version).isdigit():
+            imms_id_cache.update(immunization_identifier, imms_id, int(version) + 1)
+        else:
+            imms_id_cache.evict(immunization_identifier)
 
 
 def send_delete_request(
-    fhir_json: dict, supplier: str, file_key: str, row_id: str, created_at_formatted_string: str, local_id: str
+    fhir_json: dict,
+    supplier: str,
+    file_key: str,
+    row_id: str,
+    created_at_formatted_string: str,
+    local_id: str,
+    synchronous: bool = False,
 ):
-    """Obtains the imms_id, sends the delete request."""
+    """
+    Obtains the imms_id, sends the delete request. Only the identifier of the fhir_json is needed, so by default the
+    recordprocessor sends a fhir_json holding only the identifier for DELETE rows (see its DELETE_PAYLOAD setting).
+    """
     # Obtain imms_id
     try:
         imms_id, _ = get_imms_id_and_version(fhir_json)
@@ -80,13 +127,17 @@ def send_delete_request(
         "local_id": local_id,
     }
     payload = {"headers": headers, "body": fhir_json, "pathParameters": {"id": imms_id}}
-    invoke_lambda(DELETE_LAMBDA_NAME, payload)
+    send_write_request(DELETE_LAMBDA_NAME, payload, synchronous)
+
+    if get_imms_id_cache_enabled():
+        imms_id_cache.evict(get_immunization_identifier(fhir_json))
 
 
-def send_request_to_lambda(message_body: dict):
+def send_request_to_lambda(message_body: dict, synchronous: bool = False):
     """
     Sends request to the Imms API (unless there was a failure at the recordprocessor level). Returns the imms id.
     If message is not successfully received and accepted by the Imms API raises a MessageNotSuccessful Error.
+    If synchronous, waits for the Imms API to complete the request (see send_write_request).
     """
     if incoming_diagnostics := message_body.get("diagnostics"):
         raise MessageNotSuccessfulError(incoming_diagnostics)
@@ -108,4 +159,5 @@ def send_request_to_lambda(message_body: dict):
         row_id=row_id,
         created_at_formatted_string=created_at_formatted_string,
         local_id=local_id,
+        synchronous=synchronous,
     )
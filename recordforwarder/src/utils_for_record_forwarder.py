@@ -6,6 +6,7 @@ from errors import MessageNotSuccessfulError
 from typing import Union
 
 from clients import lambda_client
+from constants import AGGREGATED_RECORD_VERSION
 
 
 def get_environment() -> str:
@@ -31,18 +32,33 @@ def get_operation_outcome_diagnostics(body: dict) -> str:
         return "Unable to obtain diagnostics from API response"
 
 
-def invoke_lambda(lambda_name: str, payload: dict) -> Union[tuple[int, dict, str], None]:
+def get_message_bodies(kinesis_payload: dict) -> list:
     """
-    Uses the lambda_client to invoke the specified lambda with the given payload.
-    Returns the ressponse status code, body (loaded in as a dictionary) and headers.
+    Returns the message body for each row carried by the Kinesis record. Records without a version key carry a
+    single row. Aggregated records carry the file details once, alongside a list of rows.
+    """
+    version = kinesis_payload.get("version", 1)
+    if version == 1:
+        return [kinesis_payload]
+    if version == AGGREGATED_RECORD_VERSION:
+        file_details = kinesis_payload["file"]
+        return [{**file_details, **row} for row in kinesis_payload["rows"]]
+    raise ValueError(f"Unsupported Kinesis record version: {version}")
+
+
+def invoke_lambda(lambda_name: str, payload: dict, synchronous: bool = False) -> Union[tuple[int, dict, str], None]:
+    """
+    Uses the lambda_client to invoke the specified lambda with the given payload. The search lambda is always invoked
+    synchronously, and the other lambdas are invoked asynchronously unless synchronous is True.
+    For a synchronous invocation, returns the response status code, body (loaded in as a dictionary) and headers.
     """
     # Change InvocationType to 'Event' for asynchronous invocation
-    if "search_imms" in lambda_name:
+    if synchronous or "search_imms" in lambda_name:
         response = lambda_client.invoke(
             FunctionName=lambda_name, InvocationType="RequestResponse", Payload=json.dumps(payload)
         )
         response_payload = json.loads(response["Payload"].read())
-        body = json.loads(response_payload.get("body", "{}"))
+        body = json.loads(response_payload.get("body") or "{}")
         return response_payload.get("statusCode"), body, response_payload.get("headers")
     else:
         response = lambda_client.invoke(FunctionName=lambda_name, InvocationType="Event", Payload=json.dumps(payload))
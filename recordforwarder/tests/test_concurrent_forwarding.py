@@ -0,0 +1,221 @@
+"""Tests for concurrent_forwarding"""
+
+import unittest
+from unittest.mock import patch
+import random
+import threading
+import time
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+SRCDIR = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, SRCDIR)))
+
+from concurrent_forwarding import (  # noqa: E402
+    RetriedRows,
+    forward_rows,
+    get_forwarding_workers,
+    get_synchronous_positions,
+    group_by_local_id,
+)
+from forwarding_lambda import forward_lambda_handler  # noqa: E402
+from tests.utils_for_recordfowarder_tests.utils_for_recordforwarder_tests import (  # noqa: E402
+    generate_kinesis_message,
+)
+
+
+def make_message_bodies(number_of_rows: int, number_of_local_ids: int) -> list:
+    """Returns message bodies for the given number of rows, spread at random across the given number of local_ids"""
+    rng = random.Random(20241024)
+    return [
+        {"row_id": f"file^{index}", "local_id": f"{rng.randrange(number_of_local_ids)}^system"}
+        for index in range(1, number_of_rows + 1)
+    ]
+
+
+class RecordingForwarder:
+    """
+    Stands in for forward_row, recording the order in which rows are forwarded, the row_ids of the rows forwarded
+    synchronously, and the peak concurrency
+    """
+
+    def __init__(self, seconds_per_row: float = 0.002):
+        self.seconds_per_row = seconds_per_row
+        self.forwarded = []
+        self.synchronous_row_ids = set()
+        self.active = 0
+        self.peak_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, message_body: dict, synchronous: bool = False) -> bool:
+        with self._lock:
+            if synchronous:
+                self.synchronous_row_ids.add(message_body["row_id"])
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        time.sleep(self.seconds_per_row * random.random())
+        with self._lock:
+            self.active -= 1
+            self.forwarded.append(message_body)
+        return True
+
+
+class TestConcurrentForwarding(unittest.TestCase):
+    """Tests for forward_rows"""
+
+    def assert_rows_of_each_local_id_in_order(self, forwarded: list, message_bodies: list):
+        """Asserts that every row was forwarded once, and that the rows of each local_id were forwarded in order"""
+        self.assertCountEqual([row["row_id"] for row in forwarded], [row["row_id"] for row in message_bodies])
+        for positions in group_by_local_id(message_bodies):
+            group = [message_bodies[position] for position in positions]
+            local_id = group[0]["local_id"]
+            self.assertEqual([row for row in forwarded if row["local_id"] == local_id], group)
+
+    def test_rows_of_each_local_id_are_forwarded_in_order(self):
+        """Tests that rows are forwarded concurrently, but that the rows of each local_id are forwarded in order"""
+        message_bodies = make_message_bodies(500, 40)
+        forwarder = RecordingForwarder()
+        self.assertIsNone(forward_rows(message_bodies, forwarder, workers=8))
+
+        self.assert_rows_of_each_local_id_in_order(forwarder.forwarded, message_bodies)
+        self.assertGreater(forwarder.peak_active, 1)
+        self.assertLessEqual(forwarder.peak_active, 8)
+
+    def test_single_worker_forwards_rows_in_batch_order(self):
+        """Tests that with one worker, or a single local_id, the rows are forwarded one at a time in batch order"""
+        for message_bodies, workers in [(make_message_bodies(50, 10), 1), (make_message_bodies(50, 1), 8)]:
+            with self.subTest(workers=workers):
+                forwarder = RecordingForwarder(0)
+                forward_rows(message_bodies, forwarder, workers)
+                self.assertEqual(forwarder.forwarded, message_bodies)
+                self.assertEqual(forwarder.peak_active, 1)
+
+    def test_rows_from_the_first_failed_record_are_not_forwarded(self):
+        """
+        Tests that the index of the first record with a failed row is returned, that every row of the records before
+        it is forwarded, and that the later rows of the local_id of the failed row are not forwarded
+        """
+        message_bodies = make_message_bodies(300, 30)
+        record_indexes = [position // 3 for position in range(300)]
+        failed_row = message_bodies[151]
+        forwarder = RecordingForwarder()
+
+        def forward(message_body, synchronous):
+            return forwarder(message_body, synchronous) and message_body["row_id"] not in ("file^152", "file^250")
+
+        for workers in (1, 8):
+            with self.subTest(workers=workers):
+                forwarder.forwarded = []
+                self.assertEqual(forward_rows(message_bodies, forward, workers, record_indexes), 50)
+
+                forwarded_row_ids = {row["row_id"] for row in forwarder.forwarded}
+                self.assertTrue({row["row_id"] for row in message_bodies[:150] + [failed_row]} <= forwarded_row_ids)
+                later_rows_of_local_id = [
+                    row for row in message_bodies[152:] if row["local_id"] == failed_row["local_id"]
+                ]
+                self.assertFalse(forwarded_row_ids & {row["row_id"] for row in later_rows_of_local_id})
+                if workers == 1:
+                    self.assertEqual(forwarder.forwarded, message_bodies[:152])
+
+    def test_forward_lambda_handler_forwards_every_row_of_the_batch(self):
+        """
+        Tests that the rows of every record of the batch are forwarded, keeping the rows of each local_id in order,
+        and that an error for one row does not stop the later rows of its local_id being forwarded
+        """
+        message_bodies = make_message_bodies(200, 20)
+        records = [generate_kinesis_message(message_body)["Records"][0] for message_body in message_bodies]
+        forwarder = RecordingForwarder()
+
+        def forward_request_to_lambda(message_body, synchronous):
+            forwarder(message_body, synchronous)
+            if message_body["row_id"].endswith("7"):
+                raise ValueError("Error")
+
+        with (
+            patch("forwarding_lambda.forward_request_to_lambda", side_effect=forward_request_to_lambda),
+            patch.dict("os.environ", {"FORWARDING_WORKERS": "4"}),
+        ):
+            forward_lambda_handler({"Records": records}, None)
+
+        self.assert_rows_of_each_local_id_in_order(forwarder.forwarded, message_bodies)
+
+    def test_rows_followed_by_a_row_of_their_local_id_are_forwarded_synchronously(self):
+        """
+        Tests that each row which is followed by another row of its local_id in the batch is forwarded synchronously,
+        so that the row after it is only forwarded once it has been completed, and that the other rows are not
+        """
+        message_bodies = make_message_bodies(200, 40)
+        last_positions = {row["local_id"]: position for position, row in enumerate(message_bodies)}
+        expected_synchronous_row_ids = {
+            row["row_id"] for position, row in enumerate(message_bodies) if position != last_positions[row["local_id"]]
+        }
+        self.assertEqual(
+            {
+                message_bodies[position]["row_id"]
+                for position in get_synchronous_positions(group_by_local_id(message_bodies))
+            },
+            expected_synchronous_row_ids,
+        )
+        for workers in (1, 8):
+            with self.subTest(workers=workers):
+                forwarder = RecordingForwarder()
+                forward_rows(message_bodies, forwarder, workers)
+                self.assertEqual(forwarder.synchronous_row_ids, expected_synchronous_row_ids)
+
+    def test_rows_forwarded_before_a_failure_are_not_forwarded_again(self):
+        """
+        Tests that the rows forwarded from the first failed record, or from a later record, are recorded, and that
+        when the batch is retried from that record they are skipped, so that every row is forwarded exactly once
+        """
+        message_bodies = make_message_bodies(300, 30)
+        record_indexes = [position // 3 for position in range(300)]
+
+        def failing_forward(message_body, synchronous):
+            return forwarder(message_body, synchronous) and message_body["row_id"] != "file^152"
+
+        for workers in (1, 8):
+            with self.subTest(workers=workers):
+                forwarder = RecordingForwarder()
+                already_forwarded = RetriedRows(max_size=1000)
+                self.assertEqual(
+                    forward_rows(message_bodies, failing_forward, workers, record_indexes, already_forwarded), 50
+                )
+                # The retried batch starts from the first failed record
+                self.assertEqual(
+                    forward_rows(
+                        message_bodies[150:],
+                        forwarder,
+                        workers,
+                        [index - 50 for index in record_indexes[150:]],
+                        already_forwarded,
+                    ),
+                    None,
+                )
+
+                forwarded_row_ids = [row["row_id"] for row in forwarder.forwarded if row["row_id"] != "file^152"]
+                self.assertCountEqual(
+                    forwarded_row_ids, [row["row_id"] for row in message_bodies if row["row_id"] != "file^152"]
+                )
+                # Rows of the records before the first failed record are not retried, so are not recorded
+                self.assertNotIn("file^150", already_forwarded)
+                if workers == 1:
+                    self.assertIn("file^151", already_forwarded)
+
+    def test_retried_rows_are_bounded(self):
+        """Tests that the least recently added rows are forgotten once the record of retried rows is full"""
+        retried_rows = RetriedRows(max_size=2)
+        retried_rows.add(["a", "b"])
+        retried_rows.add(["a", "c"])
+        self.assertEqual([row_id in retried_rows for row_id in ("a", "b", "c")], [True, False, True])
+
+    def test_get_forwarding_workers(self):
+        """Tests that the number of workers is read from the environment, defaulting to 10"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_forwarding_workers(), 10)
+        with patch.dict("os.environ", {"FORWARDING_WORKERS": "0"}):
+            self.assertEqual(get_forwarding_workers(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
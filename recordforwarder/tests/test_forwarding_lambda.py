@@ -3,6 +3,7 @@
 """Tests for forwarding lambda"""
 
 import unittest
+import json
 from unittest.mock import patch, MagicMock
 import os
 import sys
@@ -21,6 +22,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(maindir, SRCDIR)))
 
 from tests.utils_for_recordfowarder_tests.values_for_recordforwarder_tests import (
     MOCK_ENVIRONMENT_DICT,
+    MOCK_IDENTIFIER_SYSTEM,
+    MOCK_IDENTIFIER_VALUE,
     AWS_REGION,
     Message,
     LambdaPayloads,
@@ -31,6 +34,8 @@ from tests.utils_for_recordfowarder_tests.utils_for_recordforwarder_tests import
     generate_lambda_invocation_side_effect,
 )
 from forwarding_lambda import forward_lambda_handler, forward_request_to_lambda
+from imms_id_cache import imms_id_cache
+from concurrent_forwarding import retried_rows
 
 # from update_ack_file import create_ack_data
 
@@ -47,6 +52,10 @@ LAMBDA_PAYLOADS = LambdaPayloads()
 @patch("send_request_to_lambda.DELETE_LAMBDA_NAME", "mock_delete_imms")
 class TestForwardingLambda(unittest.TestCase):
 
+    def setUp(self):
+        imms_id_cache.clear()
+        retried_rows.clear()
+
     @contextmanager
     def common_contexts_for_forwarding_lambda_tests(
         self, mock_lambda_payloads=None
@@ -186,6 +195,29 @@ class TestForwardingLambda(unittest.TestCase):
         #     "20240821T10153000", Message.ROW_ID, True, None, "277befd9-574e-47fe-a6ee-189858af3bb0"
         # )
 
+    @patch("forwarding_lambda.sqs_client.send_message")
+    def test_forward_request_to_api_identifier_only_delete_success(self, mock_sqs_message):
+        """Tests that a DELETE message whose fhir_json holds only the identifier is forwarded to the delete lambda"""
+        mock_lambda_payloads = {
+            **deepcopy(LAMBDA_PAYLOADS.DELETE.SUCCESS),
+            **deepcopy(LAMBDA_PAYLOADS.SEARCH.ID_AND_VERSION_FOUND),
+        }
+        with patch(
+            "utils_for_record_forwarder.lambda_client.invoke",
+            side_effect=generate_lambda_invocation_side_effect(mock_lambda_payloads),
+        ) as mock_lambda_client:
+            forward_request_to_lambda(deepcopy(Message.identifier_only_delete_message))
+
+        mock_sqs_message.assert_not_called()
+        search_call, delete_call = mock_lambda_client.call_args_list
+        search_payload = json.loads(search_call.kwargs["Payload"])
+        delete_payload = json.loads(delete_call.kwargs["Payload"])
+        self.assertEqual(
+            search_payload["queryStringParameters"]["immunization.identifier"],
+            f"{MOCK_IDENTIFIER_SYSTEM}|{MOCK_IDENTIFIER_VALUE}",
+        )
+        self.assertEqual(delete_payload["pathParameters"], {"id": Message.IMMS_ID})
+
     def test_forward_lambda_handler(self):
         for message in [
             deepcopy(Message.create_message),
@@ -194,7 +226,33 @@ class TestForwardingLambda(unittest.TestCase):
         ]:
             with patch("forwarding_lambda.forward_request_to_lambda") as mock_forward_request_to_api:
                 forward_lambda_handler(generate_kinesis_message(message), None)
-            mock_forward_request_to_api.assert_called_once_with(message)
+            mock_forward_request_to_api.assert_called_once_with(message, False)
+
+    def test_forward_lambda_handler_with_aggregated_record(self):
+        """Tests that each row of an aggregated record is forwarded, even where forwarding an earlier row fails"""
+        messages = [deepcopy(Message.create_message), deepcopy(Message.update_message), deepcopy(Message.delete_message)]
+        file_details = {key: messages[0][key] for key in ("file_key", "supplier")}
+        aggregated_record = {
+            "version": 2,
+            "file": file_details,
+            "rows": [{key: value for key, value in message.items() if key not in file_details} for message in messages],
+        }
+        with patch(
+            "forwarding_lambda.forward_request_to_lambda", side_effect=[Exception("Error"), None, None]
+        ) as mock_forward_request_to_api:
+            forward_lambda_handler(generate_kinesis_message(aggregated_record), None)
+
+        self.assertEqual([call.args[0] for call in mock_forward_request_to_api.call_args_list], messages)
+
+    def test_forward_lambda_handler_with_unsupported_record_version(self):
+        """Tests that a record with an unsupported version is logged as an error and not forwarded"""
+        with (
+            patch("forwarding_lambda.forward_request_to_lambda") as mock_forward_request_to_api,
+            patch("forwarding_lambda.logger") as mock_logger,
+        ):
+            forward_lambda_handler(generate_kinesis_message({"version": 99, "rows": []}), None)
+        mock_forward_request_to_api.assert_not_called()
+        mock_logger.error.assert_called()
 
     def test_forward_lambda_handler_with_exception(self):
         message_body = {**deepcopy(Message.create_message), "operation_request": "INVALID_OPERATION"}
@@ -202,6 +260,136 @@ class TestForwardingLambda(unittest.TestCase):
             forward_lambda_handler(generate_kinesis_message(message_body), None)
         mock_logger.error.assert_called()
 
+    def generate_batch(self, messages: list) -> dict:
+        """Returns a Kinesis event with a single row record for each message, with sequence numbers 1, 2, 3..."""
+        return {
+            "Records": [
+                generate_kinesis_message(message, str(index))["Records"][0]
+                for index, message in enumerate(messages, start=1)
+            ]
+        }
+
+    def test_forward_lambda_handler_batch_item_failures(self):
+        """
+        Tests that, for batches mixing rows which are forwarded with rows which fail, the sequence number of the
+        first record with a row which failed with an AWS service error is returned, and that no later rows of the
+        batch are forwarded. Rows which fail with any other error are not retried.
+        """
+        client_error = ClientError({"Error": {"Code": "ServiceException"}}, "Invoke")
+        messages = [
+            {**deepcopy(Message.create_message), "row_id": f"row^{index}", "local_id": f"{index}^a"}
+            for index in range(1, 6)
+        ]
+        # Test case tuples are structured as (test_name, side effect for each row, expected failures, rows forwarded)
+        test_cases = [
+            ("all rows forwarded", [None] * 5, [], 5),
+            ("infrastructure failure", [None, None, client_error, None, None], [{"itemIdentifier": "3"}], 3),
+            ("first row fails", [client_error] + [None] * 4, [{"itemIdentifier": "1"}], 1),
+            ("other errors are not retried", [None, ValueError("Error"), None, None, None], [], 5),
+            ("mixed errors", [ValueError("Error"), None, None, client_error, None], [{"itemIdentifier": "4"}], 4),
+        ]
+        for test_name, side_effect, expected_failures, rows_forwarded in test_cases:
+            with self.subTest(test_name):
+                with (
+                    patch("forwarding_lambda.forward_request_to_lambda", side_effect=side_effect) as mock_forward,
+                    patch.dict("os.environ", {"FORWARDING_WORKERS": "1"}),
+                ):
+                    response = forward_lambda_handler(self.generate_batch(messages), None)
+
+                self.assertEqual(response, {"batchItemFailures": expected_failures})
+                self.assertEqual([call.args[0] for call in mock_forward.call_args_list], messages[:rows_forwarded])
+
+    def test_forward_lambda_handler_batch_item_failures_with_concurrent_forwarding(self):
+        """
+        Tests that, when rows are forwarded concurrently, the sequence number of the earliest record with a failed row
+        is returned, and that every row of the records before it is forwarded
+        """
+        messages = [
+            {**deepcopy(Message.create_message), "row_id": f"row^{index}", "local_id": f"{index % 4}^a"}
+            for index in range(1, 41)
+        ]
+
+        def forward_request_to_lambda(message_body, _synchronous):
+            if message_body["row_id"] in ("row^30", "row^17"):
+                raise ClientError({"Error": {"Code": "ServiceException"}}, "Invoke")
+
+        with (
+            patch("forwarding_lambda.forward_request_to_lambda", side_effect=forward_request_to_lambda) as mock_fwd,
+            patch.dict("os.environ", {"FORWARDING_WORKERS": "4"}),
+        ):
+            response = forward_lambda_handler(self.generate_batch(messages), None)
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "17"}]})
+        forwarded = [call.args[0] for call in mock_fwd.call_args_list]
+        self.assertTrue(all(message in forwarded for message in messages[:17]))
+        # row^21 is the next row with the local_id of row^17
+        self.assertNotIn(messages[20], forwarded)
+
+    def test_forward_lambda_handler_retry_does_not_forward_rows_again(self):
+        """
+        Tests that when a batch is retried from the record with a row which failed, the rows of that record and of
+        later records which were forwarded before the failure are not forwarded again
+        """
+        client_error = ClientError({"Error": {"Code": "ServiceException"}}, "Invoke")
+        messages = [
+            {**deepcopy(Message.create_message), "row_id": f"row^{index}", "local_id": f"{index}^a"}
+            for index in range(1, 6)
+        ]
+        file_details = {key: messages[0][key] for key in ("file_key", "supplier")}
+        aggregated_record = {
+            "version": 2,
+            "file": file_details,
+            "rows": [{key: value for key, value in message.items() if key not in file_details} for message in messages[1:4]],
+        }
+        # The second record carries rows 2 to 4, of which row 3 fails on the first attempt
+        event = {
+            "Records": [
+                generate_kinesis_message(messages[0], "1")["Records"][0],
+                generate_kinesis_message(aggregated_record, "2")["Records"][0],
+                generate_kinesis_message(messages[4], "3")["Records"][0],
+            ]
+        }
+        with (
+            patch("forwarding_lambda.forward_request_to_lambda", side_effect=[None, None, client_error]) as mock_forward,
+            patch.dict("os.environ", {"FORWARDING_WORKERS": "1"}),
+        ):
+            response = forward_lambda_handler(event, None)
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "2"}]})
+        self.assertEqual([call.args[0] for call in mock_forward.call_args_list], messages[:3])
+
+        retried_event = {"Records": event["Records"][1:]}
+        with (
+            patch("forwarding_lambda.forward_request_to_lambda") as mock_forward,
+            patch.dict("os.environ", {"FORWARDING_WORKERS": "1"}),
+        ):
+            response = forward_lambda_handler(retried_event, None)
+        self.assertEqual(response, {"batchItemFailures": []})
+        self.assertEqual([call.args[0] for call in mock_forward.call_args_list], messages[2:])
+
+    def test_forward_lambda_handler_failure_ack_not_sent(self):
+        """Tests that a row is retried if its failure ack can not be sent to the ack queue"""
+        with patch(
+            "forwarding_lambda.sqs_client.send_message",
+            side_effect=ClientError({"Error": {"Code": "ServiceUnavailable"}}, "SendMessage"),
+        ):
+            response = forward_lambda_handler(generate_kinesis_message(deepcopy(Message.diagnostics_message)), None)
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "1"}]})
+
+    def test_forward_lambda_handler_undecodable_record(self):
+        """Tests that a record which can not be decoded is logged, and is not retried"""
+        event = self.generate_batch([deepcopy(Message.create_message)])
+        event["Records"][0]["kinesis"]["data"] = "not base64 json"
+        with (
+            patch("forwarding_lambda.forward_request_to_lambda") as mock_forward,
+            patch("forwarding_lambda.logger") as mock_logger,
+        ):
+            response = forward_lambda_handler(event, None)
+
+        self.assertEqual(response, {"batchItemFailures": []})
+        mock_forward.assert_not_called()
+        mock_logger.error.assert_called()
+
 
 # if __name__ == "__main__":
 #     unittest.main()
@@ -5,6 +5,7 @@ from unittest.mock import patch
 from copy import deepcopy
 from get_imms_id_and_version import get_imms_id_and_version
 from errors import IdNotFoundError
+from imms_id_cache import imms_id_cache
 from tests.utils_for_recordfowarder_tests.utils_for_recordforwarder_tests import (
     generate_lambda_invocation_side_effect,
 )
@@ -22,6 +23,9 @@ class TestGetImmsIdAndVersion(unittest.TestCase):
     Note that these test mock the lambda invocation, therefore they do not test the interaction with search lambda.
     """
 
+    def setUp(self):
+        imms_id_cache.clear()
+
     def test_success(self):
         """Test that imms_id and version are correctly identified from a successful search lambda response."""
         with patch(
@@ -0,0 +1,266 @@
+"""Tests for imms_id_cache"""
+
+import unittest
+from unittest.mock import patch
+import json
+import threading
+import os
+import sys
+from copy import deepcopy
+
+maindir = os.path.dirname(__file__)
+SRCDIR = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, SRCDIR)))
+
+from imms_id_cache import (  # noqa: E402
+    ImmsIdCache,
+    imms_id_cache,
+    get_imms_id_cache_enabled,
+    get_imms_id_cache_size,
+    get_imms_id_cache_ttl_seconds,
+)
+from errors import IdNotFoundError  # noqa: E402
+from send_request_to_lambda import send_request_to_lambda  # noqa: E402
+from tests.utils_for_recordfowarder_tests.utils_for_recordforwarder_tests import (  # noqa: E402
+    generate_lambda_payload,
+)
+from tests.utils_for_recordfowarder_tests.values_for_recordforwarder_tests import (  # noqa: E402
+    Message,
+    SearchLambdaResponseBody,
+    MOCK_ENVIRONMENT_DICT,
+    MOCK_IDENTIFIER_SYSTEM,
+    MOCK_IDENTIFIER_VALUE,
+)
+
+IDENTIFIER = f"{MOCK_IDENTIFIER_SYSTEM}|{MOCK_IDENTIFIER_VALUE}"
+
+
+class FakeClock:
+    """Stands in for time.monotonic, returning a time which is only advanced by the test"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CountingSearch:
+    """Stands in for the search, counting the number of times it is called"""
+
+    def __init__(self, imms_id: str = "an_imms_id", version: int = 1):
+        self.result = (imms_id, version)
+        self.calls = 0
+
+    def __call__(self) -> tuple:
+        self.calls += 1
+        return self.result
+
+
+class TestImmsIdCache(unittest.TestCase):
+    """Tests for ImmsIdCache"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ImmsIdCache(max_size=2, ttl_seconds=60, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        """Tests that only the first lookup of an identifier searches, and that the hit rate is reported"""
+        search = CountingSearch()
+        for _ in range(4):
+            self.assertEqual(self.cache.get_or_search("system|value", search), ("an_imms_id", 1))
+
+        self.assertEqual(search.calls, 1)
+        statistics = self.cache.statistics()
+        self.assertEqual((statistics["hits"], statistics["misses"], statistics["size"]), (3, 1, 1))
+        self.assertEqual(statistics["hit_rate"], 0.75)
+
+    def test_expiry(self):
+        """Tests that an entry is searched again once its time to live has passed"""
+        search = CountingSearch()
+        self.cache.get_or_search("system|value", search)
+        self.clock.now = 59
+        self.cache.get_or_search("system|value", search)
+        self.assertEqual(search.calls, 1)
+
+        self.clock.now = 60
+        self.cache.get_or_search("system|value", search)
+        self.assertEqual(search.calls, 2)
+        self.assertEqual(self.cache.statistics()["expirations"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """Tests that the least recently used identifier is evicted once the cache is full"""
+        searches = {identifier: CountingSearch(identifier) for identifier in ("a|1", "b|2", "c|3")}
+        self.cache.get_or_search("a|1", searches["a|1"])
+        self.cache.get_or_search("b|2", searches["b|2"])
+        self.cache.get_or_search("a|1", searches["a|1"])
+        self.cache.get_or_search("c|3", searches["c|3"])
+
+        self.cache.get_or_search("a|1", searches["a|1"])
+        self.cache.get_or_search("b|2", searches["b|2"])
+        self.assertEqual(
+            {identifier: search.calls for identifier, search in searches.items()}, {"a|1": 1, "b|2": 2, "c|3": 1}
+        )
+        self.assertEqual(self.cache.statistics()["evictions"], 2)
+
+    def test_update_and_evict(self):
+        """Tests that an updated entry is returned without searching, and that an evicted entry is searched again"""
+        search = CountingSearch()
+        self.cache.get_or_search("system|value", search)
+        self.cache.update("system|value", "an_imms_id", 2)
+        self.assertEqual(self.cache.get_or_search("system|value", search), ("an_imms_id", 2))
+        self.assertEqual(search.calls, 1)
+
+        self.cache.evict("system|value")
+        self.assertEqual(self.cache.get_or_search("system|value", search), ("an_imms_id", 1))
+        self.assertEqual(search.calls, 2)
+
+    def test_failed_search_is_not_cached(self):
+        """Tests that the error of a failed search is raised, and that the identifier is searched again next time"""
+
+        def failing_search():
+            raise IdNotFoundError("Imms id not found")
+
+        with self.assertRaises(IdNotFoundError):
+            self.cache.get_or_search("system|value", failing_search)
+        search = CountingSearch()
+        self.assertEqual(self.cache.get_or_search("system|value", search), ("an_imms_id", 1))
+        self.assertEqual(search.calls, 1)
+
+    def test_concurrent_lookups_share_one_search(self):
+        """Tests that concurrent lookups of an identifier share a single search, including when the search fails"""
+        for error in (None, IdNotFoundError("Imms id not found")):
+            with self.subTest(error=error):
+                cache = ImmsIdCache(max_size=10, ttl_seconds=60)
+                search_started = threading.Event()
+                release_search = threading.Event()
+                calls = []
+
+                def blocking_search():
+                    calls.append(1)
+                    search_started.set()
+                    release_search.wait(5)
+                    if error is not None:
+                        raise error
+                    return ("an_imms_id", 1)
+
+                results = []
+
+                def look_up():
+                    try:
+                        results.append(cache.get_or_search("system|value", blocking_search))
+                    except IdNotFoundError as lookup_error:
+                        results.append(lookup_error)
+
+                threads = [threading.Thread(target=look_up) for _ in range(8)]
+                threads[0].start()
+                search_started.wait(5)
+                for thread in threads[1:]:
+                    thread.start()
+                # Wait until every other lookup is waiting on the search before letting it finish
+                while cache.statistics()["shared_searches"] < 7:
+                    threading.Event().wait(0.001)
+                release_search.set()
+                for thread in threads:
+                    thread.join(5)
+
+                self.assertEqual(len(calls), 1)
+                self.assertEqual(results, [error or ("an_imms_id", 1)] * 8)
+                self.assertEqual(cache.statistics()["size"], 0 if error else 1)
+
+    def test_result_of_superseded_search_is_not_cached(self):
+        """Tests that a search which was running when its identifier was evicted does not cache its result"""
+
+        def search():
+            self.cache.evict("system|value")
+            return ("an_imms_id", 1)
+
+        self.assertEqual(self.cache.get_or_search("system|value", search), ("an_imms_id", 1))
+        self.assertEqual(self.cache.statistics()["size"], 0)
+
+    def test_config(self):
+        """Tests that the cache settings are read from the environment, and that the cache can be switched off"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertTrue(get_imms_id_cache_enabled())
+            self.assertEqual(get_imms_id_cache_size(), 10000)
+            self.assertEqual(get_imms_id_cache_ttl_seconds(), 300)
+        for value in ("false", "False", "0", "off"):
+            with patch.dict("os.environ", {"IMMS_ID_CACHE_ENABLED": value}):
+                self.assertFalse(get_imms_id_cache_enabled())
+
+
+@patch.dict("os.environ", MOCK_ENVIRONMENT_DICT)
+@patch("send_request_to_lambda.UPDATE_LAMBDA_NAME", "mock_update_imms")
+@patch("send_request_to_lambda.DELETE_LAMBDA_NAME", "mock_delete_imms")
+class TestImmsIdCacheForwarding(unittest.TestCase):
+    """Tests of the use of the imms id cache when forwarding UPDATE and DELETE rows"""
+
+    def setUp(self):
+        imms_id_cache.clear()
+
+    def forward(self, messages: list, synchronous: bool = False, status_code: int = 200) -> list:
+        """
+        Forwards each message in turn, returning the (lambda type, payload) of each lambda invocation. Synchronous
+        invocations of the update and delete lambdas respond with the status code.
+        """
+        invocations = []
+
+        def lambda_invocation_side_effect(FunctionName, InvocationType, Payload):  # pylint: disable=invalid-name
+            lambda_type = FunctionName.split("_")[1].upper()
+            invocations.append((lambda_type, json.loads(Payload)))
+            if lambda_type == "SEARCH":
+                return generate_lambda_payload(200, body=SearchLambdaResponseBody.id_and_version_found)
+            self.assertEqual(InvocationType, "RequestResponse" if synchronous else "Event")
+            return (
+                generate_lambda_payload(status_code, invocation_status_code=200) if synchronous else {"StatusCode": 202}
+            )
+
+        with patch("utils_for_record_forwarder.lambda_client.invoke", side_effect=lambda_invocation_side_effect):
+            for message in messages:
+                send_request_to_lambda(deepcopy(message), synchronous)
+        return invocations
+
+    def test_update_evicts_identifier(self):
+        """
+        Tests that the identifier is searched again following an UPDATE, as the update lambda is invoked
+        asynchronously so the version following the update is not known
+        """
+        invocations = self.forward([Message.update_message, Message.update_message])
+
+        self.assertEqual([lambda_type for lambda_type, _ in invocations], ["SEARCH", "UPDATE", "SEARCH", "UPDATE"])
+        self.assertEqual([payload["headers"]["E-Tag"] for _, payload in invocations[1::2]], [2, 2])
+        self.assertEqual(imms_id_cache.statistics()["size"], 0)
+
+    def test_synchronous_update_caches_next_version(self):
+        """
+        Tests that once an UPDATE sent synchronously has succeeded, the next UPDATE of the identifier is sent without
+        searching, with the next version, and that the identifier is evicted if the UPDATE did not succeed
+        """
+        invocations = self.forward([Message.update_message, Message.update_message], synchronous=True)
+
+        self.assertEqual([lambda_type for lambda_type, _ in invocations], ["SEARCH", "UPDATE", "UPDATE"])
+        self.assertEqual([payload["headers"]["E-Tag"] for _, payload in invocations[1:]], [2, 3])
+        self.assertEqual(imms_id_cache.statistics()["hits"], 1)
+
+        imms_id_cache.clear()
+        invocations = self.forward([Message.update_message, Message.update_message], synchronous=True, status_code=412)
+        self.assertEqual([lambda_type for lambda_type, _ in invocations], ["SEARCH", "UPDATE", "SEARCH", "UPDATE"])
+
+    def test_delete_evicts_identifier(self):
+        """Tests that the identifier is searched again following a DELETE"""
+        invocations = self.forward([Message.delete_message, Message.update_message])
+
+        self.assertEqual([lambda_type for lambda_type, _ in invocations], ["SEARCH", "DELETE", "SEARCH", "UPDATE"])
+        self.assertEqual(invocations[0][1]["queryStringParameters"]["immunization.identifier"], IDENTIFIER)
+
+    def test_cache_disabled(self):
+        """Tests that every UPDATE searches when the cache is switched off"""
+        with patch.dict("os.environ", {"IMMS_ID_CACHE_ENABLED": "false"}):
+            invocations = self.forward([Message.update_message, Message.update_message])
+
+        self.assertEqual([lambda_type for lambda_type, _ in invocations], ["SEARCH", "UPDATE", "SEARCH", "UPDATE"])
+        self.assertEqual(imms_id_cache.statistics()["size"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,7 @@
 
 from unittest import TestCase
 from unittest.mock import patch
-from utils_for_record_forwarder import get_environment
+from utils_for_record_forwarder import get_environment, get_message_bodies
 
 # from constants import ACK_HEADERS
 
@@ -32,3 +32,27 @@ class TestUtilsForRecordForwarder(TestCase):
             with self.subTest(f"SubTest for environment: {environment}"):
                 with patch.dict("os.environ", {"ENVIRONMENT": environment}):
                     self.assertEqual(get_environment(), expected_result)
+
+    def test_get_message_bodies(self):
+        """Tests that get_message_bodies returns one message body for each row carried by the Kinesis record"""
+        file_details = {"file_key": "test_file_key", "supplier": "EMIS", "created_at_formatted_string": "2024"}
+        single_row_record = {"row_id": "test^1", **file_details, "operation_requested": "CREATE"}
+        aggregated_record = {
+            "version": 2,
+            "file": file_details,
+            "rows": [
+                {"row_id": "test^1", "operation_requested": "CREATE"},
+                {"row_id": "test^2", "operation_requested": "DELETE"},
+            ],
+        }
+
+        self.assertEqual(get_message_bodies(single_row_record), [single_row_record])
+        self.assertEqual(
+            get_message_bodies(aggregated_record),
+            [
+                {"row_id": "test^1", **file_details, "operation_requested": "CREATE"},
+                {"row_id": "test^2", **file_details, "operation_requested": "DELETE"},
+            ],
+        )
+        with self.assertRaises(ValueError):
+            get_message_bodies({"version": 3})
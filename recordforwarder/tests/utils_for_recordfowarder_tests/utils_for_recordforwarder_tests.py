@@ -6,10 +6,10 @@ from io import StringIO
 from typing import Union
 
 
-def generate_kinesis_message(message: dict) -> str:
+def generate_kinesis_message(message: dict, sequence_number: str = "1") -> str:
     """Convert a dictionary to a kinesis message"""
     kinesis_encoded_data = base64.b64encode(json.dumps(message).encode("utf-8")).decode("utf-8")
-    return {"Records": [{"kinesis": {"data": kinesis_encoded_data}}]}
+    return {"Records": [{"kinesis": {"data": kinesis_encoded_data, "sequenceNumber": sequence_number}}]}
 
 
 def generate_operation_outcome(diagnostics: str, code: str = "duplicate") -> dict:
@@ -170,6 +170,15 @@ class Message:
         "operation_requested": Operations.DELETE,
         "local_id": LOCAL_ID,
     }
+    identifier_only_delete_message = {
+        **base_message_fields,
+        "fhir_json": {
+            "resourceType": "Immunization",
+            "identifier": [{"value": MOCK_IDENTIFIER_VALUE, "system": MOCK_IDENTIFIER_SYSTEM}],
+        },
+        "operation_requested": Operations.DELETE,
+        "local_id": LOCAL_ID,
+    }
     diagnostics_message = {**base_message_fields, "diagnostics": DIAGNOSTICS, "local_id": LOCAL_ID}
 
 
@@ -0,0 +1,80 @@
+"""
+Benchmark of converting a synthetic file, comparing converting the values of each row as the row is processed with
+converting the columns of each chunk of rows together before the rows are processed (see columnar_conversion). The
+synthetic file repeats values across its rows as real files do (a few hundred dates of vaccination, some thousands of
+dates of birth, and a handful of gender codes, booleans and dose sequences). The file is parsed in both cases, and
+both the dictionary and the direct json encodings of the FHIR Immunization resource are timed.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_columnar_conversion.py [number_of_rows]
+"""
+
+import os
+import random
+import simplejson as json
+import sys
+import timeit
+from csv import DictReader
+from datetime import date, timedelta
+from io import StringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from columnar_conversion import convert_columns_in_chunks  # noqa: E402
+from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource, encode_fhir_imms_resource  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import all_fields  # noqa: E402
+
+ROWS_PER_CHUNK = 1000
+
+
+def synthetic_file(number_of_rows: int) -> str:
+    """Returns the content of a pipe-delimited file of the given number of rows, with values repeated across rows"""
+    rng = random.Random(20241020)
+    start = date(2024, 9, 1)
+    rows = ["|".join(all_fields)]
+    for _ in range(number_of_rows):
+        row = dict(all_fields)
+        row["DATE_AND_TIME"] = (start + timedelta(days=rng.randrange(200))).strftime("%Y%m%d") + "T100000"
+        row["RECORDED_DATE"] = (start + timedelta(days=rng.randrange(200))).strftime("%Y%m%d")
+        row["EXPIRY_DATE"] = (start + timedelta(days=rng.randrange(400, 500))).strftime("%Y%m%d")
+        row["PERSON_DOB"] = (date(1940, 1, 1) + timedelta(days=rng.randrange(8000))).strftime("%Y%m%d")
+        row["PERSON_GENDER_CODE"] = rng.choice(["1", "2", "9", "0"])
+        row["PRIMARY_SOURCE"] = rng.choice(["TRUE", "FALSE"])
+        row["DOSE_SEQUENCE"] = rng.choice(["1", "2", "3", ""])
+        row["UNIQUE_ID"] = str(rng.randrange(10**9))
+        rows.append("|".join(f'"{value}"' for value in row.values()))
+    return "\n".join(rows)
+
+
+def convert_by_row(file_content: str, convert) -> list:
+    """Parses the file, and converts the values of each row as the row is converted"""
+    return [convert(row, Vaccine.RSV) for row in DictReader(StringIO(file_content), delimiter="|")]
+
+
+def convert_by_column(file_content: str, convert) -> list:
+    """Parses the file, and converts the columns of each chunk of rows before the rows are converted"""
+    numbered_rows = enumerate(DictReader(StringIO(file_content), delimiter="|"))
+    return [convert(row, Vaccine.RSV, True) for _, row in convert_columns_in_chunks(numbered_rows, ROWS_PER_CHUNK)]
+
+
+def encode(resources: list) -> list:
+    """Returns the json of each resource, as encoded when sent to Kinesis"""
+    return [json.dumps(resource, ensure_ascii=False) for resource in resources]
+
+
+def main(number_of_rows: int) -> None:
+    """Times both methods for a synthetic file of the given number of rows, for both encodings of the resource"""
+    file_content = synthetic_file(number_of_rows)
+    print(f"{number_of_rows} rows, columns converted in chunks of {ROWS_PER_CHUNK} rows")
+    for name, convert in [("Dictionary", convert_to_fhir_imms_resource), ("Direct json", encode_fhir_imms_resource)]:
+        assert encode(convert_by_row(file_content, convert)) == encode(convert_by_column(file_content, convert))
+        by_row = min(timeit.repeat(lambda: convert_by_row(file_content, convert), number=1, repeat=5))
+        by_column = min(timeit.repeat(lambda: convert_by_column(file_content, convert), number=1, repeat=5))
+        print(f"{name}:")
+        print(f"  Row by row: {by_row:.3f}s ({by_row / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Columnar:   {by_column:.3f}s ({by_column / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Speed-up:   {by_row / by_column:.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,48 @@
+"""
+Benchmark of the per-row cost of converting a row into a FHIR Immunization resource, comparing the decorators with
+the converter compiled from the FHIR mapping specification, for a row with all fields and a row with only the
+critical fields populated.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_compiled_converter.py [number_of_rows]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from convert_to_fhir_imms_resource import (  # noqa: E402
+    convert_to_fhir_imms_resource,
+    convert_to_fhir_imms_resource_with_decorators,
+)
+from mappings import Vaccine  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    all_fields,
+    critical_fields_only,
+)
+
+
+def main(number_of_rows: int) -> None:
+    """Times both converters for the given number of rows of each kind"""
+    print(f"{number_of_rows} rows")
+    for row_name, row in [("All fields", all_fields), ("Critical fields only", critical_fields_only)]:
+        assert convert_to_fhir_imms_resource(row, Vaccine.RSV) == convert_to_fhir_imms_resource_with_decorators(
+            row, Vaccine.RSV
+        )
+        decorators = min(
+            timeit.repeat(
+                lambda: convert_to_fhir_imms_resource_with_decorators(row, Vaccine.RSV), number=number_of_rows, repeat=5
+            )
+        )
+        compiled = min(
+            timeit.repeat(lambda: convert_to_fhir_imms_resource(row, Vaccine.RSV), number=number_of_rows, repeat=5)
+        )
+        print(f"{row_name}:")
+        print(f"  Decorators: {decorators:.3f}s ({decorators / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Compiled:   {compiled:.3f}s ({compiled / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Speed-up:   {decorators / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
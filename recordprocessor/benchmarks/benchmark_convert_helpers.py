@@ -0,0 +1,94 @@
+"""
+Benchmark of the per-row cost of the Convert helpers and _is_not_empty. Makes the helper calls made when converting
+a row with all fields populated, using the reference implementations (as before the helpers were reworked), the
+reworked helpers with the date conversion caches bypassed, and the reworked helpers with the caches.
+The rows cycle through a few hundred distinct dates, as in a typical supplier file.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_convert_helpers.py [number_of_rows]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from utils_for_fhir_conversion import (  # noqa: E402
+    _convert_date_string,
+    _convert_date_time_string,
+    _is_not_empty,
+    Convert,
+)
+from tests.utils_for_recordprocessor_tests.reference_conversions import (  # noqa: E402
+    ReferenceConvert,
+    reference_is_not_empty,
+)
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import all_fields  # noqa: E402
+
+DISTINCT_DATES = 300
+
+
+class UncachedConvert(Convert):
+    """The reworked helpers, with the date conversion caches bypassed"""
+
+    @staticmethod
+    def date_time(date_time: str) -> str:
+        return _convert_date_time_string.__wrapped__(date_time) if isinstance(date_time, str) else date_time
+
+    @staticmethod
+    def date(date: str) -> str:
+        return _convert_date_string.__wrapped__(date) if isinstance(date, str) else date
+
+
+def make_rows(number_of_rows: int) -> list:
+    """Returns copies of all_fields with the dates cycling through DISTINCT_DATES values"""
+    rows = []
+    for row_number in range(number_of_rows):
+        day = row_number % DISTINCT_DATES
+        date = f"2024{day // 28 + 1:02}{day % 28 + 1:02}"
+        rows.append(
+            {**all_fields, "DATE_AND_TIME": f"{date}T13280000", "RECORDED_DATE": date, "PERSON_DOB": f"19{date[2:]}"}
+        )
+    return rows
+
+
+def convert_row_values(row: dict, convert, is_not_empty) -> None:
+    """Makes the helper calls made when converting the row"""
+    for value in row.values():
+        is_not_empty(value)
+    convert.date_time(row["DATE_AND_TIME"])
+    convert.date(row["RECORDED_DATE"])
+    convert.date(row["EXPIRY_DATE"])
+    convert.date(row["PERSON_DOB"])
+    convert.gender_code(row["PERSON_GENDER_CODE"])
+    convert.boolean(row["PRIMARY_SOURCE"])
+    convert.integer(row["DOSE_SEQUENCE"])
+    convert.integer_or_decimal(row["DOSE_AMOUNT"])
+
+
+def time_rows(rows: list, convert, is_not_empty) -> float:
+    """Returns the fastest of five timings of making the helper calls for every row"""
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for row in rows:
+            convert_row_values(row, convert, is_not_empty)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(number_of_rows: int) -> None:
+    """Times the helpers for the given number of rows"""
+    rows = make_rows(number_of_rows)
+    reference = time_rows(rows, ReferenceConvert, reference_is_not_empty)
+    uncached = time_rows(rows, UncachedConvert, _is_not_empty)
+    cached = time_rows(rows, Convert, _is_not_empty)
+    print(f"{number_of_rows} rows")
+    timings = [("Reference helpers", reference), ("Reworked, uncached", uncached), ("Reworked, cached", cached)]
+    for name, timing in timings:
+        per_row = timing / number_of_rows * 1e6
+        print(f"{name + ':':20}{timing:.3f}s ({per_row:.2f}us per row, {reference / timing:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,83 @@
+"""
+Benchmark of reading the rows of a synthetic file into dictionaries with csv.DictReader, compared with reading them
+into CsvRows with csv.reader. Measures the memory held by the rows when the whole file is read into a list, the time
+to read the rows, and the time to read and convert the rows to the json of the FHIR Immunization resources.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_csv_row.py [number_of_rows]
+"""
+
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+from io import StringIO
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from convert_to_fhir_imms_resource import encode_fhir_imms_resource  # noqa: E402
+from csv_row import read_csv_rows  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import all_fields  # noqa: E402
+
+
+def synthetic_file(number_of_rows: int) -> str:
+    """Returns the content of a pipe-delimited file of the given number of rows, each with all fields populated"""
+    rng = random.Random(20241022)
+    rows = ["|".join(all_fields)]
+    for _ in range(number_of_rows):
+        row = {**all_fields, "UNIQUE_ID": str(rng.randrange(10**9)), "NHS_NUMBER": str(rng.randrange(10**10))}
+        rows.append("|".join(f'"{value}"' for value in row.values()))
+    return "\n".join(rows)
+
+
+def read_rows(file_content: str) -> list:
+    """Reads the rows of the file into a list"""
+    return list(read_csv_rows(StringIO(file_content)))
+
+
+def read_and_convert_rows(file_content: str) -> list:
+    """Reads the rows of the file, converting each to the json of the FHIR Immunization resource as it is read"""
+    return [encode_fhir_imms_resource(row, Vaccine.RSV) for row in read_csv_rows(StringIO(file_content))]
+
+
+def memory_held_by_rows(file_content: str) -> int:
+    """Returns the number of bytes allocated for the rows when the whole file is read into a list"""
+    tracemalloc.start()
+    try:
+        rows = read_rows(file_content)
+        memory, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del rows
+    return memory
+
+
+def main(number_of_rows: int) -> None:
+    """Measures both row types for a synthetic file of the given number of rows"""
+    file_content = synthetic_file(number_of_rows)
+    print(f"{number_of_rows} rows")
+    results = {}
+    for csv_row_type in ("dict", "tuple"):
+        with patch.dict("os.environ", {"CSV_ROW_TYPE": csv_row_type}):
+            results[csv_row_type] = (
+                memory_held_by_rows(file_content),
+                min(timeit.repeat(lambda: read_rows(file_content), number=1, repeat=5)),
+                min(timeit.repeat(lambda: read_and_convert_rows(file_content), number=1, repeat=5)),
+            )
+
+    for csv_row_type, name in [("dict", "csv.DictReader dicts"), ("tuple", "csv.reader CsvRows")]:
+        memory, read_time, convert_time = results[csv_row_type]
+        print(f"{name}:")
+        print(f"  Memory held by rows: {memory / 2**20:.1f}MiB ({memory / number_of_rows:.0f} bytes per row)")
+        print(f"  Read:                {read_time:.3f}s ({read_time / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Read and convert:    {convert_time:.3f}s ({convert_time / number_of_rows * 1e6:.2f}us per row)")
+
+    (dict_memory, dict_read, dict_convert), (tuple_memory, tuple_read, tuple_convert) = results.values()
+    print(f"Memory saving: {1 - tuple_memory / dict_memory:.0%}")
+    print(f"Speed-up: read {dict_read / tuple_read:.2f}x, read and convert {dict_convert / tuple_convert:.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,52 @@
+"""
+Benchmark of the per-row cost of building and encoding the Kinesis message body of a row, comparing building the
+FHIR Immunization resource as a dictionary which is then encoded with the message body, with writing the json of the
+resource directly from the row values, for a row with all fields and a row with only the critical fields populated.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_direct_json_encoding.py [number_of_rows]
+"""
+
+import os
+import sys
+import timeit
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource, encode_fhir_imms_resource  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from send_to_kinesis import encode_message_body  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    all_fields,
+    critical_fields_only,
+)
+
+MESSAGE_BODY = {"row_id": "123456^1", "file_key": "benchmark.csv", "supplier": "EMIS", "local_id": "a^b"}
+
+
+def encode_from_dict(row: dict) -> bytes:
+    """Builds the resource as a dictionary, then encodes the message body"""
+    return encode_message_body({**MESSAGE_BODY, "fhir_json": convert_to_fhir_imms_resource(row, Vaccine.RSV)})
+
+
+def encode_direct(row: dict) -> bytes:
+    """Writes the json of the resource directly from the row, then encodes the message body"""
+    return encode_message_body({**MESSAGE_BODY, "fhir_json": encode_fhir_imms_resource(row, Vaccine.RSV)})
+
+
+def main(number_of_rows: int) -> None:
+    """Times both methods for the given number of rows of each kind"""
+    print(f"{number_of_rows} rows")
+    for row_name, row in [("All fields", all_fields), ("Critical fields only", critical_fields_only)]:
+        assert encode_from_dict(row) == encode_direct(row)
+        from_dict = min(timeit.repeat(lambda: encode_from_dict(row), number=number_of_rows, repeat=5))
+        direct = min(timeit.repeat(lambda: encode_direct(row), number=number_of_rows, repeat=5))
+        print(f"{row_name}:")
+        print(f"  Dictionary then encoded: {from_dict:.3f}s ({from_dict / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Direct json:             {direct:.3f}s ({direct / number_of_rows * 1e6:.2f}us per row)")
+        print(f"  Speed-up:                {from_dict / direct:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,46 @@
+"""
+Benchmark of the per-row cost of building the constant elements of the FHIR Immunization resource (resourceType,
+status and the protocolApplied targetDisease element) for MMR, which has three target diseases. Compares building
+the elements for every row, as was done before, with the elements built once per vaccine type.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_fhir_skeleton.py [number_of_rows]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from convert_to_fhir_imms_resource import TARGET_DISEASE_ELEMENTS  # noqa: E402
+from mappings import Vaccine, map_target_disease  # noqa: E402
+
+
+def build_per_row(vaccine: Vaccine) -> dict:
+    """Builds the constant elements of the resource from the mappings"""
+    imms_resource = {"resourceType": "Immunization", "status": "completed"}
+    imms_resource["protocolApplied"] = [{"targetDisease": map_target_disease(vaccine)}]
+    return imms_resource
+
+
+def build_from_skeleton(vaccine: Vaccine) -> dict:
+    """Builds the constant elements of the resource using the targetDisease element built once per vaccine type"""
+    return {
+        "resourceType": "Immunization",
+        "status": "completed",
+        "protocolApplied": [{"targetDisease": TARGET_DISEASE_ELEMENTS[vaccine]}],
+    }
+
+
+def main(number_of_rows: int) -> None:
+    """Times both methods for the given number of MMR rows"""
+    assert build_per_row(Vaccine.MMR) == build_from_skeleton(Vaccine.MMR)
+    per_row = min(timeit.repeat(lambda: build_per_row(Vaccine.MMR), number=number_of_rows, repeat=5))
+    skeleton = min(timeit.repeat(lambda: build_from_skeleton(Vaccine.MMR), number=number_of_rows, repeat=5))
+    print(f"{number_of_rows} MMR rows")
+    print(f"Built per row:       {per_row:.3f}s ({per_row / number_of_rows * 1e6:.2f}us per row)")
+    print(f"Built from skeleton: {skeleton:.3f}s ({skeleton / number_of_rows * 1e6:.2f}us per row)")
+    print(f"Saving per row:      {(per_row - skeleton) / number_of_rows * 1e6:.2f}us ({per_row / skeleton:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
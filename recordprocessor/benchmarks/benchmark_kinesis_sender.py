@@ -0,0 +1,67 @@
+"""
+Benchmark comparing one put_record call per row with the KinesisBatchSender, using moto as a stand-in for Kinesis.
+moto has no network latency, so the real-world saving (one round trip per 500 rows instead of one per row) is
+larger than shown here.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_kinesis_sender.py [number_of_rows]
+"""
+
+import os
+import sys
+import time
+from moto import mock_kinesis
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from send_to_kinesis import KinesisBatchSender, encode_message_body  # noqa: E402
+from s3_clients import kinesis_client  # noqa: E402
+
+STREAM_NAME = "benchmark-processingdata-stream"
+SUPPLIER = "EMIS"
+
+
+def make_message_body(row_number: int) -> dict:
+    """Returns a message body of a similar size to that of a typical row"""
+    return {
+        "row_id": f"benchmark^{row_number}",
+        "file_key": "RSV_Vaccinations_v5_YGM41_20240708T12130100.csv",
+        "supplier": SUPPLIER,
+        "created_at_formatted_string": "20240708T12130100",
+        "operation_requested": "CREATE",
+        "local_id": f"{row_number}^https://www.ravs.england.nhs.uk/",
+        "fhir_json": {"resourceType": "Immunization", "status": "completed", "padding": "x" * 2500},
+    }
+
+
+def send_with_put_record(number_of_rows: int) -> None:
+    """Sends each row with its own put_record call"""
+    for row_number in range(number_of_rows):
+        data = encode_message_body(make_message_body(row_number))
+        kinesis_client.put_record(StreamName=STREAM_NAME, Data=data, PartitionKey=SUPPLIER)
+
+
+def send_with_batch_sender(number_of_rows: int) -> None:
+    """Sends the rows using the KinesisBatchSender"""
+    sender = KinesisBatchSender(STREAM_NAME)
+    for row_number in range(number_of_rows):
+        sender.put_record(encode_message_body(make_message_body(row_number)), SUPPLIER, f"benchmark^{row_number}")
+    sender.flush()
+
+
+def time_function(function, number_of_rows: int) -> float:
+    """Returns the time taken to send the rows using the given function, against a new moto stream"""
+    with mock_kinesis():
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        start = time.perf_counter()
+        function(number_of_rows)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    put_record_time = time_function(send_with_put_record, rows)
+    batch_sender_time = time_function(send_with_batch_sender, rows)
+    print(f"Rows: {rows}")
+    print(f"put_record per row: {put_record_time:.2f}s ({rows / put_record_time:.0f} rows/s)")
+    print(f"KinesisBatchSender: {batch_sender_time:.2f}s ({rows / batch_sender_time:.0f} rows/s)")
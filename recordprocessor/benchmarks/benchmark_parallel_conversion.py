@@ -0,0 +1,59 @@
+"""
+Benchmark comparing serial row conversion with conversion across a pool of worker processes.
+The file is read from memory rather than S3, so only the conversion and encoding of the rows is timed.
+
+Usage (from the recordprocessor directory): python benchmarks/benchmark_parallel_conversion.py [number_of_rows]
+"""
+
+import os
+import sys
+import time
+import logging
+from csv import DictReader
+from io import BytesIO
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from convert_rows import convert_rows, convert_rows_in_parallel  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from scan_csv_file import scan_csv  # noqa: E402
+from utils_for_recordprocessor import stream_lines  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+)
+
+ALLOWED_OPERATIONS = {"CREATE", "UPDATE", "DELETE"}
+FILE_DETAILS = {"file_key": "benchmark.csv", "supplier": "EMIS", "created_at_formatted_string": "20240708T12130100"}
+
+
+def main(number_of_rows: int) -> None:
+    """Times serial and parallel conversion of a file with the given number of rows"""
+    logging.disable(logging.INFO)  # Per row logging would otherwise dominate the timings
+    rows = [FILE_ROW_NEW, FILE_ROW_UPDATE] * (number_of_rows // 2)
+    file_bytes = "\n".join([FILE_HEADERS] + rows).encode("utf-8")
+    file_scan = scan_csv(BytesIO(file_bytes))
+
+    start = time.perf_counter()
+    csv_reader = DictReader(stream_lines(BytesIO(file_bytes)), delimiter="|")
+    serial_rows = list(convert_rows(csv_reader, "benchmark", Vaccine.RSV, ALLOWED_OPERATIONS, FILE_DETAILS))
+    serial_time = time.perf_counter() - start
+    print(f"serial: {len(serial_rows)} rows in {serial_time:.2f}s")
+
+    for workers in sorted({2, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        parallel_rows = list(
+            convert_rows_in_parallel(
+                BytesIO(file_bytes), file_scan, "benchmark", Vaccine.RSV, ALLOWED_OPERATIONS, FILE_DETAILS, workers
+            )
+        )
+        parallel_time = time.perf_counter() - start
+        assert parallel_rows == serial_rows
+        print(f"{workers} workers: {len(parallel_rows)} rows in {parallel_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
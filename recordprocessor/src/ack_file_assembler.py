@@ -0,0 +1,140 @@
+"""
+Assembles the ack file in row order from ack rows which arrive in any order, using an external merge sort so that
+the memory used stays bounded however many rows the file has
+"""
+
+import os
+import heapq
+import pickle
+import logging
+import tempfile
+from typing import BinaryIO, Iterator, List, Tuple, Union
+from update_ack_file import AckFileWriter, create_ack_data, format_ack_row
+from utils_for_recordprocessor import get_row_number
+
+logger = logging.getLogger()
+
+# The number of ack rows written to, and read from, a run file at a time
+ROWS_PER_RUN_CHUNK = 1000
+
+# The maximum number of run files merged at once. Once there are this many runs, they are merged into a single run.
+MAX_RUNS_PER_MERGE = 64
+
+
+def get_ack_rows_per_run() -> int:
+    """
+    Returns the maximum number of ack rows held in memory before they are sorted and spilled to a run file on local
+    disk, given by ACK_ROWS_PER_RUN. Defaults to 100000.
+    """
+    return max(1, int(os.getenv("ACK_ROWS_PER_RUN", "100000")))
+
+
+def _write_run(run_file: BinaryIO, sorted_rows: Iterator[Tuple[int, str]]) -> None:
+    """Writes the sorted (row number, ack row) tuples to the run file, in pickled chunks"""
+    chunk = []
+    for row in sorted_rows:
+        chunk.append(row)
+        if len(chunk) >= ROWS_PER_RUN_CHUNK:
+            pickle.dump(chunk, run_file, pickle.HIGHEST_PROTOCOL)
+            chunk = []
+    if chunk:
+        pickle.dump(chunk, run_file, pickle.HIGHEST_PROTOCOL)
+
+
+def _read_run(run_path: str) -> Iterator[Tuple[int, str]]:
+    """Yields the (row number, ack row) tuples of the run file, reading one chunk at a time"""
+    with open(run_path, "rb") as run_file:
+        while True:
+            try:
+                chunk = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from chunk
+
+
+class AckFileAssembler:
+    """
+    Collects the ack rows of a file, which may be added in any order, and writes them to the ack file in row_id
+    order once the file is complete (see close). Up to rows_per_run rows are held in memory, after which they are
+    sorted and spilled to a run file in a temporary directory on local disk. On close, the runs and the rows still in
+    memory are merged, in row order, into the ack file writer.
+    """
+
+    def __init__(
+        self,
+        ack_file_writer: AckFileWriter,
+        rows_per_run: Union[int, None] = None,
+        spill_directory: Union[str, None] = None,
+    ):
+        self.ack_file_writer = ack_file_writer
+        self.rows_per_run = rows_per_run or get_ack_rows_per_run()
+        self.spill_directory = spill_directory
+        self.row_count = 0
+        self.runs_spilled = 0
+        self._rows: List[Tuple[int, str]] = []
+        self._run_paths: List[str] = []
+        self._temporary_directory = None
+
+    def add_row(
+        self, row_id: str, message_delivered: bool, diagnostics: Union[None, str], imms_id: Union[None, str]
+    ) -> None:
+        """Adds the ack row, based on the given arguments, spilling the rows held in memory if there are enough"""
+        ack_data_row = create_ack_data(
+            self.ack_file_writer.created_at_formatted_string, row_id, message_delivered, diagnostics, imms_id
+        )
+        self._rows.append((get_row_number(row_id), format_ack_row(ack_data_row)))
+        self.row_count += 1
+        if len(self._rows) >= self.rows_per_run:
+            self._spill()
+
+    def close(self) -> None:
+        """Merges the ack rows, in row order, into the ack file writer, and closes the writer"""
+        try:
+            self._rows.sort()
+            runs = [_read_run(run_path) for run_path in self._run_paths]
+            chunk = []
+            for _, ack_row in heapq.merge(*runs, self._rows):
+                chunk.append(ack_row)
+                if len(chunk) >= ROWS_PER_RUN_CHUNK:
+                    self.ack_file_writer.write("".join(chunk))
+                    chunk = []
+            if chunk:
+                self.ack_file_writer.write("".join(chunk))
+            self.ack_file_writer.close()
+            logger.info("%s ack rows assembled from %s spilled runs", self.row_count, self.runs_spilled)
+        finally:
+            self._cleanup()
+
+    def abort(self) -> None:
+        """Abandons the ack file, deleting any spilled runs"""
+        self.ack_file_writer.abort()
+        self._cleanup()
+
+    def _spill(self) -> None:
+        """Sorts the rows held in memory and writes them to a new run file"""
+        self._rows.sort()
+        self._add_run(iter(self._rows))
+        self._rows = []
+        self.runs_spilled += 1
+        if len(self._run_paths) >= MAX_RUNS_PER_MERGE:
+            # Keeps the number of files open during a merge bounded
+            run_paths, self._run_paths = self._run_paths, []
+            self._add_run(heapq.merge(*[_read_run(run_path) for run_path in run_paths]))
+            for run_path in run_paths:
+                os.remove(run_path)
+
+    def _add_run(self, sorted_rows: Iterator[Tuple[int, str]]) -> None:
+        """Writes the sorted rows to a new run file"""
+        if self._temporary_directory is None:
+            self._temporary_directory = tempfile.TemporaryDirectory(prefix="ack_runs_", dir=self.spill_directory)
+        run_path = os.path.join(self._temporary_directory.name, f"run_{self.runs_spilled}_{len(self._run_paths)}")
+        with open(run_path, "wb") as run_file:
+            _write_run(run_file, sorted_rows)
+        self._run_paths.append(run_path)
+
+    def _cleanup(self) -> None:
+        """Deletes the run files"""
+        self._rows, self._run_paths = [], []
+        if self._temporary_directory is not None:
+            self._temporary_directory.cleanup()
+            self._temporary_directory = None
@@ -1,21 +1,43 @@
 """Functions for processing the file on a row-by-row basis"""
 
 import json
-
-# from io import StringIO
+import asyncio
 import os
 import time
 import logging
 from constants import Constants
-from utils_for_recordprocessor import get_environment, get_csv_content_dict_reader
-from unique_permission import get_unique_action_flags_from_s3
+from utils_for_recordprocessor import get_environment, get_file_streaming_body, stream_lines
+from scan_csv_file import scan_csv_file, scan_csv_file_shard, CsvFileScan
 from make_and_upload_ack_file import make_and_upload_ack_file
 from get_operation_permissions import get_operation_permissions
-from process_row import process_row
+from convert_rows import convert_rows, convert_rows_in_parallel, get_conversion_workers
+from csv_row import read_csv_rows
 from mappings import Vaccine
+from send_to_kinesis import KinesisBatchSender, get_kinesis_stream_name
+from update_ack_file import AckFileWriter, get_row_ack_file_enabled
+from ack_file_assembler import AckFileAssembler
+from failure_acks import FailureAckSender, get_failure_ack_queue_url
+from kinesis_record_aggregator import (
+    KinesisRecordAggregator,
+    get_rows_per_kinesis_record,
+    send_encoded_rows,
+    count_rows_not_delivered,
+)
+from processing_pipeline import run_processing_pipeline, get_processing_pipeline
+from partition_strategies import get_partition_strategy
+from checkpoints import (
+    CheckpointTracker,
+    get_byte_offset,
+    get_checkpoint_store,
+    get_resume_moved_row_count,
+    get_resume_row_count,
+    register_shutdown_handler,
+    shutdown_requested,
+)
+from file_shards import get_checkpoint_id, load_shard_plan, send_moved_rows
+from row_logging import start_file_logging, log_file_summary, register_row_log_toggle_handler
+from utils_for_fhir_conversion import Convert, Flyweight
 
-# from update_ack_file import update_ack_file
-from send_to_kinesis import send_to_kinesis
 logging.basicConfig(level="INFO")
 logger = logging.getLogger()
 
@@ -34,54 +56,199 @@ def process_csv_to_fhir(incoming_message_body: dict) -> None:
     )
     supplier = incoming_message_body.get("supplier").upper()
     file_key = incoming_message_body.get("filename")
+    # A large file may be split into shards of rows (see filenameprocessor), each of which has its own message
+    shard = incoming_message_body.get("shard")
+    if shard and not (shard := load_shard_plan(shard)):
+        logger.error("Shard of %s not processed as there is no shard plan", file_key)
+        return
     permission = incoming_message_body.get("permission")
     created_at_formatted_string = incoming_message_body.get("created_at_formatted_string")
     allowed_operations = get_operation_permissions(vaccine, permission)
 
     # Fetch the data
     bucket_name = os.getenv("SOURCE_BUCKET_NAME", f"immunisation-batch-{get_environment()}-data-sources")
-    csv_reader, csv_data = get_csv_content_dict_reader(bucket_name, file_key)
+    # A shard only reads the header row and its own rows
+    file_scan = scan_csv_file_shard(bucket_name, file_key, shard) if shard else scan_csv_file(bucket_name, file_key)
 
-    is_valid_headers = validate_content_headers(csv_reader)
+    is_valid_headers = validate_content_headers(file_scan)
     # Validate has permission to perform at least one of the requested actions
-    action_flag_check = validate_action_flag_permissions(supplier, vaccine.value, permission, csv_data)
+    action_flag_check = validate_action_flag_permissions(supplier, vaccine.value, permission, file_scan)
+
+    # Every shard validates the whole file in the same way, so only the first shard uploads the ack file
+    is_first_shard = not shard or shard["shard_index"] == 0
 
     if not action_flag_check or not is_valid_headers:
-        make_and_upload_ack_file(file_id, file_key, False, False, created_at_formatted_string)
+        if is_first_shard:
+            make_and_upload_ack_file(file_id, file_key, False, False, created_at_formatted_string)
     else:
-        # Initialise the accumulated_ack_file_content with the headers
-        make_and_upload_ack_file(file_id, file_key, True, True, created_at_formatted_string)
-        # accumulated_ack_file_content = StringIO()
-        # accumulated_ack_file_content.write("|".join(Constants.ack_headers) + "\n")
+        if is_first_shard:
+            make_and_upload_ack_file(file_id, file_key, True, True, created_at_formatted_string)
 
-        row_count = 0  # Initialize a counter for rows
-        for row in csv_reader:
-            row_count += 1
-            row_id = f"{file_id}^{row_count}"
-            logger.info("MESSAGE ID : %s", row_id)
-            # Process the row to obtain the details needed for the message_body and ack file
-            details_from_processing = process_row(vaccine, allowed_operations, row)
+        kinesis_sender = KinesisBatchSender(get_kinesis_stream_name(), os.getenv("KINESIS_STREAM_ARN"))
+        file_details = {
+            "file_key": file_key,
+            "supplier": supplier,
+            "created_at_formatted_string": created_at_formatted_string,
+        }
+        failure_ack_queue_url = get_failure_ack_queue_url()
+        record_aggregator = KinesisRecordAggregator(
+            kinesis_sender,
+            file_details,
+            get_rows_per_kinesis_record(),
+            failure_ack_sender=(
+                FailureAckSender(failure_ack_queue_url, file_details) if failure_ack_queue_url else None
+            ),
+        )
+        partition_strategy = get_partition_strategy(supplier)
 
-            # Create the message body for sending
-            outgoing_message_body = {
-                "row_id": row_id,
-                "file_key": file_key,
-                "supplier": supplier,
-                "created_at_formatted_string": created_at_formatted_string,
-                **details_from_processing,
-            }
+        # Find the rows to process, resuming from the checkpoint for the message (or shard), if there is one
+        start_row_index, end_row_index = file_scan.first_row_index, file_scan.row_count
+        checkpoint_id = get_checkpoint_id(file_id, shard)
+        checkpoint_store = get_checkpoint_store()
+        resume_row_count = get_resume_row_count(
+            checkpoint_store, checkpoint_id, file_key, file_scan, start_row_index, end_row_index
+        )
+        # The rows of each local_id are sent by the shard with its first row (see filenameprocessor), so rows of
+        # later shards may have been moved to this shard, and rows of this shard moved to an earlier shard
+        moved_rows = shard.get("moved_rows", []) if shard else []
+        skipped_row_numbers = set(shard.get("skipped_row_numbers", [])) if shard else None
+        resume_moved_row_count = (
+            get_resume_moved_row_count(
+                checkpoint_store, checkpoint_id, file_key, file_scan, start_row_index, end_row_index, len(moved_rows)
+            )
+            if moved_rows
+            else 0
+        )
+        rows_processed = resume_row_count > start_row_index and resume_row_count == end_row_index
+        if rows_processed and resume_moved_row_count == len(moved_rows):
+            logger.info("All rows of %s have already been processed", file_key)
+            return
+        # The ack file of the rows is only written by a task which processes every row of the file, as it would
+        # otherwise be overwritten with the acks of only some of the rows
+        if get_row_ack_file_enabled():
+            if shard or resume_row_count > start_row_index:
+                logger.warning("Ack file of the rows of %s not written, as not every row is processed", file_key)
+            else:
+                record_aggregator.ack_file_assembler = AckFileAssembler(
+                    AckFileWriter(file_key, bucket_name, "|".join(Constants.ack_headers) + "\n")
+                )
+        checkpoint_tracker = (
+            CheckpointTracker(
+                checkpoint_store,
+                checkpoint_id,
+                file_key,
+                file_scan,
+                resume_row_count,
+                end_row_index,
+                moved_row_numbers=[row_number for row_number, _, _ in moved_rows],
+                resume_moved_row_count=resume_moved_row_count,
+            )
+            if checkpoint_store
+            else None
+        )
+        # Unless processing starts at the first row, only the bytes of the rows to be processed are read
+        start_byte = get_byte_offset(file_scan, resume_row_count) if resume_row_count else 0
+        end_byte = get_byte_offset(file_scan, end_row_index) if shard else None
 
-            send_to_kinesis(supplier, outgoing_message_body)
+        # Process each row to obtain the details needed for the message_body and ack file
+        start_file_logging()
+        conversion_workers = get_conversion_workers()
+        if rows_processed:
+            row_count, rows_not_delivered = 0, 0
+        elif conversion_workers > 1:
+            encoded_rows = convert_rows_in_parallel(
+                get_file_streaming_body(bucket_name, file_key, start_byte, end_byte),
+                file_scan,
+                file_id,
+                vaccine,
+                allowed_operations,
+                record_aggregator.row_file_details,
+                conversion_workers,
+                start_row_index=resume_row_count,
+                end_row_index=end_row_index,
+                skipped_row_numbers=skipped_row_numbers,
+            )
+            try:
+                row_count, rows_not_delivered = send_encoded_rows(
+                    encoded_rows, record_aggregator, partition_strategy, checkpoint_tracker, skipped_row_numbers
+                )
+            finally:
+                # Releases the chunks still in flight if sending stopped early
+                encoded_rows.close()
+        elif get_processing_pipeline() == "async":
+            row_count, rows_not_delivered = asyncio.run(
+                run_processing_pipeline(
+                    get_file_streaming_body(bucket_name, file_key, start_byte, end_byte),
+                    file_scan,
+                    file_id,
+                    vaccine,
+                    allowed_operations,
+                    record_aggregator,
+                    partition_strategy,
+                    start_row_index=resume_row_count,
+                    end_row_index=end_row_index,
+                    checkpoint_tracker=checkpoint_tracker,
+                    skipped_row_numbers=skipped_row_numbers,
+                )
+            )
+        else:
+            # The header row is only read if processing starts at the first row
+            csv_reader = read_csv_rows(
+                stream_lines(get_file_streaming_body(bucket_name, file_key, start_byte, end_byte)),
+                fieldnames=file_scan.headers if start_byte else None,
+            )
+            encoded_rows = convert_rows(
+                csv_reader,
+                file_id,
+                vaccine,
+                allowed_operations,
+                record_aggregator.row_file_details,
+                first_row_number=resume_row_count + 1,
+                skipped_row_numbers=skipped_row_numbers,
+            )
+            row_count, rows_not_delivered = send_encoded_rows(
+                encoded_rows, record_aggregator, partition_strategy, checkpoint_tracker, skipped_row_numbers
+            )
+        if resume_moved_row_count < len(moved_rows):
+            moved_row_count, moved_rows_not_delivered = send_moved_rows(
+                bucket_name,
+                file_key,
+                moved_rows[resume_moved_row_count:],
+                file_scan.headers,
+                file_id,
+                vaccine,
+                allowed_operations,
+                record_aggregator,
+                partition_strategy,
+                checkpoint_tracker,
+            )
+            row_count += moved_row_count
+            rows_not_delivered += moved_rows_not_delivered
 
-        logger.info("Total rows processed: %s", row_count)
+        final_delivery_results = record_aggregator.flush()
+        rows_not_delivered += count_rows_not_delivered(final_delivery_results)
+        if checkpoint_tracker:
+            checkpoint_tracker.record_results(final_delivery_results)
+            checkpoint_tracker.save()
+        if ack_file_assembler := record_aggregator.ack_file_assembler:
+            if shutdown_requested.is_set():
+                logger.warning("Ack file of the rows of %s not written, as processing was stopped early", file_key)
+                ack_file_assembler.abort()
+            else:
+                ack_file_assembler.close()
+        log_file_summary(file_key, file_id, row_count, rows_not_delivered, shard, record_aggregator.routing_counts())
+        logger.info(
+            "Conversion cache statistics: %s",
+            json.dumps({**Convert.cache_statistics(), **Flyweight.cache_statistics()}),
+        )
 
 
-def validate_content_headers(csv_content_reader):
-    """Returns a bool to indicate whether the given CSV headers match the 34 expected headers exactly"""
-    return csv_content_reader.fieldnames == Constants.expected_csv_headers
+def validate_content_headers(file_scan: CsvFileScan) -> bool:
+    """Returns a bool to indicate whether the scanned CSV headers match the 34 expected headers exactly"""
+    return file_scan.headers == Constants.expected_csv_headers
 
 
-def validate_action_flag_permissions(supplier: str, vaccine_type: str, permission, csv_data) -> bool:
+def validate_action_flag_permissions(supplier: str, vaccine_type: str, permission, file_scan: CsvFileScan) -> bool:
     """
     Returns True if the supplier has permission to perform ANY of the requested actions for the given vaccine type,
     else False.
@@ -92,8 +259,8 @@ def validate_action_flag_permissions(supplier: str, vaccine_type: str, permissio
     if f"{vaccine_type}_FULL" in allowed_permissions_set:
         return True
 
-    # Get unique ACTION_FLAG values from the S3 file
-    operations_requested = get_unique_action_flags_from_s3(csv_data)
+    # Get unique ACTION_FLAG values found when scanning the file
+    operations_requested = file_scan.action_flags
 
     # Convert action flags into the expected operation names
     operation_requests_set = {
@@ -116,6 +283,8 @@ def validate_action_flag_permissions(supplier: str, vaccine_type: str, permissio
 def main(event: str) -> None:
     """Process each row of the file"""
     logger.info("task started")
+    register_shutdown_handler()
+    register_row_log_toggle_handler()
     start = time.time()
     try:
         process_csv_to_fhir(incoming_message_body=json.loads(event))
@@ -0,0 +1,272 @@
+"""
+Checkpoints which record how far through a file processing has reached, so that if the task is stopped partway
+through a file the next attempt can resume from the checkpoint rather than from the first row
+"""
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+from typing import Dict, List, Sequence, Set, Tuple, Union
+from botocore.exceptions import ClientError
+from s3_clients import s3_client
+from scan_csv_file import CsvFileScan
+from utils_for_recordprocessor import get_environment
+
+logger = logging.getLogger()
+
+# Set when the task has been asked to stop (on SIGTERM). Processing stops at the next row, and the rows already
+# sent are flushed and checkpointed.
+shutdown_requested = threading.Event()
+
+DEFAULT_CHECKPOINT_INTERVAL_ROWS = 10000
+DEFAULT_CHECKPOINT_INTERVAL_SECONDS = 30
+
+
+def request_shutdown(signal_number, _frame) -> None:
+    """Signal handler which asks for processing to stop, so that a final flush and checkpoint can be made"""
+    logger.warning("Received signal %s: stopping processing after a final flush and checkpoint", signal_number)
+    shutdown_requested.set()
+
+
+def register_shutdown_handler() -> None:
+    """Registers request_shutdown as the SIGTERM handler (ECS sends SIGTERM before stopping a task)"""
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+
+class S3CheckpointStore:
+    """Stores each checkpoint as a json object in an S3 bucket, keyed by message_id"""
+
+    def __init__(self, bucket_name: str, prefix: str = "checkpoints/"):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def load(self, message_id: str) -> Union[dict, None]:
+        """Returns the checkpoint for the message_id, or None if there is no checkpoint"""
+        try:
+            response = s3_client.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}{message_id}.json")
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def save(self, message_id: str, checkpoint: dict) -> None:
+        """Writes the checkpoint for the message_id"""
+        s3_client.put_object(
+            Bucket=self.bucket_name, Key=f"{self.prefix}{message_id}.json", Body=json.dumps(checkpoint).encode("utf-8")
+        )
+
+
+class LocalFileCheckpointStore:
+    """Stores each checkpoint as a json file in a local directory, keyed by message_id"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, message_id: str) -> Union[dict, None]:
+        """Returns the checkpoint for the message_id, or None if there is no checkpoint"""
+        try:
+            with open(os.path.join(self.directory, f"{message_id}.json"), encoding="utf-8") as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, message_id: str, checkpoint: dict) -> None:
+        """Writes the checkpoint for the message_id (to a temporary file which is then renamed, so it is atomic)"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{message_id}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(f"{path}.tmp", path)
+
+
+def get_checkpoint_store() -> Union[S3CheckpointStore, LocalFileCheckpointStore, None]:
+    """
+    Returns the checkpoint store given by CHECKPOINT_STORE, which may be "s3" (the CHECKPOINT_BUCKET_NAME bucket,
+    defaulting to the ack bucket), "file" (the CHECKPOINT_DIRECTORY directory) or "none" (the default).
+    """
+    store = os.getenv("CHECKPOINT_STORE", "none").lower()
+    if store == "s3":
+        ack_bucket_name = os.getenv("ACK_BUCKET_NAME", f"immunisation-batch-{get_environment()}-data-destinations")
+        return S3CheckpointStore(os.getenv("CHECKPOINT_BUCKET_NAME", ack_bucket_name))
+    if store == "file":
+        return LocalFileCheckpointStore(os.getenv("CHECKPOINT_DIRECTORY", "/tmp/checkpoints"))
+    return None
+
+
+def load_matching_checkpoint(
+    checkpoint_store: Union[S3CheckpointStore, LocalFileCheckpointStore, None],
+    message_id: str,
+    file_key: str,
+    file_scan: CsvFileScan,
+    start_row_count: int = 0,
+    end_row_count: Union[int, None] = None,
+) -> Union[dict, None]:
+    """
+    Returns the checkpoint for the message_id, or None if there is no checkpoint or the checkpoint does not match the
+    file. If only the rows after the first start_row_count rows (and up to end_row_count) are to be processed, the
+    checkpoint must lie within that range.
+    """
+    checkpoint = checkpoint_store.load(message_id) if checkpoint_store else None
+    if not checkpoint:
+        return None
+
+    last_row = checkpoint.get("last_row", 0)
+    end_row_count = file_scan.row_count if end_row_count is None else end_row_count
+    if (
+        checkpoint.get("file_key") != file_key
+        or checkpoint.get("file_size") != file_scan.size
+        or not start_row_count <= last_row <= end_row_count
+        or checkpoint.get("byte_offset") != get_byte_offset(file_scan, last_row)
+    ):
+        logger.warning("Ignoring checkpoint for %s as it does not match the file: %s", message_id, checkpoint)
+        return None
+    return checkpoint
+
+
+def get_resume_row_count(
+    checkpoint_store: Union[S3CheckpointStore, LocalFileCheckpointStore, None],
+    message_id: str,
+    file_key: str,
+    file_scan: CsvFileScan,
+    start_row_count: int = 0,
+    end_row_count: Union[int, None] = None,
+) -> int:
+    """
+    Returns the number of rows at the start of the file which have already been processed, according to the
+    checkpoint for the message_id (see load_matching_checkpoint). Returns start_row_count if there is no checkpoint,
+    or if the checkpoint does not match the file.
+    """
+    checkpoint = load_matching_checkpoint(
+        checkpoint_store, message_id, file_key, file_scan, start_row_count, end_row_count
+    )
+    if not checkpoint:
+        return start_row_count
+
+    logger.info(
+        "Resuming %s from checkpoint after row %s (byte offset %s)",
+        file_key,
+        checkpoint["last_row"],
+        checkpoint["byte_offset"],
+    )
+    return checkpoint["last_row"]
+
+
+def get_resume_moved_row_count(
+    checkpoint_store: Union[S3CheckpointStore, LocalFileCheckpointStore, None],
+    message_id: str,
+    file_key: str,
+    file_scan: CsvFileScan,
+    start_row_count: int,
+    end_row_count: int,
+    moved_row_count: int,
+) -> int:
+    """
+    Returns the number of the rows moved to a shard of a file (see file_shards) which have already been processed,
+    according to the checkpoint for the message_id. Returns 0 if there is no checkpoint, or if the checkpoint does not
+    match the file.
+    """
+    checkpoint = load_matching_checkpoint(
+        checkpoint_store, message_id, file_key, file_scan, start_row_count, end_row_count
+    )
+    return min(checkpoint.get("moved_rows_sent", 0), moved_row_count) if checkpoint else 0
+
+
+def get_byte_offset(file_scan: CsvFileScan, row_count: int) -> int:
+    """Returns the byte offset at which the row after the first row_count rows starts (the file size after the end)"""
+    return file_scan.row_offset(row_count)
+
+
+class CheckpointTracker:
+    """
+    Tracks the delivery results of the rows of a file, which may arrive out of order when rows with different
+    partition keys are aggregated, and saves a checkpoint with the last row up to which every row has a result.
+    Rows which could not be delivered have a result (and have been logged as not sent), so are not retried on resume.
+    For a shard of a file, the rows moved to the shard (see file_shards) are processed after its own rows, in the order
+    of moved_row_numbers, and the checkpoint also holds the number of them up to which every moved row has a result.
+    A checkpoint is saved once interval_rows more rows, or interval_seconds, have passed since the last one.
+    The checkpoint is completed once every row up to end_row_count (by default the end of the file), and every moved
+    row, has a result.
+    """
+
+    def __init__(
+        self,
+        checkpoint_store: Union[S3CheckpointStore, LocalFileCheckpointStore],
+        message_id: str,
+        file_key: str,
+        file_scan: CsvFileScan,
+        resume_row_count: int = 0,
+        end_row_count: Union[int, None] = None,
+        interval_rows: int = DEFAULT_CHECKPOINT_INTERVAL_ROWS,
+        interval_seconds: float = DEFAULT_CHECKPOINT_INTERVAL_SECONDS,
+        moved_row_numbers: Sequence[int] = (),
+        resume_moved_row_count: int = 0,
+    ):
+        self.checkpoint_store = checkpoint_store
+        self.message_id = message_id
+        self.file_key = file_key
+        self.file_scan = file_scan
+        self.end_row_count = file_scan.row_count if end_row_count is None else end_row_count
+        self.interval_rows = interval_rows
+        self.interval_seconds = interval_seconds
+        self.last_row = resume_row_count
+        self._completed_rows: Set[int] = set()
+        # The position (counting from 1) of each moved row in the order in which the moved rows are processed
+        self._moved_row_positions: Dict[int, int] = {
+            row_number: position for position, row_number in enumerate(moved_row_numbers, start=1)
+        }
+        self.moved_rows_sent = resume_moved_row_count
+        self._completed_moved_rows: Set[int] = set()
+        self._last_saved = (resume_row_count, resume_moved_row_count)
+        self._last_saved_at = time.monotonic()
+
+    @property
+    def completed(self) -> bool:
+        """Whether every row up to end_row_count, and every moved row, has a result"""
+        return self.last_row == self.end_row_count and self.moved_rows_sent == len(self._moved_row_positions)
+
+    def record_results(self, delivery_results: List[Tuple[str, bool]]) -> None:
+        """Records that the rows have a delivery result, saving a checkpoint if one is due"""
+        for row_id, _ in delivery_results:
+            row_number = int(row_id.rsplit("^", 1)[1])
+            if (moved_row_position := self._moved_row_positions.get(row_number)) is not None:
+                self._completed_moved_rows.add(moved_row_position)
+            else:
+                self._completed_rows.add(row_number)
+        while self.last_row + 1 in self._completed_rows:
+            self.last_row += 1
+            self._completed_rows.remove(self.last_row)
+        while self.moved_rows_sent + 1 in self._completed_moved_rows:
+            self.moved_rows_sent += 1
+            self._completed_moved_rows.remove(self.moved_rows_sent)
+
+        if (
+            self.last_row + self.moved_rows_sent - sum(self._last_saved) >= self.interval_rows
+            or time.monotonic() - self._last_saved_at >= self.interval_seconds
+        ):
+            self.save()
+
+    def save(self) -> None:
+        """
+        Saves a checkpoint with the last row up to which every row has a delivery result (and, if there are moved rows,
+        the number of moved rows up to which every moved row has a delivery result)
+        """
+        if (self.last_row, self.moved_rows_sent) == self._last_saved and not self.completed:
+            return
+        checkpoint = {
+            "message_id": self.message_id,
+            "file_key": self.file_key,
+            "file_size": self.file_scan.size,
+            "last_row": self.last_row,
+            "byte_offset": get_byte_offset(self.file_scan, self.last_row),
+            "completed": self.completed,
+        }
+        if self._moved_row_positions:
+            checkpoint["moved_rows_sent"] = self.moved_rows_sent
+        self.checkpoint_store.save(self.message_id, checkpoint)
+        self._last_saved = (self.last_row, self.moved_rows_sent)
+        self._last_saved_at = time.monotonic()
+        logger.info("Checkpoint saved for %s after row %s", self.file_key, self.last_row)
@@ -0,0 +1,108 @@
+"""
+Columnar conversion of the rows of a file. The rows are read in chunks, and each column which the FHIR mapping
+specification converts (dates, date_times, gender codes, booleans and integers) is converted for the whole chunk in a
+single pass over the column. The converted values are written back to the rows, so that the FHIR resources are then
+assembled from the converted rows without converting any values. Repeated dates and date_times are served by the
+conversion caches (see utils_for_fhir_conversion), so are not cached again here.
+"""
+
+import os
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from csv_row import CSV_ROW_FIELD_INDEXES, CsvRow
+from fhir_mapping_spec import FHIR_MAPPING_SPEC, Column, NonEmpty, Call, Field, Append, Resource, Group
+from utils_for_fhir_conversion import _is_not_empty
+
+
+def get_columnar_conversion_rows() -> int:
+    """
+    Returns the number of rows in each chunk of rows whose columns are converted together, given by
+    COLUMNAR_CONVERSION_ROWS. Defaults to 0, which converts the values of each row as the row is processed.
+    """
+    return max(0, int(os.getenv("COLUMNAR_CONVERSION_ROWS", "0")))
+
+
+def get_column_conversions(spec: list) -> Dict[str, Callable]:
+    """
+    Returns the convert function of each column of the specification which is converted. Raises a ValueError if a
+    column is converted by more than one function, as the column could then not be converted in place.
+    """
+    column_conversions = {}
+
+    def add_template(template: any) -> None:
+        if isinstance(template, Column):
+            if template.convert is None:
+                return
+            if column_conversions.setdefault(template.name, template.convert) is not template.convert:
+                raise ValueError(f"Column {template.name} is converted by more than one function")
+        elif isinstance(template, NonEmpty):
+            add_template(template.template)
+        elif isinstance(template, Call):
+            for argument in template.arguments:
+                add_template(argument)
+        elif isinstance(template, dict):
+            for value in template.values():
+                add_template(value)
+        elif isinstance(template, list):
+            for value in template:
+                add_template(value)
+
+    def add_elements(elements: list) -> None:
+        for element in elements:
+            if isinstance(element, Field):
+                add_template(element.value)
+                if element.otherwise is not None:
+                    add_elements([element.otherwise])
+            elif isinstance(element, Append):
+                add_template(element.value)
+            elif isinstance(element, Resource):
+                add_template(element.value)
+                add_elements(element.elements)
+            elif isinstance(element, Group):
+                add_elements(element.elements)
+
+    add_elements(spec)
+    return column_conversions
+
+
+COLUMN_CONVERSIONS = get_column_conversions(FHIR_MAPPING_SPEC)
+
+
+def _convert_column(column: Iterable, convert: Callable) -> List[any]:
+    """Returns the converted values of the column, in order. Empty values are never converted."""
+    return [convert(value) if _is_not_empty(value) else value for value in column]
+
+
+def convert_columns(
+    rows: List[Union[dict, CsvRow]], column_conversions: Dict[str, Callable] = COLUMN_CONVERSIONS
+) -> None:
+    """
+    Converts the values of each converted column of the rows in place, a column at a time. Empty values are left
+    unchanged, as they are never converted.
+    Dictionary rows are updated in place. CsvRows, which are immutable, are split into their columns, which are
+    converted and then joined into new CsvRows which replace the rows in the list.
+    """
+    if rows and rows[0].__class__ is CsvRow:
+        columns = list(zip(*rows))
+        for name, convert in column_conversions.items():
+            column = columns[CSV_ROW_FIELD_INDEXES[name]]
+            columns[CSV_ROW_FIELD_INDEXES[name]] = _convert_column(column, convert)
+        rows[:] = map(CsvRow, zip(*columns))
+        return
+
+    for name, convert in column_conversions.items():
+        column = [row.get(name) for row in rows]
+        for row, value, converted_value in zip(rows, column, _convert_column(column, convert)):
+            if value is not None:
+                row[name] = converted_value
+
+
+def convert_columns_in_chunks(
+    numbered_rows: Iterable[Tuple[int, Union[dict, CsvRow]]], rows_per_chunk: int
+) -> Iterator[Tuple[int, Union[dict, CsvRow]]]:
+    """Reads the numbered rows in chunks of rows_per_chunk rows, and converts the columns of each chunk (see above)"""
+    numbered_rows = iter(numbered_rows)
+    while chunk := list(islice(numbered_rows, rows_per_chunk)):
+        rows = [row for _, row in chunk]
+        convert_columns(rows)
+        yield from zip([row_number for row_number, _ in chunk], rows)
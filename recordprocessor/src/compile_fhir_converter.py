@@ -0,0 +1,346 @@
+"""
+Compiles the declarative FHIR mapping specification (see fhir_mapping_spec) into specialised functions for each
+vaccine type: a converter, which builds the FHIR Immunization resource, and a json encoder, which writes the json of
+the resource directly from the values of the row, without building the resource. The source of each function is
+generated with one local variable per column, so that each column is read from the row and checked for emptiness
+only once, and is then compiled using exec.
+"""
+
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Union
+import simplejson as json
+from simplejson.encoder import encode_basestring
+from constants import Constants
+from fhir_mapping_spec import Column, NonEmpty, Call, Field, Append, Resource, Group
+from utils_for_fhir_conversion import _is_not_empty, Generate
+
+# Types of value which are written into the generated source as literals. Any other value is passed to the converter
+# as a named constant, so that it is shared rather than copied.
+LITERAL_TYPES = (str, int, float, bool, type(None))
+
+
+class ConverterSource:
+    """Generates the source of a converter function, and the namespace of the objects it refers to"""
+
+    def __init__(self, columns_converted: bool = False, column_indexes: Union[Dict[str, int], None] = None):
+        self.columns_converted = columns_converted
+        self.column_indexes = column_indexes
+        self.lines: List[str] = []
+        self.columns: List[str] = []
+        self.checked_columns: List[str] = []
+        self.namespace: Dict[str, any] = {"_is_not_empty": _is_not_empty, "_generate_dictionary": Generate.dictionary}
+
+    def add_object(self, obj: any) -> str:
+        """Adds the object to the namespace, and returns the name by which it is referred to in the source"""
+        for name, existing_obj in self.namespace.items():
+            if existing_obj is obj:
+                return name
+        name = f"_object_{len(self.namespace)}"
+        self.namespace[name] = obj
+        return name
+
+    def add_column(self, name: str) -> str:
+        """Returns the name of the local variable holding the value of the column"""
+        if name not in Constants.expected_csv_headers:
+            raise ValueError(f"FHIR mapping specification refers to unknown column {name}")
+        if name not in self.columns:
+            self.columns.append(name)
+        return f"value_{name}"
+
+    def condition(self, when: List[str]) -> str:
+        """Returns the source of the condition that at least one of the columns is non-empty"""
+        for name in when:
+            self.add_column(name)
+            if name not in self.checked_columns:
+                self.checked_columns.append(name)
+        return " or ".join(f"present_{name}" for name in when)
+
+    def expression(self, template: any) -> str:
+        """Returns the source of an expression which builds the template"""
+        if isinstance(template, Column):
+            variable = self.add_column(template.name)
+            if template.convert and not self.columns_converted:
+                return f"{self.add_object(template.convert)}({variable})"
+            return variable
+        if isinstance(template, NonEmpty):
+            return f"_generate_dictionary({self.expression(template.template)})"
+        if isinstance(template, Call):
+            arguments = ", ".join(self.expression(argument) for argument in template.arguments)
+            return f"{self.add_object(template.function)}({arguments})"
+        if isinstance(template, dict):
+            return "{" + ", ".join(f"{key!r}: {self.expression(value)}" for key, value in template.items()) + "}"
+        if isinstance(template, list):
+            return "[" + ", ".join(self.expression(item) for item in template) + "]"
+        if isinstance(template, LITERAL_TYPES):
+            return repr(template)
+        return self.add_object(template)
+
+    def add_elements(self, elements: list, indent: str) -> None:
+        """Adds the source of the statements which add each of the elements"""
+        for element in elements:
+            self.add_element(element, indent)
+
+    def add_element(self, element: any, indent: str) -> None:
+        """Adds the source of the statements which add the element"""
+        if isinstance(element, Group):
+            self.lines.append(f"{indent}if {self.condition(element.when)}:")
+            self.add_elements(element.elements, indent + "    ")
+            return
+
+        if isinstance(element, Resource):
+            self.add_resource(element, indent)
+            return
+
+        if isinstance(element, (Field, Append)):
+            when = element.when if element.when is not None else self.template_columns(element.value)
+            statement_indent = indent + "    " if when else indent
+            if when:
+                self.lines.append(f"{indent}if {self.condition(when)}:")
+            self.lines.append(f"{statement_indent}{self.statement(element)}")
+            if isinstance(element, Field) and element.otherwise:
+                if not when:
+                    raise ValueError(f"Field {element.key} has an otherwise field but is always set")
+                self.lines.append(f"{indent}else:")
+                self.add_element(element.otherwise, indent + "    ")
+            return
+
+        raise ValueError(f"Unknown FHIR mapping specification element {element!r}")
+
+    def add_resource(self, resource: Resource, indent: str) -> None:
+        """Adds the source of the statements which build the resource and append it to its target"""
+        self.lines.append(f"{indent}{resource.name} = {self.expression(resource.value)}")
+        self.add_elements(resource.elements, indent)
+        self.lines.append(f"{indent}{resource.target}.setdefault({resource.append_to!r}, []).append({resource.name})")
+
+    def column_lines(self) -> List[str]:
+        """
+        Returns the source of the statements which read each column into a local variable, and check whether each
+        of the columns used in conditions is non-empty
+        """
+        if self.column_indexes is None:
+            lines = [f"    value_{name} = row.get({name!r})" for name in self.columns]
+        else:
+            lines = [f"    value_{name} = row[{self.column_indexes[name]}]" for name in self.columns]
+        # The values read by a csv reader are strings, so strings are checked inline, without calling _is_not_empty
+        lines += [
+            f"    present_{name} = value_{name} != '' if value_{name}.__class__ is str else _is_not_empty(value_{name})"
+            for name in self.checked_columns
+        ]
+        return lines
+
+    def compile_function(self, lines: List[str], filename: str) -> Callable:
+        """Compiles the source of the function named convert, and returns it with the source as its source attribute"""
+        source = "\n".join(lines) + "\n"
+        namespace = dict(self.namespace)
+        exec(compile(source, filename, "exec"), namespace)  # pylint: disable=exec-used
+        function = namespace["convert"]
+        function.source = source
+        return function
+
+    def statement(self, element: any) -> str:
+        """Returns the source of the statement which sets or appends the value of the Field or Append element"""
+        value = self.expression(element.value)
+        if isinstance(element, Append):
+            return f"{element.target}.setdefault({element.key!r}, []).append({value})"
+        return f"{element.target}[{element.key!r}] = {value}"
+
+    @staticmethod
+    def template_columns(template: any) -> List[str]:
+        """Returns the names of the columns in the template"""
+        if isinstance(template, Column):
+            return [template.name]
+        if isinstance(template, NonEmpty):
+            return ConverterSource.template_columns(template.template)
+        if isinstance(template, Call):
+            return ConverterSource.template_columns(list(template.arguments))
+        if isinstance(template, dict):
+            template = list(template.values())
+        if isinstance(template, list):
+            return [name for item in template for name in ConverterSource.template_columns(item)]
+        return []
+
+
+def compile_converter(
+    spec: list,
+    target_disease: list,
+    columns_converted: bool = False,
+    column_indexes: Union[Dict[str, int], None] = None,
+) -> Callable[[dict], dict]:
+    """
+    Compiles the specification into a function which converts a row into a FHIR Immunization resource. The resource
+    starts with the constant elements, including the given targetDisease element, which is shared by every resource.
+    If columns_converted is True, the convert functions of the Columns are not called, as the non-empty values of the
+    columns have already been converted (see columnar_conversion). If column_indexes is given, the function converts
+    a row held as a tuple, reading each column at its index, rather than a dictionary (see csv_row). The generated
+    source is kept as the source attribute of the function.
+    """
+    body = ConverterSource(columns_converted, column_indexes)
+    # The elements are compiled first, to find which columns are read and checked
+    body.add_elements(spec, "    ")
+    target_disease_name = body.add_object(target_disease)
+
+    lines = [
+        "def convert(row):",
+        *body.column_lines(),
+        f"    protocol_applied = {{'targetDisease': {target_disease_name}}}",
+        "    imms = {'resourceType': 'Immunization', 'status': 'completed', 'protocolApplied': [protocol_applied]}",
+        *body.lines,
+        "    return imms",
+    ]
+    return body.compile_function(lines, "<compiled FHIR converter>")
+
+
+def encode_value(value: any) -> str:
+    """Returns the value encoded as json exactly as by simplejson with ensure_ascii=False (as sent to Kinesis)"""
+    if value.__class__ is str:
+        return encode_basestring(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def render_object(members: list) -> str:
+    """
+    Returns the json object with the members, each of which is either the json of the member, or a tuple of the json
+    of the key and a list of the json of each of the items of its array value
+    """
+    return (
+        "{"
+        + ", ".join(
+            member if member.__class__ is str else member[0] + "[" + ", ".join(member[1]) + "]" for member in members
+        )
+        + "}"
+    )
+
+
+def render_non_empty(*items: Tuple[str, any]) -> str:
+    """Returns the json object of the items (each the json of the key, and a value), with all empty items removed"""
+    return "{" + ", ".join(key_json + encode_value(value) for key_json, value in items if _is_not_empty(value)) + "}"
+
+
+class JsonEncoderSource(ConverterSource):
+    """
+    Generates the source of a json encoder function. Each target (the resource and each of the resources and name
+    elements built in it) is held as a list of the json of each of its members, in order, which is rendered once it
+    is complete. The array held under each key which values are appended to is a list of the json of its items.
+    """
+
+    def __init__(self, columns_converted: bool = False, column_indexes: Union[Dict[str, int], None] = None):
+        super().__init__(columns_converted, column_indexes)
+        self.namespace.update({"_encode_value": encode_value, "_render_non_empty": render_non_empty})
+        self.appended_arrays: List[str] = []
+
+    def json_expression(self, template: any, prefix: str = "") -> str:
+        """Returns the source of an expression which gives the json of the template, preceded by the prefix"""
+        pieces = [(True, prefix)] + self.json_pieces(template)
+        merged_pieces = []
+        for is_literal, text in pieces:
+            if is_literal and merged_pieces and merged_pieces[-1][0]:
+                merged_pieces[-1] = (True, merged_pieces[-1][1] + text)
+            else:
+                merged_pieces.append((is_literal, text))
+        return " + ".join(repr(text) if is_literal else text for is_literal, text in merged_pieces)
+
+    def json_pieces(self, template: any) -> List[Tuple[bool, str]]:
+        """
+        Returns the pieces of the json of the template, each either a literal string or the source of an expression
+        which gives a string
+        """
+        if isinstance(template, Column):
+            return [(False, f"_encode_value({self.expression(template)})")]
+        if isinstance(template, NonEmpty):
+            items = ", ".join(
+                f"({encode_value(key) + ': '!r}, {self.expression(value)})" for key, value in template.template.items()
+            )
+            return [(False, f"_render_non_empty({items})")]
+        if isinstance(template, Call):
+            if hasattr(template.function, "cache_info"):
+                # The json of the elements from the Flyweight caches is cached in the same way
+                encode_call = lru_cache(maxsize=template.function.cache_info().maxsize)(
+                    lambda *arguments, function=template.function: encode_value(function(*arguments))
+                )
+                arguments = ", ".join(self.expression(argument) for argument in template.arguments)
+                return [(False, f"{self.add_object(encode_call)}({arguments})")]
+            return [(False, f"_encode_value({self.expression(template)})")]
+        if isinstance(template, dict):
+            pieces = [(True, "{")]
+            for index, (key, value) in enumerate(template.items()):
+                pieces.append((True, (", " if index else "") + encode_value(key) + ": "))
+                pieces += self.json_pieces(value)
+            return pieces + [(True, "}")]
+        if isinstance(template, list):
+            pieces = [(True, "[")]
+            for index, item in enumerate(template):
+                if index:
+                    pieces.append((True, ", "))
+                pieces += self.json_pieces(item)
+            return pieces + [(True, "]")]
+        return [(True, encode_value(template))]
+
+    def appended_array(self, target: str, key: str, indent: str) -> str:
+        """
+        Returns the name of the local variable holding the array appended to under the key of the target, and adds
+        the source of the statements which add the array to the target on its first use
+        """
+        name = f"{target}__{key}"
+        if name not in self.appended_arrays:
+            self.appended_arrays.append(name)
+        self.lines.append(f"{indent}if {name} is None:")
+        self.lines.append(f"{indent}    {name} = []")
+        self.lines.append(f"{indent}    {target}.append(({encode_value(key) + ': '!r}, {name}))")
+        return name
+
+    def add_resource(self, resource: Resource, indent: str) -> None:
+        """Adds the source of the statements which build the resource and append its json to its target"""
+        if not isinstance(resource.value, dict) or self.template_columns(resource.value):
+            raise ValueError(f"Resource {resource.name} must be a dictionary without columns")
+        members = [encode_value(key) + ": " + encode_value(value) for key, value in resource.value.items()]
+        self.lines.append(f"{indent}{resource.name} = {members!r}")
+        self.add_elements(resource.elements, indent)
+        array = self.appended_array(resource.target, resource.append_to, indent)
+        self.lines.append(f"{indent}{array}.append(_render_object({resource.name}))")
+
+    def add_element(self, element: any, indent: str) -> None:
+        """Adds the source of the statements which add the element, where an Append must be handled here"""
+        if isinstance(element, Append):
+            when = element.when if element.when is not None else self.template_columns(element.value)
+            if when:
+                self.lines.append(f"{indent}if {self.condition(when)}:")
+                indent += "    "
+            array = self.appended_array(element.target, element.key, indent)
+            self.lines.append(f"{indent}{array}.append({self.json_expression(element.value)})")
+            return
+        super().add_element(element, indent)
+
+    def statement(self, element: any) -> str:
+        """Returns the source of the statement which adds the json of the Field element to its target"""
+        return f"{element.target}.append({self.json_expression(element.value, encode_value(element.key) + ': ')})"
+
+
+def compile_json_encoder(
+    spec: list,
+    target_disease: list,
+    columns_converted: bool = False,
+    column_indexes: Union[Dict[str, int], None] = None,
+) -> Callable[[dict], str]:
+    """
+    Compiles the specification into a function which returns the json of the FHIR Immunization resource for a row,
+    identical to the json of the resource given by the converter compiled from the same specification (see
+    compile_converter, including for columns_converted and column_indexes). The generated source is kept as the
+    source attribute of the function.
+    """
+    body = JsonEncoderSource(columns_converted, column_indexes)
+    # The elements are compiled first, to find which columns are read and checked and which arrays are appended to
+    body.add_elements(spec, "    ")
+
+    target_disease_member = '"targetDisease": ' + encode_value(target_disease)
+    lines = [
+        "def convert(row):",
+        *body.column_lines(),
+        *[f"    {name} = None" for name in body.appended_arrays],
+        f"    protocol_applied = [{target_disease_member!r}]",
+        """    imms = ['"resourceType": "Immunization"', '"status": "completed"', None]""",
+        *body.lines,
+        """    imms[2] = '"protocolApplied": [' + _render_object(protocol_applied) + ']'""",
+        "    return _render_object(imms)",
+    ]
+    body.namespace["_render_object"] = render_object
+    return body.compile_function(lines, "<compiled FHIR json encoder>")
@@ -0,0 +1,260 @@
+"""Functions for converting the rows of a csv file into encoded rows, either serially or across a pool of processes"""
+
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from io import StringIO
+from multiprocessing.shared_memory import SharedMemory
+from typing import Deque, Iterable, Iterator, List, Set, Tuple, Union
+from columnar_conversion import convert_columns_in_chunks, get_columnar_conversion_rows
+from csv_row import CsvRow, read_csv_rows
+from kinesis_record_aggregator import encode_row
+from mappings import Vaccine
+from process_row import process_row
+from row_logging import row_outcome_counters, should_log_row
+from scan_csv_file import CsvFileScan
+from utils_for_recordprocessor import STREAM_CHUNK_SIZE
+
+logger = logging.getLogger()
+
+# Number of rows sent to a worker process at a time
+ROWS_PER_CHUNK = 1000
+
+
+def get_conversion_workers() -> int:
+    """
+    Returns the number of worker processes to use for converting rows. CONVERSION_WORKERS may be set to a number of
+    processes, or to "auto" to use one process per available CPU. Defaults to 1, which converts rows serially.
+    """
+    conversion_workers = os.getenv("CONVERSION_WORKERS", "1")
+    if conversion_workers.lower() == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(conversion_workers))
+
+
+def convert_rows(
+    csv_reader: Iterable[Union[dict, CsvRow]],
+    file_id: str,
+    vaccine: Vaccine,
+    allowed_operations: set,
+    row_file_details: Union[dict, None],
+    first_row_number: int = 1,
+    row_numbers: Union[Iterable[int], None] = None,
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> Iterator[Tuple[str, Union[str, None], Union[bytes, None]]]:
+    """
+    Processes each row in turn, yielding the row_id, local_id and encoded row for each row. The rows are numbered
+    from first_row_number, unless the row_numbers of rows which are not consecutive are given. If
+    COLUMNAR_CONVERSION_ROWS is set, the columns of each chunk of that many rows are converted before the rows of the
+    chunk are processed (see columnar_conversion).
+    Rows whose numbers are in skipped_row_numbers (which are sent by another shard of the file) are not processed, so
+    are not counted in the outcomes of the rows, and are yielded with no local_id or encoded row.
+    """
+    numbered_rows = (
+        enumerate(csv_reader, start=first_row_number) if row_numbers is None else zip(row_numbers, csv_reader)
+    )
+    if columns_converted := bool(columnar_conversion_rows := get_columnar_conversion_rows()):
+        numbered_rows = convert_columns_in_chunks(numbered_rows, columnar_conversion_rows)
+
+    for row_number, row in numbered_rows:
+        row_id = f"{file_id}^{row_number}"
+        if skipped_row_numbers and row_number in skipped_row_numbers:
+            yield row_id, None, None
+            continue
+        details_from_processing = process_row(
+            vaccine, allowed_operations, row, columns_converted, should_log_row(row_number)
+        )
+        encoded_row = encode_row(row_id, details_from_processing, row_file_details)
+        yield row_id, details_from_processing["local_id"], encoded_row
+
+
+class RowChunker:
+    """
+    Cuts the bytes of a file, fed in as they are read, into chunks of rows_per_chunk rows. Chunks are cut at the row
+    offsets found by the scan, so a row is never split across chunks. Only the bytes of rows which are not yet part
+    of a complete chunk are held in memory.
+    If start_row_index is given, the bytes fed in must start at the offset of that row (e.g. when resuming a file).
+    If end_row_index is given, only the rows before that row are cut into chunks (e.g. for a shard of a file).
+    """
+
+    def __init__(
+        self,
+        file_scan: CsvFileScan,
+        rows_per_chunk: int = ROWS_PER_CHUNK,
+        start_row_index: int = 0,
+        end_row_index: Union[int, None] = None,
+    ):
+        self.file_scan = file_scan
+        self.rows_per_chunk = rows_per_chunk
+        self.end_row_index = file_scan.row_count if end_row_index is None else end_row_index
+        self._buffer = bytearray()
+        # The offset in the file of the first byte in the buffer (the stream starts at the first byte of the file,
+        # including the header row, unless resuming from a later row)
+        self._buffer_start = file_scan.row_offset(start_row_index) if start_row_index else 0
+        self._next_row_index = start_row_index
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """Adds the data to the buffer, and returns the index of the first row and raw bytes of each complete chunk"""
+        self._buffer += data
+        chunks = []
+        while self._next_row_index < self.end_row_index:
+            next_chunk_row_index = min(self._next_row_index + self.rows_per_chunk, self.end_row_index)
+            chunk_end = self.file_scan.row_offset(next_chunk_row_index)
+            if self._buffer_start + len(self._buffer) < chunk_end:
+                break
+            chunks.append(self._cut_chunk(chunk_end, next_chunk_row_index))
+        return chunks
+
+    def finish(self) -> List[Tuple[int, bytes]]:
+        """
+        Returns any rows remaining in the buffer once the stream has been read in full (only possible if the file is
+        shorter than when it was scanned)
+        """
+        if self._next_row_index >= self.end_row_index or not self._buffer:
+            return []
+        return [self._cut_chunk(self._buffer_start + len(self._buffer), self.end_row_index)]
+
+    def _cut_chunk(self, chunk_end: int, next_chunk_row_index: int) -> Tuple[int, bytes]:
+        """Removes the chunk ending at the chunk_end file offset from the buffer and returns it"""
+        start = self.file_scan.row_offset(self._next_row_index) - self._buffer_start
+        end = chunk_end - self._buffer_start
+        chunk = (self._next_row_index, bytes(self._buffer[start:end]))
+        del self._buffer[:end]
+        self._buffer_start = chunk_end
+        self._next_row_index = next_chunk_row_index
+        return chunk
+
+
+def stream_row_chunks(
+    streaming_body,
+    file_scan: CsvFileScan,
+    rows_per_chunk: int = ROWS_PER_CHUNK,
+    start_row_index: int = 0,
+    end_row_index: Union[int, None] = None,
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Reads the streaming body, yielding the index of the first row and the raw bytes of each consecutive chunk of
+    rows_per_chunk rows (see RowChunker)
+    """
+    row_chunker = RowChunker(file_scan, rows_per_chunk, start_row_index, end_row_index)
+    for data in iter(lambda: streaming_body.read(STREAM_CHUNK_SIZE), b""):
+        yield from row_chunker.feed(data)
+    yield from row_chunker.finish()
+
+
+def convert_row_chunk(
+    shared_memory_name: str,
+    chunk_size: int,
+    first_row_number: int,
+    fieldnames: list,
+    file_id: str,
+    vaccine: Vaccine,
+    allowed_operations: set,
+    row_file_details: Union[dict, None],
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> Tuple[List[Tuple[str, Union[str, None], Union[bytes, None]]], dict]:
+    """
+    Runs in a worker process. Reads the raw bytes of a chunk of rows from shared memory, and returns the row_id,
+    local_id and encoded row for each row in the chunk (see convert_rows), and the counts of the outcomes of the rows
+    in the chunk.
+    """
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        chunk = bytes(shared_memory.buf[:chunk_size]).decode("utf-8")
+    finally:
+        shared_memory.close()
+
+    row_outcome_counters.clear()
+    csv_reader = read_csv_rows(StringIO(chunk), fieldnames=fieldnames)
+    encoded_rows = list(
+        convert_rows(
+            csv_reader,
+            file_id,
+            vaccine,
+            allowed_operations,
+            row_file_details,
+            first_row_number,
+            skipped_row_numbers=skipped_row_numbers,
+        )
+    )
+    return encoded_rows, row_outcome_counters.as_dict()
+
+
+def convert_rows_in_parallel(
+    streaming_body,
+    file_scan: CsvFileScan,
+    file_id: str,
+    vaccine: Vaccine,
+    allowed_operations: set,
+    row_file_details: Union[dict, None],
+    workers: int,
+    rows_per_chunk: int = ROWS_PER_CHUNK,
+    start_row_index: int = 0,
+    end_row_index: Union[int, None] = None,
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> Iterator[Tuple[str, Union[str, None], Union[bytes, None]]]:
+    """
+    Processes chunks of rows in a pool of worker processes, yielding the row_id, local_id and encoded row for each
+    row in file order. The raw bytes of each chunk are passed to the workers in shared memory. At most two chunks per
+    worker are in flight at a time, so that the file is never held in memory in full.
+    If start_row_index is given, the streaming body must start at the offset of that row, and if end_row_index is
+    given only the rows before that row are processed (see RowChunker). Rows whose numbers are in skipped_row_numbers
+    are not processed (see convert_rows).
+    """
+    logger.info("Converting rows using %s worker processes", workers)
+    in_flight: Deque[Tuple[SharedMemory, Future]] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for first_row_index, chunk in stream_row_chunks(
+                streaming_body, file_scan, rows_per_chunk, start_row_index, end_row_index
+            ):
+                shared_memory = SharedMemory(create=True, size=max(len(chunk), 1))
+                shared_memory.buf[: len(chunk)] = chunk
+                future = executor.submit(
+                    convert_row_chunk,
+                    shared_memory.name,
+                    len(chunk),
+                    first_row_index + 1,
+                    file_scan.headers,
+                    file_id,
+                    vaccine,
+                    allowed_operations,
+                    row_file_details,
+                    # Only the skipped rows of the chunk are passed to the worker
+                    {
+                        row_number
+                        for row_number in skipped_row_numbers or ()
+                        if first_row_index < row_number <= first_row_index + rows_per_chunk
+                    },
+                )
+                in_flight.append((shared_memory, future))
+                if len(in_flight) >= 2 * workers:
+                    yield from _collect_chunk_result(*in_flight.popleft())
+
+            while in_flight:
+                yield from _collect_chunk_result(*in_flight.popleft())
+        finally:
+            # Only reached with chunks in flight if the rows are not consumed in full, or a worker fails
+            for shared_memory, future in in_flight:
+                future.cancel()
+                _release_shared_memory(shared_memory)
+
+
+def _collect_chunk_result(shared_memory: SharedMemory, future: Future) -> List[Tuple[str, str, bytes]]:
+    """
+    Waits for the worker to convert the chunk, then releases the chunk's shared memory. The counts of the outcomes
+    of the rows in the chunk are added to the counters of this process.
+    """
+    try:
+        encoded_rows, outcome_counts = future.result()
+        row_outcome_counters.update(outcome_counts)
+        return encoded_rows
+    finally:
+        _release_shared_memory(shared_memory)
+
+
+def _release_shared_memory(shared_memory: SharedMemory) -> None:
+    """Closes and unlinks the shared memory block"""
+    shared_memory.close()
+    shared_memory.unlink()
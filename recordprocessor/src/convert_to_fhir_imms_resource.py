@@ -1,9 +1,14 @@
 """"Decorators to add the relevant fields to the FHIR immunization resource from the batch stream"""
 
-from typing import List, Callable, Dict
-from utils_for_fhir_conversion import _is_not_empty, Generate, Add, Convert
+from itertools import product
+from typing import List, Callable, Dict, Tuple, Union
+from utils_for_fhir_conversion import _is_not_empty, Generate, Add, Convert, Flyweight
 from mappings import map_target_disease, Vaccine
 from constants import Urls
+from simplejson import RawJSON
+from compile_fhir_converter import compile_converter, compile_json_encoder
+from fhir_mapping_spec import FHIR_MAPPING_SPEC
+from csv_row import CSV_ROW_FIELD_INDEXES, CsvRow
 
 
 ImmunizationDecorator = Callable[[Dict, Dict[str, str]], None]
@@ -66,15 +71,8 @@ def _decorate_patient(imms: dict, row: Dict[str, str]) -> None:
 def _decorate_vaccine(imms: dict, row: Dict[str, str]) -> None:
     """Adds fields relating to the physical product"""
 
-    vax_prod_code = row.get("VACCINE_PRODUCT_CODE")
-    vax_prod_term = row.get("VACCINE_PRODUCT_TERM")
-    vax_prod_system = Urls.SNOMED
     # vaccineCode is a mandatory FHIR field. If no values are supplied a default null flavour code of 'NAVU' is used.
-    if not (vax_prod_code or vax_prod_term):
-        vax_prod_code, vax_prod_term, vax_prod_system = "NAVU", "Not available", Urls.NULL_FLAVOUR_CODES
-    imms["vaccineCode"] = {
-        "coding": [Generate.dictionary({"system": vax_prod_system, "code": vax_prod_code, "display": vax_prod_term})]
-    }
+    imms["vaccineCode"] = Flyweight.vaccine_code(row.get("VACCINE_PRODUCT_CODE"), row.get("VACCINE_PRODUCT_TERM"))
 
     Add.dictionary(imms, "manufacturer", {"display": row.get("VACCINE_MANUFACTURER")})
 
@@ -116,14 +114,8 @@ def _decorate_vaccination(imms: dict, row: Dict[str, str]) -> None:
         dose_unit_term := row.get("DOSE_UNIT_TERM"),
         dose_unit_code := row.get("DOSE_UNIT_CODE"),
     ]
-    dose_quantity_dict = {
-        "value": Convert.integer_or_decimal(dose_amount),
-        "unit": dose_unit_term,
-        # Only include system if dose unit code is  non-empty
-        **({"system": Urls.SNOMED} if _is_not_empty(dose_unit_code) else {}),
-        "code": dose_unit_code,
-    }
-    Add.custom_item(imms, "doseQuantity", dose_quantity_values, Generate.dictionary(dose_quantity_dict))
+    if any(_is_not_empty(value) for value in dose_quantity_values):
+        imms["doseQuantity"] = Flyweight.dose_quantity(dose_amount, dose_unit_term, dose_unit_code)
 
     # If DOSE_SEQUENCE is empty, default FHIR "doseNumberString" to "Dose sequence not recorded",
     # otherwise assume the sender's intentiion is to supply a positive integer
@@ -179,12 +171,12 @@ def _decorate_performer(imms: dict, row: Dict[str, str]) -> None:
             # Add practitioner to contained list if it exists, else create a contained list and add it to imms
             imms.setdefault("contained", []).append(practitioner)
 
-    Add.custom_item(
-        imms,
-        "location",
-        [location_code := row.get("LOCATION_CODE"), location_code_type_uri := row.get("LOCATION_CODE_TYPE_URI")],
-        {"identifier": Generate.dictionary({"value": location_code, "system": location_code_type_uri})},
-    )
+    location_values = [
+        location_code := row.get("LOCATION_CODE"),
+        location_code_type_uri := row.get("LOCATION_CODE_TYPE_URI"),
+    ]
+    if any(_is_not_empty(value) for value in location_values):
+        imms["location"] = Flyweight.location(location_code, location_code_type_uri)
 
 
 all_decorators: List[ImmunizationDecorator] = [
@@ -196,16 +188,86 @@ all_decorators: List[ImmunizationDecorator] = [
 ]
 
 
-def convert_to_fhir_imms_resource(row: dict, vaccine: Vaccine) -> dict:
-    """Converts a row of data to a FHIR Immunization Resource"""
-    # Prepare the imms_resource. Note that all data sent via this service is assumed to be for completed vaccinations.
-    imms_resource = {"resourceType": "Immunization", "status": "completed"}
+# The targetDisease element for each vaccine type, built once. Each element is shared by every resource for the
+# vaccine type, so must never be modified (the decorators only ever add keys to the protocolApplied item around it).
+TARGET_DISEASE_ELEMENTS: Dict[Vaccine, list] = {vaccine: map_target_disease(vaccine) for vaccine in Vaccine}
 
-    # Add the targetDisease element based on the vaccine type
-    imms_resource["protocolApplied"] = [{"targetDisease": map_target_disease(vaccine)}]
+
+def convert_to_fhir_imms_resource_with_decorators(row: dict, vaccine: Vaccine) -> dict:
+    """
+    Converts a row of data to a FHIR Immunization Resource by applying each of the decorators in turn. This is the
+    reference implementation, which the compiled converters used by convert_to_fhir_imms_resource must match exactly.
+    """
+    # Prepare the imms_resource from the constant elements for the vaccine type. Note that all data sent via this
+    # service is assumed to be for completed vaccinations.
+    imms_resource = {
+        "resourceType": "Immunization",
+        "status": "completed",
+        "protocolApplied": [{"targetDisease": TARGET_DISEASE_ELEMENTS[vaccine]}],
+    }
 
     # Apply all decorators to add the relevant fields to the imms_resource
     for decorator in all_decorators:
         decorator(imms_resource, row)
 
     return imms_resource
+
+
+def compile_for_each_vaccine(compile_function: Callable, **options) -> Dict[Vaccine, Callable]:
+    """Compiles the FHIR mapping specification with the given options for each vaccine type"""
+    return {
+        vaccine: compile_function(FHIR_MAPPING_SPEC, TARGET_DISEASE_ELEMENTS[vaccine], **options) for vaccine in Vaccine
+    }
+
+
+# The converter and json encoder compiled from the FHIR mapping specification for each vaccine type, for each
+# combination of whether the columns of the row have already been converted (see columnar_conversion) and whether the
+# row is a CsvRow (see csv_row)
+CONVERTERS: Dict[Tuple[bool, bool], Dict[Vaccine, Callable[[dict], dict]]] = {
+    (columns_converted, csv_row): compile_for_each_vaccine(
+        compile_converter,
+        columns_converted=columns_converted,
+        column_indexes=CSV_ROW_FIELD_INDEXES if csv_row else None,
+    )
+    for columns_converted, csv_row in product((False, True), repeat=2)
+}
+JSON_ENCODERS: Dict[Tuple[bool, bool], Dict[Vaccine, Callable[[dict], str]]] = {
+    (columns_converted, csv_row): compile_for_each_vaccine(
+        compile_json_encoder,
+        columns_converted=columns_converted,
+        column_indexes=CSV_ROW_FIELD_INDEXES if csv_row else None,
+    )
+    for columns_converted, csv_row in product((False, True), repeat=2)
+}
+
+# The converter and json encoder for each vaccine type for dictionary rows whose columns have not been converted
+COMPILED_CONVERTERS = CONVERTERS[False, False]
+COMPILED_JSON_ENCODERS = JSON_ENCODERS[False, False]
+
+
+def convert_to_fhir_imms_resource(row: Union[dict, CsvRow], vaccine: Vaccine, columns_converted: bool = False) -> dict:
+    """
+    Converts a row of data to a FHIR Immunization Resource, using the compiled converter for the vaccine type and row
+    type. columns_converted must be True if the row's columns have already been converted (see columnar_conversion).
+    """
+    return CONVERTERS[columns_converted, row.__class__ is CsvRow][vaccine](row)
+
+
+def encode_fhir_imms_resource(row: Union[dict, CsvRow], vaccine: Vaccine, columns_converted: bool = False) -> RawJSON:
+    """
+    Returns the json of the FHIR Immunization Resource for a row of data, written directly from the row values by the
+    compiled json encoder for the vaccine type and row type. The json is identical to that of
+    convert_to_fhir_imms_resource when encoded by simplejson, and is wrapped as RawJSON so that simplejson includes it
+    as it is in the message body.
+    columns_converted must be True if the row's columns have already been converted (see columnar_conversion).
+    """
+    return RawJSON(JSON_ENCODERS[columns_converted, row.__class__ is CsvRow][vaccine](row))
+
+
+def convert_to_identifier_only_imms_resource(unique_id: str, unique_id_uri: str) -> dict:
+    """
+    Returns a FHIR Immunization Resource holding only the identifier element, identical to the identifier element of
+    the full resource for a row with the given non-empty UNIQUE_ID and UNIQUE_ID_URI. Used for DELETE rows, as the
+    identifier is all that is needed to find the resource to delete.
+    """
+    return {"resourceType": "Immunization", "identifier": [{"value": unique_id, "system": unique_id_uri}]}
@@ -0,0 +1,69 @@
+"""
+Compact representation of the rows of a csv file with the expected headers. Each row is held as a tuple of its
+values, in the order of the headers, rather than as a dictionary keyed by the headers as by csv.DictReader.
+"""
+
+import os
+from csv import DictReader, reader
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, Union
+from constants import Constants
+
+# The index of each of the expected columns in a CsvRow
+CSV_ROW_FIELD_INDEXES: Dict[str, int] = {name: index for index, name in enumerate(Constants.expected_csv_headers)}
+
+
+def get_csv_row_type() -> str:
+    """
+    Returns the type of row which the rows of a file are read into. CSV_ROW_TYPE may be set to "dict" to read each
+    row into a dictionary using csv.DictReader. Defaults to "tuple" (see CsvRow).
+    """
+    return "dict" if os.getenv("CSV_ROW_TYPE", "tuple").lower() == "dict" else "tuple"
+
+
+class CsvRow(tuple):
+    """
+    A row of a csv file with the expected headers, held as a tuple of its values in the order of the headers. A value
+    may be read by index, as an attribute named after its column (e.g. row.PERSON_DOB), or by column name using get,
+    as for the dictionaries given by csv.DictReader. As for csv.DictReader, the value of a column which is missing
+    from a short row is None.
+    """
+
+    __slots__ = ()
+
+    def get(self, key: str, default: any = None) -> any:
+        """Returns the value of the column, or the default if there is no such column"""
+        index = CSV_ROW_FIELD_INDEXES.get(key)
+        return default if index is None else self[index]
+
+
+for _name, _index in CSV_ROW_FIELD_INDEXES.items():
+    setattr(CsvRow, _name, property(itemgetter(_index), doc=f"The value of the {_name} column"))
+
+
+def _csv_rows(csv_reader: Iterator[list]) -> Iterator[CsvRow]:
+    """Yields each row read by the csv reader as a CsvRow. Blank lines are skipped, as they are by csv.DictReader."""
+    row_length = len(CSV_ROW_FIELD_INDEXES)
+    for values in csv_reader:
+        if len(values) == row_length:
+            yield CsvRow(values)
+        elif values:
+            # Short rows are padded with None, and values beyond the expected columns are dropped
+            yield CsvRow((values + [None] * row_length)[:row_length])
+
+
+def read_csv_rows(lines: Iterable[str], fieldnames: Union[list, None] = None) -> Iterator[Union[CsvRow, dict]]:
+    """
+    Returns an iterator of the rows of the pipe-delimited lines. If fieldnames is not given, the first row holds the
+    headers. The rows are read with csv.reader into CsvRows if the headers are the expected headers, or otherwise (or
+    if CSV_ROW_TYPE is "dict") into dictionaries with csv.DictReader.
+    """
+    lines = iter(lines)
+    csv_reader = reader(lines, delimiter="|")
+    if fieldnames is None:
+        # The csv reader only reads the lines of the header row, so the remaining lines start at the first data row
+        fieldnames = next(csv_reader, [])
+
+    if get_csv_row_type() == "dict" or list(fieldnames) != Constants.expected_csv_headers:
+        return iter(DictReader(lines, fieldnames=fieldnames, delimiter="|"))
+    return _csv_rows(csv_reader)
@@ -0,0 +1,121 @@
+"""
+Sends the failure acks of rows which failed in the processor straight to the ack queue, rather than sending the rows
+through Kinesis for the forwarder to ack
+"""
+
+import os
+import json
+import time
+import random
+import logging
+from typing import List, Tuple, Union
+from botocore.exceptions import ClientError
+from s3_clients import sqs_client
+
+logger = logging.getLogger()
+
+# SQS SendMessageBatch limit
+MAX_MESSAGES_PER_BATCH = 10
+
+
+def get_failure_ack_queue_url() -> Union[str, None]:
+    """
+    Returns the url of the ack queue, given by SQS_QUEUE_URL (the queue to which the forwarder sends its failure
+    acks). If it is not set, rows which failed in the processor are sent through Kinesis like any other row.
+    """
+    return os.getenv("SQS_QUEUE_URL") or None
+
+
+class FailedRow(bytes):
+    """
+    A row, encoded by encode_row, whose details from processing hold diagnostics (e.g. INVALID_ACTION_FLAG,
+    NO_PERMISSIONS or MISSING_UNIQUE_ID). It is identical to the encoded row, so can be sent to Kinesis as it is,
+    but marks the row as one which can be acked directly by a FailureAckSender.
+    """
+
+
+class FailureAckSender:
+    """
+    Buffers the failure ack messages of rows which failed in the processor, and sends them to the ack queue using
+    SendMessageBatch, up to 10 at a time. Each message body is the one which the forwarder would send for the row.
+    Entries which fail are retried, with jittered exponential backoff, up to max_attempts times.
+    As for KinesisBatchSender, each flush returns a list of (row_id, delivered) tuples for every row sent.
+    """
+
+    def __init__(
+        self,
+        queue_url: str,
+        file_details: dict,
+        max_attempts: int = 3,
+        base_backoff_seconds: float = 0.1,
+        max_backoff_seconds: float = 2.0,
+    ):
+        self.queue_url = queue_url
+        self.file_details = file_details
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.messages_sent = 0
+        self.batches_sent = 0
+        self._entries: List[dict] = []
+        self._row_ids: List[str] = []
+
+    def add_row(self, row_id: str, encoded_row: bytes) -> List[Tuple[str, bool]]:
+        """
+        Adds the failure ack message of the failed row to the buffer, flushing once the buffer is full.
+        Returns the results of any flush which took place (an empty list if nothing was sent).
+        """
+        row = json.loads(encoded_row)
+        message_body = {
+            "diagnostics": row["diagnostics"],
+            "supplier": self.file_details.get("supplier"),
+            "file_key": self.file_details.get("file_key"),
+            "row_id": row_id,
+            "created_at_formatted_string": self.file_details.get("created_at_formatted_string"),
+            "local_id": row.get("local_id"),
+        }
+        self._entries.append(
+            {
+                "Id": str(len(self._entries)),
+                "MessageBody": json.dumps(message_body),
+                "MessageGroupId": message_body["file_key"],
+            }
+        )
+        self._row_ids.append(row_id)
+        return self.flush() if len(self._entries) >= MAX_MESSAGES_PER_BATCH else []
+
+    def flush(self) -> List[Tuple[str, bool]]:
+        """Sends all buffered messages, retrying any failed entries. Returns the (row_id, delivered) results."""
+        entries, row_ids = self._entries, self._row_ids
+        self._entries, self._row_ids = [], []
+        if not entries:
+            return []
+
+        pending = {entry["Id"]: entry for entry in entries}
+        error_codes = set()
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self._backoff(attempt)
+            try:
+                response = sqs_client.send_message_batch(QueueUrl=self.queue_url, Entries=list(pending.values()))
+            except ClientError as error:
+                logger.error("Error sending failure acks to the ack queue: %s", error)
+                break
+
+            self.batches_sent += 1
+            for result in response.get("Successful", []):
+                pending.pop(result["Id"], None)
+            failed = response.get("Failed", [])
+            error_codes.update(result.get("Code") for result in failed)
+            # Entries which failed through the fault of the sender would fail again, so are not retried
+            if not pending or any(result.get("SenderFault") for result in failed):
+                break
+
+        if pending:
+            logger.error("%s failure acks were not sent to the ack queue. Error codes: %s", len(pending), error_codes)
+        self.messages_sent += len(entries) - len(pending)
+        return [(row_id, entry["Id"] not in pending) for row_id, entry in zip(row_ids, entries)]
+
+    def _backoff(self, attempt: int) -> None:
+        """Sleeps for a random time of up to base_backoff_seconds * 2 ** attempt (capped at max_backoff_seconds)"""
+        time.sleep(random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * 2**attempt)))
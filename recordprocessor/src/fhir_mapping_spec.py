@@ -0,0 +1,233 @@
+"""
+Declarative specification of the mapping from the columns of the batch file to the elements of the FHIR Immunization
+resource. The specification is compiled into a converter function for each vaccine type (see compile_fhir_converter).
+NOTE: NO VALIDATION should be performed. Validation is left to the Imms API.
+NOTE: An overarching data rule is that where data is not present the field should not be added to the FHIR Immunization
+resource. Therefore an element is only added if at least one of the columns it depends on is non-empty.
+"""
+
+from typing import Callable, List, Union
+from utils_for_fhir_conversion import Generate, Convert, Flyweight
+from constants import Urls
+
+
+class Column:
+    """The value of a column of the row, converted using the convert function if one is given"""
+
+    def __init__(self, name: str, convert: Union[Callable, None] = None):
+        self.name = name
+        self.convert = convert
+
+
+class NonEmpty:
+    """A dictionary built from the template, with all empty items removed"""
+
+    def __init__(self, template: dict):
+        self.template = template
+
+
+class Call:
+    """The result of calling the function with the arguments, each of which may be a template"""
+
+    def __init__(self, function: Callable, *arguments):
+        self.function = function
+        self.arguments = arguments
+
+
+class Field:
+    """
+    Sets the key of the target to the value, which is a template that may contain Columns, NonEmpty and Call items.
+    The field is only set if at least one of the when columns is non-empty. By default the when columns are the
+    columns in the value, and an empty list of when columns always sets the field. If an otherwise Field is given, it
+    is set instead when none of the when columns are non-empty.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        value: any,
+        when: Union[List[str], None] = None,
+        otherwise: Union["Field", None] = None,
+        target: str = "imms",
+    ):
+        self.key = key
+        self.value = value
+        self.when = when
+        self.otherwise = otherwise
+        self.target = target
+
+
+class Append:
+    """Appends the value to the list held under the key of the target (see Field), creating the list if needed"""
+
+    def __init__(self, key: str, value: any, when: Union[List[str], None] = None, target: str = "imms"):
+        self.key = key
+        self.value = value
+        self.when = when
+        self.target = target
+
+
+class Resource:
+    """
+    Builds the value as a new target with the given name, adds the elements to it, then appends it to the list held
+    under the append_to key of the target (used for the contained resources and the name elements)
+    """
+
+    def __init__(self, name: str, value: dict, elements: list, append_to: str, target: str = "imms"):
+        self.name = name
+        self.value = value
+        self.elements = elements
+        self.append_to = append_to
+        self.target = target
+
+
+class Group:
+    """Adds the elements only if at least one of the when columns is non-empty"""
+
+    def __init__(self, when: List[str], elements: list):
+        self.when = when
+        self.elements = elements
+
+
+PATIENT_COLUMNS = [
+    "PERSON_SURNAME",
+    "PERSON_FORENAME",
+    "PERSON_GENDER_CODE",
+    "PERSON_DOB",
+    "PERSON_POSTCODE",
+    "NHS_NUMBER",
+]
+ORGANIZATION_COLUMNS = ["SITE_CODE_TYPE_URI", "SITE_CODE"]
+PRACTITIONER_COLUMNS = ["PERFORMING_PROFESSIONAL_SURNAME", "PERFORMING_PROFESSIONAL_FORENAME"]
+
+# The elements are listed in the order in which they are added to the resource, which is the order of the keys in the
+# resource. The resource starts with the resourceType, status and protocolApplied elements. The targets "imms" and
+# "protocol_applied" are the resource and the single item of its protocolApplied list.
+FHIR_MAPPING_SPEC = [
+    # Immunization
+    Field("reasonCode", [{"coding": [{"system": Urls.SNOMED, "code": Column("INDICATION_CODE")}]}]),
+    Field("recorded", Column("RECORDED_DATE", Convert.date)),
+    Field("identifier", [NonEmpty({"value": Column("UNIQUE_ID"), "system": Column("UNIQUE_ID_URI")})]),
+    # Patient
+    Group(
+        PATIENT_COLUMNS,
+        [
+            Field("patient", {"reference": "#Patient1"}, when=[]),
+            Resource(
+                "patient",
+                {"id": "Patient1", "resourceType": "Patient"},
+                [
+                    Field("birthDate", Column("PERSON_DOB", Convert.date), target="patient"),
+                    Field("gender", Column("PERSON_GENDER_CODE", Convert.gender_code), target="patient"),
+                    Field("address", [NonEmpty({"postalCode": Column("PERSON_POSTCODE")})], target="patient"),
+                    Field("identifier", [{"system": Urls.NHS_NUMBER, "value": Column("NHS_NUMBER")}], target="patient"),
+                    Group(
+                        ["PERSON_SURNAME", "PERSON_FORENAME"],
+                        [
+                            Resource(
+                                "patient_name",
+                                {},
+                                [
+                                    Field("family", Column("PERSON_SURNAME"), target="patient_name"),
+                                    Field("given", [Column("PERSON_FORENAME")], target="patient_name"),
+                                ],
+                                append_to="name",
+                                target="patient",
+                            )
+                        ],
+                    ),
+                ],
+                append_to="contained",
+            ),
+        ],
+    ),
+    # Vaccine. vaccineCode is a mandatory FHIR field, which defaults to a null flavour code if no values are supplied.
+    Field(
+        "vaccineCode",
+        Call(Flyweight.vaccine_code, Column("VACCINE_PRODUCT_CODE"), Column("VACCINE_PRODUCT_TERM")),
+        when=[],
+    ),
+    Field("manufacturer", NonEmpty({"display": Column("VACCINE_MANUFACTURER")})),
+    Field("expirationDate", Column("EXPIRY_DATE", Convert.date)),
+    Field("lotNumber", Column("BATCH_NUMBER")),
+    # Vaccination
+    Field(
+        "extension",
+        [
+            Call(
+                Generate.extension_item,
+                Urls.VACCINATION_PROCEDURE,
+                Urls.SNOMED,
+                Column("VACCINATION_PROCEDURE_CODE"),
+                Column("VACCINATION_PROCEDURE_TERM"),
+            )
+        ],
+    ),
+    Field("occurrenceDateTime", Column("DATE_AND_TIME", Convert.date_time)),
+    Field("primarySource", Column("PRIMARY_SOURCE", Convert.boolean)),
+    Field("site", Call(Flyweight.snomed, Column("SITE_OF_VACCINATION_CODE"), Column("SITE_OF_VACCINATION_TERM"))),
+    Field("route", Call(Flyweight.snomed, Column("ROUTE_OF_VACCINATION_CODE"), Column("ROUTE_OF_VACCINATION_TERM"))),
+    Field(
+        "doseQuantity",
+        Call(Flyweight.dose_quantity, Column("DOSE_AMOUNT"), Column("DOSE_UNIT_TERM"), Column("DOSE_UNIT_CODE")),
+    ),
+    # If DOSE_SEQUENCE is empty, default FHIR "doseNumberString" to "Dose sequence not recorded",
+    # otherwise assume the sender's intention is to supply a positive integer
+    Field(
+        "doseNumberPositiveInt",
+        Column("DOSE_SEQUENCE", Convert.integer),
+        otherwise=Field("doseNumberString", "Dose sequence not recorded", when=[], target="protocol_applied"),
+        target="protocol_applied",
+    ),
+    # Performer
+    Group(
+        ORGANIZATION_COLUMNS,
+        [
+            Append(
+                "performer",
+                {
+                    "actor": {
+                        "type": "Organization",
+                        "identifier": NonEmpty({"system": Column("SITE_CODE_TYPE_URI"), "value": Column("SITE_CODE")}),
+                    }
+                },
+                when=[],
+            )
+        ],
+    ),
+    Group(
+        PRACTITIONER_COLUMNS,
+        [
+            Append("performer", {"actor": {"reference": "#Practitioner1"}}, when=[]),
+            Resource(
+                "practitioner",
+                {"resourceType": "Practitioner", "id": "Practitioner1"},
+                [
+                    Group(
+                        PRACTITIONER_COLUMNS,
+                        [
+                            Resource(
+                                "practitioner_name",
+                                {},
+                                [
+                                    Field(
+                                        "family", Column("PERFORMING_PROFESSIONAL_SURNAME"), target="practitioner_name"
+                                    ),
+                                    Field(
+                                        "given",
+                                        [Column("PERFORMING_PROFESSIONAL_FORENAME")],
+                                        target="practitioner_name",
+                                    ),
+                                ],
+                                append_to="name",
+                                target="practitioner",
+                            )
+                        ],
+                    )
+                ],
+                append_to="contained",
+            ),
+        ],
+    ),
+    Field("location", Call(Flyweight.location, Column("LOCATION_CODE"), Column("LOCATION_CODE_TYPE_URI"))),
+]
@@ -0,0 +1,121 @@
+"""Functions for processing a shard of a file, when a file has been split into shards each processed by a task"""
+
+import os
+import json
+import logging
+from io import BytesIO
+from typing import Iterator, List, Tuple, Union
+from botocore.exceptions import ClientError
+from checkpoints import CheckpointTracker, shutdown_requested
+from convert_rows import convert_rows
+from csv_row import read_csv_rows
+from kinesis_record_aggregator import KinesisRecordAggregator, send_encoded_rows
+from mappings import Vaccine
+from partition_strategies import PartitionStrategy
+from s3_clients import s3_client
+from utils_for_recordprocessor import get_environment, get_file_streaming_body, stream_lines
+
+logger = logging.getLogger()
+
+# Moved rows separated by no more than this many bytes are fetched in the same ranged GET
+MAX_MOVED_ROWS_GAP_BYTES = 256 * 1024
+# Maximum number of bytes fetched in each ranged GET of moved rows (a single larger row is fetched on its own)
+MAX_MOVED_ROWS_RANGE_BYTES = 8 * 1024 * 1024
+
+
+def get_checkpoint_id(message_id: str, shard: Union[dict, None]) -> str:
+    """Returns the id under which progress is checkpointed, which is separate for each shard of a file"""
+    return f"{message_id}_{shard['shard_index']}" if shard else message_id
+
+
+def load_shard_plan(shard: dict) -> Union[dict, None]:
+    """
+    Returns the shard with the moved_rows and skipped_row_numbers given for it by the plan of the file's shards, which
+    filenameprocessor uploads to the ack bucket (so that the message for each shard stays small).
+    Returns None if there is no plan, which filenameprocessor deletes if the messages for the shards could not all be
+    sent (so that none of the shards are processed).
+    """
+    ack_bucket_name = os.getenv("ACK_BUCKET_NAME", f"immunisation-batch-{get_environment()}-data-destinations")
+    try:
+        response = s3_client.get_object(Bucket=ack_bucket_name, Key=shard["plan_key"])
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return {**shard, **json.loads(response["Body"].read())["shards"][shard["shard_index"]]}
+
+
+def coalesce_moved_rows(
+    moved_rows: List[list],
+    max_gap_bytes: int = MAX_MOVED_ROWS_GAP_BYTES,
+    max_range_bytes: int = MAX_MOVED_ROWS_RANGE_BYTES,
+) -> Iterator[Tuple[int, int, List[list]]]:
+    """
+    Groups the moved rows (as [row number, start byte, end byte], in file order) into byte ranges which can each be
+    fetched with a single ranged GET. A row joins the range of the rows before it if it starts no more than
+    max_gap_bytes after the end of the range, and the range would be no longer than max_range_bytes.
+    Yields the start byte, end byte and moved rows of each range.
+    """
+    range_rows: List[list] = []
+    for moved_row in moved_rows:
+        _, start_byte, end_byte = moved_row
+        if range_rows and (
+            start_byte - range_rows[-1][2] > max_gap_bytes or end_byte - range_rows[0][1] > max_range_bytes
+        ):
+            yield range_rows[0][1], range_rows[-1][2], range_rows
+            range_rows = []
+        range_rows.append(moved_row)
+    if range_rows:
+        yield range_rows[0][1], range_rows[-1][2], range_rows
+
+
+def send_moved_rows(
+    bucket_name: str,
+    file_key: str,
+    moved_rows: List[list],
+    headers: list,
+    file_id: str,
+    vaccine: Vaccine,
+    allowed_operations: set,
+    record_aggregator: KinesisRecordAggregator,
+    partition_strategy: PartitionStrategy,
+    checkpoint_tracker: Union[CheckpointTracker, None] = None,
+) -> Tuple[int, int]:
+    """
+    Processes and sends the moved_rows of later shards which the planner moved to this shard, because the first row of
+    their local_id is in this shard (see filenameprocessor). They are sent after the rows of the shard itself, so that
+    the rows of each local_id are sent in file order. The rows are fetched in coalesced byte ranges (see
+    coalesce_moved_rows), and only the bytes of the moved rows themselves are read as rows.
+    The delivery results of the moved rows are passed to the checkpoint tracker (if there is one), so a restarted task
+    only sends the moved rows after the checkpoint. Stops early if shutdown has been requested.
+    Returns the number of rows processed, and the number of rows not delivered. The caller is responsible for the
+    final flush of the record aggregator.
+    """
+    row_count = 0
+    rows_not_delivered = 0
+    for range_start, range_end, range_rows in coalesce_moved_rows(moved_rows):
+        if shutdown_requested.is_set():
+            break
+        range_bytes = get_file_streaming_body(bucket_name, file_key, range_start, range_end).read()
+        # The range may include rows between the moved rows, which are left out
+        rows_bytes = b"".join(
+            range_bytes[slice(start_byte - range_start, end_byte - range_start)]
+            for _, start_byte, end_byte in range_rows
+        )
+        csv_reader = read_csv_rows(stream_lines(BytesIO(rows_bytes)), fieldnames=headers)
+        encoded_rows = convert_rows(
+            csv_reader,
+            file_id,
+            vaccine,
+            allowed_operations,
+            record_aggregator.row_file_details,
+            row_numbers=[row_number for row_number, _, _ in range_rows],
+        )
+        range_row_count, range_rows_not_delivered = send_encoded_rows(
+            encoded_rows, record_aggregator, partition_strategy, checkpoint_tracker
+        )
+        row_count += range_row_count
+        rows_not_delivered += range_rows_not_delivered
+    if row_count:
+        logger.info("Processed %s rows moved to this shard of %s", row_count, file_key)
+    return row_count, rows_not_delivered
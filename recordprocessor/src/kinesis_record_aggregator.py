@@ -0,0 +1,209 @@
+"""Packs the message bodies of several rows into each record sent to the processing data stream"""
+
+import os
+import json
+import logging
+from typing import Dict, Iterable, List, Set, Tuple, Union
+from send_to_kinesis import KinesisBatchSender, encode_message_body, MAX_BYTES_PER_RECORD
+from failure_acks import FailedRow, FailureAckSender
+from partition_strategies import PartitionStrategy
+from checkpoints import CheckpointTracker, shutdown_requested
+from utils_for_recordprocessor import get_row_number
+from row_logging import should_log_row
+from ack_file_assembler import AckFileAssembler
+
+logger = logging.getLogger()
+
+# Records without a version key carry a single row (version 1). Version 2 records have the structure
+# {"version": 2, "file": {"file_key", "supplier", "created_at_formatted_string"}, "rows": [row, ...]}, where each row
+# holds the row_id and the details from processing the row.
+AGGREGATED_RECORD_VERSION = 2
+
+
+def encode_row(row_id: str, details_from_processing: dict, file_details: Union[dict, None] = None) -> bytes:
+    """
+    Returns the json encoded row. The file details are included in the row for single row records, but are held
+    once per record (rather than in each row) in aggregated records. Rows whose details from processing hold
+    diagnostics are returned as a FailedRow.
+    """
+    encoded_row = encode_message_body({"row_id": row_id, **(file_details or {}), **details_from_processing})
+    return FailedRow(encoded_row) if "diagnostics" in details_from_processing else encoded_row
+
+
+def get_rows_per_kinesis_record() -> int:
+    """Returns the maximum number of rows to pack into each Kinesis record (1 means single row records)"""
+    return max(1, int(os.getenv("ROWS_PER_KINESIS_RECORD", "1")))
+
+
+class KinesisRecordAggregator:
+    """
+    Packs the rows which share a partition key into aggregated records of up to max_rows_per_record rows, which are
+    passed to the sender once full (or once the next row would take the record over the record size limit).
+    Where max_rows_per_record is 1, each row is sent as a single row (version 1) record.
+    Each row is json encoded only once, either when it is added or, using encode_row, before it is added.
+    If there is a failure ack sender, rows which failed in the processor (FailedRows) are passed to it, to be acked
+    directly, rather than being sent to Kinesis.
+    If there is an ack file assembler, the delivery result of each row is added to it, along with the diagnostics of
+    each FailedRow (which are held only until the row's result is returned). The results are returned in the order in
+    which the records are delivered, so the assembler puts the rows of the ack file back in row order.
+    """
+
+    def __init__(
+        self,
+        kinesis_sender: KinesisBatchSender,
+        file_details: dict,
+        max_rows_per_record: int = 1,
+        max_record_bytes: int = MAX_BYTES_PER_RECORD,
+        failure_ack_sender: Union[FailureAckSender, None] = None,
+        ack_file_assembler: Union[AckFileAssembler, None] = None,
+    ):
+        self.kinesis_sender = kinesis_sender
+        self.failure_ack_sender = failure_ack_sender
+        self.ack_file_assembler = ack_file_assembler
+        self._row_diagnostics: Dict[str, str] = {}
+        self.file_details = file_details
+        self.max_rows_per_record = max_rows_per_record
+        self.max_record_bytes = max_record_bytes
+        self._record_prefix = (
+            b'{"version": %d, "file": ' % AGGREGATED_RECORD_VERSION + encode_message_body(file_details) + b', "rows": ['
+        )
+        self._record_suffix = b"]}"
+        # Open records, keyed by partition key, as (list of encoded rows, list of row_ids, size in bytes)
+        self._open_records: Dict[str, Tuple[List[bytes], List[str], int]] = {}
+        self.kinesis_rows = 0
+        self.kinesis_records = 0
+
+    @property
+    def row_file_details(self) -> Union[dict, None]:
+        """Returns the file details to be passed to encode_row for the rows added to this aggregator"""
+        return self.file_details if self.max_rows_per_record == 1 else None
+
+    def add_row(self, row_id: str, details_from_processing: dict, partition_key: str) -> List[Tuple[str, bool]]:
+        """Adds the row to the open record for its partition key. Returns the results of any records sent."""
+        encoded_row = encode_row(row_id, details_from_processing, self.row_file_details)
+        return self.add_encoded_row(row_id, encoded_row, partition_key)
+
+    def add_encoded_row(self, row_id: str, encoded_row: bytes, partition_key: str) -> List[Tuple[str, bool]]:
+        """
+        Adds a row which has already been encoded by encode_row (with the row_file_details) to the open record for
+        its partition key. Returns the results of any records (or failure acks) sent.
+        """
+        if self.ack_file_assembler and encoded_row.__class__ is FailedRow:
+            self._row_diagnostics[row_id] = json.loads(encoded_row)["diagnostics"]
+        return self._add_to_ack_file(self._add_encoded_row(row_id, encoded_row, partition_key))
+
+    def _add_encoded_row(self, row_id: str, encoded_row: bytes, partition_key: str) -> List[Tuple[str, bool]]:
+        """Adds the encoded row to a record (or to the failure acks). Returns the results of any records sent."""
+        if self.failure_ack_sender and encoded_row.__class__ is FailedRow:
+            return self.failure_ack_sender.add_row(row_id, encoded_row)
+
+        self.kinesis_rows += 1
+        if self.max_rows_per_record == 1:
+            self.kinesis_records += 1
+            return self.kinesis_sender.put_record(encoded_row, partition_key, [row_id])
+
+        results = []
+        rows, row_ids, size = self._open_records.get(partition_key, ([], [], 0))
+        # Each row after the first adds a two byte separator to the record
+        if rows and self._record_size(size + len(encoded_row) + 2, partition_key) > self.max_record_bytes:
+            results = self._send_record(partition_key)
+            rows, row_ids, size = [], [], 0
+
+        rows.append(encoded_row)
+        row_ids.append(row_id)
+        size += len(encoded_row) + (2 if len(rows) > 1 else 0)
+        self._open_records[partition_key] = (rows, row_ids, size)
+
+        if len(rows) >= self.max_rows_per_record:
+            results.extend(self._send_record(partition_key))
+        return results
+
+    def flush(self) -> List[Tuple[str, bool]]:
+        """Sends all open records and flushes the senders. Returns the (row_id, delivered) results."""
+        results = []
+        for partition_key in list(self._open_records):
+            results.extend(self._send_record(partition_key))
+        results.extend(self.kinesis_sender.flush())
+        if self.failure_ack_sender:
+            results.extend(self.failure_ack_sender.flush())
+        return self._add_to_ack_file(results)
+
+    def routing_counts(self) -> dict:
+        """
+        Returns the number of rows and records passed to the Kinesis sender, and the number of failure acks sent
+        directly to the ack queue (and the number of SendMessageBatch requests used to send them)
+        """
+        return {
+            "kinesis_rows": self.kinesis_rows,
+            "kinesis_records": self.kinesis_records,
+            "direct_failure_acks": self.failure_ack_sender.messages_sent if self.failure_ack_sender else 0,
+            "direct_failure_ack_batches": self.failure_ack_sender.batches_sent if self.failure_ack_sender else 0,
+        }
+
+    def _add_to_ack_file(self, delivery_results: List[Tuple[str, bool]]) -> List[Tuple[str, bool]]:
+        """Adds the delivery result of each row to the ack file (if there is an ack file assembler)"""
+        if self.ack_file_assembler:
+            for row_id, delivered in delivery_results:
+                self.ack_file_assembler.add_row(row_id, delivered, self._row_diagnostics.pop(row_id, None), None)
+        return delivery_results
+
+    def _record_size(self, rows_size: int, partition_key: str) -> int:
+        """Returns the size of a record, including its partition key, with rows of the given total size"""
+        return len(self._record_prefix) + rows_size + len(self._record_suffix) + len(partition_key.encode("utf-8"))
+
+    def _send_record(self, partition_key: str) -> List[Tuple[str, bool]]:
+        """Passes the open record for the partition key to the sender"""
+        rows, row_ids, _ = self._open_records.pop(partition_key)
+        data = self._record_prefix + b", ".join(rows) + self._record_suffix
+        self.kinesis_records += 1
+        return self.kinesis_sender.put_record(data, partition_key, row_ids)
+
+
+def count_rows_not_delivered(delivery_results: list) -> int:
+    """
+    Logs each row which was not delivered (to Kinesis or, for rows acked directly, to the ack queue), and returns the
+    number of such rows
+    """
+    rows_not_delivered = 0
+    for row_id, delivered in delivery_results:
+        if not delivered:
+            logger.error("Row %s was not sent", row_id)
+            rows_not_delivered += 1
+    return rows_not_delivered
+
+
+def send_encoded_rows(
+    encoded_rows: Iterable[Tuple[str, str, bytes]],
+    record_aggregator: KinesisRecordAggregator,
+    partition_strategy: PartitionStrategy,
+    checkpoint_tracker: Union[CheckpointTracker, None] = None,
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> Tuple[int, int]:
+    """
+    Adds each encoded row to the record aggregator, with the partition key given by the partition strategy, and
+    passes the delivery results of any records sent as a result to the checkpoint tracker (if there is one).
+    Rows whose numbers are in skipped_row_numbers are not added (they are sent by another shard of the file, so are
+    not converted, see convert_rows), but are passed to the checkpoint tracker as having a result. Stops early if
+    shutdown has been requested.
+    Returns the number of rows added, and the number of rows which were not delivered by any records sent as a
+    result. The caller is responsible for the final flush.
+    """
+    row_count = 0
+    rows_not_delivered = 0
+    for row_id, local_id, encoded_row in encoded_rows:
+        if shutdown_requested.is_set():
+            break
+        row_number = get_row_number(row_id)
+        if skipped_row_numbers and row_number in skipped_row_numbers:
+            if checkpoint_tracker:
+                checkpoint_tracker.record_results([(row_id, True)])
+            continue
+        row_count += 1
+        if should_log_row(row_number):
+            logger.info("MESSAGE ID : %s", row_id)
+        partition_key = partition_strategy.get_partition_key(local_id, row_number)
+        delivery_results = record_aggregator.add_encoded_row(row_id, encoded_row, partition_key)
+        rows_not_delivered += count_rows_not_delivered(delivery_results)
+        if checkpoint_tracker and delivery_results:
+            checkpoint_tracker.record_results(delivery_results)
+    return row_count, rows_not_delivered
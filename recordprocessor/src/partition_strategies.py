@@ -0,0 +1,111 @@
+"""
+Strategies for choosing the partition key of each row sent to the processing data stream.
+
+Kinesis assigns each record to a shard by the MD5 hash of its partition key, and records on a shard are read in
+order. The supplier and local_id strategies send every row for a given local_id with the same partition key, so the
+operations for a local_id reach the forwarder in the order in which they appear in the file. This holds when records
+are retried, as each PutRecords request carries at most one record per partition key (see KinesisBatchSender), and
+across shard tasks and checkpoint resumes, as the partition key depends only on the local_id.
+The row_range strategy only gives this guarantee within limits (see RowRangePartitionStrategy).
+"""
+
+import os
+from hashlib import md5
+from collections import OrderedDict
+
+# Number of partition keys each file is spread across by the local_id strategy
+DEFAULT_PARTITION_BUCKETS = 64
+# Number of consecutive rows which share a partition key under the row_range strategy
+DEFAULT_ROWS_PER_PARTITION = 1000
+# Number of local_ids whose partition is remembered by the row_range strategy
+DEFAULT_MAX_TRACKED_LOCAL_IDS = 100000
+
+
+class PartitionStrategy:
+    """Base class for the partition strategies. A new instance is used for each file."""
+
+    def __init__(self, supplier: str):
+        self.supplier = supplier
+
+    def get_partition_key(self, local_id: str, row_number: int) -> str:
+        """Returns the partition key for the row of the file with the given local_id and (absolute) row number"""
+        raise NotImplementedError
+
+
+class SupplierPartitionStrategy(PartitionStrategy):
+    """Sends every row of the file with the supplier as the partition key, so the whole file is sent to one shard"""
+
+    def get_partition_key(self, local_id: str, row_number: int) -> str:
+        return self.supplier
+
+
+class LocalIdPartitionStrategy(PartitionStrategy):
+    """
+    Spreads the rows of the file across a fixed number of partition keys, by a stable hash of the local_id.
+    A fixed number of keys (rather than the local_id itself) is used so that rows can still be aggregated into
+    multi-row records.
+    """
+
+    def __init__(self, supplier: str, buckets: int = DEFAULT_PARTITION_BUCKETS):
+        super().__init__(supplier)
+        self.buckets = buckets
+
+    def get_partition_key(self, local_id: str, row_number: int) -> str:
+        bucket = int.from_bytes(md5(local_id.encode("utf-8")).digest()[:8], "big") % self.buckets
+        return f"{self.supplier}-{bucket}"
+
+
+class RowRangePartitionStrategy(PartitionStrategy):
+    """
+    Gives each range of rows_per_partition consecutive rows of the file (by absolute row number, so that the ranges
+    are the same for every shard task and after resuming from a checkpoint) its own partition key. A row whose
+    local_id is one of the max_tracked_local_ids most recently seen local_ids is sent with the partition key of the
+    earlier row of that local_id.
+    Unlike the other strategies, this only keeps the rows of a local_id in order while the local_id is still tracked,
+    which is not the case after it has been evicted, or for rows processed by a different shard task or after
+    resuming from a checkpoint.
+    """
+
+    def __init__(
+        self,
+        supplier: str,
+        rows_per_partition: int = DEFAULT_ROWS_PER_PARTITION,
+        max_tracked_local_ids: int = DEFAULT_MAX_TRACKED_LOCAL_IDS,
+    ):
+        super().__init__(supplier)
+        self.rows_per_partition = rows_per_partition
+        self.max_tracked_local_ids = max_tracked_local_ids
+        # The partition of each tracked local_id, in least to most recently seen order
+        self._local_id_partitions: "OrderedDict[str, int]" = OrderedDict()
+
+    def get_partition_key(self, local_id: str, row_number: int) -> str:
+        partition = self._local_id_partitions.get(local_id)
+        if partition is None:
+            partition = (row_number - 1) // self.rows_per_partition
+            self._local_id_partitions[local_id] = partition
+            if len(self._local_id_partitions) > self.max_tracked_local_ids:
+                self._local_id_partitions.popitem(last=False)
+        else:
+            self._local_id_partitions.move_to_end(local_id)
+        return f"{self.supplier}-{partition}"
+
+
+def get_partition_strategy(supplier: str) -> PartitionStrategy:
+    """
+    Returns the partition strategy given by KINESIS_PARTITION_STRATEGY, which may be "local_id" (the default, with
+    KINESIS_PARTITION_BUCKETS keys), "supplier" or "row_range" (with KINESIS_ROWS_PER_PARTITION rows per key,
+    remembering the partitions of up to KINESIS_ROW_RANGE_TRACKED_LOCAL_IDS local_ids).
+    The supplier strategy gives every row of the file the same key, so each PutRecords request carries one record.
+    """
+    strategy = os.getenv("KINESIS_PARTITION_STRATEGY", "local_id").lower()
+    if strategy == "supplier":
+        return SupplierPartitionStrategy(supplier)
+    if strategy == "row_range":
+        return RowRangePartitionStrategy(
+            supplier,
+            int(os.getenv("KINESIS_ROWS_PER_PARTITION", str(DEFAULT_ROWS_PER_PARTITION))),
+            int(os.getenv("KINESIS_ROW_RANGE_TRACKED_LOCAL_IDS", str(DEFAULT_MAX_TRACKED_LOCAL_IDS))),
+        )
+    return LocalIdPartitionStrategy(
+        supplier, int(os.getenv("KINESIS_PARTITION_BUCKETS", str(DEFAULT_PARTITION_BUCKETS)))
+    )
@@ -1,19 +1,62 @@
 """Function to process a single row of a csv file"""
 
+import os
 import logging
-from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource
+from convert_to_fhir_imms_resource import (
+    convert_to_fhir_imms_resource,
+    convert_to_identifier_only_imms_resource,
+    encode_fhir_imms_resource,
+)
 from constants import Diagnostics
 from mappings import Vaccine
+from row_logging import row_outcome_counters
 
 logger = logging.getLogger()
 
 
-def process_row(vaccine: Vaccine, allowed_operations: set, row: dict) -> dict:
+def get_fhir_json_encoding() -> str:
+    """
+    Returns how the fhir_json of each row is built, given by FHIR_JSON_ENCODING. Defaults to "direct", where the json
+    is written directly from the row values. "dict" builds the FHIR Immunization Resource as a dictionary, which is
+    then encoded with the rest of the message body.
+    """
+    return os.getenv("FHIR_JSON_ENCODING", "direct").lower()
+
+
+def get_delete_payload() -> str:
+    """
+    Returns the fhir_json sent for DELETE rows, given by DELETE_PAYLOAD. Defaults to "identifier", where the fhir_json
+    holds only the identifier, which is all the forwarder needs to find the imms id of the resource to delete. "full"
+    sends the full FHIR Immunization Resource, as for CREATE and UPDATE rows.
+    """
+    return os.getenv("DELETE_PAYLOAD", "identifier").lower()
+
+
+# The FHIR_JSON_ENCODING and DELETE_PAYLOAD are read once, rather than for every row
+DIRECT_FHIR_JSON_ENCODING = get_fhir_json_encoding() == "direct"
+FULL_DELETE_PAYLOAD = get_delete_payload() == "full"
+
+
+def process_row(
+    vaccine: Vaccine, allowed_operations: set, row: dict, columns_converted: bool = False, log_row: bool = True
+) -> dict:
     """
     Processes a row of the file and returns a dictionary containing the fhir_json, action_flag, imms_id, local_id
     (where applicable), version(where applicable) and any diagnostics.
     The local_id is combination of unique_id and unique_id_uri combined by "^"
+    The outcome is added to the row outcome counters.
+    columns_converted must be True if the row's columns have already been converted (see columnar_conversion).
+    log_row is whether the row's logs are emitted, apart from those for failures (see should_log_row).
     """
+    details_from_processing = _process_row(vaccine, allowed_operations, row, columns_converted, log_row)
+    row_outcome_counters.add(details_from_processing)
+    return details_from_processing
+
+
+def _process_row(
+    vaccine: Vaccine, allowed_operations: set, row: dict, columns_converted: bool = False, log_row: bool = True
+) -> dict:
+    """Processes a row of the file (see process_row). Rows which fail are always logged, other rows are sampled."""
     action_flag = row.get("ACTION_FLAG", "").upper()
     unique_id_uri = row.get("UNIQUE_ID_URI")
     unique_id = row.get("UNIQUE_ID")
@@ -29,8 +72,9 @@ def process_row(vaccine: Vaccine, allowed_operations: set, row: dict) -> dict:
         }
 
     operation_requested = action_flag.replace("NEW", "CREATE")
-    logger.info("OPERATION REQUESTED:  %s", operation_requested)
-    logger.info("OPERATION ALLOWED: %s", allowed_operations)
+    if log_row:
+        logger.info("OPERATION REQUESTED:  %s", operation_requested)
+        logger.info("OPERATION ALLOWED: %s", allowed_operations)
 
     # Handle no permissions
     if operation_requested not in allowed_operations:
@@ -50,9 +94,15 @@ def process_row(vaccine: Vaccine, allowed_operations: set, row: dict) -> dict:
             "local_id": local_id,
         }
 
-    # Handle success
+    # Handle success. DELETE rows are not converted in full unless the full payload is required (see DELETE_PAYLOAD)
+    if operation_requested == "DELETE" and not FULL_DELETE_PAYLOAD:
+        fhir_json = convert_to_identifier_only_imms_resource(unique_id, unique_id_uri)
+    elif DIRECT_FHIR_JSON_ENCODING:
+        fhir_json = encode_fhir_imms_resource(row, vaccine, columns_converted)
+    else:
+        fhir_json = convert_to_fhir_imms_resource(row, vaccine, columns_converted)
     return {
-        "fhir_json": convert_to_fhir_imms_resource(row, vaccine),
+        "fhir_json": fhir_json,
         "operation_requested": operation_requested,
         "local_id": local_id,
     }
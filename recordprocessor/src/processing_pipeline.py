@@ -0,0 +1,199 @@
+"""
+Asyncio pipeline which fetches, parses, converts, serializes and sends the rows of a csv file in separate stages,
+so that reading from S3 and sending to Kinesis overlap with the conversion of rows
+"""
+
+import os
+import asyncio
+import logging
+from io import StringIO
+from typing import List, Set, Tuple, Union
+from kinesis_record_aggregator import KinesisRecordAggregator, encode_row, send_encoded_rows
+from partition_strategies import PartitionStrategy
+from checkpoints import CheckpointTracker, shutdown_requested
+from columnar_conversion import convert_columns, get_columnar_conversion_rows
+from convert_rows import RowChunker
+from csv_row import CsvRow, read_csv_rows
+from mappings import Vaccine
+from process_row import process_row
+from row_logging import should_log_row
+from scan_csv_file import CsvFileScan
+from utils_for_recordprocessor import STREAM_CHUNK_SIZE
+
+logger = logging.getLogger()
+
+# Number of rows passed between the stages at a time
+PIPELINE_ROWS_PER_CHUNK = 100
+# Number of items which each queue between the stages may hold before the stage feeding it must wait
+PIPELINE_QUEUE_SIZE = 4
+
+
+def get_processing_pipeline() -> str:
+    """
+    Returns the method used to process the rows of a file. PROCESSING_PIPELINE may be set to "serial" to process
+    the rows one at a time in a single loop. Defaults to "async" (see run_processing_pipeline).
+    """
+    return "serial" if os.getenv("PROCESSING_PIPELINE", "async").lower() == "serial" else "async"
+
+
+async def run_processing_pipeline(
+    streaming_body,
+    file_scan: CsvFileScan,
+    file_id: str,
+    vaccine: Vaccine,
+    allowed_operations: set,
+    record_aggregator: KinesisRecordAggregator,
+    partition_strategy: PartitionStrategy,
+    rows_per_chunk: int = PIPELINE_ROWS_PER_CHUNK,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    start_row_index: int = 0,
+    end_row_index: Union[int, None] = None,
+    checkpoint_tracker: Union[CheckpointTracker, None] = None,
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> Tuple[int, int]:
+    """
+    Processes the rows of the file in five stages, each of which passes its output to the next through a bounded
+    queue: fetch (reads from S3), parse (cuts the bytes into chunks of whole rows and parses them), convert (runs
+    process_row), serialize (encodes each row) and send (adds the rows to the record aggregator).
+    The blocking S3 reads and Kinesis sends run in threads, so they overlap with the conversion of rows on the event
+    loop. If the send stage falls behind, the queues fill up and the fetch stage waits, so memory use is bounded.
+    If start_row_index is given, the streaming body must start at the offset of that row, and if end_row_index is
+    given only the rows before that row are processed (see RowChunker). Rows whose numbers are in skipped_row_numbers
+    are neither converted nor sent (see convert_rows).
+    If shutdown is requested, the fetch stage stops reading and the rows already read are passed through the stages.
+    Returns the number of rows processed, and the number of rows not delivered. The caller is responsible for the
+    final flush of the record aggregator.
+    """
+    byte_chunks: asyncio.Queue = asyncio.Queue(queue_size)
+    parsed_chunks: asyncio.Queue = asyncio.Queue(queue_size)
+    converted_chunks: asyncio.Queue = asyncio.Queue(queue_size)
+    encoded_chunks: asyncio.Queue = asyncio.Queue(queue_size)
+
+    stages = [
+        _fetch(streaming_body, byte_chunks),
+        _parse(byte_chunks, parsed_chunks, file_scan, rows_per_chunk, start_row_index, end_row_index),
+        _convert(parsed_chunks, converted_chunks, file_id, vaccine, allowed_operations, skipped_row_numbers),
+        _serialize(converted_chunks, encoded_chunks, record_aggregator.row_file_details),
+        _send(encoded_chunks, record_aggregator, partition_strategy, checkpoint_tracker, skipped_row_numbers),
+    ]
+    tasks = [asyncio.create_task(stage) for stage in stages]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the remaining stages, which would otherwise wait forever on the queues of the stage which failed
+        for task in tasks:
+            task.cancel()
+        raise
+    return results[-1]
+
+
+async def _fetch(streaming_body, output_queue: asyncio.Queue) -> None:
+    """Reads the streaming body in chunks, in a thread, and passes each chunk on until shutdown is requested"""
+    while not shutdown_requested.is_set() and (data := await asyncio.to_thread(streaming_body.read, STREAM_CHUNK_SIZE)):
+        await output_queue.put(data)
+    await output_queue.put(None)
+
+
+async def _parse(
+    input_queue: asyncio.Queue,
+    output_queue: asyncio.Queue,
+    file_scan: CsvFileScan,
+    rows_per_chunk: int,
+    start_row_index: int,
+    end_row_index: Union[int, None],
+) -> None:
+    """Cuts the bytes into chunks of whole rows, and passes on the index of the first row and the rows of each chunk"""
+    row_chunker = RowChunker(file_scan, rows_per_chunk, start_row_index, end_row_index)
+    while (data := await input_queue.get()) is not None:
+        for first_row_index, chunk in row_chunker.feed(data):
+            await output_queue.put((first_row_index, _parse_chunk(chunk, file_scan.headers)))
+    for first_row_index, chunk in row_chunker.finish():
+        await output_queue.put((first_row_index, _parse_chunk(chunk, file_scan.headers)))
+    await output_queue.put(None)
+
+
+def _parse_chunk(chunk: bytes, fieldnames: list) -> List[Union[dict, CsvRow]]:
+    """Returns the rows of the chunk (see read_csv_rows)"""
+    return list(read_csv_rows(StringIO(chunk.decode("utf-8")), fieldnames=fieldnames))
+
+
+async def _convert(
+    input_queue: asyncio.Queue,
+    output_queue: asyncio.Queue,
+    file_id: str,
+    vaccine: Vaccine,
+    allowed_operations: set,
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> None:
+    """
+    Processes each row, and passes on the row_id and details from processing for each row of the chunk. If
+    COLUMNAR_CONVERSION_ROWS is set, the columns of each chunk are converted before its rows are processed (see
+    columnar_conversion). Rows whose numbers are in skipped_row_numbers are not processed, and are passed on with no
+    details.
+    """
+    columns_converted = bool(get_columnar_conversion_rows())
+    while (item := await input_queue.get()) is not None:
+        first_row_index, rows = item
+        if columns_converted:
+            convert_columns(rows)
+        await output_queue.put(
+            [
+                (
+                    f"{file_id}^{row_number}",
+                    (
+                        None
+                        if skipped_row_numbers and row_number in skipped_row_numbers
+                        else process_row(
+                            vaccine, allowed_operations, row, columns_converted, should_log_row(row_number)
+                        )
+                    ),
+                )
+                for row_number, row in enumerate(rows, start=first_row_index + 1)
+            ]
+        )
+    await output_queue.put(None)
+
+
+async def _serialize(
+    input_queue: asyncio.Queue, output_queue: asyncio.Queue, row_file_details: Union[dict, None]
+) -> None:
+    """Encodes each row, and passes on the row_id, local_id and encoded row for each row of the chunk"""
+    while (converted_rows := await input_queue.get()) is not None:
+        await output_queue.put(
+            [
+                (
+                    (row_id, details["local_id"], encode_row(row_id, details, row_file_details))
+                    if details
+                    else (row_id, None, None)
+                )
+                for row_id, details in converted_rows
+            ]
+        )
+    await output_queue.put(None)
+
+
+async def _send(
+    input_queue: asyncio.Queue,
+    record_aggregator: KinesisRecordAggregator,
+    partition_strategy: PartitionStrategy,
+    checkpoint_tracker: Union[CheckpointTracker, None],
+    skipped_row_numbers: Union[Set[int], None] = None,
+) -> Tuple[int, int]:
+    """
+    Adds the rows of each chunk to the record aggregator, in a thread, as the aggregator may send records to Kinesis.
+    Returns the number of rows processed, and the number of rows not delivered.
+    """
+    row_count = 0
+    rows_not_delivered = 0
+    while (encoded_rows := await input_queue.get()) is not None:
+        chunk_row_count, chunk_rows_not_delivered = await asyncio.to_thread(
+            send_encoded_rows,
+            encoded_rows,
+            record_aggregator,
+            partition_strategy,
+            checkpoint_tracker,
+            skipped_row_numbers,
+        )
+        row_count += chunk_row_count
+        rows_not_delivered += chunk_rows_not_delivered
+    return row_count, rows_not_delivered
@@ -0,0 +1,119 @@
+"""
+Sampling of the logs emitted for each row, and counters of the outcome of each row, which are logged as a single
+structured summary for each file
+"""
+
+import os
+import json
+import signal
+import logging
+from collections import Counter
+from typing import Union
+
+logger = logging.getLogger()
+
+
+def get_row_log_sample_rate() -> int:
+    """
+    Returns N, where the per-row logs are emitted for every Nth row (errors are always logged), given by
+    ROW_LOG_SAMPLE_RATE. Defaults to 1, which logs every row.
+    """
+    return max(1, int(os.getenv("ROW_LOG_SAMPLE_RATE", "1")))
+
+
+class RowLogSettings:
+    """
+    The settings used by should_log_row. log_every_row can be switched at runtime (see toggle_log_every_row)
+    to log every row regardless of the sample rate.
+    """
+
+    def __init__(self, sample_rate: int = 1):
+        self.sample_rate = sample_rate
+        self.log_every_row = False
+
+
+row_log_settings = RowLogSettings(get_row_log_sample_rate())
+
+
+def should_log_row(row_number: int) -> bool:
+    """
+    Returns whether the logs for the row should be emitted. The decision depends only on the row number, so every
+    logging site (in any process) logs the same rows: the first row, and every Nth row after it.
+    """
+    return row_log_settings.log_every_row or (row_number - 1) % row_log_settings.sample_rate == 0
+
+
+def toggle_log_every_row(_signal_number=None, _frame=None) -> None:
+    """
+    Signal handler which switches between logging every row and sampling the per-row logs. Only affects the process
+    which receives the signal (the worker processes used for parallel conversion keep their settings).
+    """
+    row_log_settings.log_every_row = not row_log_settings.log_every_row
+    logger.warning("Per-row logging switched to %s", "every row" if row_log_settings.log_every_row else "sampled")
+
+
+def register_row_log_toggle_handler() -> None:
+    """Registers toggle_log_every_row as the SIGUSR1 handler"""
+    signal.signal(signal.SIGUSR1, toggle_log_every_row)
+
+
+class RowOutcomeCounters:
+    """Counts the rows processed by the operation requested, and by diagnostic for the rows which have one"""
+
+    def __init__(self):
+        self.operations: Counter = Counter()
+        self.diagnostics: Counter = Counter()
+
+    def add(self, details_from_processing: dict) -> None:
+        """Counts the outcome of processing a row"""
+        self.operations[details_from_processing.get("operation_requested")] += 1
+        if diagnostics := details_from_processing.get("diagnostics"):
+            self.diagnostics[diagnostics] += 1
+
+    def update(self, counts: dict) -> None:
+        """Adds the counts (as returned by as_dict) from another process"""
+        self.operations.update(counts["operations"])
+        self.diagnostics.update(counts["diagnostics"])
+
+    def clear(self) -> None:
+        """Resets the counters"""
+        self.operations.clear()
+        self.diagnostics.clear()
+
+    def as_dict(self) -> dict:
+        """Returns the counts as a dictionary"""
+        return {"operations": dict(self.operations), "diagnostics": dict(self.diagnostics)}
+
+
+row_outcome_counters = RowOutcomeCounters()
+
+
+def start_file_logging() -> None:
+    """Resets the counters and reads the sample rate from the environment, before the rows of a file are processed"""
+    row_log_settings.sample_rate = get_row_log_sample_rate()
+    row_outcome_counters.clear()
+
+
+def log_file_summary(
+    file_key: str,
+    message_id: str,
+    row_count: int,
+    rows_not_delivered: int,
+    shard: Union[dict, None] = None,
+    routing_counts: Union[dict, None] = None,
+) -> None:
+    """
+    Logs a single structured summary of the outcome of processing the rows of the file (or shard), including the
+    routing counts (see KinesisRecordAggregator.routing_counts), if given
+    """
+    summary = {
+        "file_key": file_key,
+        "message_id": message_id,
+        "shard_index": shard["shard_index"] if shard else None,
+        "rows_processed": row_count,
+        "rows_sent": row_count - rows_not_delivered,
+        "rows_not_sent": rows_not_delivered,
+        **row_outcome_counters.as_dict(),
+        **({"routing": routing_counts} if routing_counts is not None else {}),
+    }
+    logger.info("File processing summary: %s", json.dumps(summary))
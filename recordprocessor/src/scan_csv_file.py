@@ -0,0 +1,121 @@
+"""Functions for scanning a csv file in a single pass before its rows are processed"""
+
+import logging
+from array import array
+from csv import reader
+from dataclasses import dataclass
+from typing import Iterator, Union
+from s3_clients import s3_client
+from utils_for_recordprocessor import get_file_streaming_body, stream_byte_lines, stream_lines
+
+logger = logging.getLogger()
+
+
+@dataclass
+class CsvFileScan:
+    """
+    The details of a csv file (or of a shard of its rows) which are needed before its rows can be processed.
+    row_offsets holds the byte offset at which each scanned data row starts (in file order), the first of which is the
+    row at first_row_index within the file, and size is the offset of the end of the scanned rows (the total number of
+    bytes in the file, for a scan of the whole file).
+    """
+
+    headers: list
+    action_flags: set
+    row_offsets: array
+    size: int
+    first_row_index: int = 0
+
+    @property
+    def row_count(self) -> int:
+        """
+        Returns the index within the file of the row after the last scanned row (the number of data rows in the file,
+        excluding the header row and any blank lines, for a scan of the whole file)
+        """
+        return self.first_row_index + len(self.row_offsets)
+
+    def row_offset(self, row_index: int) -> int:
+        """Returns the byte offset of the row at the index within the file (size, for the row after the last row)"""
+        return self.row_offsets[row_index - self.first_row_index] if row_index < self.row_count else self.size
+
+
+def scan_csv(
+    streaming_body, headers: Union[list, None] = None, start_byte: int = 0, first_row_index: int = 0
+) -> CsvFileScan:
+    """
+    Reads the streaming body once, returning the headers, the set of upper-cased ACTION_FLAG values, and the byte
+    offset of each data row. Blank lines are skipped, in the same way as they are by csv.DictReader.
+    If headers are given, the streaming body must hold only data rows, the first of which is the row at
+    first_row_index, starting at start_byte within the file (e.g. a shard of the file).
+    Only one chunk of the stream is held in memory at a time.
+    """
+    bytes_read = start_byte
+
+    def decoded_lines() -> Iterator[str]:
+        nonlocal bytes_read
+        for line in stream_byte_lines(streaming_body):
+            bytes_read += len(line)
+            yield line.decode("utf-8")
+
+    # The csv reader only pulls as many lines as are needed to complete each row, so the number of bytes read
+    # before each call to next gives the offset of the start of that row
+    csv_reader = reader(decoded_lines(), delimiter="|")
+    if headers is None:
+        headers = next(csv_reader, [])
+    action_flag_index = headers.index("ACTION_FLAG") if "ACTION_FLAG" in headers else None
+
+    action_flags = set()
+    row_offsets = array("Q")
+    while True:
+        row_offset = bytes_read
+        if (row := next(csv_reader, None)) is None:
+            break
+        if not row:
+            continue
+        row_offsets.append(row_offset)
+        if action_flag_index is not None and action_flag_index < len(row):
+            action_flags.add(row[action_flag_index].upper())
+
+    return CsvFileScan(
+        headers=headers,
+        action_flags=action_flags,
+        row_offsets=row_offsets,
+        size=bytes_read,
+        first_row_index=first_row_index,
+    )
+
+
+def scan_csv_file(bucket_name: str, file_key: str) -> CsvFileScan:
+    """Streams the file from the S3 bucket and returns the results of scanning it"""
+    response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+    file_scan = scan_csv(response["Body"])
+    logger.info("Scanned %s: %s rows, action flags %s", file_key, file_scan.row_count, file_scan.action_flags)
+    return file_scan
+
+
+def scan_csv_file_shard(bucket_name: str, file_key: str, shard: dict) -> CsvFileScan:
+    """
+    Streams only the header row and the byte range of the shard (as planned by filenameprocessor) from the S3 bucket,
+    and returns the results of scanning the rows of the shard. The action flags are those of the whole file, which
+    were found when the shard was planned.
+    """
+    header_body = get_file_streaming_body(bucket_name, file_key, 0, shard["start_byte"])
+    headers = next(reader(stream_lines(header_body), delimiter="|"), [])
+    header_body.close()
+
+    file_scan = scan_csv(
+        get_file_streaming_body(bucket_name, file_key, shard["start_byte"], shard["end_byte"]),
+        headers,
+        shard["start_byte"],
+        shard["first_row_number"] - 1,
+    )
+    file_scan.action_flags = set(shard["action_flags"])
+    logger.info(
+        "Scanned shard %s of %s of %s: rows %s to %s",
+        shard["shard_index"] + 1,
+        shard["shard_count"],
+        file_key,
+        file_scan.first_row_index + 1,
+        file_scan.row_count,
+    )
+    return file_scan
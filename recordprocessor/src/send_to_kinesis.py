@@ -1,23 +1,180 @@
-"""Function to send the message to kinesis"""
+"""Functions and classes for sending messages to kinesis"""
 
 import os
+import time
+import random
 import logging
+from typing import List, Sequence, Tuple, Union
 import simplejson as json
 from botocore.exceptions import ClientError
 from s3_clients import kinesis_client
 
 logger = logging.getLogger()
 
+# Kinesis PutRecords limits. Record sizes include both the data and the partition key.
+MAX_RECORDS_PER_PUT = 500
+MAX_BYTES_PER_PUT = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
 
-def send_to_kinesis(supplier: str, message_body: dict) -> bool:
-    """Send a message to the specified Kinesis stream. Returns a boolean indicating whether the send was successful."""
-    try:
-        stream_name = f"{os.getenv('SHORT_QUEUE_PREFIX', 'imms-batch-internal-dev')}-processingdata-stream"
-        data = json.dumps(message_body, ensure_ascii=False)
-        stream_arn = os.getenv("KINESIS_STREAM_ARN")
-        resp = kinesis_client.put_record(StreamName=stream_name, StreamARN=stream_arn, Data=data, PartitionKey=supplier)
-        logger.info("Message sent to Kinesis stream: %s for supplier: %s with resp: %s", stream_name, supplier, resp)
-        return True
-    except ClientError as error:
-        logger.error("Error sending message to Kinesis: %s", error)
-        return False
+
+def get_kinesis_stream_name() -> str:
+    """Returns the name of the processing data stream"""
+    return f"{os.getenv('SHORT_QUEUE_PREFIX', 'imms-batch-internal-dev')}-processingdata-stream"
+
+
+def encode_message_body(message_body: dict) -> bytes:
+    """Returns the message body as utf-8 encoded json (simplejson is used so that Decimals are encoded as numbers)"""
+    return json.dumps(message_body, ensure_ascii=False).encode("utf-8")
+
+
+class KinesisBatchSender:
+    """
+    Buffers records and sends them to the Kinesis stream using PutRecords. A request is sent whenever the buffer holds
+    as many records or bytes as a PutRecords request can carry, or once the oldest buffered record has waited for
+    max_buffer_seconds (checked each time a record is added).
+    Entries which Kinesis fails to write are retried, with jittered exponential backoff, up to max_attempts times.
+    Each request carries at most one record for each partition key. Later records with the same partition key stay in
+    the buffer for a later request, so that a record which fails is retried before the next record with its partition
+    key is sent, and the records of each partition key are written to the stream in the order in which they were added.
+    A record may carry more than one row. Each request returns a list of (row_id, delivered) tuples for every row of
+    every record sent, in the order in which the records were added.
+    """
+
+    def __init__(
+        self,
+        stream_name: str,
+        stream_arn: Union[str, None] = None,
+        max_records: int = MAX_RECORDS_PER_PUT,
+        max_bytes: int = MAX_BYTES_PER_PUT,
+        max_buffer_seconds: Union[float, None] = None,
+        max_attempts: int = 5,
+        base_backoff_seconds: float = 0.1,
+        max_backoff_seconds: float = 5.0,
+    ):
+        self.stream_name = stream_name
+        self.stream_arn = stream_arn
+        self.max_records = min(max_records, MAX_RECORDS_PER_PUT)
+        self.max_bytes = min(max_bytes, MAX_BYTES_PER_PUT)
+        self.max_buffer_seconds = (
+            max_buffer_seconds
+            if max_buffer_seconds is not None
+            else float(os.getenv("KINESIS_MAX_BUFFER_SECONDS", "1"))
+        )
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        # Buffered records, in the order in which they were added, as (record, row_ids, record size in bytes)
+        self._buffer: List[Tuple[dict, Sequence[str], int]] = []
+        self._buffered_bytes = 0
+        self._buffer_started_at = None
+
+    def put_record(self, data: bytes, partition_key: str, row_ids: Sequence[str]) -> List[Tuple[str, bool]]:
+        """
+        Adds the record to the buffer, then sends requests until the buffer no longer holds a full request's worth of
+        records or bytes, or flushes the buffer if max_buffer_seconds has passed.
+        Returns the results of any requests which were sent (an empty list if nothing was sent).
+        """
+        record_size = len(data) + len(partition_key.encode("utf-8"))
+        if record_size > MAX_BYTES_PER_RECORD:
+            logger.error(
+                "Rows %s not sent to Kinesis as the record size of %s bytes is too large", row_ids, record_size
+            )
+            return [(row_id, False) for row_id in row_ids]
+
+        if not self._buffer:
+            self._buffer_started_at = time.monotonic()
+        self._buffer.append(({"Data": data, "PartitionKey": partition_key}, row_ids, record_size))
+        self._buffered_bytes += record_size
+
+        if time.monotonic() - self._buffer_started_at >= self.max_buffer_seconds:
+            return self.flush()
+        results = []
+        while len(self._buffer) >= self.max_records or self._buffered_bytes >= self.max_bytes:
+            results.extend(self._send_request())
+        return results
+
+    def flush(self) -> List[Tuple[str, bool]]:
+        """Sends all buffered records, retrying any failed entries. Returns the (row_id, delivered) results."""
+        results = []
+        while self._buffer:
+            results.extend(self._send_request())
+        return results
+
+    def _take_request(self) -> List[Tuple[dict, Sequence[str], int]]:
+        """
+        Removes the records of the next request from the buffer and returns them. The request takes the earliest
+        buffered record of each partition key, up to the PutRecords record and byte limits. Once the record of a
+        partition key has been left out, the later records of that partition key are left out too.
+        """
+        request, remaining = [], []
+        partition_keys = set()
+        request_bytes = 0
+        for entry in self._buffer:
+            record, _, record_size = entry
+            if (
+                len(request) < self.max_records
+                and record["PartitionKey"] not in partition_keys
+                and (not request or request_bytes + record_size <= self.max_bytes)
+            ):
+                request.append(entry)
+                request_bytes += record_size
+            else:
+                remaining.append(entry)
+            partition_keys.add(record["PartitionKey"])
+
+        self._buffer = remaining
+        self._buffered_bytes -= request_bytes
+        if not remaining:
+            self._buffer_started_at = None
+        return request
+
+    def _send_request(self) -> List[Tuple[str, bool]]:
+        """Sends the next request, retrying any failed entries. Returns the (row_id, delivered) results."""
+        request = self._take_request()
+        records = [record for record, _, _ in request]
+
+        delivered = [False] * len(records)
+        pending = list(range(len(records)))
+        error_codes = set()
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self._backoff(attempt)
+            try:
+                response = kinesis_client.put_records(
+                    StreamName=self.stream_name,
+                    **({"StreamARN": self.stream_arn} if self.stream_arn else {}),
+                    Records=[records[index] for index in pending],
+                )
+            except ClientError as error:
+                # botocore has already retried any throttling of the request itself, so this is not retried again
+                logger.error("Error sending records to Kinesis: %s", error)
+                break
+
+            failed = []
+            for index, record_result in zip(pending, response["Records"]):
+                if "ErrorCode" in record_result:
+                    failed.append(index)
+                    error_codes.add(record_result["ErrorCode"])
+                else:
+                    delivered[index] = True
+            pending = failed
+            if not pending:
+                break
+            logger.warning(
+                "%s of %s records failed to be written to Kinesis on attempt %s", len(failed), len(records), attempt + 1
+            )
+
+        if pending:
+            logger.error("%s records were not sent to Kinesis. Error codes: %s", len(pending), error_codes)
+        logger.info(
+            "%s of %s records sent to Kinesis stream %s", len(records) - len(pending), len(records), self.stream_name
+        )
+        return [
+            (row_id, record_delivered)
+            for (_, record_row_ids, _), record_delivered in zip(request, delivered)
+            for row_id in record_row_ids
+        ]
+
+    def _backoff(self, attempt: int) -> None:
+        """Sleeps for a random time of up to base_backoff_seconds * 2 ** attempt (capped at max_backoff_seconds)"""
+        time.sleep(random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * 2**attempt)))
@@ -1,14 +1,16 @@
-"""Functions for adding a row of data to the ack file"""
+"""Functions and classes for adding rows of data to the ack file"""
 
 import logging
-from io import StringIO, BytesIO
 import os
-from typing import Union
+from typing import List, Union
 from s3_clients import s3_client
 from utils_for_recordprocessor import get_environment
 
 logger = logging.getLogger()
 
+# The minimum size of all but the last part of an S3 multipart upload
+MIN_PART_BYTES = 5 * 1024 * 1024
+
 
 def create_ack_data(
     created_at_formatted_string: str,
@@ -38,30 +40,145 @@ def create_ack_data(
     }
 
 
-def add_row_to_ack_file(ack_data: dict, accumulated_ack_file_content: StringIO, file_key: str) -> StringIO:
-    """Adds the data row to the uploaded ack file"""
+def get_row_ack_file_enabled() -> bool:
+    """
+    Returns whether the processor writes the ack file of the rows of each file (see AckFileWriter), given by
+    WRITE_ROW_ACK_FILE. Defaults to false, as the rows are acked by the consumer of the ack queue.
+    """
+    return os.getenv("WRITE_ROW_ACK_FILE", "false").lower() == "true"
+
+
+def get_ack_part_bytes() -> int:
+    """
+    Returns the number of bytes of ack rows to buffer before uploading them as a part of the ack file, given by
+    ACK_PART_BYTES. Defaults to 8MiB, and is never less than 5MiB, the minimum size of all but the last part of an S3
+    multipart upload.
+    """
+    return max(MIN_PART_BYTES, int(os.getenv("ACK_PART_BYTES", str(8 * 1024 * 1024))))
+
+
+def format_ack_row(ack_data: dict) -> str:
+    """Returns the line of the ack file for the ack data, as a pipe-delimited row ending with a newline"""
     data_row_str = [str(item) for item in ack_data.values()]
     cleaned_row = "|".join(data_row_str).replace(" |", "|").replace("| ", "|").strip()
-    accumulated_ack_file_content.write(cleaned_row + "\n")
-    csv_file_like_object = BytesIO(accumulated_ack_file_content.getvalue().encode("utf-8"))
-    ack_bucket_name = os.getenv("ACK_BUCKET_NAME", f"immunisation-batch-{get_environment()}-data-destinations")
-    ack_filename = f"processedFile/{file_key.replace('.csv', '_response.csv')}"
-    s3_client.upload_fileobj(csv_file_like_object, ack_bucket_name, ack_filename)
-    return accumulated_ack_file_content
-
-
-def update_ack_file(
-    file_key: str,
-    bucket_name: str,
-    accumulated_ack_file_content: StringIO,
-    row_id: str,
-    message_delivered: bool,
-    diagnostics: Union[None, str],
-    imms_id: Union[None, str],
-) -> StringIO:
-    """Updates the ack file with the new data row based on the given arguments"""
-    response = s3_client.head_object(Bucket=bucket_name, Key=file_key)
-    created_at_formatted_string = response["LastModified"].strftime("%Y%m%dT%H%M%S00")
-    ack_data_row = create_ack_data(created_at_formatted_string, row_id, message_delivered, diagnostics, imms_id)
-    accumulated_ack_file_content = add_row_to_ack_file(ack_data_row, accumulated_ack_file_content, file_key)
-    return accumulated_ack_file_content
+    return cleaned_row + "\n"
+
+
+def get_ack_filename(file_key: str) -> str:
+    """Returns the key of the ack file for the source file"""
+    return f"processedFile/{file_key.replace('.csv', '_response.csv')}"
+
+
+class AckFileWriter:
+    """
+    Writes the ack file for a source file, one row at a time. The rows are buffered, and uploaded as the parts of an
+    S3 multipart upload of the ack file each time part_bytes of rows have been buffered. The ack file is complete once
+    close is called, which uploads the remaining rows as the last part (or, if the whole file is smaller than a part,
+    uploads it with a single PutObject). No ack file is uploaded if no rows are added.
+    The created_at_formatted_string (the LastModified time of the source file) is read only once for each file.
+    initial_content (e.g. the header row) is written before the first row.
+    """
+
+    def __init__(
+        self,
+        file_key: str,
+        bucket_name: str,
+        initial_content: str = "",
+        part_bytes: Union[int, None] = None,
+        ack_bucket_name: Union[str, None] = None,
+    ):
+        self.file_key = file_key
+        self.bucket_name = bucket_name
+        self.part_bytes = max(MIN_PART_BYTES, part_bytes) if part_bytes is not None else get_ack_part_bytes()
+        self.ack_bucket_name = ack_bucket_name or os.getenv(
+            "ACK_BUCKET_NAME", f"immunisation-batch-{get_environment()}-data-destinations"
+        )
+        self.ack_filename = get_ack_filename(file_key)
+        self.rows_written = False
+        self._created_at_formatted_string = None
+        self._buffer: List[bytes] = [initial_content.encode("utf-8")] if initial_content else []
+        self._buffered_bytes = len(self._buffer[0]) if self._buffer else 0
+        self._upload_id = None
+        self._parts: List[dict] = []
+
+    @property
+    def created_at_formatted_string(self) -> str:
+        """Returns the LastModified time of the source file, formatted as the RECEIVED_TIME of the ack rows"""
+        if self._created_at_formatted_string is None:
+            response = s3_client.head_object(Bucket=self.bucket_name, Key=self.file_key)
+            self._created_at_formatted_string = response["LastModified"].strftime("%Y%m%dT%H%M%S00")
+        return self._created_at_formatted_string
+
+    def add_row(
+        self, row_id: str, message_delivered: bool, diagnostics: Union[None, str], imms_id: Union[None, str]
+    ) -> None:
+        """Adds the data row, based on the given arguments, to the ack file"""
+        ack_data_row = create_ack_data(
+            self.created_at_formatted_string, row_id, message_delivered, diagnostics, imms_id
+        )
+        self.write(format_ack_row(ack_data_row))
+
+    def write(self, content: str) -> None:
+        """Adds content holding one or more complete, formatted rows (see format_ack_row) to the ack file"""
+        encoded_content = content.encode("utf-8")
+        self._buffer.append(encoded_content)
+        self._buffered_bytes += len(encoded_content)
+        self.rows_written = True
+        if self._buffered_bytes >= self.part_bytes:
+            self._upload_part()
+
+    def close(self) -> None:
+        """Uploads the remaining rows and completes the ack file"""
+        if not self.rows_written:
+            return
+        try:
+            if self._upload_id is None:
+                s3_client.put_object(Bucket=self.ack_bucket_name, Key=self.ack_filename, Body=self._take_buffer())
+                return
+            if self._buffered_bytes:
+                self._upload_part()
+            s3_client.complete_multipart_upload(
+                Bucket=self.ack_bucket_name,
+                Key=self.ack_filename,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        except Exception:
+            self.abort()
+            raise
+        logger.info("Ack file %s uploaded in %s parts", self.ack_filename, len(self._parts))
+
+    def abort(self) -> None:
+        """Abandons the ack file, aborting the multipart upload (if one was started) so that its parts are deleted"""
+        if self._upload_id is not None:
+            s3_client.abort_multipart_upload(
+                Bucket=self.ack_bucket_name, Key=self.ack_filename, UploadId=self._upload_id
+            )
+            self._upload_id = None
+        self._buffer, self._buffered_bytes = [], 0
+
+    def _take_buffer(self) -> bytes:
+        """Returns the buffered bytes, emptying the buffer"""
+        data = b"".join(self._buffer)
+        self._buffer, self._buffered_bytes = [], 0
+        return data
+
+    def _upload_part(self) -> None:
+        """Uploads the buffered rows as the next part of the multipart upload, starting the upload if needed"""
+        try:
+            if self._upload_id is None:
+                self._upload_id = s3_client.create_multipart_upload(Bucket=self.ack_bucket_name, Key=self.ack_filename)[
+                    "UploadId"
+                ]
+            part_number = len(self._parts) + 1
+            response = s3_client.upload_part(
+                Bucket=self.ack_bucket_name,
+                Key=self.ack_filename,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=self._take_buffer(),
+            )
+        except Exception:
+            self.abort()
+            raise
+        self._parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
@@ -1,18 +1,90 @@
 """Utils for the batch decorators"""
 
+import os
 import re
 
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
+from functools import lru_cache
 from constants import Urls
 
+# Maximum number of distinct elements held by each of the Flyweight caches
+FLYWEIGHT_CACHE_SIZE = 1024
+
+# "YYYYMMDDThhmmss", optionally followed by a timezone of "00" (UTC) or "01" (BST)
+DATE_TIME_PATTERN = re.compile(r"\d{8}T\d{6}(0[01])?")
+DATE_PATTERN = re.compile(r"\d{8}")
+DECIMAL_PATTERN = re.compile(r"[0-9]+\.[0-9]*|\.[0-9]+")
+
+DATE_TIME_FORMATS = {
+    None: ("%Y%m%dT%H%M%S", "%Y-%m-%dT%H:%M:%S+00:00"),
+    "00": ("%Y%m%dT%H%M%S00", "%Y-%m-%dT%H:%M:%S+00:00"),
+    "01": ("%Y%m%dT%H%M%S01", "%Y-%m-%dT%H:%M:%S+01:00"),
+}
+GENDER_CODE_TO_FHIR = {"1": "male", "2": "female", "9": "other", "0": "unknown"}
+BOOLEAN_STRINGS = {"true": True, "false": False}
+
+
+def get_date_conversion_cache_size() -> int:
+    """
+    Returns the maximum number of distinct values held by each of the date conversion caches, given by
+    DATE_CONVERSION_CACHE_SIZE. The least recently used value is evicted once the cache is full. Defaults to 4096.
+    A size of 0 disables the caches, so that every value is converted.
+    """
+    return max(0, int(os.getenv("DATE_CONVERSION_CACHE_SIZE", "4096")))
+
+
+def _cache_statistics(cached_functions: dict) -> dict:
+    """Returns the hits, misses, size and hit rate of the cache of each of the lru_cache decorated functions"""
+    statistics = {}
+    for name, cached_function in cached_functions.items():
+        cache_info = cached_function.cache_info()
+        lookups = cache_info.hits + cache_info.misses
+        statistics[name] = {
+            "hits": cache_info.hits,
+            "misses": cache_info.misses,
+            "size": cache_info.currsize,
+            "hit_rate": round(cache_info.hits / lookups, 4) if lookups else None,
+        }
+    return statistics
+
+
+@lru_cache(maxsize=get_date_conversion_cache_size())
+def _convert_date_time_string(date_time: str) -> str:
+    """Converts the date_time string (see Convert.date_time). Results are cached as files repeat the same values."""
+    if not (match := DATE_TIME_PATTERN.fullmatch(date_time)):
+        return date_time
+
+    input_format, output_format = DATE_TIME_FORMATS[match.group(1)]
+    try:
+        return datetime.strptime(date_time, input_format).strftime(output_format)
+    except ValueError:
+        return date_time
+
+
+@lru_cache(maxsize=get_date_conversion_cache_size())
+def _convert_date_string(date: str) -> str:
+    """Converts the date string (see Convert.date). Results are cached as files repeat the same values."""
+    # Date cannot be converted if it is not a string of eight digits
+    if not DATE_PATTERN.fullmatch(date):
+        return date
+
+    try:
+        return datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return date
+
 
 def _is_not_empty(value: any) -> bool:
     """
     Determine if a value is not empty i.e. there is data present. Note that some "Falsey" values, such as zero
     values and a boolean of false, are valid data and are therefore classed here as non-empty
     """
-    return value not in [None, "", [], {}, (), [""]]
+    if value is None or value == "":
+        return False
+    if isinstance(value, (list, dict, tuple)):
+        return len(value) > 0 and value != [""]
+    return True
 
 
 class Convert:
@@ -32,24 +104,7 @@ class Convert:
         if not isinstance(date_time, str):
             return date_time
 
-        is_date_time_without_timezone = re.compile(r"\d{8}T\d{6}").fullmatch(date_time)
-        is_date_time_utc = re.compile(r"\d{8}T\d{6}00").fullmatch(date_time)
-        is_date_time_bst = re.compile(r"\d{8}T\d{6}01").fullmatch(date_time)
-
-        if not (is_date_time_without_timezone or is_date_time_utc or is_date_time_bst):
-            return date_time
-
-        try:
-            if is_date_time_utc:
-                return datetime.strptime(date_time, "%Y%m%dT%H%M%S00").strftime("%Y-%m-%dT%H:%M:%S+00:00")
-
-            if is_date_time_bst:
-                return datetime.strptime(date_time, "%Y%m%dT%H%M%S01").strftime("%Y-%m-%dT%H:%M:%S+01:00")
-
-            if is_date_time_without_timezone:
-                return datetime.strptime(date_time, "%Y%m%dT%H%M%S").strftime("%Y-%m-%dT%H:%M:%S+00:00")
-        except ValueError:
-            return date_time
+        return _convert_date_time_string(date_time)
 
     @staticmethod
     def date(date: str) -> str:
@@ -57,20 +112,15 @@ class Convert:
         Converts value to a FHIR-formatted date if the value is a string represenation of a date
         in the specified format of "YYYYMMDD". Otherwise returns the original value.
         """
-        # Date cannot be converted if it is not a string of eight digits
-        if not isinstance(date, str) or not re.compile(r"\d{8}").fullmatch(date):
+        if not isinstance(date, str):
             return date
 
-        try:
-            return datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
-        except ValueError:
-            return date
+        return _convert_date_string(date)
 
     @staticmethod
     def gender_code(code: any) -> any:
         """Converts gender code to fhir gender if the code is recognised. Otherwise returns the original code."""
-        code_to_fhir = {"1": "male", "2": "female", "9": "other", "0": "unknown"}
-        return code_to_fhir.get(code, code)
+        return GENDER_CODE_TO_FHIR.get(code, code)
 
     @staticmethod
     def boolean(value: any) -> any:
@@ -78,8 +128,9 @@ class Convert:
         Converts value to a Python boolean if the value is a string representation of a boolean.
         Otherwise returns the original value.
         """
-        lower_value = value.lower() if isinstance(value, str) else None
-        return {"true": True, "false": False}.get(lower_value, value)
+        if isinstance(value, str):
+            return BOOLEAN_STRINGS.get(value.lower(), value)
+        return value
 
     @staticmethod
     def integer_or_decimal(value: any) -> any:
@@ -88,6 +139,15 @@ class Convert:
         or Decimal if the value is a string representation of a decimal.
         Otherwise returns the original value.
         """
+        # Fast paths for the usual values, which avoid raising exceptions
+        if value is None or value == "":
+            return value
+        if isinstance(value, str) and value.isascii():
+            if value.isdigit():
+                return int(value)
+            if DECIMAL_PATTERN.fullmatch(value):
+                return Decimal(value)
+
         try:
             return int(value)
         except (TypeError, ValueError):
@@ -102,6 +162,12 @@ class Convert:
         Converts value to a integer if the value is a string representation of an integer.
         Otherwise returns the original value.
         """
+        # Fast paths for the usual values, which avoid raising exceptions
+        if value is None or value == "":
+            return value
+        if isinstance(value, str) and value.isascii() and value.isdigit():
+            return int(value)
+
         try:
             return int(value)
         except (TypeError, ValueError):
@@ -110,11 +176,18 @@ class Convert:
     @staticmethod
     def to_lower(value: any) -> any:
         """Converts value to a lower case string if the value is a string. Otherwise returns the original value."""
+        if isinstance(value, str):
+            return value.lower()
         try:
             return value.lower()
         except (AttributeError, SyntaxError):
             return value
 
+    @staticmethod
+    def cache_statistics() -> dict:
+        """Returns the hits, misses, size and hit rate of each of the date conversion caches"""
+        return _cache_statistics({"date_time": _convert_date_time_string, "date": _convert_date_string})
+
 
 class Generate:
     """Each function generates an element with empty items removed"""
@@ -140,6 +213,108 @@ class Generate:
         return extension_item
 
 
+class FrozenDict(dict):
+    """
+    A dictionary which cannot be modified in place. It is encoded as json in the same way as a dictionary, and a copy
+    of it (including a deep copy) is an ordinary dictionary.
+    """
+
+    def _modify(self, *_args, **_kwargs):
+        raise TypeError(f"{self.__class__.__name__} cannot be modified")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _modify
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """
+    A list which cannot be modified in place. It is encoded as json in the same way as a list, and a copy of it
+    (including a deep copy) is an ordinary list.
+    """
+
+    def _modify(self, *_args, **_kwargs):
+        raise TypeError(f"{self.__class__.__name__} cannot be modified")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _modify
+    append = clear = extend = insert = pop = remove = reverse = sort = _modify
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def _freeze(value: any) -> any:
+    """Returns the value with each dictionary and list in it (at any depth) replaced by a FrozenDict or FrozenList"""
+    if isinstance(value, dict):
+        return FrozenDict({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return FrozenList(_freeze(item) for item in value)
+    return value
+
+
+class Flyweight:
+    """
+    Each function generates a coded element from the values which are repeated across the rows of a file (such as the
+    vaccine product, site and route). The elements are held in bounded LRU caches keyed by the values, so that each
+    distinct element is only built once. A cached element is shared by every resource which uses it, so is frozen
+    (see FrozenDict and FrozenList): modifying it in place raises a TypeError, and a resource which needs to modify
+    it must modify a copy.
+    """
+
+    @staticmethod
+    @lru_cache(maxsize=FLYWEIGHT_CACHE_SIZE)
+    def snomed(code: str, display: str) -> dict:
+        """Generates a snomed code element"""
+        return _freeze({"coding": [Generate.dictionary({"system": Urls.SNOMED, "code": code, "display": display})]})
+
+    @staticmethod
+    @lru_cache(maxsize=FLYWEIGHT_CACHE_SIZE)
+    def vaccine_code(code: str, term: str) -> dict:
+        """
+        Generates the vaccineCode element. vaccineCode is a mandatory FHIR field. If no values are supplied a default
+        null flavour code of 'NAVU' is used.
+        """
+        system = Urls.SNOMED
+        if not (code or term):
+            code, term, system = "NAVU", "Not available", Urls.NULL_FLAVOUR_CODES
+        return _freeze({"coding": [Generate.dictionary({"system": system, "code": code, "display": term})]})
+
+    @staticmethod
+    @lru_cache(maxsize=FLYWEIGHT_CACHE_SIZE)
+    def dose_quantity(dose_amount: str, dose_unit_term: str, dose_unit_code: str) -> dict:
+        """Generates the doseQuantity element"""
+        return _freeze(
+            Generate.dictionary(
+                {
+                    "value": Convert.integer_or_decimal(dose_amount),
+                    "unit": dose_unit_term,
+                    # Only include system if dose unit code is  non-empty
+                    **({"system": Urls.SNOMED} if _is_not_empty(dose_unit_code) else {}),
+                    "code": dose_unit_code,
+                }
+            )
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=FLYWEIGHT_CACHE_SIZE)
+    def location(location_code: str, location_code_type_uri: str) -> dict:
+        """Generates the location element"""
+        return _freeze({"identifier": Generate.dictionary({"value": location_code, "system": location_code_type_uri})})
+
+    @staticmethod
+    def cache_statistics() -> dict:
+        """Returns the hits, misses, size and hit rate of each of the caches"""
+        return _cache_statistics(
+            {
+                "snomed": Flyweight.snomed,
+                "vaccine_code": Flyweight.vaccine_code,
+                "dose_quantity": Flyweight.dose_quantity,
+                "location": Flyweight.location,
+            }
+        )
+
+
 class Add:
     """Each function adds an element to a dictionary after removing any empty values"""
 
@@ -189,6 +364,4 @@ class Add:
         The key-value pair will only be added if at least one of the code or display is non-empty.
         """
         if any(_is_not_empty(value) for value in [code, display]):
-            dictionary[key] = {
-                "coding": [Generate.dictionary({"system": Urls.SNOMED, "code": code, "display": display})]
-            }
+            dictionary[key] = Flyweight.snomed(code, display)
@@ -3,8 +3,12 @@
 import os
 from csv import DictReader
 from io import StringIO
+from typing import Iterator, Union
 from s3_clients import s3_client
 
+# Number of bytes requested from the S3 StreamingBody per read when streaming a file
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 def get_environment() -> str:
     """Returns the current environment. Defaults to internal-dev for pr and user environments"""
@@ -13,11 +17,53 @@ def get_environment() -> str:
     return _env if _env in ["internal-dev", "int", "ref", "sandbox", "prod"] else "internal-dev"
 
 
+def stream_byte_lines(streaming_body, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Reads the streaming body in chunks of chunk_size bytes and yields each raw line (including its line ending).
+    At most one chunk plus one partial line is held in memory at a time.
+    """
+    remainder = b""
+    for chunk in iter(lambda: streaming_body.read(chunk_size), b""):
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if remainder:
+        yield remainder
+
+
+def stream_lines(streaming_body, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Reads the streaming body in chunks of chunk_size bytes and yields each decoded line (including its line ending).
+    Lines are split on the newline byte before being decoded, which is safe for utf-8 because the newline byte can
+    never form part of a multi-byte character.
+    """
+    for line in stream_byte_lines(streaming_body, chunk_size):
+        yield line.decode("utf-8")
+
+
+def get_row_number(row_id: str) -> int:
+    """Returns the row number of the row_id (message_id^N)"""
+    return int(row_id.rsplit("^", 1)[1])
+
+
+def get_file_streaming_body(bucket_name: str, file_key: str, start_byte: int = 0, end_byte: Union[int, None] = None):
+    """
+    Returns the StreamingBody of the requested file, from which the file contents can be read as they arrive.
+    If start_byte or end_byte is given, only the contents from start_byte up to (but excluding) end_byte are fetched.
+    """
+    if start_byte or end_byte is not None:
+        byte_range = f"bytes={start_byte}-{'' if end_byte is None else end_byte - 1}"
+        return s3_client.get_object(Bucket=bucket_name, Key=file_key, Range=byte_range)["Body"]
+    return s3_client.get_object(Bucket=bucket_name, Key=file_key)["Body"]
+
+
 def get_csv_content_dict_reader(bucket_name: str, file_key: str) -> DictReader:
-    """Returns the requested file contents in the form of a DictReader"""
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-    csv_data = response["Body"].read().decode("utf-8")
-    return DictReader(StringIO(csv_data), delimiter="|"), csv_data
+    """
+    Returns a DictReader which streams the requested file contents, yielding each row as it is read from S3.
+    The file is never held in memory in full.
+    """
+    return DictReader(stream_lines(get_file_streaming_body(bucket_name, file_key)), delimiter="|")
 
 
 def convert_string_to_dict_reader(data_string: str):
@@ -0,0 +1,152 @@
+"""Tests for ack_file_assembler"""
+
+import unittest
+from unittest.mock import patch
+from moto import mock_s3
+from boto3 import client as boto3_client
+import random
+import tempfile
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from ack_file_assembler import AckFileAssembler, get_ack_rows_per_run  # noqa: E402
+from constants import Constants, Diagnostics  # noqa: E402
+from update_ack_file import AckFileWriter, create_ack_data, format_ack_row  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    SOURCE_BUCKET_NAME,
+    DESTINATION_BUCKET_NAME,
+    AWS_REGION,
+    TEST_FILE_KEY,
+)
+
+s3_client = boto3_client("s3", region_name=AWS_REGION)
+
+CREATED_AT_FORMATTED_STRING = "20241020T12000000"
+
+
+def make_row_arguments(row_number: int) -> tuple:
+    """Returns the (row_id, message_delivered, diagnostics, imms_id) of the row with the given row number"""
+    if row_number % 7 == 0:
+        return (f"message_id^{row_number}", False, Diagnostics.NO_PERMISSIONS, None)
+    return (f"message_id^{row_number}", True, None, f"imms-id-{row_number}")
+
+
+def expected_ack_row(row_number: int) -> str:
+    """Returns the ack row for the row with the given row number"""
+    return format_ack_row(create_ack_data(CREATED_AT_FORMATTED_STRING, *make_row_arguments(row_number)))
+
+
+class CheckingAckFileWriter:
+    """
+    Stands in for an AckFileWriter, checking that the ack rows written are the expected rows in row order, without
+    holding the whole ack file in memory
+    """
+
+    def __init__(self):
+        self.created_at_formatted_string = CREATED_AT_FORMATTED_STRING
+        self.rows_written = 0
+        self.rows_out_of_order = 0
+        self.closed = False
+
+    def write(self, content: str) -> None:
+        """
+        Checks the row_id of each ack row against the row_id expected next, counting any which are not as expected.
+        Every 1000th row is compared in full.
+        """
+        for ack_row in content.splitlines(keepends=True):
+            self.rows_written += 1
+            if ack_row[: ack_row.index("|")] != f"message_id^{self.rows_written}" or (
+                self.rows_written % 1000 == 0 and ack_row != expected_ack_row(self.rows_written)
+            ):
+                self.rows_out_of_order += 1
+
+    def close(self) -> None:
+        """Records that the ack file is complete"""
+        self.closed = True
+
+
+class TestAckFileAssembler(unittest.TestCase):
+    """Tests for AckFileAssembler"""
+
+    def assemble(self, number_of_rows: int, rows_per_run: int, spill_directory: str) -> tuple:
+        """Adds the ack rows of the file in a shuffled order, and returns the writer and assembler once closed"""
+        row_numbers = list(range(1, number_of_rows + 1))
+        random.Random(20241022).shuffle(row_numbers)
+        ack_file_writer = CheckingAckFileWriter()
+        assembler = AckFileAssembler(ack_file_writer, rows_per_run, spill_directory)
+        for row_number in row_numbers:
+            assembler.add_row(*make_row_arguments(row_number))
+        assembler.close()
+        return ack_file_writer, assembler
+
+    def test_shuffled_million_rows(self):
+        """
+        Tests that the ack rows of a shuffled 1M-row file, spilled in runs of 100000 rows, are written in row order,
+        and that the spilled runs are deleted once the ack file is complete
+        """
+        with tempfile.TemporaryDirectory() as spill_directory:
+            ack_file_writer, assembler = self.assemble(1_000_000, 100_000, spill_directory)
+            self.assertEqual(os.listdir(spill_directory), [])
+
+        self.assertEqual(ack_file_writer.rows_written, 1_000_000)
+        self.assertEqual(ack_file_writer.rows_out_of_order, 0)
+        self.assertTrue(ack_file_writer.closed)
+        self.assertEqual(assembler.runs_spilled, 10)
+
+    def test_runs_are_merged_once_there_are_too_many(self):
+        """Tests that, once there are MAX_RUNS_PER_MERGE runs, they are merged into a single run"""
+        with tempfile.TemporaryDirectory() as spill_directory:
+            with patch("ack_file_assembler.MAX_RUNS_PER_MERGE", 3):
+                ack_file_writer, assembler = self.assemble(10_050, 1000, spill_directory)
+
+        self.assertEqual(ack_file_writer.rows_written, 10_050)
+        self.assertEqual(ack_file_writer.rows_out_of_order, 0)
+        self.assertEqual(assembler.runs_spilled, 10)
+
+    def test_rows_held_in_memory_only(self):
+        """Tests that rows are sorted without spilling any runs if there are fewer than rows_per_run rows"""
+        with tempfile.TemporaryDirectory() as spill_directory:
+            ack_file_writer, assembler = self.assemble(500, 1000, spill_directory)
+            self.assertEqual(os.listdir(spill_directory), [])
+
+        self.assertEqual((ack_file_writer.rows_written, ack_file_writer.rows_out_of_order), (500, 0))
+        self.assertEqual(assembler.runs_spilled, 0)
+
+    @patch.dict("os.environ", {"ACK_BUCKET_NAME": DESTINATION_BUCKET_NAME})
+    @mock_s3
+    def test_ack_file_is_uploaded_in_row_order(self):
+        """Tests that the ack file uploaded by the ack file writer holds the header row and then the rows in order"""
+        for bucket_name in [SOURCE_BUCKET_NAME, DESTINATION_BUCKET_NAME]:
+            s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body="source file")
+        header_row = "|".join(Constants.ack_headers) + "\n"
+        ack_file_writer = AckFileWriter(TEST_FILE_KEY, SOURCE_BUCKET_NAME, header_row)
+        assembler = AckFileAssembler(ack_file_writer, rows_per_run=100)
+        row_numbers = list(range(1, 1001))
+        random.Random(20241023).shuffle(row_numbers)
+        for row_number in row_numbers:
+            assembler.add_row(*make_row_arguments(row_number))
+        assembler.close()
+
+        created_at_formatted_string = ack_file_writer.created_at_formatted_string
+        expected_rows = [
+            format_ack_row(create_ack_data(created_at_formatted_string, *make_row_arguments(row_number)))
+            for row_number in range(1, 1001)
+        ]
+        ack_file_key = f"processedFile/{TEST_FILE_KEY.replace('.csv', '_response.csv')}"
+        ack_file = s3_client.get_object(Bucket=DESTINATION_BUCKET_NAME, Key=ack_file_key)["Body"].read()
+        self.assertEqual(ack_file.decode("utf-8"), header_row + "".join(expected_rows))
+
+    def test_get_ack_rows_per_run(self):
+        """Tests that the number of rows per run is read from the environment, defaulting to 100000"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_ack_rows_per_run(), 100000)
+        with patch.dict("os.environ", {"ACK_ROWS_PER_RUN": "5000"}):
+            self.assertEqual(get_ack_rows_per_run(), 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+"""Tests for checkpoints"""
+
+import unittest
+from unittest.mock import patch
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from moto import mock_s3, mock_kinesis
+from boto3 import client as boto3_client
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from checkpoints import (  # noqa: E402
+    CheckpointTracker,
+    LocalFileCheckpointStore,
+    S3CheckpointStore,
+    get_checkpoint_store,
+    get_resume_moved_row_count,
+    get_resume_row_count,
+    shutdown_requested,
+)
+from batch_processing import process_csv_to_fhir  # noqa: E402
+from scan_csv_file import scan_csv  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    AWS_REGION,
+    CONFIG_BUCKET_NAME,
+    DESTINATION_BUCKET_NAME,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+    MOCK_ENVIRONMENT_DICT,
+    MOCK_PERMISSIONS,
+    PERMISSIONS_FILE_KEY,
+    SOURCE_BUCKET_NAME,
+    STREAM_NAME,
+    TEST_EVENT_DUMPED,
+    TEST_FILE_ID,
+    TEST_FILE_KEY,
+)
+
+s3_client = boto3_client("s3", region_name=AWS_REGION)
+kinesis_client = boto3_client("kinesis", region_name=AWS_REGION)
+
+FILE_CONTENT = "\n".join([FILE_HEADERS] + [[FILE_ROW_NEW, FILE_ROW_UPDATE][index % 2] for index in range(10)])
+
+
+def make_results(row_numbers: list) -> list:
+    """Returns a successful delivery result for each row number"""
+    return [(f"{TEST_FILE_ID}^{row_number}", True) for row_number in row_numbers]
+
+
+class TestCheckpointTracker(unittest.TestCase):
+    """Tests for CheckpointTracker and get_resume_row_count"""
+
+    def setUp(self):
+        self.temporary_directory = TemporaryDirectory()
+        self.checkpoint_store = LocalFileCheckpointStore(self.temporary_directory.name)
+        self.file_scan = scan_csv(BytesIO(FILE_CONTENT.encode("utf-8")))
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def make_tracker(self, **kwargs) -> CheckpointTracker:
+        """Returns a checkpoint tracker for the test file"""
+        return CheckpointTracker(self.checkpoint_store, TEST_FILE_ID, TEST_FILE_KEY, self.file_scan, **kwargs)
+
+    def test_checkpoint_only_covers_contiguous_rows(self):
+        """Tests that the checkpoint is the last row up to which every row has a result, if results are out of order"""
+        tracker = self.make_tracker(interval_rows=1)
+        tracker.record_results(make_results([1, 2, 5, 6]))
+        self.assertEqual(self.checkpoint_store.load(TEST_FILE_ID)["last_row"], 2)
+
+        tracker.record_results(make_results([4, 3]))
+        self.assertEqual(
+            self.checkpoint_store.load(TEST_FILE_ID),
+            {
+                "message_id": TEST_FILE_ID,
+                "file_key": TEST_FILE_KEY,
+                "file_size": self.file_scan.size,
+                "last_row": 6,
+                "byte_offset": self.file_scan.row_offsets[6],
+                "completed": False,
+            },
+        )
+
+    def test_checkpoint_is_saved_at_intervals(self):
+        """Tests that a checkpoint is only saved once enough rows have results, unless one is saved explicitly"""
+        tracker = self.make_tracker(interval_rows=5, interval_seconds=3600)
+        tracker.record_results(make_results([1, 2, 3, 4]))
+        self.assertIsNone(self.checkpoint_store.load(TEST_FILE_ID))
+        tracker.record_results(make_results([5]))
+        self.assertEqual(self.checkpoint_store.load(TEST_FILE_ID)["last_row"], 5)
+
+        tracker.record_results(make_results(range(6, 11)))
+        tracker.save()
+        checkpoint = self.checkpoint_store.load(TEST_FILE_ID)
+        self.assertEqual((checkpoint["last_row"], checkpoint["byte_offset"]), (10, self.file_scan.size))
+        self.assertTrue(checkpoint["completed"])
+
+    def test_get_resume_row_count(self):
+        """Tests that the checkpoint is only used if it matches the file"""
+        self.assertEqual(get_resume_row_count(None, TEST_FILE_ID, TEST_FILE_KEY, self.file_scan), 0)
+        self.assertEqual(get_resume_row_count(self.checkpoint_store, TEST_FILE_ID, TEST_FILE_KEY, self.file_scan), 0)
+
+        self.make_tracker(interval_rows=1).record_results(make_results([1, 2, 3]))
+        self.assertEqual(get_resume_row_count(self.checkpoint_store, TEST_FILE_ID, TEST_FILE_KEY, self.file_scan), 3)
+        self.assertEqual(get_resume_row_count(self.checkpoint_store, TEST_FILE_ID, "other_file.csv", self.file_scan), 0)
+
+        changed_file_scan = scan_csv(BytesIO((FILE_CONTENT + "\n" + FILE_ROW_NEW).encode("utf-8")))
+        self.assertEqual(get_resume_row_count(self.checkpoint_store, TEST_FILE_ID, TEST_FILE_KEY, changed_file_scan), 0)
+
+    def test_moved_rows_are_checkpointed(self):
+        """
+        Tests that the checkpoint of a shard holds the number of its moved rows (processed in the order given, after
+        its own rows) up to which every moved row has a result, and is only completed once every moved row has one
+        """
+        tracker = self.make_tracker(interval_rows=1, end_row_count=6, moved_row_numbers=[9, 7, 10])
+        tracker.record_results(make_results([1, 2, 3, 4, 5, 6, 7]))
+        checkpoint = self.checkpoint_store.load(TEST_FILE_ID)
+        self.assertEqual((checkpoint["last_row"], checkpoint["moved_rows_sent"]), (6, 0))
+        self.assertFalse(checkpoint["completed"])
+
+        tracker.record_results(make_results([9]))
+        self.assertEqual(self.checkpoint_store.load(TEST_FILE_ID)["moved_rows_sent"], 2)
+        self.assertEqual(
+            get_resume_moved_row_count(self.checkpoint_store, TEST_FILE_ID, TEST_FILE_KEY, self.file_scan, 0, 6, 3), 2
+        )
+
+        tracker.record_results(make_results([10]))
+        checkpoint = self.checkpoint_store.load(TEST_FILE_ID)
+        self.assertEqual((checkpoint["moved_rows_sent"], checkpoint["completed"]), (3, True))
+        self.assertEqual(
+            get_resume_moved_row_count(self.checkpoint_store, TEST_FILE_ID, "other_file.csv", self.file_scan, 0, 6, 3),
+            0,
+        )
+
+    def test_get_checkpoint_store(self):
+        """Tests that the checkpoint store is read from the environment, defaulting to none"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertIsNone(get_checkpoint_store())
+        with patch.dict("os.environ", {"CHECKPOINT_STORE": "file", "CHECKPOINT_DIRECTORY": "/tmp/test"}):
+            self.assertEqual(get_checkpoint_store().directory, "/tmp/test")
+        with patch.dict("os.environ", {"CHECKPOINT_STORE": "S3", "ACK_BUCKET_NAME": DESTINATION_BUCKET_NAME}):
+            self.assertEqual(get_checkpoint_store().bucket_name, DESTINATION_BUCKET_NAME)
+
+
+@patch.dict("os.environ", {**MOCK_ENVIRONMENT_DICT, "CHECKPOINT_STORE": "s3"})
+@mock_s3
+@mock_kinesis
+class TestResumeFromCheckpoint(unittest.TestCase):
+    """Tests that process_csv_to_fhir checkpoints its progress and resumes from the checkpoint"""
+
+    def setUp(self):
+        for bucket_name in [SOURCE_BUCKET_NAME, DESTINATION_BUCKET_NAME, CONFIG_BUCKET_NAME]:
+            s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=FILE_CONTENT)
+        s3_client.put_object(Bucket=CONFIG_BUCKET_NAME, Key=PERMISSIONS_FILE_KEY, Body=json.dumps(MOCK_PERMISSIONS))
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        self.file_scan = scan_csv(BytesIO(FILE_CONTENT.encode("utf-8")))
+        self.checkpoint_store = S3CheckpointStore(DESTINATION_BUCKET_NAME)
+
+    def tearDown(self):
+        shutdown_requested.clear()
+
+    @staticmethod
+    def get_sent_row_ids() -> list:
+        """Returns the row_id of each row sent to the stream"""
+        shard_id = kinesis_client.describe_stream(StreamName=STREAM_NAME)["StreamDescription"]["Shards"][0]["ShardId"]
+        shard_iterator = kinesis_client.get_shard_iterator(
+            StreamName=STREAM_NAME, ShardId=shard_id, ShardIteratorType="TRIM_HORIZON"
+        )["ShardIterator"]
+        records = kinesis_client.get_records(ShardIterator=shard_iterator)["Records"]
+        return [json.loads(record["Data"])["row_id"] for record in records]
+
+    @staticmethod
+    def request_shutdown_at_third_row(message, *args) -> None:
+        """Requests shutdown when the "MESSAGE ID" of the third row is logged"""
+        if message == "MESSAGE ID : %s" and args[0] == f"{TEST_FILE_ID}^3":
+            shutdown_requested.set()
+
+    def test_resumes_after_checkpoint(self):
+        """Tests that each processing method only sends the rows after the checkpoint, and completes the checkpoint"""
+        for environment in (
+            {"PROCESSING_PIPELINE": "serial"},
+            {"PROCESSING_PIPELINE": "async"},
+            {"CONVERSION_WORKERS": "2"},
+        ):
+            with self.subTest(environment=environment), patch.dict("os.environ", environment):
+                kinesis_client.delete_stream(StreamName=STREAM_NAME)
+                kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+                CheckpointTracker(
+                    self.checkpoint_store, TEST_FILE_ID, TEST_FILE_KEY, self.file_scan, interval_rows=1
+                ).record_results(make_results([1, 2, 3, 4]))
+
+                process_csv_to_fhir(json.loads(TEST_EVENT_DUMPED))
+
+                self.assertEqual(self.get_sent_row_ids(), [f"{TEST_FILE_ID}^{row}" for row in range(5, 11)])
+                checkpoint = self.checkpoint_store.load(TEST_FILE_ID)
+                self.assertEqual((checkpoint["last_row"], checkpoint["completed"]), (10, True))
+
+    def test_completed_file_is_not_sent_again(self):
+        """Tests that no rows are sent if the checkpoint shows that every row has been processed"""
+        process_csv_to_fhir(json.loads(TEST_EVENT_DUMPED))
+        self.assertEqual(len(self.get_sent_row_ids()), 10)
+
+        process_csv_to_fhir(json.loads(TEST_EVENT_DUMPED))
+        self.assertEqual(len(self.get_sent_row_ids()), 10)
+
+    def test_shutdown_stops_processing_with_a_checkpoint(self):
+        """Tests that, once shutdown is requested, no more rows are sent and the rows already sent are checkpointed"""
+        with patch.dict("os.environ", {"PROCESSING_PIPELINE": "serial", "ROWS_PER_KINESIS_RECORD": "1"}):
+            # Request shutdown as the third row is added
+            with patch("kinesis_record_aggregator.logger.info", side_effect=self.request_shutdown_at_third_row):
+                process_csv_to_fhir(json.loads(TEST_EVENT_DUMPED))
+
+        self.assertEqual(self.get_sent_row_ids(), [f"{TEST_FILE_ID}^{row}" for row in range(1, 4)])
+        checkpoint = self.checkpoint_store.load(TEST_FILE_ID)
+        self.assertEqual((checkpoint["last_row"], checkpoint["completed"]), (3, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+"""Tests for columnar_conversion"""
+
+import unittest
+from unittest.mock import Mock, patch
+import random
+import os
+import sys
+import simplejson as json
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from columnar_conversion import (  # noqa: E402
+    COLUMN_CONVERSIONS,
+    convert_columns,
+    convert_columns_in_chunks,
+    get_column_conversions,
+    get_columnar_conversion_rows,
+)
+from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource, encode_fhir_imms_resource  # noqa: E402
+from fhir_mapping_spec import Column, Field, Group  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from utils_for_fhir_conversion import Convert  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    all_fields,
+    mandatory_fields_only,
+    critical_fields_only,
+    update_request_dose_sequence_missing,
+    update_request_dose_sequence_string,
+)
+
+
+def encode_resource(resource: dict) -> bytes:
+    """Encodes the resource as it is encoded when sent to Kinesis"""
+    return json.dumps(resource, ensure_ascii=False).encode("utf-8")
+
+
+class TestColumnarConversion(unittest.TestCase):
+    """Tests for converting the columns of a chunk of rows"""
+
+    def assert_matches_row_conversion(self, rows: list, vaccine: Vaccine) -> None:
+        """
+        Asserts that the resources and json built from the rows after their columns are converted are identical to
+        those built from the original rows
+        """
+        expected_resources = [encode_resource(convert_to_fhir_imms_resource(row, vaccine)) for row in rows]
+        expected_json = [encode_resource(encode_fhir_imms_resource(row, vaccine)) for row in rows]
+
+        converted_rows = [dict(row) for row in rows]
+        convert_columns(converted_rows)
+
+        self.assertEqual(
+            [encode_resource(convert_to_fhir_imms_resource(row, vaccine, True)) for row in converted_rows],
+            expected_resources,
+        )
+        self.assertEqual(
+            [encode_resource(encode_fhir_imms_resource(row, vaccine, True)) for row in converted_rows], expected_json
+        )
+
+    def test_get_column_conversions(self):
+        """Test that the convert function of each converted column of the specification is found"""
+        self.assertEqual(
+            COLUMN_CONVERSIONS,
+            {
+                "RECORDED_DATE": Convert.date,
+                "PERSON_DOB": Convert.date,
+                "PERSON_GENDER_CODE": Convert.gender_code,
+                "EXPIRY_DATE": Convert.date,
+                "DATE_AND_TIME": Convert.date_time,
+                "PRIMARY_SOURCE": Convert.boolean,
+                "DOSE_SEQUENCE": Convert.integer,
+            },
+        )
+
+    def test_get_column_conversions_conflicting_conversions(self):
+        """Test that a ValueError is raised if a column is converted by more than one function"""
+        spec = [
+            Field("recorded", Column("RECORDED_DATE", Convert.date)),
+            Group(["RECORDED_DATE"], [Field("other", Column("RECORDED_DATE", Convert.date_time))]),
+        ]
+        with self.assertRaises(ValueError):
+            get_column_conversions(spec)
+
+    def test_convert_columns(self):
+        """Test that the non-empty values of the converted columns are converted, and all other values are unchanged"""
+        rows = [
+            {"PERSON_DOB": "20000101", "PRIMARY_SOURCE": "TRUE", "DOSE_SEQUENCE": "1", "PERSON_SURNAME": "20000101"},
+            {"PERSON_DOB": "", "PRIMARY_SOURCE": "false", "DOSE_SEQUENCE": "one"},
+            {"PERSON_DOB": "20000101", "DOSE_SEQUENCE": "1"},
+        ]
+        convert_columns(rows)
+        self.assertEqual(
+            rows,
+            [
+                {"PERSON_DOB": "2000-01-01", "PRIMARY_SOURCE": True, "DOSE_SEQUENCE": 1, "PERSON_SURNAME": "20000101"},
+                {"PERSON_DOB": "", "PRIMARY_SOURCE": False, "DOSE_SEQUENCE": "one"},
+                {"PERSON_DOB": "2000-01-01", "DOSE_SEQUENCE": 1},
+            ],
+        )
+
+    def test_convert_columns_converts_each_non_empty_value(self):
+        """Test that each non-empty value of a column is converted in order, and that empty values are not converted"""
+        rows = [{"DOSE_SEQUENCE": value} for value in ["1", "2", "1", "", "1", "2"]]
+        integer = Mock(wraps=Convert.integer)
+        convert_columns(rows, {"DOSE_SEQUENCE": integer})
+        self.assertEqual([row["DOSE_SEQUENCE"] for row in rows], [1, 2, 1, "", 1, 2])
+        self.assertEqual([call.args[0] for call in integer.call_args_list], ["1", "2", "1", "1", "2"])
+
+    def test_convert_columns_matches_row_conversion_for_fixtures(self):
+        """Test that the resources built from the converted columns are identical for the test fixtures"""
+        rows = [
+            all_fields,
+            mandatory_fields_only,
+            critical_fields_only,
+            update_request_dose_sequence_missing,
+            update_request_dose_sequence_string,
+            {key: "" for key in all_fields},
+            {},
+        ]
+        for vaccine in Vaccine:
+            with self.subTest(vaccine=vaccine):
+                self.assert_matches_row_conversion(rows, vaccine)
+
+    def test_convert_columns_matches_row_conversion_for_random_rows(self):
+        """
+        Test that the resources built from the converted columns are identical for chunks of rows with randomly chosen
+        fields empty, missing, or holding values which are not converted as expected
+        """
+        rng = random.Random(20241019)
+        awkward_values = ["", "0", "TRUE", "false", "20240101", "20240230", "20240101T120000", "1", "9", "x"]
+        for _ in range(100):
+            rows = []
+            for _ in range(20):
+                row = {}
+                for key, value in all_fields.items():
+                    choice = rng.random()
+                    if choice < 0.4:
+                        row[key] = value
+                    elif choice < 0.7:
+                        row[key] = rng.choice(awkward_values)
+                    elif choice < 0.9:
+                        row[key] = ""
+                rows.append(row)
+            self.assert_matches_row_conversion(rows, rng.choice(list(Vaccine)))
+
+    def test_convert_columns_in_chunks(self):
+        """Test that the numbered rows are passed on in order, with the columns of every chunk converted"""
+        numbered_rows = [(row_number, {"DOSE_SEQUENCE": str(row_number)}) for row_number in range(1, 8)]
+        self.assertEqual(
+            list(convert_columns_in_chunks(numbered_rows, 3)),
+            [(row_number, {"DOSE_SEQUENCE": row_number}) for row_number in range(1, 8)],
+        )
+
+    def test_get_columnar_conversion_rows(self):
+        """Test that the number of rows is read from the environment, defaulting to 0 (row by row conversion)"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_columnar_conversion_rows(), 0)
+        with patch.dict("os.environ", {"COLUMNAR_CONVERSION_ROWS": "1000"}):
+            self.assertEqual(get_columnar_conversion_rows(), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+"""Tests for compile_fhir_converter"""
+
+import unittest
+import random
+from decimal import Decimal
+import os
+import sys
+import simplejson as json
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from compile_fhir_converter import compile_converter, encode_value  # noqa: E402
+from convert_to_fhir_imms_resource import (  # noqa: E402
+    COMPILED_CONVERTERS,
+    convert_to_fhir_imms_resource,
+    convert_to_fhir_imms_resource_with_decorators,
+    encode_fhir_imms_resource,
+)
+from fhir_mapping_spec import Column, Field, Group  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    all_fields,
+    mandatory_fields_only,
+    critical_fields_only,
+    update_request_dose_sequence_missing,
+    update_request_dose_sequence_string,
+)
+
+
+def encode_resource(resource: dict) -> bytes:
+    """Encodes the resource as it is encoded when sent to Kinesis"""
+    return json.dumps(resource, ensure_ascii=False).encode("utf-8")
+
+
+class TestCompileFhirConverter(unittest.TestCase):
+    """Tests for compile_converter and the converters compiled from the FHIR mapping specification"""
+
+    def assert_matches_decorators(self, row: dict, vaccine: Vaccine) -> None:
+        """Asserts that the compiled converter gives byte-identical output to the decorators"""
+        self.assertEqual(
+            encode_resource(convert_to_fhir_imms_resource(row, vaccine)),
+            encode_resource(convert_to_fhir_imms_resource_with_decorators(row, vaccine)),
+        )
+
+    def test_compiled_converters_match_decorators_for_fixtures(self):
+        """Test that the compiled converters give byte-identical output to the decorators for the test fixtures"""
+        fixtures = {
+            "All fields": all_fields,
+            "Mandatory fields only": mandatory_fields_only,
+            "Critical fields only": critical_fields_only,
+            "Dose sequence missing": update_request_dose_sequence_missing,
+            "Dose sequence string": update_request_dose_sequence_string,
+            "All fields empty": {key: "" for key in all_fields},
+            "All fields missing": {},
+        }
+        for vaccine in Vaccine:
+            for fixture_name, row in fixtures.items():
+                with self.subTest(vaccine=vaccine, fixture=fixture_name):
+                    self.assert_matches_decorators(row, vaccine)
+
+    def test_compiled_converters_match_decorators_for_random_rows(self):
+        """
+        Test that the compiled converters give byte-identical output to the decorators for rows with randomly chosen
+        fields empty or missing
+        """
+        rng = random.Random(20241017)
+        for _ in range(2000):
+            row = {}
+            for key, value in all_fields.items():
+                choice = rng.random()
+                if choice < 0.5:
+                    row[key] = value
+                elif choice < 0.8:
+                    row[key] = ""
+            vaccine = rng.choice(list(Vaccine))
+            self.assert_matches_decorators(row, vaccine)
+
+    def test_compiled_converter_for_each_vaccine(self):
+        """Test that a converter is compiled for each vaccine type, each with the vaccine type's targetDisease"""
+        self.assertEqual(set(COMPILED_CONVERTERS), set(Vaccine))
+        for vaccine, converter in COMPILED_CONVERTERS.items():
+            with self.subTest(vaccine):
+                expected = convert_to_fhir_imms_resource_with_decorators(all_fields, vaccine)
+                self.assertEqual(converter(all_fields)["protocolApplied"], expected["protocolApplied"])
+
+    def test_compile_converter(self):
+        """
+        Test that compile_converter reads each column once, only sets fields when a when column is non-empty, and
+        keeps the generated source
+        """
+        spec = [
+            Field("recorded", Column("RECORDED_DATE")),
+            Group(["PERSON_SURNAME"], [Field("family", Column("PERSON_SURNAME"), when=[])]),
+            Field("lotNumber", Column("BATCH_NUMBER"), otherwise=Field("lotNumber", "Unknown", when=[])),
+        ]
+        converter = compile_converter(spec, ["target disease"])
+
+        self.assertEqual(converter.source.count("row.get("), 3)
+        self.assertEqual(
+            converter({"RECORDED_DATE": "20240101", "PERSON_SURNAME": "", "BATCH_NUMBER": ""}),
+            {
+                "resourceType": "Immunization",
+                "status": "completed",
+                "protocolApplied": [{"targetDisease": ["target disease"]}],
+                "recorded": "20240101",
+                "lotNumber": "Unknown",
+            },
+        )
+        self.assertEqual(converter({"PERSON_SURNAME": "Smith"})["family"], "Smith")
+
+    def test_compile_converter_unknown_column(self):
+        """Test that compile_converter raises a ValueError if the specification refers to an unknown column"""
+        with self.assertRaises(ValueError):
+            compile_converter([Field("recorded", Column("NOT_A_COLUMN"))], [])
+
+
+class TestCompileJsonEncoder(unittest.TestCase):
+    """Tests for the json encoders compiled from the FHIR mapping specification"""
+
+    def assert_matches_converter(self, row: dict, vaccine: Vaccine) -> None:
+        """
+        Asserts that the message body with the json written by the encoder is byte-identical to, and parses to the
+        same value as, the message body with the resource built by the converter
+        """
+        message_body = {"row_id": "123456^1", "operation_requested": "CREATE", "local_id": "a^b"}
+        direct = encode_resource({**message_body, "fhir_json": encode_fhir_imms_resource(row, vaccine)})
+        from_dict = encode_resource({**message_body, "fhir_json": convert_to_fhir_imms_resource(row, vaccine)})
+        self.assertEqual(direct, from_dict)
+        self.assertEqual(json.loads(direct), json.loads(from_dict))
+
+    def test_json_encoders_match_converters_for_fixtures(self):
+        """Test that the json encoders give identical json to the converters for the test fixtures"""
+        fixtures = {
+            "All fields": all_fields,
+            "Mandatory fields only": mandatory_fields_only,
+            "Critical fields only": critical_fields_only,
+            "Dose sequence missing": update_request_dose_sequence_missing,
+            "Dose sequence string": update_request_dose_sequence_string,
+            "All fields empty": {key: "" for key in all_fields},
+            "All fields missing": {},
+        }
+        for vaccine in Vaccine:
+            for fixture_name, row in fixtures.items():
+                with self.subTest(vaccine=vaccine, fixture=fixture_name):
+                    self.assert_matches_converter(row, vaccine)
+
+    def test_json_encoders_match_converters_for_random_rows(self):
+        """
+        Test that the json encoders give identical json to the converters for rows with randomly chosen fields empty,
+        missing, or holding values which need escaping or are converted to numbers, booleans or Decimals
+        """
+        rng = random.Random(20241018)
+        awkward_values = ['quote " and back\\slash', "Zoë Ångström", "new\nline", "\u2028", "", "0", "TRUE", "20240101"]
+        dose_amounts = ["0.5", "0.30", "1.500", "2", ".5", "1e2", "-0.0", "00.10", "abc", "1_0"]
+        for _ in range(2000):
+            row = {}
+            for key, value in all_fields.items():
+                choice = rng.random()
+                if choice < 0.4:
+                    row[key] = value
+                elif choice < 0.6:
+                    row[key] = rng.choice(awkward_values)
+                elif choice < 0.8:
+                    row[key] = ""
+            if rng.random() < 0.5:
+                row["DOSE_AMOUNT"] = rng.choice(dose_amounts)
+            self.assert_matches_converter(row, rng.choice(list(Vaccine)))
+
+    def test_encode_value_decimals(self):
+        """Test that encode_value encodes Decimals exactly as simplejson does"""
+        for value in [Decimal("0.30"), Decimal("1.500"), Decimal("1E+2"), Decimal("-0.0"), Decimal("0.1"), 2, True]:
+            with self.subTest(value):
+                self.assertEqual(encode_value(value), json.dumps(value, ensure_ascii=False))
@@ -0,0 +1,149 @@
+"""Tests for convert_rows"""
+
+import unittest
+from unittest.mock import patch
+from csv import DictReader
+from io import BytesIO, StringIO
+from moto import mock_s3
+from boto3 import client as boto3_client
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from convert_rows import (  # noqa: E402
+    convert_rows,
+    convert_rows_in_parallel,
+    get_conversion_workers,
+    stream_row_chunks,
+)
+from mappings import Vaccine  # noqa: E402
+from scan_csv_file import scan_csv  # noqa: E402
+from utils_for_recordprocessor import get_file_streaming_body  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    SOURCE_BUCKET_NAME,
+    AWS_REGION,
+    TEST_FILE_KEY,
+    TEST_FILE_ID,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+    FILE_ROW_DELETE,
+)
+
+s3_client = boto3_client("s3", region_name=AWS_REGION)
+
+ALLOWED_OPERATIONS = {"CREATE", "UPDATE", "DELETE"}
+FILE_DETAILS = {"file_key": TEST_FILE_KEY, "supplier": "EMIS", "created_at_formatted_string": "20211120T12000000"}
+
+# Eleven rows, including a blank line, a row with a quoted newline, and a row with a multi-byte character
+FILE_CONTENT = "\r\n".join(
+    [FILE_HEADERS]
+    + [FILE_ROW_NEW, FILE_ROW_UPDATE, FILE_ROW_DELETE] * 3
+    + ["", FILE_ROW_NEW.replace('"SABINA"', '"SAB\nINA"'), FILE_ROW_NEW.replace('"SABINA"', '"SABÏNA"')]
+)
+
+
+class TestStreamRowChunks(unittest.TestCase):
+    """Tests for stream_row_chunks"""
+
+    def test_chunks_are_cut_at_row_boundaries(self):
+        """Tests that each chunk holds whole rows, and that together the chunks hold every row in the file"""
+        file_bytes = FILE_CONTENT.encode("utf-8")
+        file_scan = scan_csv(BytesIO(file_bytes))
+        expected_rows = list(DictReader(StringIO(FILE_CONTENT), delimiter="|"))
+        self.assertEqual(len(expected_rows), 11)
+
+        for rows_per_chunk in (1, 2, 4, 11, 100):
+            with self.subTest(rows_per_chunk=rows_per_chunk):
+                chunks = list(stream_row_chunks(BytesIO(file_bytes), file_scan, rows_per_chunk))
+
+                self.assertEqual([index for index, _ in chunks], list(range(0, 11, rows_per_chunk)))
+                first_row_offset = file_scan.row_offsets[0]
+                self.assertEqual(b"".join(chunk for _, chunk in chunks), file_bytes[first_row_offset:])
+                chunk_rows = [
+                    list(DictReader(StringIO(chunk.decode("utf-8")), fieldnames=file_scan.headers, delimiter="|"))
+                    for _, chunk in chunks
+                ]
+                self.assertTrue(all(len(rows) <= rows_per_chunk for rows in chunk_rows))
+                self.assertEqual([row for rows in chunk_rows for row in rows], expected_rows)
+
+
+@mock_s3
+class TestConvertRowsInParallel(unittest.TestCase):
+    """Tests for convert_rows_in_parallel"""
+
+    def setUp(self):
+        s3_client.create_bucket(Bucket=SOURCE_BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=FILE_CONTENT.encode("utf-8"))
+
+    def test_parallel_conversion_matches_serial_conversion(self):
+        """Tests that rows converted by worker processes are identical to, and in the same order as, serial results"""
+        file_scan = scan_csv(BytesIO(FILE_CONTENT.encode("utf-8")))
+
+        for row_file_details in (FILE_DETAILS, None):
+            with self.subTest(row_file_details=row_file_details):
+                csv_reader = DictReader(StringIO(FILE_CONTENT), delimiter="|")
+                expected_rows = list(
+                    convert_rows(csv_reader, TEST_FILE_ID, Vaccine.RSV, ALLOWED_OPERATIONS, row_file_details)
+                )
+
+                parallel_rows = list(
+                    convert_rows_in_parallel(
+                        get_file_streaming_body(SOURCE_BUCKET_NAME, TEST_FILE_KEY),
+                        file_scan,
+                        TEST_FILE_ID,
+                        Vaccine.RSV,
+                        ALLOWED_OPERATIONS,
+                        row_file_details,
+                        workers=2,
+                        rows_per_chunk=3,
+                    )
+                )
+
+                self.assertEqual(parallel_rows, expected_rows)
+                expected_row_ids = [f"{TEST_FILE_ID}^{row_number}" for row_number in range(1, 12)]
+                self.assertEqual([row_id for row_id, _, _ in parallel_rows], expected_row_ids)
+                patient = json.loads(parallel_rows[9][2])["fhir_json"]["contained"][0]
+                self.assertEqual(patient["name"][0]["given"], ["SAB\nINA"])
+                self.assertIn("SABÏNA", parallel_rows[10][2].decode("utf-8"))
+
+
+class TestColumnarConversion(unittest.TestCase):
+    """Tests for convert_rows when the columns of each chunk of rows are converted together"""
+
+    def test_columnar_conversion_matches_row_conversion(self):
+        """Tests that rows whose columns are converted in chunks are identical to rows converted one at a time"""
+        csv_reader = DictReader(StringIO(FILE_CONTENT), delimiter="|")
+        expected_rows = list(convert_rows(csv_reader, TEST_FILE_ID, Vaccine.RSV, ALLOWED_OPERATIONS, FILE_DETAILS))
+
+        for columnar_conversion_rows in ("1", "4", "100"):
+            with self.subTest(columnar_conversion_rows=columnar_conversion_rows), patch.dict(
+                "os.environ", {"COLUMNAR_CONVERSION_ROWS": columnar_conversion_rows}
+            ):
+                csv_reader = DictReader(StringIO(FILE_CONTENT), delimiter="|")
+                columnar_rows = list(
+                    convert_rows(csv_reader, TEST_FILE_ID, Vaccine.RSV, ALLOWED_OPERATIONS, FILE_DETAILS)
+                )
+                self.assertEqual(columnar_rows, expected_rows)
+
+
+class TestGetConversionWorkers(unittest.TestCase):
+    """Tests for get_conversion_workers"""
+
+    def test_get_conversion_workers(self):
+        """Tests that the number of workers is read from the environment, defaulting to 1 (serial conversion)"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_conversion_workers(), 1)
+        with patch.dict("os.environ", {"CONVERSION_WORKERS": "4"}):
+            self.assertEqual(get_conversion_workers(), 4)
+        with patch.dict("os.environ", {"CONVERSION_WORKERS": "auto"}), patch(
+            "convert_rows.os.cpu_count", return_value=2
+        ):
+            self.assertEqual(get_conversion_workers(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 """Tests for convert_to_fhir_imms_resource"""
 
 import unittest
+from copy import deepcopy
 import os
 import sys
 maindir = os.path.dirname(__file__)
@@ -9,7 +10,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
 from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource  # noqa: E402
 
 # Do not try from src.mappings import Vaccine as this imports a different instance of Vaccine and tests will break
-from mappings import Vaccine  # noqa: E402
+from mappings import Vaccine, map_target_disease  # noqa: E402
 from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
     all_fields,
     mandatory_fields_only,
@@ -38,3 +39,54 @@ class TestConvertToFhirImmsResource(unittest.TestCase):
         for test_name, input_values, expected_output in cases:
             with self.subTest(test_name):
                 self.assertEqual(convert_to_fhir_imms_resource(input_values, Vaccine.RSV), expected_output)
+
+    def test_target_disease_element_is_shared_and_unchanged(self):
+        """
+        Test that the targetDisease element is built once per vaccine type and shared by every resource, and that
+        converting rows never modifies it
+        """
+        for vaccine in Vaccine:
+            with self.subTest(vaccine):
+                resources = [convert_to_fhir_imms_resource(row, vaccine) for row in [all_fields, critical_fields_only]]
+                target_diseases = [resource["protocolApplied"][0]["targetDisease"] for resource in resources]
+                self.assertIs(target_diseases[0], target_diseases[1])
+                self.assertEqual(target_diseases[0], map_target_disease(vaccine))
+                self.assertIsNot(resources[0]["protocolApplied"][0], resources[1]["protocolApplied"][0])
+
+    def test_flyweight_elements_are_shared_and_unchanged(self):
+        """
+        Test that the coded elements which are repeated across rows are shared by every resource which uses them,
+        and that converting rows never modifies them
+        """
+        shared_keys = ["vaccineCode", "site", "route", "doseQuantity", "location"]
+        first_resource = convert_to_fhir_imms_resource(all_fields, Vaccine.RSV)
+        elements_before = deepcopy({key: first_resource[key] for key in shared_keys})
+
+        resources = [convert_to_fhir_imms_resource(row, Vaccine.RSV) for row in [all_fields, critical_fields_only]]
+        for key in shared_keys:
+            with self.subTest(key):
+                self.assertIs(resources[0][key], first_resource[key])
+                self.assertEqual(first_resource[key], elements_before[key])
+        self.assertIsNot(resources[0], first_resource)
+
+    def test_changing_a_resource_does_not_change_another_sharing_its_elements(self):
+        """
+        Test that the shared elements of a resource cannot be modified in place, so that changing one resource never
+        changes another resource which shares its elements, and that a copy of a resource can be modified freely
+        """
+        first_resource, second_resource = [convert_to_fhir_imms_resource(all_fields, Vaccine.RSV) for _ in range(2)]
+        second_resource_before = deepcopy(second_resource)
+
+        with self.assertRaises(TypeError):
+            first_resource["vaccineCode"]["coding"][0]["code"] = "changed"
+        with self.assertRaises(TypeError):
+            first_resource["vaccineCode"]["coding"].append({"code": "changed"})
+        with self.assertRaises(TypeError):
+            first_resource["doseQuantity"].update({"value": 2})
+        first_resource["site"] = {"coding": []}
+        self.assertEqual(second_resource, second_resource_before)
+
+        copied_resource = deepcopy(second_resource)
+        copied_resource["vaccineCode"]["coding"][0]["code"] = "changed"
+        copied_resource["location"]["identifier"].pop("system")
+        self.assertEqual(second_resource, second_resource_before)
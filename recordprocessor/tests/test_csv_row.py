@@ -0,0 +1,145 @@
+"""Tests for csv_row"""
+
+import unittest
+from unittest.mock import patch
+from csv import DictReader
+from io import StringIO
+import random
+import os
+import sys
+import simplejson as json
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from columnar_conversion import convert_columns  # noqa: E402
+from constants import Constants  # noqa: E402
+from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource, encode_fhir_imms_resource  # noqa: E402
+from csv_row import CsvRow, get_csv_row_type, read_csv_rows  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    all_fields,
+    mandatory_fields_only,
+    critical_fields_only,
+    update_request_dose_sequence_missing,
+    update_request_dose_sequence_string,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+)
+
+# Rows include a blank line, a short row and a row with a quoted newline
+FILE_CONTENT = "\n".join(
+    [
+        FILE_HEADERS,
+        FILE_ROW_NEW,
+        "",
+        FILE_ROW_UPDATE,
+        '"9732928395"|"PEAY"',
+        FILE_ROW_NEW.replace('"SABINA"', '"SAB\nINA"'),
+    ]
+)
+
+
+def to_csv_row(row: dict) -> CsvRow:
+    """Returns the row as a CsvRow, with None for each column missing from the row"""
+    return CsvRow(row.get(name) for name in Constants.expected_csv_headers)
+
+
+def encode_resource(resource: dict) -> bytes:
+    """Encodes the resource as it is encoded when sent to Kinesis"""
+    return json.dumps(resource, ensure_ascii=False).encode("utf-8")
+
+
+class TestCsvRow(unittest.TestCase):
+    """Tests for CsvRow"""
+
+    def test_csv_row_access(self):
+        """Test that the values of a CsvRow can be read by index, by attribute and by column name"""
+        row = to_csv_row(all_fields)
+        self.assertEqual(row[3], all_fields["PERSON_DOB"])
+        self.assertEqual(row.PERSON_DOB, all_fields["PERSON_DOB"])
+        self.assertEqual(row.get("PERSON_DOB"), all_fields["PERSON_DOB"])
+        self.assertEqual(row.get("NOT_A_COLUMN", ""), "")
+        self.assertIsNone(row.get("NOT_A_COLUMN"))
+        with self.assertRaises(AttributeError):
+            row.NOT_A_COLUMN = "value"
+
+    def test_read_csv_rows_matches_dict_reader(self):
+        """
+        Test that the CsvRows read from a file with the expected headers hold the same values as the rows read by
+        csv.DictReader, including for short rows, and that blank lines are skipped
+        """
+        expected_rows = list(DictReader(StringIO(FILE_CONTENT), delimiter="|"))
+        rows = list(read_csv_rows(StringIO(FILE_CONTENT)))
+
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(all(row.__class__ is CsvRow for row in rows))
+        for row, expected_row in zip(rows, expected_rows):
+            self.assertEqual({name: row.get(name) for name in Constants.expected_csv_headers}, expected_row)
+        self.assertEqual(rows[2].PERSON_FORENAME, "PEAY")
+        self.assertIsNone(rows[2].PERSON_SURNAME)
+        self.assertEqual(rows[3].PERSON_FORENAME, "SAB\nINA")
+
+    def test_read_csv_rows_with_fieldnames(self):
+        """Test that when fieldnames are given, the first line is read as a row rather than as the headers"""
+        data_rows = FILE_CONTENT.split("\n", 1)[1]
+        rows = list(read_csv_rows(StringIO(data_rows), fieldnames=Constants.expected_csv_headers))
+        self.assertEqual(rows, list(read_csv_rows(StringIO(FILE_CONTENT))))
+
+    def test_read_csv_rows_reads_dicts(self):
+        """
+        Test that the rows are read into dictionaries, as by csv.DictReader, if the headers are not the expected
+        headers or CSV_ROW_TYPE is "dict"
+        """
+        unexpected_headers = "NHS_NUMBER|PERSON_FORENAME\n1|A\n2|B"
+        self.assertEqual(
+            list(read_csv_rows(StringIO(unexpected_headers))),
+            [{"NHS_NUMBER": "1", "PERSON_FORENAME": "A"}, {"NHS_NUMBER": "2", "PERSON_FORENAME": "B"}],
+        )
+        with patch.dict("os.environ", {"CSV_ROW_TYPE": "dict"}):
+            self.assertEqual(
+                list(read_csv_rows(StringIO(FILE_CONTENT))), list(DictReader(StringIO(FILE_CONTENT), delimiter="|"))
+            )
+
+    def test_get_csv_row_type(self):
+        """Test that the row type is read from the environment, defaulting to tuple"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_csv_row_type(), "tuple")
+        with patch.dict("os.environ", {"CSV_ROW_TYPE": "DICT"}):
+            self.assertEqual(get_csv_row_type(), "dict")
+
+    def test_csv_row_conversion_matches_dict_conversion(self):
+        """
+        Test that the resources and json converted from CsvRows are identical to those converted from the same rows
+        as dictionaries, for the test fixtures and for rows with randomly chosen fields empty or missing, both with
+        and without the columns converted first
+        """
+        rows = [
+            all_fields,
+            mandatory_fields_only,
+            critical_fields_only,
+            update_request_dose_sequence_missing,
+            update_request_dose_sequence_string,
+            {},
+        ]
+        rng = random.Random(20241021)
+        for _ in range(200):
+            rows.append(
+                {key: value if rng.random() < 0.6 else "" for key, value in all_fields.items() if rng.random() < 0.9}
+            )
+
+        for vaccine in Vaccine:
+            with self.subTest(vaccine=vaccine):
+                for convert in (convert_to_fhir_imms_resource, encode_fhir_imms_resource):
+                    expected = [encode_resource(convert(row, vaccine)) for row in rows]
+                    csv_rows = [to_csv_row(row) for row in rows]
+                    self.assertEqual([encode_resource(convert(row, vaccine)) for row in csv_rows], expected)
+
+                    convert_columns(csv_rows)
+                    self.assertTrue(all(row.__class__ is CsvRow for row in csv_rows))
+                    self.assertEqual([encode_resource(convert(row, vaccine, True)) for row in csv_rows], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Tests for failure_acks"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+from moto import mock_sqs
+from boto3 import client as boto3_client
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from constants import Diagnostics  # noqa: E402
+from failure_acks import FailedRow, FailureAckSender, get_failure_ack_queue_url  # noqa: E402
+from kinesis_record_aggregator import KinesisRecordAggregator, encode_row, send_encoded_rows  # noqa: E402
+from partition_strategies import SupplierPartitionStrategy  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import AWS_REGION  # noqa: E402
+
+sqs_client = boto3_client("sqs", region_name=AWS_REGION)
+
+FILE_DETAILS = {
+    "file_key": "flu_Vaccinations_v5_8HK48_20210730T12000000.csv",
+    "supplier": "EMIS",
+    "created_at_formatted_string": "20211120T12000000",
+}
+
+
+def make_row_details(index: int) -> dict:
+    """Returns details from processing for the row with the given index, which fails every third row"""
+    if index % 3 == 0:
+        return {"diagnostics": Diagnostics.NO_PERMISSIONS, "operation_requested": "UPDATE", "local_id": f"{index}^a"}
+    return {"fhir_json": {"resourceType": "Immunization"}, "operation_requested": "CREATE", "local_id": f"{index}^a"}
+
+
+def expected_ack_message_body(index: int) -> dict:
+    """Returns the failure ack message body which the forwarder would send for the row with the given index"""
+    return {
+        "diagnostics": Diagnostics.NO_PERMISSIONS,
+        "supplier": FILE_DETAILS["supplier"],
+        "file_key": FILE_DETAILS["file_key"],
+        "row_id": f"file^{index}",
+        "created_at_formatted_string": FILE_DETAILS["created_at_formatted_string"],
+        "local_id": f"{index}^a",
+    }
+
+
+class TestFailureAcks(unittest.TestCase):
+    """Tests for FailureAckSender, and the routing of failed rows to it by KinesisRecordAggregator"""
+
+    def setUp(self):
+        self.mock_kinesis_sender = MagicMock()
+        self.mock_kinesis_sender.put_record.side_effect = lambda _data, _key, row_ids: [(r, True) for r in row_ids]
+        self.mock_kinesis_sender.flush.return_value = []
+
+    def test_encode_row_marks_failed_rows(self):
+        """Tests that only rows with diagnostics are encoded as FailedRows, which are identical to the encoded row"""
+        failed_row = encode_row("file^3", make_row_details(3), FILE_DETAILS)
+        self.assertIs(failed_row.__class__, FailedRow)
+        self.assertEqual(json.loads(failed_row), {"row_id": "file^3", **FILE_DETAILS, **make_row_details(3)})
+        self.assertIs(encode_row("file^1", make_row_details(1), FILE_DETAILS).__class__, bytes)
+
+    @mock_sqs
+    def test_failed_rows_are_acked_directly(self):
+        """
+        Tests that, with a failure ack sender, the failed rows are sent to the ack queue in batches of up to 10, with
+        the message bodies sent by the forwarder, and that only the other rows are sent to Kinesis
+        """
+        queue_url = sqs_client.create_queue(
+            QueueName="ack-metadata-queue.fifo",
+            Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+        )["QueueUrl"]
+        for max_rows_per_record in (1, 5):
+            with self.subTest(max_rows_per_record=max_rows_per_record):
+                self.mock_kinesis_sender.put_record.reset_mock()
+                aggregator = KinesisRecordAggregator(
+                    self.mock_kinesis_sender,
+                    FILE_DETAILS,
+                    max_rows_per_record,
+                    failure_ack_sender=FailureAckSender(queue_url, FILE_DETAILS),
+                )
+                encoded_rows = [
+                    (f"file^{index}", f"{index}^a", encode_row(f"file^{index}", make_row_details(index)))
+                    for index in range(1, 46)
+                ]
+                row_count, rows_not_delivered = send_encoded_rows(
+                    encoded_rows, aggregator, SupplierPartitionStrategy("EMIS")
+                )
+                results = aggregator.flush()
+
+                self.assertEqual((row_count, rows_not_delivered), (45, 0))
+                # The first 10 failure acks are sent as soon as the batch is full, and the rest on the final flush
+                self.assertEqual(results, [(f"file^{index}", True) for index in range(33, 46, 3)])
+                kinesis_row_ids = [
+                    row_id for call in self.mock_kinesis_sender.put_record.call_args_list for row_id in call.args[2]
+                ]
+                self.assertEqual(kinesis_row_ids, [f"file^{index}" for index in range(1, 46) if index % 3])
+                self.assertEqual(
+                    aggregator.routing_counts(),
+                    {
+                        "kinesis_rows": 30,
+                        "kinesis_records": 30 // max_rows_per_record,
+                        "direct_failure_acks": 15,
+                        "direct_failure_ack_batches": 2,
+                    },
+                )
+
+                messages = []
+                while response := sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10):
+                    if not response.get("Messages"):
+                        break
+                    for message in response["Messages"]:
+                        messages.append(json.loads(message["Body"]))
+                        sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"])
+                self.assertEqual(messages, [expected_ack_message_body(index) for index in range(3, 46, 3)])
+
+    def test_failed_rows_are_sent_to_kinesis_without_a_failure_ack_sender(self):
+        """Tests that, without a failure ack sender, failed rows are sent to Kinesis like any other row"""
+        aggregator = KinesisRecordAggregator(self.mock_kinesis_sender, FILE_DETAILS)
+        results = aggregator.add_encoded_row("file^3", encode_row("file^3", make_row_details(3), FILE_DETAILS), "EMIS")
+
+        self.assertEqual(results, [("file^3", True)])
+        self.assertEqual(aggregator.routing_counts()["kinesis_rows"], 1)
+        self.assertEqual(aggregator.routing_counts()["direct_failure_acks"], 0)
+
+    def test_failed_entries_are_retried(self):
+        """Tests that entries which fail are retried, and that entries which fail every attempt are not delivered"""
+        responses = [
+            {"Successful": [{"Id": "0"}], "Failed": [{"Id": "1", "Code": "InternalError", "SenderFault": False}]},
+            {"Successful": [], "Failed": [{"Id": "1", "Code": "InternalError", "SenderFault": False}]},
+        ]
+        with patch("failure_acks.sqs_client.send_message_batch", side_effect=responses) as mock_send_message_batch:
+            sender = FailureAckSender("queue_url", FILE_DETAILS, max_attempts=2, base_backoff_seconds=0)
+            for index in (3, 6):
+                sender.add_row(f"file^{index}", encode_row(f"file^{index}", make_row_details(index)))
+            results = sender.flush()
+
+        self.assertEqual(results, [("file^3", True), ("file^6", False)])
+        self.assertEqual(len(mock_send_message_batch.call_args_list[1].kwargs["Entries"]), 1)
+        self.assertEqual((sender.messages_sent, sender.batches_sent), (1, 2))
+
+    def test_get_failure_ack_queue_url(self):
+        """Tests that the queue url is read from SQS_QUEUE_URL, and is None if that is not set"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertIsNone(get_failure_ack_queue_url())
+        with patch.dict("os.environ", {"SQS_QUEUE_URL": "queue_url"}):
+            self.assertEqual(get_failure_ack_queue_url(), "queue_url")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,336 @@
+"""Tests for processing a file which has been split into shards"""
+
+import unittest
+from collections import Counter
+from unittest.mock import patch
+from csv import DictReader
+from io import BytesIO, StringIO
+from moto import mock_s3, mock_kinesis
+from boto3 import client as boto3_client
+from tempfile import TemporaryDirectory
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from file_shards import coalesce_moved_rows, get_checkpoint_id  # noqa: E402
+from batch_processing import process_csv_to_fhir  # noqa: E402
+from checkpoints import CheckpointTracker, LocalFileCheckpointStore  # noqa: E402
+from convert_rows import RowChunker  # noqa: E402
+from scan_csv_file import scan_csv, scan_csv_file_shard  # noqa: E402
+from utils_for_recordprocessor import get_file_streaming_body  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    AWS_REGION,
+    CONFIG_BUCKET_NAME,
+    DESTINATION_BUCKET_NAME,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+    MOCK_ENVIRONMENT_DICT,
+    MOCK_PERMISSIONS,
+    PERMISSIONS_FILE_KEY,
+    SOURCE_BUCKET_NAME,
+    STREAM_NAME,
+    TEST_EVENT_DUMPED,
+    TEST_FILE_ID,
+    TEST_FILE_KEY,
+)
+
+s3_client = boto3_client("s3", region_name=AWS_REGION)
+kinesis_client = boto3_client("kinesis", region_name=AWS_REGION)
+
+# Includes a blank line and a quoted newline. The NEW rows share a local_id, which has rows in every shard, while
+# each UPDATE row has its own local_id.
+FILE_CONTENT = "\n".join(
+    [FILE_HEADERS]
+    + [
+        [FILE_ROW_NEW, FILE_ROW_UPDATE.replace("0002_COVID19_v1_DOSE_1", f"0002_COVID19_v1_DOSE_{index}"), ""][
+            index % 3
+        ]
+        for index in range(30)
+    ]
+    + [FILE_ROW_NEW.replace('"SABINA"', '"SAB\nINA"')]
+)
+FILE_SCAN = scan_csv(BytesIO(FILE_CONTENT.encode("utf-8")))
+LOCAL_IDS = [f"{row['UNIQUE_ID']}^{row['UNIQUE_ID_URI']}" for row in DictReader(StringIO(FILE_CONTENT), delimiter="|")]
+
+
+def make_shards(first_row_numbers: list) -> list:
+    """
+    Returns the shards of the file which start at the given row numbers, as planned by filenameprocessor, with the
+    rows of each local_id moved to the shard with its first row
+    """
+    shard_indexes = [
+        sum(row_number >= first_row_number for first_row_number in first_row_numbers) - 1
+        for row_number in range(1, FILE_SCAN.row_count + 1)
+    ]
+    first_shard_indexes = {}
+    for local_id, shard_index in zip(LOCAL_IDS, shard_indexes):
+        first_shard_indexes.setdefault(local_id, shard_index)
+
+    shards = [
+        {
+            "shard_index": shard_index,
+            "shard_count": len(first_row_numbers),
+            "start_byte": FILE_SCAN.row_offset(first_row_number - 1),
+            "end_byte": FILE_SCAN.row_offset(
+                first_row_numbers[shard_index + 1] - 1
+                if shard_index + 1 < len(first_row_numbers)
+                else FILE_SCAN.row_count
+            ),
+            "first_row_number": first_row_number,
+            "moved_rows": [],
+            "skipped_row_numbers": [],
+            "action_flags": sorted(FILE_SCAN.action_flags),
+        }
+        for shard_index, first_row_number in enumerate(first_row_numbers)
+    ]
+    for row_index, (local_id, shard_index) in enumerate(zip(LOCAL_IDS, shard_indexes)):
+        if (first_shard_index := first_shard_indexes[local_id]) != shard_index:
+            shards[first_shard_index]["moved_rows"].append(
+                [row_index + 1, FILE_SCAN.row_offset(row_index), FILE_SCAN.row_offset(row_index + 1)]
+            )
+            shards[shard_index]["skipped_row_numbers"].append(row_index + 1)
+    return shards
+
+
+def upload_shard_plan(shards: list) -> list:
+    """
+    Uploads the moved rows and skipped row numbers of the shards to the ack bucket, as filenameprocessor does, and
+    returns the shards as they are given in the message for each shard
+    """
+    plan_key = f"shard_plans/{TEST_FILE_ID}.json"
+    plan = {
+        "shards": [
+            {"moved_rows": shard["moved_rows"], "skipped_row_numbers": shard["skipped_row_numbers"]} for shard in shards
+        ]
+    }
+    s3_client.put_object(Bucket=DESTINATION_BUCKET_NAME, Key=plan_key, Body=json.dumps(plan))
+    return [
+        {
+            **{key: value for key, value in shard.items() if key not in ("moved_rows", "skipped_row_numbers")},
+            "plan_key": plan_key,
+        }
+        for shard in shards
+    ]
+
+
+class TestFileShards(unittest.TestCase):
+    """Tests for scanning a shard, get_checkpoint_id and RowChunker with a range of rows"""
+
+    def test_scan_shard(self):
+        """Tests that scanning only the bytes of a shard finds the same row offsets as scanning the whole file"""
+        file_bytes = FILE_CONTENT.encode("utf-8")
+        shard = make_shards([1, 8, 20])[1]
+        start_byte, end_byte = shard["start_byte"], shard["end_byte"]
+        shard_scan = scan_csv(
+            BytesIO(file_bytes[start_byte:end_byte]), FILE_SCAN.headers, start_byte, shard["first_row_number"] - 1
+        )
+
+        self.assertEqual(FILE_SCAN.row_count, 21)
+        self.assertEqual((shard_scan.first_row_index, shard_scan.row_count), (7, 19))
+        self.assertEqual(list(shard_scan.row_offsets), list(FILE_SCAN.row_offsets[7:19]))
+        self.assertEqual(shard_scan.row_offset(19), FILE_SCAN.row_offset(19))
+
+    def test_get_checkpoint_id(self):
+        """Tests that each shard is checkpointed separately"""
+        self.assertEqual(get_checkpoint_id(TEST_FILE_ID, None), TEST_FILE_ID)
+        self.assertEqual(get_checkpoint_id(TEST_FILE_ID, make_shards([1, 8])[1]), f"{TEST_FILE_ID}_1")
+
+    def test_coalesce_moved_rows(self):
+        """Tests that moved rows are grouped into ranges, split where the gap or the range would be too large"""
+        moved_rows = [[1, 0, 10], [2, 10, 20], [5, 40, 50], [9, 200, 210], [10, 210, 300]]
+        self.assertEqual(
+            list(coalesce_moved_rows(moved_rows, max_gap_bytes=20, max_range_bytes=90)),
+            [(0, 50, moved_rows[:3]), (200, 210, moved_rows[3:4]), (210, 300, moved_rows[4:])],
+        )
+
+    def test_row_chunker_stops_at_end_row(self):
+        """Tests that only the rows of the range are cut into chunks, when the bytes start at the first row"""
+        file_bytes = FILE_CONTENT.encode("utf-8")
+        start, end = FILE_SCAN.row_offset(7), FILE_SCAN.row_offset(19)
+        row_chunker = RowChunker(FILE_SCAN, rows_per_chunk=5, start_row_index=7, end_row_index=19)
+        chunks = row_chunker.feed(file_bytes[start:]) + row_chunker.finish()
+
+        self.assertEqual([first_row_index for first_row_index, _ in chunks], [7, 12, 17])
+        self.assertEqual(b"".join(chunk for _, chunk in chunks), file_bytes[start:end])
+
+
+@patch.dict("os.environ", MOCK_ENVIRONMENT_DICT)
+@mock_s3
+@mock_kinesis
+class TestProcessShards(unittest.TestCase):
+    """Tests that the shards of a file are processed as if the whole file had been processed by one task"""
+
+    def setUp(self):
+        for bucket_name in [SOURCE_BUCKET_NAME, DESTINATION_BUCKET_NAME, CONFIG_BUCKET_NAME]:
+            s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=FILE_CONTENT)
+        s3_client.put_object(Bucket=CONFIG_BUCKET_NAME, Key=PERMISSIONS_FILE_KEY, Body=json.dumps(MOCK_PERMISSIONS))
+
+    @staticmethod
+    def get_sent_rows() -> list:
+        """Returns each row sent to the stream"""
+        shard_id = kinesis_client.describe_stream(StreamName=STREAM_NAME)["StreamDescription"]["Shards"][0]["ShardId"]
+        shard_iterator = kinesis_client.get_shard_iterator(
+            StreamName=STREAM_NAME, ShardId=shard_id, ShardIteratorType="TRIM_HORIZON"
+        )["ShardIterator"]
+        return [
+            json.loads(record["Data"]) for record in kinesis_client.get_records(ShardIterator=shard_iterator)["Records"]
+        ]
+
+    def test_shards_send_the_same_rows_as_the_whole_file(self):
+        """Tests that, for each processing method, the shards together send the same rows as the whole file"""
+        for environment in (
+            {"PROCESSING_PIPELINE": "serial"},
+            {"PROCESSING_PIPELINE": "async"},
+            {"CONVERSION_WORKERS": "2"},
+        ):
+            with self.subTest(environment=environment), patch.dict("os.environ", environment):
+                kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+                process_csv_to_fhir(json.loads(TEST_EVENT_DUMPED))
+                unsharded_rows = self.get_sent_rows()
+                kinesis_client.delete_stream(StreamName=STREAM_NAME)
+
+                kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+                # The shards may be processed in any order
+                for shard in reversed(upload_shard_plan(make_shards([1, 8, 20]))):
+                    process_csv_to_fhir({**json.loads(TEST_EVENT_DUMPED), "shard": shard})
+                sharded_rows = self.get_sent_rows()
+                kinesis_client.delete_stream(StreamName=STREAM_NAME)
+
+                self.assertEqual(len(unsharded_rows), 21)
+                self.assertEqual(
+                    sorted(sharded_rows, key=lambda row: int(row["row_id"].split("^")[1])),
+                    sorted(unsharded_rows, key=lambda row: int(row["row_id"].split("^")[1])),
+                )
+                # The rows of each local_id are sent in file order
+                for local_id in set(LOCAL_IDS):
+                    for rows in (unsharded_rows, sharded_rows):
+                        row_numbers = [int(row["row_id"].split("^")[1]) for row in rows if row["local_id"] == local_id]
+                        self.assertEqual(row_numbers, sorted(row_numbers))
+
+    def test_shard_summaries_add_up_to_the_whole_file(self):
+        """
+        Tests that, for each processing method, the rows which a shard skips (as another shard sends them) are not
+        counted in its summary, so the summaries of the shards add up to the summary of the whole file
+        """
+        for environment in (
+            {"PROCESSING_PIPELINE": "serial"},
+            {"PROCESSING_PIPELINE": "async"},
+            {"CONVERSION_WORKERS": "2"},
+        ):
+            with self.subTest(environment=environment), patch.dict("os.environ", environment):
+                kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+                (unsharded_summary,) = self.get_summaries([json.loads(TEST_EVENT_DUMPED)])
+                shard_summaries = self.get_summaries(
+                    [
+                        {**json.loads(TEST_EVENT_DUMPED), "shard": shard}
+                        for shard in upload_shard_plan(make_shards([1, 8, 20]))
+                    ]
+                )
+                kinesis_client.delete_stream(StreamName=STREAM_NAME)
+
+                for field in ("rows_processed", "rows_sent", "rows_not_sent"):
+                    self.assertEqual(sum(summary[field] for summary in shard_summaries), unsharded_summary[field])
+                for field in ("operations", "diagnostics"):
+                    self.assertEqual(
+                        sum((Counter(summary[field]) for summary in shard_summaries), Counter()),
+                        Counter(unsharded_summary[field]),
+                    )
+
+    @staticmethod
+    def get_summaries(messages: list) -> list:
+        """Processes each message, and returns the summary logged for each"""
+        summaries = []
+        for message in messages:
+            with patch("row_logging.logger.info") as mock_info:
+                process_csv_to_fhir(message)
+            summaries.extend(
+                json.loads(call.args[1])
+                for call in mock_info.call_args_list
+                if call.args[0] == "File processing summary: %s"
+            )
+        return summaries
+
+    def test_moved_rows_are_fetched_in_coalesced_ranges(self):
+        """
+        Tests that the moved rows of a shard are fetched in one ranged GET, rather than one per row, and that only the
+        moved rows of the range are sent
+        """
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        planned_shard = make_shards([1, 8, 20])[0]
+        moved_row_numbers = [row_number for row_number, _, _ in planned_shard["moved_rows"]]
+        shard = upload_shard_plan([planned_shard])[0]
+        self.assertEqual(len(moved_row_numbers), 7)
+        with patch("file_shards.get_file_streaming_body", wraps=get_file_streaming_body) as mock_get_body:
+            process_csv_to_fhir({**json.loads(TEST_EVENT_DUMPED), "shard": shard})
+
+        mock_get_body.assert_called_once()
+        sent_row_numbers = sorted(int(row["row_id"].split("^")[1]) for row in self.get_sent_rows())
+        self.assertEqual(sent_row_numbers, sorted(list(range(1, 8)) + moved_row_numbers))
+
+    def test_restarted_shard_only_sends_moved_rows_after_the_checkpoint(self):
+        """Tests that a shard restarted after some of its moved rows were sent only sends the remaining moved rows"""
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        planned_shard = make_shards([1, 8, 20])[0]
+        moved_row_numbers = [row_number for row_number, _, _ in planned_shard["moved_rows"]]
+        shard = upload_shard_plan([planned_shard])[0]
+        with TemporaryDirectory() as checkpoint_directory, patch.dict(
+            "os.environ", {"CHECKPOINT_STORE": "file", "CHECKPOINT_DIRECTORY": checkpoint_directory}
+        ):
+            checkpoint_store = LocalFileCheckpointStore(checkpoint_directory)
+            checkpoint_id = get_checkpoint_id(TEST_FILE_ID, shard)
+            CheckpointTracker(
+                checkpoint_store,
+                checkpoint_id,
+                TEST_FILE_KEY,
+                scan_csv_file_shard(SOURCE_BUCKET_NAME, TEST_FILE_KEY, shard),
+                end_row_count=7,
+                interval_rows=1,
+                moved_row_numbers=moved_row_numbers,
+            ).record_results([(f"{TEST_FILE_ID}^{row}", True) for row in list(range(1, 8)) + moved_row_numbers[:3]])
+
+            process_csv_to_fhir({**json.loads(TEST_EVENT_DUMPED), "shard": shard})
+
+            sent_row_numbers = [int(row["row_id"].split("^")[1]) for row in self.get_sent_rows()]
+            self.assertEqual(sorted(sent_row_numbers), sorted(moved_row_numbers[3:]))
+            checkpoint = checkpoint_store.load(checkpoint_id)
+            self.assertEqual((checkpoint["moved_rows_sent"], checkpoint["completed"]), (7, True))
+
+    def test_shard_without_a_plan_is_not_processed(self):
+        """
+        Tests that a shard is not processed if its plan has been deleted, as filenameprocessor does when the messages
+        for the shards could not all be sent
+        """
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        shard = upload_shard_plan(make_shards([1, 8, 20]))[1]
+        s3_client.delete_object(Bucket=DESTINATION_BUCKET_NAME, Key=shard["plan_key"])
+
+        with self.assertLogs(level="ERROR"):
+            process_csv_to_fhir({**json.loads(TEST_EVENT_DUMPED), "shard": shard})
+        self.assertEqual(self.get_sent_rows(), [])
+
+    def test_shards_do_not_write_the_row_ack_file(self):
+        """Tests that the ack file of the rows is not written by a shard, which only processes some of the rows"""
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        with patch.dict("os.environ", {"WRITE_ROW_ACK_FILE": "true"}), self.assertLogs(level="WARNING"):
+            for shard in upload_shard_plan(make_shards([1, 8, 20])):
+                process_csv_to_fhir({**json.loads(TEST_EVENT_DUMPED), "shard": shard})
+
+        ack_file_keys = [obj["Key"] for obj in s3_client.list_objects_v2(Bucket=DESTINATION_BUCKET_NAME)["Contents"]]
+        self.assertFalse(any(key.startswith("processedFile/") for key in ack_file_keys))
+
+    def test_only_first_shard_uploads_ack_file(self):
+        """Tests that the ack file for the whole file is only uploaded by the first shard"""
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        with patch("batch_processing.make_and_upload_ack_file") as mock_make_and_upload_ack_file:
+            for shard in upload_shard_plan(make_shards([1, 8, 20])):
+                process_csv_to_fhir({**json.loads(TEST_EVENT_DUMPED), "shard": shard})
+        mock_make_and_upload_ack_file.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests for kinesis_record_aggregator"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+from moto import mock_kinesis
+from boto3 import client as boto3_client
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from kinesis_record_aggregator import KinesisRecordAggregator, get_rows_per_kinesis_record  # noqa: E402
+from send_to_kinesis import KinesisBatchSender  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    AWS_REGION,
+    STREAM_NAME,
+)
+
+kinesis_client = boto3_client("kinesis", region_name=AWS_REGION)
+
+FILE_DETAILS = {
+    "file_key": "flu_Vaccinations_v5_8HK48_20210730T12000000.csv",
+    "supplier": "EMIS",
+    "created_at_formatted_string": "20211120T12000000",
+}
+
+
+def make_row_details(index: int) -> dict:
+    """Returns details from processing for the row with the given index"""
+    return {"fhir_json": {"resourceType": "Immunization", "id": f"£{index}"}, "operation_requested": "CREATE"}
+
+
+class TestKinesisRecordAggregator(unittest.TestCase):
+    """Tests for KinesisRecordAggregator"""
+
+    def setUp(self):
+        self.mock_sender = MagicMock()
+        self.mock_sender.put_record.side_effect = lambda _data, _key, row_ids: [(row_id, True) for row_id in row_ids]
+        self.mock_sender.flush.return_value = []
+
+    def sent_records(self) -> list:
+        """Returns the (decoded data, partition key, row_ids) of each record passed to the sender"""
+        return [
+            (json.loads(call.args[0].decode("utf-8")), call.args[1], call.args[2])
+            for call in self.mock_sender.put_record.call_args_list
+        ]
+
+    def test_single_row_records(self):
+        """Tests that, with one row per record, each row is sent as a version 1 message body"""
+        aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS)
+        results = aggregator.add_row("file^1", make_row_details(1), "EMIS")
+
+        self.assertEqual(results, [("file^1", True)])
+        expected_message_body = {"row_id": "file^1", **FILE_DETAILS, **make_row_details(1)}
+        self.assertEqual(self.sent_records(), [(expected_message_body, "EMIS", ["file^1"])])
+        self.assertNotIn("version", expected_message_body)
+
+    def test_rows_are_aggregated(self):
+        """Tests that rows are packed, in order, into version 2 records of up to max_rows_per_record rows"""
+        aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS, max_rows_per_record=3)
+        results = []
+        for index in range(1, 8):
+            results.extend(aggregator.add_row(f"file^{index}", make_row_details(index), "EMIS"))
+        results.extend(aggregator.flush())
+
+        self.assertEqual(results, [(f"file^{index}", True) for index in range(1, 8)])
+        records = self.sent_records()
+        self.assertEqual(
+            [row_ids for _, _, row_ids in records],
+            [["file^1", "file^2", "file^3"], ["file^4", "file^5", "file^6"], ["file^7"]],
+        )
+        for data, partition_key, row_ids in records:
+            self.assertEqual(partition_key, "EMIS")
+            self.assertEqual(data["version"], 2)
+            self.assertEqual(data["file"], FILE_DETAILS)
+            self.assertEqual(
+                data["rows"],
+                [{"row_id": row_id, **make_row_details(int(row_id.split("^")[1]))} for row_id in row_ids],
+            )
+        self.mock_sender.flush.assert_called_once()
+
+    def test_rows_are_aggregated_per_partition_key(self):
+        """Tests that rows are only aggregated with rows which share their partition key"""
+        aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS, max_rows_per_record=2)
+        for index, partition_key in enumerate(["A", "B", "A", "B", "A"], start=1):
+            aggregator.add_row(f"file^{index}", make_row_details(index), partition_key)
+        aggregator.flush()
+
+        self.assertEqual(
+            [(partition_key, row_ids) for _, partition_key, row_ids in self.sent_records()],
+            [("A", ["file^1", "file^3"]), ("B", ["file^2", "file^4"]), ("A", ["file^5"])],
+        )
+
+    def test_records_do_not_exceed_max_record_bytes(self):
+        """Tests that a record is sent early if the next row would take it over the record size limit"""
+        aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS, max_rows_per_record=100)
+        one_row_record_size = (
+            len(aggregator._record_prefix + aggregator._record_suffix)
+            + len("EMIS")
+            + len(json.dumps({"row_id": "file^1", **make_row_details(1)}, ensure_ascii=False).encode("utf-8"))
+        )
+        # Room for two rows (and the separator between them) but not three
+        aggregator.max_record_bytes = 3 * one_row_record_size // 2 + 10
+        for index in range(1, 6):
+            aggregator.add_row(f"file^{index}", make_row_details(index), "EMIS")
+        aggregator.flush()
+
+        self.assertEqual(
+            [row_ids for _, _, row_ids in self.sent_records()],
+            [["file^1", "file^2"], ["file^3", "file^4"], ["file^5"]],
+        )
+        for call in self.mock_sender.put_record.call_args_list:
+            self.assertLessEqual(len(call.args[0]) + len("EMIS"), aggregator.max_record_bytes)
+
+    @mock_kinesis
+    def test_aggregated_records_are_sent_to_the_stream(self):
+        """Tests that aggregated records are written to the stream, in order, and every row is reported"""
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+        aggregator = KinesisRecordAggregator(KinesisBatchSender(STREAM_NAME), FILE_DETAILS, max_rows_per_record=2)
+        results = []
+        for index in range(1, 6):
+            results.extend(aggregator.add_row(f"file^{index}", make_row_details(index), "EMIS"))
+        results.extend(aggregator.flush())
+
+        self.assertEqual(results, [(f"file^{index}", True) for index in range(1, 6)])
+        shard_iterator = kinesis_client.get_shard_iterator(
+            StreamName=STREAM_NAME, ShardId="shardId-000000000000", ShardIteratorType="TRIM_HORIZON"
+        )["ShardIterator"]
+        records = kinesis_client.get_records(ShardIterator=shard_iterator)["Records"]
+        self.assertEqual(
+            [[row["row_id"] for row in json.loads(record["Data"])["rows"]] for record in records],
+            [["file^1", "file^2"], ["file^3", "file^4"], ["file^5"]],
+        )
+
+    def test_get_rows_per_kinesis_record(self):
+        """Tests that the number of rows per record is read from the environment, defaulting to 1"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_rows_per_kinesis_record(), 1)
+        with patch.dict("os.environ", {"ROWS_PER_KINESIS_RECORD": "50"}):
+            self.assertEqual(get_rows_per_kinesis_record(), 50)
+        with patch.dict("os.environ", {"ROWS_PER_KINESIS_RECORD": "0"}):
+            self.assertEqual(get_rows_per_kinesis_record(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,7 +15,9 @@ maindir = os.path.dirname(__file__)
 srcdir = "../src"
 sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
 from batch_processing import main  # noqa: E402
+from ack_file_assembler import AckFileAssembler  # noqa: E402
 from constants import Diagnostics  # noqa: E402
+from partition_strategies import LocalIdPartitionStrategy  # noqa: E402
 from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
     SOURCE_BUCKET_NAME,
     DESTINATION_BUCKET_NAME,
@@ -50,7 +52,7 @@ kinesis_client = boto3_client("kinesis", region_name=AWS_REGION)
 yesterday = datetime.now(timezone.utc) - timedelta(days=1)
 
 
-@patch.dict("os.environ", MOCK_ENVIRONMENT_DICT)
+@patch.dict("os.environ", {**MOCK_ENVIRONMENT_DICT, "WRITE_ROW_ACK_FILE": "true"})
 @mock_s3
 @mock_kinesis
 class TestRecordProcessor(unittest.TestCase):
@@ -112,11 +114,11 @@ class TestRecordProcessor(unittest.TestCase):
         The standard key-value pairs
         {row_id: {TEST_FILE_ID}^{index+1}, file_key: TEST_FILE_KEY, supplier: TEST_SUPPLIER} are added to the
         expected_kinesis_data dictionary before assertions are made.
-        For each index, assertions will be made on the record found at the given index in the kinesis response.
+        For each index, assertions will be made on the kinesis record carrying the row {TEST_FILE_ID}^{index+1}.
         Assertions made:
-        * Kinesis PartitionKey is TEST_SUPPLIER
-        * Kinesis SequenceNumber is index + 1
-        * Kinesis ApproximateArrivalTimestamp is later than the timestamp for the preceeding data row
+        * Kinesis PartitionKey is the key given to the row's local_id by the (default) local_id partition strategy
+        * Kinesis SequenceNumber and ApproximateArrivalTimestamp are later than those of the preceding data row with
+          the same local_id (rows with different local_ids may be sent in a different order)
         * Where expected_success is True:
             - "fhir_json" key is found in the Kinesis data
             - Kinesis Data is equal to the expected_kinesis_data when ignoring the "fhir_json"
@@ -126,23 +128,34 @@ class TestRecordProcessor(unittest.TestCase):
             - "{TEST_FILE_ID}^{index+1}|fatal-error" is found in the ack file
         """
 
-        # ack_file_content = self.get_ack_file_content()
-        kinesis_records = kinesis_client.get_records(ShardIterator=self.get_shard_iterator(), Limit=10)["Records"]
-        previous_approximate_arrival_time_stamp = yesterday  # Initialise with a time prior to the running of the test
+        ack_file_content = self.get_ack_file_content()
+        kinesis_records = {
+            json.loads(record["Data"])["row_id"]: record
+            for record in kinesis_client.get_records(ShardIterator=self.get_shard_iterator(), Limit=10)["Records"]
+        }
+        # The sequence number and arrival time of the preceding row of each local_id
+        previous_records = {}
 
         for test_name, index, expected_kinesis_data, expect_success in test_cases:
             with self.subTest(test_name):
 
-                kinesis_record = kinesis_records[index]
-                self.assertEqual(kinesis_record["PartitionKey"], TEST_SUPPLIER)
-                self.assertEqual(kinesis_record["SequenceNumber"], f"{index+1}")
-
-                # Ensure that arrival times are sequential
-                approximate_arrival_timestamp = kinesis_record["ApproximateArrivalTimestamp"]
-                self.assertGreater(approximate_arrival_timestamp, previous_approximate_arrival_time_stamp)
-                previous_approximate_arrival_time_stamp = approximate_arrival_timestamp
-
+                kinesis_record = kinesis_records[f"{TEST_FILE_ID}^{index+1}"]
                 kinesis_data = json.loads(kinesis_record["Data"].decode("utf-8"), parse_float=Decimal)
+                local_id = kinesis_data["local_id"]
+                self.assertEqual(
+                    kinesis_record["PartitionKey"],
+                    LocalIdPartitionStrategy(TEST_SUPPLIER).get_partition_key(local_id, index + 1),
+                )
+
+                # Ensure that the rows of each local_id are sent in order
+                previous_sequence_number, previous_arrival_timestamp = previous_records.get(local_id, (0, yesterday))
+                self.assertGreater(int(kinesis_record["SequenceNumber"]), previous_sequence_number)
+                self.assertGreater(kinesis_record["ApproximateArrivalTimestamp"], previous_arrival_timestamp)
+                previous_records[local_id] = (
+                    int(kinesis_record["SequenceNumber"]),
+                    kinesis_record["ApproximateArrivalTimestamp"],
+                )
+
                 expected_kinesis_data = {
                     "row_id": f"{TEST_FILE_ID}^{index+1}",
                     "file_key": TEST_FILE_KEY,
@@ -157,10 +170,10 @@ class TestRecordProcessor(unittest.TestCase):
                         self.assertIn(key_to_ignore, kinesis_data)
                         kinesis_data.pop(key_to_ignore)
                     self.assertEqual(kinesis_data, expected_kinesis_data)
-                    # self.assertIn(f"{TEST_FILE_ID}^{index+1}|OK", ack_file_content)
+                    self.assertIn(f"{TEST_FILE_ID}^{index+1}|OK", ack_file_content)
                 else:
                     self.assertEqual(kinesis_data, expected_kinesis_data)
-                    # self.assertIn(f"{TEST_FILE_ID}^{index+1}|Fatal", ack_file_content)
+                    self.assertIn(f"{TEST_FILE_ID}^{index+1}|Fatal", ack_file_content)
 
     def test_e2e_success(self):
         """
@@ -330,6 +343,28 @@ class TestRecordProcessor(unittest.TestCase):
         ]
         self.make_assertions(test_cases)
 
+    def test_e2e_ack_file_rows_are_in_row_order(self):
+        """
+        Tests that the rows of the ack file are in row order, although the records holding them are delivered in a
+        different order (the record holding rows 2 and 3, which share a local_id, is full and sent before row 1)
+        """
+        self.upload_files(VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE)
+
+        with patch.dict("os.environ", {"ROWS_PER_KINESIS_RECORD": "2"}), patch.object(
+            AckFileAssembler, "add_row", autospec=True, side_effect=AckFileAssembler.add_row
+        ) as mock_add_row:
+            main(TEST_EVENT_DUMPED)
+
+        self.assertEqual(
+            [call.args[1] for call in mock_add_row.call_args_list],
+            [f"{TEST_FILE_ID}^2", f"{TEST_FILE_ID}^3", f"{TEST_FILE_ID}^1"],
+        )
+        ack_rows = self.get_ack_file_content().splitlines()[1:]
+        self.assertEqual(
+            [ack_row.split("|")[:2] for ack_row in ack_rows],
+            [[f"{TEST_FILE_ID}^{row_number}", "OK"] for row_number in (1, 2, 3)],
+        )
+
     def test_e2e_kinesis_failed(self):
         """
         Tests that, for a file with valid content and supplier with full permissions, when the kinesis send fails, the
@@ -341,7 +376,7 @@ class TestRecordProcessor(unittest.TestCase):
 
         main(TEST_EVENT_DUMPED)
 
-        # self.assertIn("Fatal", self.get_ack_file_content())
+        self.assertIn("Fatal", self.get_ack_file_content())
 
 
 if __name__ == "__main__":
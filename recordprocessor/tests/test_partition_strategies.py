@@ -0,0 +1,223 @@
+"""Tests for partition_strategies"""
+
+import unittest
+from unittest.mock import patch
+from collections import defaultdict
+from moto import mock_kinesis
+from boto3 import client as boto3_client
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from partition_strategies import (  # noqa: E402
+    SupplierPartitionStrategy,
+    LocalIdPartitionStrategy,
+    RowRangePartitionStrategy,
+    get_partition_strategy,
+    DEFAULT_PARTITION_BUCKETS,
+)
+from kinesis_record_aggregator import (  # noqa: E402
+    KinesisRecordAggregator,
+    encode_row,
+    get_rows_per_kinesis_record,
+    send_encoded_rows,
+)
+from send_to_kinesis import KinesisBatchSender  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    AWS_REGION,
+    STREAM_NAME,
+)
+
+kinesis_client = boto3_client("kinesis", region_name=AWS_REGION)
+
+FILE_DETAILS = {"file_key": "test_file_key", "supplier": "EMIS", "created_at_formatted_string": "20211120T12000000"}
+
+
+def make_local_ids(number_of_local_ids: int, operations_per_local_id: int) -> list:
+    """Returns the local_id of each row of a file in which each local_id has several operations, interleaved"""
+    local_ids = [f"unique_id_{index}^https://www.ravs.england.nhs.uk/" for index in range(number_of_local_ids)]
+    return local_ids * operations_per_local_id
+
+
+class TestPartitionStrategies(unittest.TestCase):
+    """Tests for the partition strategies"""
+
+    def test_supplier_partition_strategy(self):
+        """Tests that every row is given the supplier as its partition key"""
+        strategy = SupplierPartitionStrategy("EMIS")
+        self.assertEqual(
+            {
+                strategy.get_partition_key(local_id, row_number)
+                for row_number, local_id in enumerate(make_local_ids(10, 2), 1)
+            },
+            {"EMIS"},
+        )
+
+    def test_local_id_partition_strategy(self):
+        """Tests that the rows are spread across the buckets, and that a local_id is always given the same key"""
+        local_ids = make_local_ids(200, 3)
+        strategy = LocalIdPartitionStrategy("EMIS", buckets=8)
+        partition_keys = [
+            strategy.get_partition_key(local_id, row_number) for row_number, local_id in enumerate(local_ids, 1)
+        ]
+
+        self.assertEqual(set(partition_keys), {f"EMIS-{bucket}" for bucket in range(8)})
+        keys_by_local_id = defaultdict(set)
+        for local_id, partition_key in zip(local_ids, partition_keys):
+            keys_by_local_id[local_id].add(partition_key)
+        self.assertTrue(all(len(keys) == 1 for keys in keys_by_local_id.values()))
+        # The hash is stable, so a new instance (e.g. in a new process) gives the same keys
+        self.assertEqual(
+            [LocalIdPartitionStrategy("EMIS", buckets=8).get_partition_key(local_id, 1) for local_id in local_ids],
+            partition_keys,
+        )
+
+    def test_row_range_partition_strategy(self):
+        """Tests that ranges of rows share a key, but that a repeated local_id keeps the key of its first row"""
+        strategy = RowRangePartitionStrategy("EMIS", rows_per_partition=2)
+        local_ids = ["a", "b", "c", "a", "d", "e", "b", "f"]
+        self.assertEqual(
+            [strategy.get_partition_key(local_id, row_number) for row_number, local_id in enumerate(local_ids, 1)],
+            ["EMIS-0", "EMIS-0", "EMIS-1", "EMIS-0", "EMIS-2", "EMIS-2", "EMIS-0", "EMIS-3"],
+        )
+
+    def test_row_range_partition_strategy_uses_absolute_row_numbers(self):
+        """
+        Tests that the partition of a row is given by its absolute row number, so that a task which starts part way
+        through the file (a shard task, or a task resuming from a checkpoint) gives the same keys
+        """
+        local_ids = [f"local_id_{index}" for index in range(10)]
+        whole_file_keys = [
+            RowRangePartitionStrategy("EMIS", rows_per_partition=3).get_partition_key(local_id, row_number)
+            for row_number, local_id in enumerate(local_ids, 1)
+        ]
+        strategy = RowRangePartitionStrategy("EMIS", rows_per_partition=3)
+        resumed_keys = [
+            strategy.get_partition_key(local_id, row_number)
+            for row_number, local_id in enumerate(local_ids, 1)
+            if row_number > 5
+        ]
+        self.assertEqual(resumed_keys, whole_file_keys[5:])
+
+    def test_row_range_partition_strategy_tracked_local_ids_are_bounded(self):
+        """Tests that only the most recently seen local_ids are remembered, so an evicted local_id gets a new key"""
+        strategy = RowRangePartitionStrategy("EMIS", rows_per_partition=2, max_tracked_local_ids=2)
+        local_ids = ["a", "b", "a", "c", "d", "a", "c"]
+        self.assertEqual(
+            [strategy.get_partition_key(local_id, row_number) for row_number, local_id in enumerate(local_ids, 1)],
+            ["EMIS-0", "EMIS-0", "EMIS-0", "EMIS-1", "EMIS-2", "EMIS-2", "EMIS-3"],
+        )
+        self.assertEqual(list(strategy._local_id_partitions), ["a", "c"])
+
+    def test_get_partition_strategy(self):
+        """Tests that the partition strategy is read from the environment, defaulting to local_id"""
+        with patch.dict("os.environ", {}, clear=True):
+            strategy = get_partition_strategy("EMIS")
+            self.assertIsInstance(strategy, LocalIdPartitionStrategy)
+            self.assertEqual(strategy.buckets, DEFAULT_PARTITION_BUCKETS)
+        with patch.dict("os.environ", {"KINESIS_PARTITION_STRATEGY": "local_id", "KINESIS_PARTITION_BUCKETS": "16"}):
+            strategy = get_partition_strategy("EMIS")
+            self.assertIsInstance(strategy, LocalIdPartitionStrategy)
+            self.assertEqual(strategy.buckets, 16)
+        with patch.dict("os.environ", {"KINESIS_PARTITION_STRATEGY": "supplier"}):
+            self.assertIsInstance(get_partition_strategy("EMIS"), SupplierPartitionStrategy)
+        with patch.dict(
+            "os.environ", {"KINESIS_PARTITION_STRATEGY": "ROW_RANGE", "KINESIS_ROW_RANGE_TRACKED_LOCAL_IDS": "50"}
+        ):
+            strategy = get_partition_strategy("EMIS")
+            self.assertIsInstance(strategy, RowRangePartitionStrategy)
+            self.assertEqual(strategy.max_tracked_local_ids, 50)
+
+
+@mock_kinesis
+class TestPartitioningAcrossShards(unittest.TestCase):
+    """Tests for the distribution of records across the shards of the stream"""
+
+    def setUp(self):
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=4)
+
+    @staticmethod
+    def get_rows_by_shard() -> dict:
+        """Returns the rows on each shard of the stream, in the order in which they are read from the shard"""
+        rows_by_shard = {}
+        for shard in kinesis_client.describe_stream(StreamName=STREAM_NAME)["StreamDescription"]["Shards"]:
+            shard_iterator = kinesis_client.get_shard_iterator(
+                StreamName=STREAM_NAME, ShardId=shard["ShardId"], ShardIteratorType="TRIM_HORIZON"
+            )["ShardIterator"]
+            records = kinesis_client.get_records(ShardIterator=shard_iterator, Limit=10000)["Records"]
+            rows_by_shard[shard["ShardId"]] = [
+                row
+                for record in records
+                for row in json.loads(record["Data"]).get("rows", [json.loads(record["Data"])])
+            ]
+        return rows_by_shard
+
+    def send_rows(self, local_ids: list, partition_strategy, rows_per_record: int) -> None:
+        """Sends a row for each local_id, using the given partition strategy"""
+        record_aggregator = KinesisRecordAggregator(KinesisBatchSender(STREAM_NAME), FILE_DETAILS, rows_per_record)
+        encoded_rows = [
+            (
+                f"file^{row_number}",
+                local_id,
+                encode_row(f"file^{row_number}", {"local_id": local_id}, record_aggregator.row_file_details),
+            )
+            for row_number, local_id in enumerate(local_ids, start=1)
+        ]
+        self.assertEqual(send_encoded_rows(encoded_rows, record_aggregator, partition_strategy), (len(local_ids), 0))
+        record_aggregator.flush()
+
+    def test_default_configuration_batches_records(self):
+        """
+        Tests that, with the default partition strategy and rows per record, rows with different local_ids are sent
+        in PutRecords requests carrying a record for each of the partition keys, rather than one record per request
+        """
+        local_ids = make_local_ids(2000, 1)
+        with patch.dict("os.environ", {}, clear=True):
+            partition_strategy = get_partition_strategy("EMIS")
+            rows_per_record = get_rows_per_kinesis_record()
+        with patch("send_to_kinesis.kinesis_client.put_records", wraps=kinesis_client.put_records) as mock_put:
+            self.send_rows(local_ids, partition_strategy, rows_per_record)
+
+        records_per_request = [len(call.kwargs["Records"]) for call in mock_put.call_args_list]
+        self.assertEqual(sum(records_per_request), 2000)
+        self.assertEqual(max(records_per_request), DEFAULT_PARTITION_BUCKETS)
+        # Only the requests sent as the buffer is flushed at the end of the file carry fewer records
+        self.assertGreater(sum(records_per_request) / len(records_per_request), DEFAULT_PARTITION_BUCKETS / 2)
+        self.assertEqual(sum(len(rows) for rows in self.get_rows_by_shard().values()), 2000)
+
+    def test_supplier_partitioning_uses_one_shard(self):
+        """Tests that partitioning by supplier sends every row to the same shard"""
+        self.send_rows(make_local_ids(100, 3), SupplierPartitionStrategy("EMIS"), rows_per_record=1)
+        self.assertEqual(sorted(len(rows) for rows in self.get_rows_by_shard().values()), [0, 0, 0, 300])
+
+    def test_local_id_partitioning_spreads_rows_across_shards_in_order(self):
+        """
+        Tests that partitioning by local_id spreads the rows across every shard, and that all of the rows for a
+        local_id are on one shard, in file order
+        """
+        for rows_per_record in (1, 10):
+            with self.subTest(rows_per_record=rows_per_record):
+                kinesis_client.delete_stream(StreamName=STREAM_NAME)
+                kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=4)
+                local_ids = make_local_ids(100, 3)
+                self.send_rows(local_ids, LocalIdPartitionStrategy("EMIS"), rows_per_record)
+
+                rows_by_shard = self.get_rows_by_shard()
+                self.assertTrue(all(len(rows) > 30 for rows in rows_by_shard.values()))
+                self.assertEqual(sum(len(rows) for rows in rows_by_shard.values()), 300)
+
+                shards_by_local_id = defaultdict(set)
+                row_numbers_by_local_id = defaultdict(list)
+                for shard_id, rows in rows_by_shard.items():
+                    for row in rows:
+                        shards_by_local_id[row["local_id"]].add(shard_id)
+                        row_numbers_by_local_id[row["local_id"]].append(int(row["row_id"].split("^")[1]))
+                self.assertTrue(all(len(shards) == 1 for shards in shards_by_local_id.values()))
+                self.assertTrue(all(numbers == sorted(numbers) for numbers in row_numbers_by_local_id.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests for process_row"""
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import simplejson as json
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from convert_to_fhir_imms_resource import convert_to_fhir_imms_resource  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from process_row import get_delete_payload, process_row  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import all_fields  # noqa: E402
+
+ALLOWED_OPERATIONS = {"CREATE", "UPDATE", "DELETE"}
+DELETE_ROW = {**all_fields, "ACTION_FLAG": "delete"}
+
+
+def decoded_fhir_json(details_from_processing: dict) -> dict:
+    """Returns the fhir_json of the details from processing as it is decoded by the forwarder"""
+    return json.loads(json.dumps(details_from_processing["fhir_json"]))
+
+
+class TestProcessRowDeletePayload(unittest.TestCase):
+    """Tests for the fhir_json of DELETE rows"""
+
+    def test_delete_row_identifier_only(self):
+        """Test that by default the fhir_json of a DELETE row holds only the identifier of the full resource"""
+        with patch("process_row.FULL_DELETE_PAYLOAD", False):
+            details_from_processing = process_row(Vaccine.RSV, ALLOWED_OPERATIONS, DELETE_ROW)
+
+        full_resource = convert_to_fhir_imms_resource(DELETE_ROW, Vaccine.RSV)
+        self.assertEqual(
+            decoded_fhir_json(details_from_processing),
+            {"resourceType": "Immunization", "identifier": full_resource["identifier"]},
+        )
+        self.assertEqual(details_from_processing["operation_requested"], "DELETE")
+
+    def test_delete_row_full_payload(self):
+        """Test that the fhir_json of a DELETE row is the full resource if the full payload is required"""
+        with patch("process_row.FULL_DELETE_PAYLOAD", True):
+            details_from_processing = process_row(Vaccine.RSV, ALLOWED_OPERATIONS, DELETE_ROW)
+
+        self.assertEqual(
+            decoded_fhir_json(details_from_processing),
+            json.loads(json.dumps(convert_to_fhir_imms_resource(DELETE_ROW, Vaccine.RSV))),
+        )
+
+    def test_other_rows_full_payload(self):
+        """Test that the fhir_json of CREATE and UPDATE rows is always the full resource"""
+        for action_flag in ("new", "update"):
+            with self.subTest(action_flag):
+                row = {**all_fields, "ACTION_FLAG": action_flag}
+                details_from_processing = process_row(Vaccine.RSV, ALLOWED_OPERATIONS, row)
+                self.assertEqual(
+                    decoded_fhir_json(details_from_processing),
+                    json.loads(json.dumps(convert_to_fhir_imms_resource(row, Vaccine.RSV))),
+                )
+
+    def test_get_delete_payload(self):
+        """Test that the DELETE payload is read from the environment, defaulting to identifier only"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_delete_payload(), "identifier")
+        with patch.dict("os.environ", {"DELETE_PAYLOAD": "FULL"}):
+            self.assertEqual(get_delete_payload(), "full")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from io import StringIO
+from io import StringIO, BytesIO
 from freezegun import freeze_time
 import json
 import csv
@@ -21,7 +21,8 @@ from batch_processing import (  # noqa: E402
     validate_action_flag_permissions,
 )
 from make_and_upload_ack_file import make_ack_data  # noqa: E402
-from utils_for_recordprocessor import get_csv_content_dict_reader, convert_string_to_dict_reader  # noqa: E402
+from utils_for_recordprocessor import get_csv_content_dict_reader  # noqa: E402
+from scan_csv_file import scan_csv  # noqa: E402
 from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
     SOURCE_BUCKET_NAME,
     DESTINATION_BUCKET_NAME,
@@ -180,61 +181,60 @@ class TestProcessLambdaFunction(unittest.TestCase):
     def test_fetch_file_from_s3(self):
         self.upload_source_file(TEST_FILE_KEY, VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
         expected_output = csv.DictReader(StringIO(VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE), delimiter="|")
-        result, csv_data = get_csv_content_dict_reader(SOURCE_BUCKET_NAME, TEST_FILE_KEY)
+        result = get_csv_content_dict_reader(SOURCE_BUCKET_NAME, TEST_FILE_KEY)
         self.assertEqual(list(result), list(expected_output))
-        self.assertEqual(csv_data, VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
 
         with patch("batch_processing.get_operation_permissions", return_value={"CREATE", "UPDATE", "DELETE"}):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("Success")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_DELETE)
 
         process_csv_to_fhir(TEST_EVENT_PERMISSION)
 
         # self.assert_value_in_ack_file("Success")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_positive_string_provided(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_positive_string_provided(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
 
         with patch("batch_processing.get_operation_permissions", return_value={"CREATE", "UPDATE", "DELETE"}):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("Success")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_only_mandatory(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_only_mandatory(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
 
         with patch("batch_processing.get_operation_permissions", return_value={"CREATE", "UPDATE", "DELETE"}):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("Success")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_positive_string_not_provided(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_positive_string_not_provided(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
 
         with patch("batch_processing.get_operation_permissions", return_value={"CREATE", "UPDATE", "DELETE"}):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("Success")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_paramter_missing(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_paramter_missing(self, mock_kinesis_sender):
         s3_client.put_object(
             Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE.replace("new", "")
         )
@@ -245,11 +245,11 @@ class TestProcessLambdaFunction(unittest.TestCase):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("Fatal")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
+    @patch("batch_processing.KinesisBatchSender")
     @freeze_time("2021-11-20, 12:00:00")
-    def test_process_csv_to_fhir_invalid_headers(self, mock_send_to_kinesis):
+    def test_process_csv_to_fhir_invalid_headers(self, mock_kinesis_sender):
         s3_client.put_object(
             Bucket=SOURCE_BUCKET_NAME,
             Key=TEST_FILE_KEY,
@@ -258,7 +258,7 @@ class TestProcessLambdaFunction(unittest.TestCase):
 
         process_csv_to_fhir(TEST_EVENT)
         self.assert_value_in_inf_ack_file("Fatal")
-        mock_send_to_kinesis.assert_not_called()
+        mock_kinesis_sender.return_value.put_record.assert_not_called()
 
     def test_validate_content_headers(self):
         "Tests that validate_content_headers returns True for an exact header match and False otherwise"
@@ -272,9 +272,9 @@ class TestProcessLambdaFunction(unittest.TestCase):
 
         for file_content, expected_result in test_cases:
             with self.subTest():
-                # validate_content_headers takes a csv dict reader as it's input
-                test_data = convert_string_to_dict_reader(file_content)
-                self.assertEqual(validate_content_headers(test_data), expected_result)
+                # validate_content_headers takes the result of scanning the file as it's input
+                file_scan = scan_csv(BytesIO(file_content.encode("utf-8")))
+                self.assertEqual(validate_content_headers(file_scan), expected_result)
 
     def test_validate_action_flag_permissions(self):
         """
@@ -325,24 +325,25 @@ class TestProcessLambdaFunction(unittest.TestCase):
 
         for vaccine_type, vaccine_permissions, file_content, expected_result in test_cases:
             with self.subTest():
-                # validate_action_flag_permissions takes a csv dict reader as one of it's args
+                # validate_action_flag_permissions takes the result of scanning the file as one of it's args
+                file_scan = scan_csv(BytesIO(file_content.encode("utf-8")))
                 self.assertEqual(
-                    validate_action_flag_permissions("TEST_SUPPLIER", vaccine_type, vaccine_permissions, file_content),
+                    validate_action_flag_permissions("TEST_SUPPLIER", vaccine_type, vaccine_permissions, file_scan),
                     expected_result,
                 )
 
     @freeze_time("2021-11-20, 12:00:00")
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_wrong_file_invalid_action_flag_permissions(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_wrong_file_invalid_action_flag_permissions(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE)
 
         process_csv_to_fhir(TEST_EVENT_PERMISSION)
 
         self.assert_value_in_inf_ack_file("Fatal")
-        mock_send_to_kinesis.assert_not_called()
+        mock_kinesis_sender.return_value.put_record.assert_not_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_successful(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_successful(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_UPDATE)
 
         with patch("batch_processing.get_operation_permissions", return_value={"CREATE", "UPDATE", "DELETE"}):
@@ -351,10 +352,10 @@ class TestProcessLambdaFunction(unittest.TestCase):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("Success")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
-    @patch("batch_processing.send_to_kinesis")
-    def test_process_csv_to_fhir_incorrect_permissions(self, mock_send_to_kinesis):
+    @patch("batch_processing.KinesisBatchSender")
+    def test_process_csv_to_fhir_incorrect_permissions(self, mock_kinesis_sender):
         s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_UPDATE)
 
         with patch("batch_processing.get_operation_permissions", return_value={"DELETE"}):
@@ -363,7 +364,7 @@ class TestProcessLambdaFunction(unittest.TestCase):
             process_csv_to_fhir(TEST_EVENT)
 
         # self.assert_value_in_ack_file("No permissions for requested operation")
-        mock_send_to_kinesis.assert_called()
+        mock_kinesis_sender.return_value.put_record.assert_called()
 
     def test_get_environment(self):
         with patch("batch_processing.os.getenv", return_value="internal-dev"):
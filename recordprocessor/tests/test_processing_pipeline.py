@@ -0,0 +1,151 @@
+"""Tests for processing_pipeline"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+import asyncio
+import time
+from csv import DictReader
+from io import BytesIO, StringIO
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from processing_pipeline import run_processing_pipeline, get_processing_pipeline  # noqa: E402
+from kinesis_record_aggregator import KinesisRecordAggregator, send_encoded_rows  # noqa: E402
+from convert_rows import convert_rows  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from scan_csv_file import scan_csv  # noqa: E402
+from partition_strategies import SupplierPartitionStrategy, LocalIdPartitionStrategy  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    TEST_FILE_ID,
+    TEST_FILE_KEY,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+    FILE_ROW_DELETE,
+)
+
+ALLOWED_OPERATIONS = {"CREATE", "UPDATE", "DELETE"}
+FILE_DETAILS = {"file_key": TEST_FILE_KEY, "supplier": "EMIS", "created_at_formatted_string": "20211120T12000000"}
+
+
+def make_file_content(number_of_rows: int) -> str:
+    """Returns file content with the given number of rows, including a row with a quoted newline"""
+    rows = [[FILE_ROW_NEW, FILE_ROW_UPDATE, FILE_ROW_DELETE][index % 3] for index in range(number_of_rows - 1)]
+    return "\n".join([FILE_HEADERS] + rows + [FILE_ROW_NEW.replace('"SABINA"', '"SAB\nINA"')])
+
+
+class TestRunProcessingPipeline(unittest.TestCase):
+    """Tests for run_processing_pipeline"""
+
+    def setUp(self):
+        self.mock_sender = MagicMock()
+        self.mock_sender.put_record.side_effect = lambda _data, _key, row_ids: [(row_id, True) for row_id in row_ids]
+
+    def run_pipeline(
+        self, file_content: str, record_aggregator: KinesisRecordAggregator, partition_strategy=None, **kwargs
+    ) -> tuple:
+        """Runs the pipeline over the file content, partitioning by supplier unless another strategy is given"""
+        file_bytes = file_content.encode("utf-8")
+        return asyncio.run(
+            run_processing_pipeline(
+                BytesIO(file_bytes),
+                scan_csv(BytesIO(file_bytes)),
+                TEST_FILE_ID,
+                Vaccine.RSV,
+                ALLOWED_OPERATIONS,
+                record_aggregator,
+                partition_strategy or SupplierPartitionStrategy("EMIS"),
+                **kwargs,
+            )
+        )
+
+    def test_pipeline_matches_serial_loop(self):
+        """Tests that the pipeline sends the same records, in the same order, as the serial loop"""
+        file_content = make_file_content(250)
+        for rows_per_record in (1, 20):
+            with self.subTest(rows_per_record=rows_per_record):
+                serial_sender = MagicMock()
+                serial_sender.put_record.return_value = []
+                serial_aggregator = KinesisRecordAggregator(serial_sender, FILE_DETAILS, rows_per_record)
+                csv_reader = DictReader(StringIO(file_content), delimiter="|")
+                encoded_rows = convert_rows(
+                    csv_reader, TEST_FILE_ID, Vaccine.RSV, ALLOWED_OPERATIONS, serial_aggregator.row_file_details
+                )
+                send_encoded_rows(encoded_rows, serial_aggregator, LocalIdPartitionStrategy("EMIS", 4))
+                serial_aggregator.flush()
+
+                self.mock_sender.reset_mock()
+                record_aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS, rows_per_record)
+                results = self.run_pipeline(
+                    file_content, record_aggregator, LocalIdPartitionStrategy("EMIS", 4), rows_per_chunk=7
+                )
+                record_aggregator.flush()
+
+                self.assertEqual(results, (250, 0))
+                self.assertEqual(self.mock_sender.put_record.call_args_list, serial_sender.put_record.call_args_list)
+
+    def test_rows_not_delivered_are_counted(self):
+        """Tests that the rows reported as not delivered by the sender are counted"""
+        self.mock_sender.put_record.side_effect = lambda _data, _key, row_ids: [(row_id, False) for row_id in row_ids]
+        record_aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS)
+        self.assertEqual(self.run_pipeline(make_file_content(10), record_aggregator), (10, 10))
+
+    def test_slow_sends_slow_down_reading(self):
+        """Tests that, while the send stage is blocked, the fetch stage only reads as far as the queues allow"""
+        file_content = make_file_content(300)
+        file_bytes = file_content.encode("utf-8")
+        streaming_body = BytesIO(file_bytes)
+        bytes_read_while_send_blocked = []
+
+        def slow_send_encoded_rows(*args):
+            if not bytes_read_while_send_blocked:
+                time.sleep(0.2)
+                bytes_read_while_send_blocked.append(streaming_body.tell())
+            return send_encoded_rows(*args)
+
+        record_aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS)
+        with (
+            patch("processing_pipeline.STREAM_CHUNK_SIZE", 1000),
+            patch("processing_pipeline.send_encoded_rows", side_effect=slow_send_encoded_rows),
+        ):
+            results = asyncio.run(
+                run_processing_pipeline(
+                    streaming_body,
+                    scan_csv(BytesIO(file_bytes)),
+                    TEST_FILE_ID,
+                    Vaccine.RSV,
+                    ALLOWED_OPERATIONS,
+                    record_aggregator,
+                    SupplierPartitionStrategy("EMIS"),
+                    rows_per_chunk=1,
+                    queue_size=1,
+                )
+            )
+
+        self.assertEqual(results, (300, 0))
+        self.assertLess(bytes_read_while_send_blocked[0], len(file_bytes) // 10)
+
+    def test_error_in_a_stage_stops_the_pipeline(self):
+        """Tests that an error in one stage is raised, rather than leaving the other stages waiting forever"""
+        record_aggregator = KinesisRecordAggregator(self.mock_sender, FILE_DETAILS)
+        with patch("processing_pipeline.process_row", side_effect=ValueError("Conversion failed")):
+            with self.assertRaises(ValueError):
+                self.run_pipeline(make_file_content(50), record_aggregator, rows_per_chunk=1, queue_size=1)
+
+
+class TestGetProcessingPipeline(unittest.TestCase):
+    """Tests for get_processing_pipeline"""
+
+    def test_get_processing_pipeline(self):
+        """Tests that the pipeline is read from the environment, defaulting to async"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_processing_pipeline(), "async")
+        with patch.dict("os.environ", {"PROCESSING_PIPELINE": "SERIAL"}):
+            self.assertEqual(get_processing_pipeline(), "serial")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Tests for row_logging"""
+
+import unittest
+from unittest.mock import MagicMock, patch
+from csv import DictReader
+from io import BytesIO, StringIO
+import json
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from row_logging import (  # noqa: E402
+    should_log_row,
+    row_log_settings,
+    row_outcome_counters,
+    toggle_log_every_row,
+    start_file_logging,
+    log_file_summary,
+)
+from convert_rows import convert_rows, convert_rows_in_parallel  # noqa: E402
+from kinesis_record_aggregator import send_encoded_rows  # noqa: E402
+from constants import Diagnostics  # noqa: E402
+from mappings import Vaccine  # noqa: E402
+from scan_csv_file import scan_csv  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    TEST_FILE_ID,
+    TEST_FILE_KEY,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+    FILE_ROW_DELETE,
+)
+
+# Nine rows: three of each operation, of which the deletes are not permitted
+FILE_CONTENT = "\n".join([FILE_HEADERS] + [FILE_ROW_NEW, FILE_ROW_UPDATE, FILE_ROW_DELETE] * 3)
+ALLOWED_OPERATIONS = {"CREATE", "UPDATE"}
+EXPECTED_COUNTS = {
+    "operations": {"CREATE": 3, "UPDATE": 3, "DELETE": 3},
+    "diagnostics": {Diagnostics.NO_PERMISSIONS: 3},
+}
+
+
+class TestShouldLogRow(unittest.TestCase):
+    """Tests for should_log_row and toggle_log_every_row"""
+
+    def tearDown(self):
+        row_log_settings.sample_rate = 1
+        row_log_settings.log_every_row = False
+
+    def test_every_nth_row_is_logged(self):
+        """Tests that the first row, and every Nth row after it, is logged"""
+        row_log_settings.sample_rate = 3
+        self.assertEqual(
+            [should_log_row(row_number) for row_number in range(1, 8)], [True, False, False, True, False, False, True]
+        )
+
+    def test_every_row_is_logged_by_default(self):
+        """Tests that every row is logged when the sample rate is 1"""
+        with patch.dict("os.environ", {}, clear=True):
+            start_file_logging()
+        self.assertTrue(all(should_log_row(row_number) for row_number in range(1, 6)))
+
+    def test_toggle_log_every_row(self):
+        """Tests that the toggle switches between logging every row and sampling"""
+        with patch.dict("os.environ", {"ROW_LOG_SAMPLE_RATE": "1000"}):
+            start_file_logging()
+        self.assertEqual([should_log_row(row_number) for row_number in range(1, 4)], [True, False, False])
+        with self.assertLogs(level="WARNING"):
+            toggle_log_every_row()
+        self.assertEqual([should_log_row(row_number) for row_number in range(1, 4)], [True, True, True])
+        with self.assertLogs(level="WARNING"):
+            toggle_log_every_row()
+        self.assertEqual([should_log_row(row_number) for row_number in range(1, 4)], [True, False, False])
+
+    def test_every_logging_site_logs_the_same_rows(self):
+        """Tests that the rows logged when processing and when sending are the same rows"""
+        row_log_settings.sample_rate = 4
+        csv_reader = DictReader(StringIO(FILE_CONTENT), delimiter="|")
+        encoded_rows = convert_rows(csv_reader, TEST_FILE_ID, Vaccine.RSV, {"CREATE", "UPDATE", "DELETE"}, None)
+        record_aggregator = MagicMock()
+        record_aggregator.add_encoded_row.return_value = []
+
+        with self.assertLogs(level="INFO") as logs:
+            send_encoded_rows(encoded_rows, record_aggregator, MagicMock())
+
+        # Each row is processed, and its logs emitted, before it is sent
+        self.assertEqual(
+            [
+                record.getMessage()
+                for record in logs.records
+                if record.msg.startswith(("OPERATION REQUESTED", "MESSAGE"))
+            ],
+            [
+                "OPERATION REQUESTED:  CREATE",
+                f"MESSAGE ID : {TEST_FILE_ID}^1",
+                "OPERATION REQUESTED:  UPDATE",
+                f"MESSAGE ID : {TEST_FILE_ID}^5",
+                "OPERATION REQUESTED:  DELETE",
+                f"MESSAGE ID : {TEST_FILE_ID}^9",
+            ],
+        )
+
+
+class TestRowOutcomeCounters(unittest.TestCase):
+    """Tests for the row outcome counters and the file summary"""
+
+    def setUp(self):
+        start_file_logging()
+
+    def test_rows_are_counted_by_operation_and_diagnostic(self):
+        """Tests that processing rows counts them by operation, and by diagnostic where there is one"""
+        csv_reader = DictReader(StringIO(FILE_CONTENT), delimiter="|")
+        self.assertEqual(len(list(convert_rows(csv_reader, TEST_FILE_ID, Vaccine.RSV, ALLOWED_OPERATIONS, None))), 9)
+        self.assertEqual(row_outcome_counters.as_dict(), EXPECTED_COUNTS)
+
+    def test_rows_converted_in_worker_processes_are_counted(self):
+        """Tests that the counts from the worker processes are added to the counters of the main process"""
+        file_bytes = FILE_CONTENT.encode("utf-8")
+        encoded_rows = convert_rows_in_parallel(
+            BytesIO(file_bytes),
+            scan_csv(BytesIO(file_bytes)),
+            TEST_FILE_ID,
+            Vaccine.RSV,
+            ALLOWED_OPERATIONS,
+            None,
+            workers=2,
+            rows_per_chunk=2,
+        )
+        self.assertEqual(len(list(encoded_rows)), 9)
+        self.assertEqual(row_outcome_counters.as_dict(), EXPECTED_COUNTS)
+
+    def test_log_file_summary(self):
+        """Tests that the summary is logged as a single json line"""
+        csv_reader = DictReader(StringIO(FILE_CONTENT), delimiter="|")
+        list(convert_rows(csv_reader, TEST_FILE_ID, Vaccine.RSV, ALLOWED_OPERATIONS, None))
+
+        with self.assertLogs(level="INFO") as logs:
+            log_file_summary(TEST_FILE_KEY, TEST_FILE_ID, 9, 2)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(
+            json.loads(logs.records[0].args[0]),
+            {
+                "file_key": TEST_FILE_KEY,
+                "message_id": TEST_FILE_ID,
+                "shard_index": None,
+                "rows_processed": 9,
+                "rows_sent": 7,
+                "rows_not_sent": 2,
+                **EXPECTED_COUNTS,
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Tests for scan_csv_file"""
+
+import unittest
+from csv import DictReader
+from io import BytesIO, StringIO
+from moto import mock_s3
+from boto3 import client as boto3_client
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from scan_csv_file import scan_csv, scan_csv_file  # noqa: E402
+from constants import Constants  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    SOURCE_BUCKET_NAME,
+    AWS_REGION,
+    TEST_FILE_KEY,
+    FILE_HEADERS,
+    FILE_ROW_NEW,
+    FILE_ROW_UPDATE,
+    FILE_ROW_DELETE,
+    VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE,
+)
+
+s3_client = boto3_client("s3", region_name=AWS_REGION)
+
+
+class TestScanCsv(unittest.TestCase):
+    """Tests for scan_csv"""
+
+    @staticmethod
+    def scan_string(content: str):
+        """Scans the utf-8 encoded content"""
+        return scan_csv(BytesIO(content.encode("utf-8")))
+
+    def test_headers_action_flags_and_row_count(self):
+        """Tests that the headers, upper-cased action flags and row count are identified"""
+        file_scan = self.scan_string(VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE)
+        self.assertEqual(file_scan.headers, Constants.expected_csv_headers)
+        self.assertEqual(file_scan.action_flags, {"NEW", "UPDATE", "DELETE"})
+        self.assertEqual(file_scan.row_count, 3)
+        self.assertEqual(file_scan.size, len(VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE.encode("utf-8")))
+
+    def test_row_offsets(self):
+        """
+        Tests that each row offset is the byte offset of the start of the row, including where the file contains
+        multi-byte characters, quoted new lines, blank lines and CRLF line endings
+        """
+        rows = [
+            FILE_ROW_NEW.replace("SABINA", "ZOË"),
+            FILE_ROW_UPDATE.replace('"Jane"', '"Jane\nMary"'),
+            FILE_ROW_DELETE,
+        ]
+        content = FILE_HEADERS + "\r\n" + rows[0] + "\r\n\r\n" + rows[1] + "\n" + rows[2] + "\n"
+        content_bytes = content.encode("utf-8")
+
+        file_scan = self.scan_string(content)
+
+        self.assertEqual(file_scan.row_count, 3)
+        for row, offset in zip(rows, file_scan.row_offsets):
+            with self.subTest(row=row[:20]):
+                self.assertTrue(content_bytes[offset:].startswith(row.encode("utf-8")))
+
+        # Reading from each offset, using the scanned headers, gives the same rows as reading the whole file
+        expected_rows = list(DictReader(StringIO(content, newline=""), delimiter="|"))
+        for index, offset in enumerate(file_scan.row_offsets):
+            remaining_content = StringIO(content_bytes[offset:].decode("utf-8"), newline="")
+            row = next(DictReader(remaining_content, fieldnames=file_scan.headers, delimiter="|"))
+            self.assertEqual(row, expected_rows[index])
+
+    def test_missing_action_flag_header(self):
+        """Tests that a file without an ACTION_FLAG header is scanned without error and has no action flags"""
+        file_scan = self.scan_string(VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE.replace("ACTION_FLAG", "FLAG"))
+        self.assertEqual(file_scan.action_flags, set())
+        self.assertEqual(file_scan.row_count, 3)
+
+    def test_empty_file(self):
+        """Tests that an empty file has no headers and no rows"""
+        file_scan = self.scan_string("")
+        self.assertEqual(file_scan.headers, [])
+        self.assertEqual(file_scan.row_count, 0)
+        self.assertEqual(file_scan.size, 0)
+
+
+@mock_s3
+class TestScanCsvFile(unittest.TestCase):
+    """Tests for scan_csv_file"""
+
+    def setUp(self):
+        s3_client.create_bucket(Bucket=SOURCE_BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+
+    def test_scan_csv_file(self):
+        """Tests that the file is streamed from S3 and scanned"""
+        s3_client.put_object(
+            Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body=VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE
+        )
+        file_scan = scan_csv_file(SOURCE_BUCKET_NAME, TEST_FILE_KEY)
+        self.assertEqual(file_scan.action_flags, {"NEW", "UPDATE", "DELETE"})
+        self.assertEqual(file_scan.row_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
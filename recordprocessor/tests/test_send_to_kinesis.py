@@ -0,0 +1,201 @@
+"""Tests for send_to_kinesis"""
+
+import unittest
+from unittest.mock import patch
+from moto import mock_kinesis
+from boto3 import client as boto3_client
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from send_to_kinesis import KinesisBatchSender, MAX_BYTES_PER_RECORD  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    AWS_REGION,
+    STREAM_NAME,
+)
+
+kinesis_client = boto3_client("kinesis", region_name=AWS_REGION)
+
+
+def make_put_records_response(failed_indexes: list, number_of_records: int) -> dict:
+    """Returns a mock put_records response in which the entries at the failed_indexes have failed"""
+    return {
+        "FailedRecordCount": len(failed_indexes),
+        "Records": [
+            (
+                {"ErrorCode": "ProvisionedThroughputExceededException", "ErrorMessage": "Rate exceeded"}
+                if index in failed_indexes
+                else {"SequenceNumber": str(index), "ShardId": "shardId-000000000000"}
+            )
+            for index in range(number_of_records)
+        ],
+    }
+
+
+@mock_kinesis
+@patch("send_to_kinesis.time.sleep")
+class TestKinesisBatchSender(unittest.TestCase):
+    """Tests for KinesisBatchSender"""
+
+    def setUp(self):
+        kinesis_client.create_stream(StreamName=STREAM_NAME, ShardCount=1)
+
+    @staticmethod
+    def get_stream_data() -> list:
+        """Returns the data of all records in the stream, in sequence order"""
+        shard_id = kinesis_client.describe_stream(StreamName=STREAM_NAME)["StreamDescription"]["Shards"][0]["ShardId"]
+        shard_iterator = kinesis_client.get_shard_iterator(
+            StreamName=STREAM_NAME, ShardId=shard_id, ShardIteratorType="TRIM_HORIZON"
+        )["ShardIterator"]
+        return [record["Data"] for record in kinesis_client.get_records(ShardIterator=shard_iterator)["Records"]]
+
+    def test_records_are_batched_up_to_the_record_limit(self, _mock_sleep):
+        """Tests that 1200 records are sent in 3 requests, in order, and that every row is reported as delivered"""
+        sender = KinesisBatchSender(STREAM_NAME, max_buffer_seconds=60)
+        results = []
+        with patch("send_to_kinesis.kinesis_client.put_records", wraps=kinesis_client.put_records) as mock_put:
+            for index in range(1200):
+                results.extend(sender.put_record(f"{index}".encode("utf-8"), f"EMIS-{index}", [f"row^{index}"]))
+            results.extend(sender.flush())
+
+        self.assertEqual([len(call.kwargs["Records"]) for call in mock_put.call_args_list], [500, 500, 200])
+        self.assertEqual(results, [(f"row^{index}", True) for index in range(1200)])
+        self.assertEqual(self.get_stream_data(), [f"{index}".encode("utf-8") for index in range(1200)])
+
+    def test_records_are_batched_up_to_the_byte_limit(self, _mock_sleep):
+        """Tests that a flush takes place before the next record would exceed the byte limit"""
+        sender = KinesisBatchSender(STREAM_NAME, max_bytes=1000, max_buffer_seconds=60)
+        with patch("send_to_kinesis.kinesis_client.put_records", wraps=kinesis_client.put_records) as mock_put:
+            for index in range(5):
+                # Each record is 296 bytes of data plus a 4 byte partition key
+                sender.put_record(b"x" * 296, f"EMI{index}", [f"row^{index}"])
+            sender.flush()
+
+        self.assertEqual([len(call.kwargs["Records"]) for call in mock_put.call_args_list], [3, 2])
+
+    def test_records_are_flushed_after_max_buffer_seconds(self, _mock_sleep):
+        """Tests that the buffer is flushed once the oldest record has been buffered for max_buffer_seconds"""
+        sender = KinesisBatchSender(STREAM_NAME, max_buffer_seconds=1)
+        with patch("send_to_kinesis.time.monotonic", side_effect=[100, 100, 100.5, 101]):
+            self.assertEqual(sender.put_record(b"0", "EMIS-0", ["row^0"]), [])
+            self.assertEqual(sender.put_record(b"1", "EMIS-1", ["row^1"]), [])
+            self.assertEqual(
+                sender.put_record(b"2", "EMIS-2", ["row^2"]), [("row^0", True), ("row^1", True), ("row^2", True)]
+            )
+
+    def test_only_failed_entries_are_retried(self, mock_sleep):
+        """Tests that only the entries which failed are retried, and that all rows are reported as delivered"""
+        sender = KinesisBatchSender(STREAM_NAME, max_buffer_seconds=60)
+        for index in range(4):
+            sender.put_record(f"{index}".encode("utf-8"), f"EMIS-{index}", [f"row^{index}"])
+
+        with patch(
+            "send_to_kinesis.kinesis_client.put_records",
+            side_effect=[make_put_records_response([1, 3], 4), make_put_records_response([], 2)],
+        ) as mock_put:
+            results = sender.flush()
+
+        self.assertEqual(mock_put.call_count, 2)
+        self.assertEqual([record["Data"] for record in mock_put.call_args_list[1].kwargs["Records"]], [b"1", b"3"])
+        self.assertEqual(results, [("row^0", True), ("row^1", True), ("row^2", True), ("row^3", True)])
+        mock_sleep.assert_called_once()
+
+    def test_records_with_the_same_partition_key_are_sent_in_separate_requests(self, _mock_sleep):
+        """
+        Tests that a request holds at most one record for each partition key, with the later records of a key left in
+        the buffer for a later request (rather than the buffer being flushed), so that a record which fails is retried
+        before the next record with its partition key is sent, and the records of each key reach the stream in order
+        """
+        sender = KinesisBatchSender(STREAM_NAME, max_buffer_seconds=60)
+        partition_keys = ["EMIS-0", "EMIS-1", "EMIS-0", "EMIS-2", "EMIS-1", "EMIS-0"]
+        responses = iter([make_put_records_response([0], 3), make_put_records_response([], 1)])
+
+        def put_records(**kwargs):
+            response = next(responses, None)
+            if response is None:
+                return kinesis_client.put_records(**kwargs)
+            # Only the entries which succeed are written to the stream
+            succeeded = [
+                record for record, result in zip(kwargs["Records"], response["Records"]) if "ErrorCode" not in result
+            ]
+            if succeeded:
+                kinesis_client.put_records(StreamName=kwargs["StreamName"], Records=succeeded)
+            return response
+
+        results = []
+        with patch("send_to_kinesis.kinesis_client.put_records", side_effect=put_records) as mock_put:
+            for index, partition_key in enumerate(partition_keys):
+                results.extend(sender.put_record(f"{index}".encode("utf-8"), partition_key, [f"row^{index}"]))
+            results.extend(sender.flush())
+
+        requests = [[record["PartitionKey"] for record in call.kwargs["Records"]] for call in mock_put.call_args_list]
+        self.assertEqual(requests, [["EMIS-0", "EMIS-1", "EMIS-2"], ["EMIS-0"], ["EMIS-0", "EMIS-1"], ["EMIS-0"]])
+        self.assertEqual(sorted(results), [(f"row^{index}", True) for index in range(6)])
+        stream_data = self.get_stream_data()
+        for partition_key in set(partition_keys):
+            expected = [f"{index}".encode("utf-8") for index, key in enumerate(partition_keys) if key == partition_key]
+            self.assertEqual([data for data in stream_data if data in expected], expected)
+
+    def test_one_partition_key_does_not_hold_back_the_others(self, _mock_sleep):
+        """
+        Tests that once the buffer is full, a request is sent with the first record of each partition key, and the
+        remaining records of a busy partition key stay buffered while the records of other keys are batched
+        """
+        sender = KinesisBatchSender(STREAM_NAME, max_records=4, max_buffer_seconds=60)
+        partition_keys = ["EMIS-0"] * 4 + ["EMIS-1", "EMIS-2", "EMIS-3"]
+        with patch("send_to_kinesis.kinesis_client.put_records", wraps=kinesis_client.put_records) as mock_put:
+            for index, partition_key in enumerate(partition_keys):
+                sender.put_record(f"{index}".encode("utf-8"), partition_key, [f"row^{index}"])
+            sender.flush()
+
+        requests = [[record["Data"] for record in call.kwargs["Records"]] for call in mock_put.call_args_list]
+        self.assertEqual(requests, [[b"0"], [b"1", b"4"], [b"2", b"5", b"6"], [b"3"]])
+
+    def test_entries_which_fail_every_attempt_are_reported_as_not_delivered(self, mock_sleep):
+        """Tests that an entry which fails on every attempt is reported as not delivered"""
+        sender = KinesisBatchSender(STREAM_NAME, max_buffer_seconds=60, max_attempts=3, base_backoff_seconds=0.1)
+        for index in range(2):
+            sender.put_record(f"{index}".encode("utf-8"), f"EMIS-{index}", [f"row^{index}"])
+
+        with patch(
+            "send_to_kinesis.kinesis_client.put_records",
+            side_effect=[make_put_records_response([0], 2)] + [make_put_records_response([0], 1)] * 2,
+        ) as mock_put:
+            results = sender.flush()
+
+        self.assertEqual(mock_put.call_count, 3)
+        self.assertEqual(results, [("row^0", False), ("row^1", True)])
+        # Backoff is jittered, and capped at base_backoff_seconds * 2 ** attempt
+        sleep_times = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(sleep_times), 2)
+        self.assertLessEqual(sleep_times[0], 0.2)
+        self.assertLessEqual(sleep_times[1], 0.4)
+
+    def test_request_failure(self, _mock_sleep):
+        """Tests that all rows are reported as not delivered if the request fails (e.g. the stream does not exist)"""
+        sender = KinesisBatchSender("non_existent_stream")
+        sender.put_record(b"0", "EMIS", ["row^0"])
+        self.assertEqual(sender.flush(), [("row^0", False)])
+
+    def test_oversized_record_is_not_sent(self, _mock_sleep):
+        """Tests that a record which exceeds the Kinesis record size limit is reported as not delivered"""
+        sender = KinesisBatchSender(STREAM_NAME)
+        self.assertEqual(sender.put_record(b"x" * MAX_BYTES_PER_RECORD, "EMIS", ["row^0"]), [("row^0", False)])
+        self.assertEqual(sender.flush(), [])
+
+    def test_rows_of_a_multi_row_record_share_its_delivery_result(self, _mock_sleep):
+        """Tests that every row carried by a record is reported with that record's delivery result"""
+        sender = KinesisBatchSender(STREAM_NAME, max_buffer_seconds=60)
+        sender.put_record(b"0", "EMIS-0", ["row^0", "row^1"])
+        sender.put_record(b"1", "EMIS-1", ["row^2"])
+        with patch("send_to_kinesis.kinesis_client.put_records", return_value=make_put_records_response([0], 2)):
+            sender.max_attempts = 1
+            results = sender.flush()
+
+        self.assertEqual(results, [("row^0", False), ("row^1", False), ("row^2", True)])
+
+
+if __name__ == "__main__":
+    unittest.main()
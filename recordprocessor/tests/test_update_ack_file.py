@@ -0,0 +1,135 @@
+"""Tests for update_ack_file"""
+
+import unittest
+from unittest.mock import patch
+from moto import mock_s3
+from boto3 import client as boto3_client
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from constants import Constants, Diagnostics  # noqa: E402
+from update_ack_file import AckFileWriter, MIN_PART_BYTES, get_ack_part_bytes  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    SOURCE_BUCKET_NAME,
+    DESTINATION_BUCKET_NAME,
+    AWS_REGION,
+    TEST_FILE_KEY,
+)
+
+s3_client = boto3_client("s3", region_name=AWS_REGION)
+
+ACK_FILE_KEY = f"processedFile/{TEST_FILE_KEY.replace('.csv', '_response.csv')}"
+HEADER_ROW = "|".join(Constants.ack_headers) + "\n"
+
+
+def make_row_arguments(index: int) -> tuple:
+    """Returns the (row_id, message_delivered, diagnostics, imms_id) of the row with the given index"""
+    if index % 4 == 0:
+        return (f"file^{index}", False, Diagnostics.NO_PERMISSIONS, None)
+    return (f"file^{index}", True, None, f"imms-id-{index}")
+
+
+def expected_ack_row(created_at_formatted_string: str, index: int) -> str:
+    """Returns the ack row which the per-row re-upload of the whole ack file wrote for the row with the given index"""
+    row_id, delivered, diagnostics, imms_id = make_row_arguments(index)
+    success = delivered and not diagnostics
+    values = [
+        row_id,
+        "OK" if success else "Fatal Error",
+        "Information" if not diagnostics else "Fatal",
+        "OK" if not diagnostics else "Fatal Error",
+        "30001" if not diagnostics else "30002",
+        "Business",
+        "30001" if success else "30002",
+        "Success" if success else "Business Level Response Value - Processing Error",
+        created_at_formatted_string,
+        "",
+        "",
+        imms_id or "",
+        diagnostics or "",
+        str(delivered),
+    ]
+    return "|".join(values).replace(" |", "|").replace("| ", "|").strip() + "\n"
+
+
+@patch.dict("os.environ", {"ACK_BUCKET_NAME": DESTINATION_BUCKET_NAME})
+@mock_s3
+class TestAckFileWriter(unittest.TestCase):
+    """Tests for AckFileWriter"""
+
+    def setUp(self) -> None:
+        for bucket_name in [SOURCE_BUCKET_NAME, DESTINATION_BUCKET_NAME]:
+            s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        s3_client.put_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY, Body="source file")
+        last_modified = s3_client.head_object(Bucket=SOURCE_BUCKET_NAME, Key=TEST_FILE_KEY)["LastModified"]
+        self.created_at_formatted_string = last_modified.strftime("%Y%m%dT%H%M%S00")
+
+    def write_ack_file(self, number_of_rows: int, part_bytes: int = MIN_PART_BYTES) -> AckFileWriter:
+        """Writes the ack file, with the header row, for the given number of rows"""
+        ack_file_writer = AckFileWriter(TEST_FILE_KEY, SOURCE_BUCKET_NAME, HEADER_ROW, part_bytes)
+        for index in range(1, number_of_rows + 1):
+            ack_file_writer.add_row(*make_row_arguments(index))
+        ack_file_writer.close()
+        return ack_file_writer
+
+    def expected_ack_file(self, number_of_rows: int) -> bytes:
+        """Returns the ack file which the per-row re-upload of the whole ack file gave for the given number of rows"""
+        rows = [expected_ack_row(self.created_at_formatted_string, index) for index in range(1, number_of_rows + 1)]
+        return (HEADER_ROW + "".join(rows)).encode("utf-8")
+
+    def get_ack_file(self) -> bytes:
+        """Returns the content of the ack file"""
+        return s3_client.get_object(Bucket=DESTINATION_BUCKET_NAME, Key=ACK_FILE_KEY)["Body"].read()
+
+    def test_small_ack_file(self):
+        """
+        Tests that an ack file smaller than a part is uploaded with a single PutObject, and that the metadata of the
+        source file is read only once
+        """
+        with patch("update_ack_file.s3_client.head_object", wraps=s3_client.head_object) as mock_head_object:
+            ack_file_writer = self.write_ack_file(10)
+
+        mock_head_object.assert_called_once()
+        self.assertIsNone(ack_file_writer._upload_id)
+        self.assertEqual(self.get_ack_file(), self.expected_ack_file(10))
+
+    def test_multipart_ack_file(self):
+        """Tests that an ack file larger than a part is uploaded in parts, and is identical to the expected ack file"""
+        number_of_rows = 3 * MIN_PART_BYTES // len(expected_ack_row(self.created_at_formatted_string, 1))
+        ack_file_writer = self.write_ack_file(number_of_rows)
+
+        self.assertGreaterEqual(len(ack_file_writer._parts), 3)
+        self.assertEqual(self.get_ack_file(), self.expected_ack_file(number_of_rows))
+
+    def test_no_rows(self):
+        """Tests that no ack file is uploaded if no rows are added"""
+        self.write_ack_file(0)
+        self.assertNotIn("Contents", s3_client.list_objects_v2(Bucket=DESTINATION_BUCKET_NAME))
+
+    def test_failed_upload_is_aborted(self):
+        """Tests that the multipart upload is aborted if the ack file can not be completed"""
+        ack_file_writer = AckFileWriter(TEST_FILE_KEY, SOURCE_BUCKET_NAME, HEADER_ROW, MIN_PART_BYTES)
+        ack_file_writer.write("x" * MIN_PART_BYTES + "\n")
+        with patch("update_ack_file.s3_client.complete_multipart_upload", side_effect=Exception("Error")):
+            with self.assertRaises(Exception):
+                ack_file_writer.close()
+
+        self.assertIsNone(ack_file_writer._upload_id)
+        self.assertNotIn("Uploads", s3_client.list_multipart_uploads(Bucket=DESTINATION_BUCKET_NAME))
+        self.assertNotIn("Contents", s3_client.list_objects_v2(Bucket=DESTINATION_BUCKET_NAME))
+
+    def test_get_ack_part_bytes(self):
+        """Tests that the part size is read from the environment, and is never less than the minimum part size"""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(get_ack_part_bytes(), 8 * 1024 * 1024)
+        with patch.dict("os.environ", {"ACK_PART_BYTES": "1000"}):
+            self.assertEqual(get_ack_part_bytes(), MIN_PART_BYTES)
+        with patch.dict("os.environ", {"ACK_PART_BYTES": str(MIN_PART_BYTES + 1)}):
+            self.assertEqual(get_ack_part_bytes(), MIN_PART_BYTES + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,31 @@
 """Unit tests for batch utils"""
 
 import unittest
+import random
+from copy import deepcopy
 from decimal import Decimal
+from unittest.mock import patch
 import os
 import sys
 maindir = os.path.dirname(__file__)
 srcdir = '../src'
 sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
 
-from utils_for_fhir_conversion import _is_not_empty, Generate, Add, Convert  # noqa: E402
+from utils_for_fhir_conversion import (  # noqa: E402
+    _is_not_empty,
+    _convert_date_string,
+    _convert_date_time_string,
+    get_date_conversion_cache_size,
+    Generate,
+    Add,
+    Convert,
+    Flyweight,
+)
 from constants import Urls  # noqa: E402
+from tests.utils_for_recordprocessor_tests.reference_conversions import (  # noqa: E402
+    ReferenceConvert,
+    reference_is_not_empty,
+)
 
 
 class TestBatchUtils(unittest.TestCase):
@@ -65,6 +81,32 @@ class TestBatchUtilsConvert(unittest.TestCase):
         for value in ["2000-01-01", 20000101, "20000230", "2000011", "990101", "20000101T00:00"]:
             self.assertEqual(Convert.date(value), value)
 
+    def test_convert_dates_are_cached(self):
+        """
+        Tests that repeated date and date_time values give the same output as the first conversion, including for
+        invalid values, and are counted as cache hits
+        """
+        _convert_date_string.cache_clear()
+        _convert_date_time_string.cache_clear()
+        for _ in range(3):
+            self.assertEqual(Convert.date("20000101"), "2000-01-01")
+            self.assertEqual(Convert.date("20000230"), "20000230")
+            self.assertEqual(Convert.date_time("20000101T11111101"), "2000-01-01T11:11:11+01:00")
+            self.assertEqual(Convert.date_time("20000101T11111102"), "20000101T11111102")
+
+        statistics = Convert.cache_statistics()
+        self.assertEqual(statistics["date"], {"hits": 4, "misses": 2, "size": 2, "hit_rate": 0.6667})
+        self.assertEqual(statistics["date_time"], {"hits": 4, "misses": 2, "size": 2, "hit_rate": 0.6667})
+
+    def test_get_date_conversion_cache_size(self):
+        """Tests that the date conversion cache size is read from the environment"""
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(get_date_conversion_cache_size(), 4096)
+        with patch.dict(os.environ, {"DATE_CONVERSION_CACHE_SIZE": "10"}):
+            self.assertEqual(get_date_conversion_cache_size(), 10)
+        with patch.dict(os.environ, {"DATE_CONVERSION_CACHE_SIZE": "-1"}):
+            self.assertEqual(get_date_conversion_cache_size(), 0)
+
     def test_convert_gender_code(self):
         """
         Tests that _convert_gender_code returns the FHIR-mapped gender if the code is recognised, or returns
@@ -142,6 +184,66 @@ class TestBatchUtilsConvert(unittest.TestCase):
             self.assertEqual(Convert.to_lower(code), expected)
 
 
+def generate_random_value(rng: random.Random) -> any:
+    """
+    Generates a random value for the equivalence tests: a string shaped like a date, date_time or number, a string
+    of characters which have a meaning to the helpers, a code or word, or a value which is not a string
+    """
+    kind = rng.randrange(6)
+    if kind == 0:
+        date = f"{rng.randint(0, 9999):04}{rng.randint(0, 13):02}{rng.randint(0, 32):02}"
+        if rng.random() < 0.5:
+            return date
+        time = f"{rng.randint(0, 25):02}{rng.randint(0, 61):02}{rng.randint(0, 61):02}"
+        return f"{date}T{time}{rng.choice(['', '00', '01', '02', '0', '+00'])}"
+    if kind == 1:
+        sign = rng.choice(["", "", "-", "+"])
+        return f"{sign}{rng.choice(['', str(rng.randint(0, 10**6))])}{rng.choice(['', '.'])}{rng.randint(0, 999)}"
+    if kind == 2:
+        return "".join(rng.choice("0123456789T.+-_ eE\tatrueFALSE\u0663") for _ in range(rng.randint(0, 20)))
+    if kind == 3:
+        return rng.choice(["", "0", "1", "2", "9", "3", "true", "False", "TRUE", "fAlSe", "yes", " 1 ", "1_000", "NaN"])
+    if kind == 4:
+        return rng.choice([None, 0, 1, -5, 1.5, 0.0, Decimal("2.5"), True, False, b"ABC", b"", 20000101])
+    return rng.choice([[], [""], {}, (), ("",), [None], {"key": ""}, [1], set(), ["", ""], {""}])
+
+
+def call_helper(helper, value: any) -> tuple:
+    """Calls the helper, returning the type and repr of the result, or the type of the exception raised"""
+    try:
+        result = helper(value)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        return "raised", type(error)
+    return type(result), repr(result)
+
+
+class TestBatchUtilsConvertEquivalence(unittest.TestCase):
+    """
+    Property based tests that the Convert helpers and _is_not_empty give exactly the same output as the reference
+    implementations, for randomly generated values
+    """
+
+    def test_helpers_match_reference_implementations(self):
+        """Tests that each helper gives the same output as its reference implementation for every generated value"""
+        rng = random.Random(20240101)
+        values = [generate_random_value(rng) for _ in range(20000)]
+        helpers = [
+            ("_is_not_empty", _is_not_empty, reference_is_not_empty),
+            *[
+                (name, getattr(Convert, name), getattr(ReferenceConvert, name))
+                for name in ["date_time", "date", "gender_code", "boolean", "integer_or_decimal", "integer", "to_lower"]
+            ],
+        ]
+        for name, helper, reference_helper in helpers:
+            with self.subTest(name):
+                mismatches = [
+                    (value, call_helper(helper, value), call_helper(reference_helper, value))
+                    for value in values
+                    if call_helper(helper, value) != call_helper(reference_helper, value)
+                ]
+                self.assertEqual(mismatches, [])
+
+
 class TestBatchUtilsCreate(unittest.TestCase):
     """Tests for the batch utils Create functions"""
 
@@ -280,3 +382,51 @@ class TestBatchUtilsAdd(unittest.TestCase):
         test_dict = {}
         Add.snomed(test_dict, "test3", "", "")
         self.assertEqual(test_dict, {})
+
+
+class TestBatchUtilsFlyweight(unittest.TestCase):
+    """Tests for the Flyweight cached elements"""
+
+    def setUp(self):
+        for name in ("snomed", "vaccine_code", "dose_quantity", "location"):
+            getattr(Flyweight, name).cache_clear()
+
+    def test_flyweight_elements(self):
+        """Test that each Flyweight function generates the expected element, with empty items removed"""
+        self.assertEqual(Flyweight.snomed("ABC", ""), {"coding": [{"system": Urls.SNOMED, "code": "ABC"}]})
+        self.assertEqual(
+            Flyweight.vaccine_code("ABC", "testTerm"),
+            {"coding": [{"system": Urls.SNOMED, "code": "ABC", "display": "testTerm"}]},
+        )
+        self.assertEqual(
+            Flyweight.vaccine_code("", None),
+            {"coding": [{"system": Urls.NULL_FLAVOUR_CODES, "code": "NAVU", "display": "Not available"}]},
+        )
+        self.assertEqual(
+            Flyweight.dose_quantity("0.5", "milliliter", "258773002"),
+            {"value": Decimal("0.5"), "unit": "milliliter", "system": Urls.SNOMED, "code": "258773002"},
+        )
+        self.assertEqual(Flyweight.dose_quantity("1", "dose", ""), {"value": 1, "unit": "dose"})
+        self.assertEqual(
+            Flyweight.location("X99999", "testUri"), {"identifier": {"value": "X99999", "system": "testUri"}}
+        )
+
+    def test_flyweight_elements_are_shared(self):
+        """Test that the same element is returned for the same values, and that hits and misses are counted"""
+        first_element = Flyweight.snomed("ABC", "testDisplay")
+        self.assertIs(Flyweight.snomed("ABC", "testDisplay"), first_element)
+        self.assertIs(Flyweight.snomed("ABC", "testDisplay"), first_element)
+        self.assertIsNot(Flyweight.snomed("DEF", "testDisplay"), first_element)
+
+        statistics = Flyweight.cache_statistics()
+        self.assertEqual(statistics["snomed"], {"hits": 2, "misses": 2, "size": 2, "hit_rate": 0.5})
+        self.assertEqual(statistics["location"], {"hits": 0, "misses": 0, "size": 0, "hit_rate": None})
+
+    def test_add_snomed_uses_flyweight_element(self):
+        """Test that Add.snomed adds the shared element, and that adding it does not modify it"""
+        first_dict, second_dict = {}, {}
+        Add.snomed(first_dict, "site", "ABC", "testDisplay")
+        expected_element = deepcopy(first_dict["site"])
+        Add.snomed(second_dict, "site", "ABC", "testDisplay")
+        self.assertIs(first_dict["site"], second_dict["site"])
+        self.assertEqual(Flyweight.snomed("ABC", "testDisplay"), expected_element)
@@ -0,0 +1,70 @@
+"""Tests for utils_for_recordprocessor functions"""
+
+import unittest
+from csv import DictReader
+from io import BytesIO, StringIO
+from botocore.response import StreamingBody
+import os
+import sys
+
+maindir = os.path.dirname(__file__)
+srcdir = "../src"
+sys.path.insert(0, os.path.abspath(os.path.join(maindir, srcdir)))
+from utils_for_recordprocessor import stream_lines  # noqa: E402
+from tests.utils_for_recordprocessor_tests.values_for_recordprocessor_tests import (  # noqa: E402
+    VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE,
+)
+
+
+def make_streaming_body(content: str) -> StreamingBody:
+    """Returns a StreamingBody (as returned by s3_client.get_object) containing the utf-8 encoded content"""
+    content_bytes = content.encode("utf-8")
+    return StreamingBody(BytesIO(content_bytes), len(content_bytes))
+
+
+class TestStreamLines(unittest.TestCase):
+    """Tests for stream_lines"""
+
+    def test_stream_lines_matches_splitting_whole_content(self):
+        """Tests that the streamed lines are the same as the lines of the full content, for any chunk size"""
+        content = "a|b\r\nc|d\ne|f"
+        for chunk_size in [1, 2, 3, 5, 1024]:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(
+                    list(stream_lines(make_streaming_body(content), chunk_size)), ["a|b\r\n", "c|d\n", "e|f"]
+                )
+
+    def test_stream_lines_multi_byte_characters_split_across_chunks(self):
+        """Tests that multi-byte utf-8 characters which are split across chunk boundaries are decoded correctly"""
+        content = "NAME|TERM\nZoë|Ménière’s\n"
+        for chunk_size in range(1, 8):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual("".join(stream_lines(make_streaming_body(content), chunk_size)), content)
+
+    def test_stream_lines_reads_in_chunks(self):
+        """Tests that the body is only ever read in chunks of the requested size"""
+        body = make_streaming_body(VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE)
+        read_sizes = []
+        original_read = body.read
+
+        def recording_read(amt=None):
+            read_sizes.append(amt)
+            return original_read(amt)
+
+        body.read = recording_read
+        list(stream_lines(body, chunk_size=100))
+        self.assertTrue(read_sizes)
+        self.assertTrue(all(size == 100 for size in read_sizes))
+
+    def test_dict_reader_over_stream_lines(self):
+        """Tests that a DictReader over the streamed lines gives the same rows as one over the full content"""
+        content = VALID_FILE_CONTENT_WITH_NEW_AND_UPDATE_AND_DELETE.replace('"Pfizer"', '"Pfizer\nLtd"')
+        expected_rows = list(DictReader(StringIO(content), delimiter="|"))
+        for chunk_size in [7, 64, 64 * 1024]:
+            with self.subTest(chunk_size=chunk_size):
+                reader = DictReader(stream_lines(make_streaming_body(content), chunk_size), delimiter="|")
+                self.assertEqual(list(reader), expected_rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
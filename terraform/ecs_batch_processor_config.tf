@@ -212,6 +212,26 @@ resource "aws_ecs_task_definition" "ecs_task" {
         name  = "KINESIS_STREAM_ARN"
         value = "${local.new_kinesis_arn}"
       },
+      {
+        name  = "ROWS_PER_KINESIS_RECORD"
+        value = "50"
+      },
+      {
+        name  = "KINESIS_PARTITION_STRATEGY"
+        value = "local_id"
+      },
+      {
+        name  = "CHECKPOINT_STORE"
+        value = "s3"
+      },
+      {
+        name  = "ROW_LOG_SAMPLE_RATE"
+        value = "1000"
+      },
+      {
+        name  = "SQS_QUEUE_URL"
+        value = "https://sqs.eu-west-2.amazonaws.com/${local.local_account_id}/imms-${local.api_env}-ack-metadata-queue.fifo"
+      },
       { name  = "SPLUNK_FIREHOSE_NAME"
         value = data.aws_kinesis_firehose_delivery_stream.splunk_stream.name},
       {
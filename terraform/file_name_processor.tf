@@ -230,7 +230,8 @@ resource "aws_lambda_function" "file_processor_lambda" {
   package_type    = "Image"
   image_uri       = module.file_processor_docker_image.image_uri
   architectures   = ["x86_64"]
-  timeout         = 60
+  # Large files are read in full to plan their shards
+  timeout         = 300
 
   vpc_config {
     subnet_ids         = data.aws_subnets.default.ids
@@ -239,15 +240,16 @@ resource "aws_lambda_function" "file_processor_lambda" {
 
   environment {
     variables = {
-      SOURCE_BUCKET_NAME   = "${local.prefix}-data-sources"
-      ACK_BUCKET_NAME      = "${local.prefix}-data-destinations"
-      ENVIRONMENT          = local.environment
-      LOCAL_ACCOUNT_ID     = local.local_account_id
-      SHORT_QUEUE_PREFIX   = local.short_queue_prefix
-      CONFIG_BUCKET_NAME   = data.aws_s3_bucket.existing_bucket.bucket
-      REDIS_HOST           = data.aws_elasticache_cluster.existing_redis.cache_nodes[0].address
-      REDIS_PORT           = data.aws_elasticache_cluster.existing_redis.cache_nodes[0].port
-      SPLUNK_FIREHOSE_NAME = data.aws_kinesis_firehose_delivery_stream.splunk_stream.name
+      SOURCE_BUCKET_NAME    = "${local.prefix}-data-sources"
+      ACK_BUCKET_NAME       = "${local.prefix}-data-destinations"
+      ENVIRONMENT           = local.environment
+      LOCAL_ACCOUNT_ID      = local.local_account_id
+      SHORT_QUEUE_PREFIX    = local.short_queue_prefix
+      CONFIG_BUCKET_NAME    = data.aws_s3_bucket.existing_bucket.bucket
+      REDIS_HOST            = data.aws_elasticache_cluster.existing_redis.cache_nodes[0].address
+      REDIS_PORT            = data.aws_elasticache_cluster.existing_redis.cache_nodes[0].port
+      SPLUNK_FIREHOSE_NAME  = data.aws_kinesis_firehose_delivery_stream.splunk_stream.name
+      FILE_SHARD_SIZE_BYTES = "104857600"
     }
   }
   kms_key_arn = data.aws_kms_key.existing_lambda_encryption_key.arn
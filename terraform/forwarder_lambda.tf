@@ -216,6 +216,8 @@ resource "aws_lambda_function" "forwarding_lambda" {
       UPDATE_LAMBDA_NAME = data.aws_lambda_function.existing_update_lambda.function_name
       DELETE_LAMBDA_NAME = data.aws_lambda_function.existing_delete_lambda.function_name
       SEARCH_LAMBDA_NAME = data.aws_lambda_function.existing_search_lambda.function_name
+      FORWARDING_WORKERS = "10"
+      IMMS_ID_CACHE_ENABLED = "true"
     }
   }
   kms_key_arn = data.aws_kms_key.existing_lambda_encryption_key.arn
@@ -229,8 +231,9 @@ resource "aws_lambda_function" "forwarding_lambda" {
     event_source_arn  = local.new_kinesis_arn
     function_name     = aws_lambda_function.forwarding_lambda.function_name
     starting_position = "LATEST"
-    batch_size        = 1
+    batch_size        = 100
     enabled           = true
+    function_response_types = ["ReportBatchItemFailures"]
 
    depends_on = [aws_lambda_function.forwarding_lambda]
  }